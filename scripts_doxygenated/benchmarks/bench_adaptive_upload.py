@@ -0,0 +1,257 @@
+##! @file bench_adaptive_upload.py
+##! @brief Upload throughput and resilience: fixed batches vs adaptive, retried, checkpointed upserts.
+##! @details
+##! Two parts, both driving upload_stories.py's own upload code:
+##!
+##! **throughput**: `--stories` stories of `--batches` queued batches (500 chunks
+##! of about 900 characters, with 384-dimensional embeddings) are drained by
+##! upload_stories.upload_worker() threads into a simulated ChromaDB server. Each
+##! request costs `--overhead-ms` plus its payload over `--bandwidth-mbps`. The
+##! server handles `--server-slots` requests at a time and rejects payloads over
+##! `--max-request-mb` (HTTP 413). A share `--failure-rate` of requests fails
+##! after taking its time (a network blip). Compared:
+##! - **fixed_sequential**: one uploader, 100-chunk requests, no retries (the original uploader);
+##! - **fixed_concurrent**: `--uploaders` uploaders, 100-chunk requests, no retries (the pipeline before adaptive batching);
+##! - **adaptive**: `--uploaders` uploaders with BatchSizer request sizes and UPLOAD_RETRIES retries.
+##! Reported: chunks/s, MB/s, requests, mean request size, retries, and stories left incomplete.
+##!
+##! **resume**: `--books` synthetic EPUBs are ingested with main_ingestion_loop()
+##! into an in-process ChromaDB collection. After `--outage-after` acknowledged
+##! requests, every upsert fails (one retry, no backoff), so the run ends with
+##! incomplete stories. A second run with the server back counts the chunks sent
+##! again, against what a run without checkpoints would resend (every chunk of
+##! the incomplete stories), and checks that the collection ends up matching the manifest.
+##!
+##! Results are printed as JSON.
+##!
+##! ### Usage
+##! ```bash
+##! python bench_adaptive_upload.py --stories 8 --batches 4 --books 12
+##! python bench_adaptive_upload.py --failure-rate 0.1 --max-request-mb 2
+##! ```
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import queue
+import random
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import chromadb
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "database"))
+import upload_stories # noqa: E402  (import after sys.path setup)
+from bench_chunker import WORDS, page_pool # noqa: E402  (import after sys.path setup)
+from bench_incremental_ingest import CountingCollection # noqa: E402  (import after sys.path setup)
+from ingest_manifest import IngestManifest # noqa: E402  (import after sys.path setup)
+from synthetic_corpus import synthetic_book, write_epub # noqa: E402  (import after sys.path setup)
+
+## @var EMBEDDING_DIM
+# Dimension of the embeddings sent in the throughput part (all-MiniLM-L6-v2's).
+EMBEDDING_DIM: int = 384
+
+## @var CHUNKS_PER_BATCH
+# Chunks per queued batch in the throughput part (upload_stories.BATCH_SIZE).
+CHUNKS_PER_BATCH: int = 500
+
+## @var FIXED_REQUEST_CHUNKS
+# Chunks per request of the fixed-size configurations (the former BATCH_SIZE).
+FIXED_REQUEST_CHUNKS: int = 100
+
+
+class SimulatedServer:
+    """Stands in for a ChromaDB collection: upserts take time by payload size, and some fail."""
+
+    def __init__(self, args: argparse.Namespace, rng: random.Random):
+        self.overhead = args.overhead_ms / 1000.0
+        self.bytes_per_second = args.bandwidth_mbps * 2**20
+        self.max_request_bytes = int(args.max_request_mb * 2**20)
+        self.failure_rate = args.failure_rate
+        self._slots = threading.Semaphore(args.server_slots)
+        self._rng = rng
+        self._lock = threading.Lock()
+
+    def upsert(self, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]], embeddings: Any = None) -> None:
+        size = sum(upload_stories.payload_bytes(doc, meta, embeddings[i] if embeddings is not None else None)
+                   for i, (doc, meta) in enumerate(zip(documents, metadatas)))
+        if size > self.max_request_bytes:
+            time.sleep(self.overhead)
+            raise RuntimeError("413 Payload Too Large")
+        with self._lock:
+            fails = self._rng.random() < self.failure_rate
+        with self._slots:
+            time.sleep(self.overhead + size / self.bytes_per_second)
+        if fails:
+            raise ConnectionError("Connection reset by peer")
+
+
+class HashEmbeddingCache:
+    """Minimal stand-in for EmbeddingCache.embed(): a fixed vector per text, without a model."""
+
+    def __init__(self):
+        self._vector = [0.123456789] * EMBEDDING_DIM
+
+    def embed(self, texts: List[str], embedding_function: Any) -> List[List[float]]:
+        return [self._vector] * len(texts)
+
+
+def run_throughput(args: argparse.Namespace, uploaders: int, fixed_chunks: Optional[int], retries: int) -> Dict[str, Any]:
+    """
+    Drains the same synthetic batches through upload_worker() threads and measures the outcome.
+    *fixed_chunks* pins the request size to that many chunks; None uses an adaptive BatchSizer.
+    """
+    rng = random.Random(args.seed)
+    upload_stories.vector_store = SimulatedServer(args, random.Random(args.seed))
+    upload_stories.embedding_cache = HashEmbeddingCache()
+    upload_stories.keyword_index = None
+    upload_stories.UPLOAD_RETRIES = retries
+    upload_stories.UPLOAD_RETRY_BACKOFF = args.backoff
+    text = " ".join(rng.choice(WORDS) for _ in range(170))[:900] + "."
+    sizer = upload_stories.BatchSizer()
+    if fixed_chunks:
+        chunk_bytes = upload_stories.payload_bytes(text, {"title": "Story 00", "author": "Unknown", "year": "Unknown",
+                                                          "genre": "Unknown", "subgenre": "Unknown", "story_id": "s00",
+                                                          "prev_chunk": ""}, [0.0] * EMBEDDING_DIM)
+        fixed_bytes = fixed_chunks * chunk_bytes + chunk_bytes // 2
+        sizer = upload_stories.BatchSizer(fixed_bytes, fixed_bytes, fixed_bytes)
+    tracker = upload_stories.UploadTracker()
+    upload_stats = upload_stories.StageStats("upload", "chunks")
+    batch_queue: "queue.Queue[Any]" = queue.Queue(maxsize=32)
+    threads = [threading.Thread(target=upload_stories.upload_worker, args=(batch_queue, tracker, upload_stats, sizer), daemon=True)
+               for _ in range(uploaders)]
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for thread in threads:
+            thread.start()
+        for story in range(args.stories):
+            metadata = {"title": f"Story {story}", "author": "Unknown", "year": "Unknown", "genre": "Unknown",
+                        "subgenre": "Unknown", "story_id": f"s{story}", "prev_chunk": ""}
+            tracker.register(f"s{story}", metadata["title"])
+            for batch in range(args.batches):
+                ids = [f"s{story}:{batch}.{i}" for i in range(CHUNKS_PER_BATCH)]
+                batch_queue.put((f"s{story}", batch + 1, ids, [text] * len(ids), [metadata] * len(ids)))
+            tracker.finish(f"s{story}", args.batches)
+        for _ in threads:
+            batch_queue.put(None)
+        for thread in threads:
+            thread.join()
+    seconds = time.perf_counter() - started
+    chunks = upload_stats.items
+    return {
+        "uploaders": uploaders,
+        "seconds": round(seconds, 2),
+        "chunks_uploaded": chunks,
+        "chunks_per_s": round(chunks / seconds, 1),
+        "mb_per_s": round(sizer.bytes / 2**20 / seconds, 2),
+        "requests": sizer.requests,
+        "mean_request_kb": round(sizer.bytes / max(1, sizer.requests) / 1024, 1),
+        "final_request_kb": sizer.target() >> 10,
+        "retries": sizer.retries,
+        "failed_requests": sizer.failed,
+        "stories_incomplete": args.stories - tracker.successful_stories,
+    }
+
+
+class OutageCollection(CountingCollection):
+    """CountingCollection whose upserts start failing after a number of acknowledged requests."""
+
+    def __init__(self, collection: Any, outage_after: int):
+        super().__init__(collection)
+        self.outage_after = outage_after
+
+    def upsert(self, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]], embeddings: Any = None) -> None:
+        with self._lock:
+            down = self.outage_after is not None and self.upsert_calls >= self.outage_after
+        if down:
+            raise ConnectionError("Connection refused")
+        super().upsert(ids, documents, metadatas, embeddings)
+
+
+def run_resume(args: argparse.Namespace) -> Dict[str, Any]:
+    """Ingests books through an outage, then again, and counts what the second run resends."""
+    rng = random.Random(args.seed)
+    pool = page_pool(rng, args.book_kb // 2 + 50, 3000)
+    collection = OutageCollection(chromadb.EphemeralClient().get_or_create_collection(
+        "bench_adaptive_upload", embedding_function=None), args.outage_after)
+    upload_stories.vector_store = collection
+    upload_stories.embedding_cache = None
+    upload_stories.keyword_index = None
+    upload_stories.UPLOAD_RETRIES = 1
+    upload_stories.UPLOAD_RETRY_BACKOFF = 0.0
+    upload_stories.BATCH_SIZE = 100
+    with tempfile.TemporaryDirectory() as workdir:
+        stories_dir = os.path.join(workdir, "stories")
+        os.makedirs(stories_dir)
+        for i in range(args.books):
+            write_epub(os.path.join(stories_dir, f"book_{i:04d}.epub"), f"Book {i:04d}", "Unknown",
+                       synthetic_book(rng, pool, args.book_kb * 1024))
+        manifest = IngestManifest(os.path.join(workdir, "manifest.sqlite3"), "bench")
+        paths = [os.path.join(stories_dir, name) for name in sorted(os.listdir(stories_dir))]
+        runs, incomplete = [], []
+        for _ in range(2):
+            collection.reset()
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                upload_stories.main_ingestion_loop(manifest, workers=2, uploaders=args.uploaders, stories_dir=stories_dir)
+            runs.append({"seconds": round(time.perf_counter() - started, 2), "chunks_upserted": sum(collection.upserted.values()),
+                         "upsert_calls": collection.upsert_calls, "stories_recorded": len(manifest)})
+            if not incomplete:
+                incomplete = [path for path in paths if manifest.get(path) is None]
+            collection.outage_after = None
+        chunks = {path: manifest.chunks(path) for path in paths}
+        stored = set(collection.get(include=[])["ids"])
+        manifest.close()
+    recorded = {chunk_id for story_chunks in chunks.values() for chunk_id in story_chunks}
+    return {
+        "books": args.books,
+        "chunks": len(recorded),
+        "interrupted_run": runs[0],
+        "incomplete_stories": len(incomplete),
+        "resumed_run": runs[1],
+        "resent_without_checkpoints": sum(len(chunks[path]) for path in incomplete),
+        "collection_matches_manifest": stored == recorded,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Runs both parts and prints the results as JSON."""
+    parser = argparse.ArgumentParser(description="Benchmark adaptive, retried, checkpointed story uploads.")
+    parser.add_argument("--stories", type=int, default=8, help="stories in the throughput part (default: %(default)s)")
+    parser.add_argument("--batches", type=int, default=4, help=f"queued batches of {CHUNKS_PER_BATCH} chunks per story (default: %(default)s)")
+    parser.add_argument("--uploaders", type=int, default=4, help="uploader threads (default: %(default)s)")
+    parser.add_argument("--overhead-ms", type=float, default=40.0, help="server time per request (default: %(default)s)")
+    parser.add_argument("--bandwidth-mbps", type=float, default=40.0, help="server throughput per request slot, MB/s (default: %(default)s)")
+    parser.add_argument("--server-slots", type=int, default=4, help="requests the server handles at once (default: %(default)s)")
+    parser.add_argument("--max-request-mb", type=float, default=4.0, help="largest accepted request payload, MB (default: %(default)s)")
+    parser.add_argument("--failure-rate", type=float, default=0.03, help="share of requests that fail (default: %(default)s)")
+    parser.add_argument("--backoff", type=float, default=0.05, help="first retry delay in the throughput part, s (default: %(default)s)")
+    parser.add_argument("--books", type=int, default=12, help="EPUBs in the resume part (default: %(default)s)")
+    parser.add_argument("--book-kb", type=int, default=100, help="book size in KB (default: %(default)s)")
+    parser.add_argument("--outage-after", type=int, default=20, help="requests acknowledged before the outage (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=7, help="random seed (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    results: Dict[str, Any] = {"config": vars(args)}
+    results["fixed_sequential"] = run_throughput(args, 1, FIXED_REQUEST_CHUNKS, 0)
+    results["fixed_concurrent"] = run_throughput(args, args.uploaders, FIXED_REQUEST_CHUNKS, 0)
+    results["adaptive"] = run_throughput(args, args.uploaders, None, 5)
+    results["resume"] = run_resume(args)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+##! @file bench_asgi_webhook.py
+##! @brief Load test of the Flask story webhooks vs their ASGI variant under a slow LLM.
+##! @details
+##! Starts fake_openai_server.py with an injected per-request latency (the LLM
+##! "thinking" time) and serves both endpoints twice:
+##! - **flask**: webhook.py (`/webhook`) and naoqi_tests/chatgpt_webhook.py
+##!   (`/generate_story`) on a WSGI server with a fixed pool of worker threads,
+##!   as with `gunicorn --threads N`;
+##! - **asgi**: webhook_asgi.py on uvicorn (one process, one event loop).
+##! The fake LLM and each server run in their own child process (this script
+##! with `--serve`), so a few hundred server threads cannot starve the load
+##! generator of the GIL. An asyncio load generator then keeps `--concurrency`
+##! requests outstanding until `--requests` have completed, and reports latency
+##! percentiles, throughput and failed requests as JSON.
+##!
+##! ### Usage
+##! ```bash
+##! python bench_asgi_webhook.py --requests 400 --concurrency 200 --llm-latency-ms 1000 --flask-threads 16
+##! ```
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+import requests
+import uvicorn
+from werkzeug.serving import BaseWSGIServer
+from werkzeug.wrappers import Response
+
+## @var HERE
+# Directory of this script (the fake LLM lives next to it).
+HERE: str = os.path.dirname(os.path.abspath(__file__))
+
+## @var ROUTES
+# (path, request body) for each benchmarked endpoint.
+ROUTES: Dict[str, Tuple[str, Dict[str, Any]]] = {
+    "generate_story": ("/generate_story", {"word": "dragon"}),
+    "webhook": ("/webhook", {"sessionInfo": {"parameters": {"username": "Mia", "theme": "forest", "moral": "courage"}}}),
+}
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """WSGI server handling connections on a fixed-size thread pool (like gunicorn's gthread worker)."""
+
+    def __init__(self, host: str, port: int, app: Any, threads: int):
+        super().__init__(host, port, app)
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="wsgi")
+
+    def process_request(self, request: Any, client_address: Any) -> None:
+        self.executor.submit(self._handle, request, client_address)
+
+    def _handle(self, request: Any, client_address: Any) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def _free_port() -> int:
+    """@return An unused localhost TCP port."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve_flask(port: int, threads: int) -> None:
+    """Serves both Flask apps (dispatched by path) on a pooled WSGI server, in the foreground."""
+    import webhook
+    import chatgpt_webhook
+    from story_pool import StoryPool
+
+    # Live generation only: the ASGI app has no story pool
+    story_app, webhook_app = chatgpt_webhook.create_app(StoryPool(size=0)), webhook.create_app(StoryPool(size=0))
+
+    def dispatch(environ: Dict[str, Any], start_response: Any) -> Any:
+        path = environ.get("PATH_INFO", "")
+        if path.startswith("/webhook"):
+            return webhook_app(environ, start_response)
+        if path in ("/generate_story", "/http_stats"):
+            return story_app(environ, start_response)
+        return Response("Not found", status=404)(environ, start_response)
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING) # No per-request access log
+    server = PooledWSGIServer("127.0.0.1", port, dispatch, threads)
+    server.socket.listen(1024) # Deep backlog: queued connections wait for a worker instead of being refused
+    server.serve_forever()
+
+
+def serve_asgi(port: int) -> None:
+    """Serves webhook_asgi.app on uvicorn, in the foreground."""
+    import webhook_asgi
+
+    uvicorn.run(webhook_asgi.app, host="127.0.0.1", port=port, log_level="warning", backlog=2048)
+
+
+def spawn(args: List[str], port: int, env: Dict[str, str]) -> subprocess.Popen:
+    """
+    Starts a child process and waits until it accepts connections on *port*.
+
+    @return The child process.
+    @raises RuntimeError If it exits or does not come up within 60 s.
+    """
+    child = subprocess.Popen([sys.executable, *args], env=env, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while True:
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return child
+        if child.poll() is not None or time.monotonic() > deadline:
+            child.terminate()
+            raise RuntimeError(f"Child process {args} failed to start.")
+        time.sleep(0.1)
+
+
+async def run_load(base: str, route: str, requests_total: int, concurrency: int) -> Dict[str, Any]:
+    """
+    Keeps *concurrency* requests outstanding until *requests_total* have completed.
+
+    @return Latency percentiles (ms), throughput and the number of failed requests.
+    """
+    path, body = ROUTES[route]
+    latencies: List[float] = []
+    failures = 0
+    remaining = iter(range(requests_total))
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async with aiohttp.ClientSession(base, connector=connector, timeout=aiohttp.ClientTimeout(total=300)) as session:
+        async def worker() -> None:
+            nonlocal failures
+            for _ in remaining:
+                start = time.perf_counter()
+                try:
+                    async with session.post(path, json=body) as resp:
+                        payload = await resp.json()
+                    text = payload.get("story") or payload["fulfillment_response"]["messages"][0]["text"]["text"][0]
+                    if resp.status != 200 or text.startswith("Error") or text.startswith("I'm sorry"):
+                        failures += 1
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError):
+                    failures += 1
+                latencies.append((time.perf_counter() - start) * 1000.0)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    ordered = sorted(latencies)
+    return {
+        "requests": requests_total,
+        "failures": failures,
+        "seconds": round(elapsed, 2),
+        "throughput_rps": round(requests_total / elapsed, 1),
+        "p50_ms": round(statistics.median(ordered), 1),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 1),
+        "max_ms": round(ordered[-1], 1),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Starts the fake LLM and both servers, runs the load and prints the results as JSON."""
+    parser = argparse.ArgumentParser(description="Compare the Flask and ASGI story webhooks under concurrent load.")
+    parser.add_argument("--requests", type=int, default=400, help="requests per server and route (default: %(default)s)")
+    parser.add_argument("--concurrency", type=int, default=200, help="outstanding requests (default: %(default)s)")
+    parser.add_argument("--llm-latency-ms", type=float, default=1000.0, help="fake LLM time per story (default: %(default)s)")
+    parser.add_argument("--flask-threads", type=int, default=16, help="Flask worker threads (default: %(default)s)")
+    parser.add_argument("--routes", nargs="+", choices=sorted(ROUTES), default=sorted(ROUTES), help="endpoints to load")
+    parser.add_argument("--serve", choices=["flask", "asgi"], help=argparse.SUPPRESS) # Child-process mode
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, os.path.join(HERE, ".."))
+    sys.path.insert(0, os.path.join(HERE, "..", "naoqi_tests"))
+    if args.serve == "flask":
+        serve_flask(args.port, args.flask_threads)
+        return
+    if args.serve == "asgi":
+        serve_asgi(args.port)
+        return
+
+    llm_port, flask_port, asgi_port = _free_port(), _free_port(), _free_port()
+    env = dict(os.environ, OPENAI_API_BASE=f"http://127.0.0.1:{llm_port}/v1")
+    env.setdefault("OPENAI_API_KEY", "sk-fake")
+    env.setdefault("AI_STORYTELLER_TEST_KEY_CV", "sk-fake")
+    script = os.path.abspath(__file__)
+    children = [spawn([os.path.join(HERE, "fake_openai_server.py"), "--port", str(llm_port),
+                       "--first-token-ms", str(args.llm_latency_ms), "--token-ms", "0"], llm_port, env)]
+    try:
+        children.append(spawn([script, "--serve", "flask", "--port", str(flask_port),
+                               "--flask-threads", str(args.flask_threads)], flask_port, env))
+        children.append(spawn([script, "--serve", "asgi", "--port", str(asgi_port)], asgi_port, env))
+        results: Dict[str, Any] = {"config": {key: value for key, value in vars(args).items()
+                                              if key not in ("serve", "port")}}
+        for route in args.routes:
+            results[route] = {
+                "flask": asyncio.run(run_load(f"http://127.0.0.1:{flask_port}", route, args.requests, args.concurrency)),
+                "asgi": asyncio.run(run_load(f"http://127.0.0.1:{asgi_port}", route, args.requests, args.concurrency)),
+            }
+        results["asgi_http_stats"] = requests.get(f"http://127.0.0.1:{asgi_port}/http_stats", timeout=10).json()
+    finally:
+        for child in children:
+            child.terminate()
+            child.wait()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
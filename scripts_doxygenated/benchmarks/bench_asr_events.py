@@ -0,0 +1,223 @@
+##! @file bench_asr_events.py
+##! @brief Compares the 0.5 s WordRecognized polling loop with the event-driven KeywordRecognizer.
+##! @details
+##! Uses mock_naoqi.MockMemory to publish synthetic recognitions, so no robot is needed:
+##! - **latency**: keywords spoken every few hundred milliseconds, each as a short burst
+##!   of duplicate events mixed with low-confidence noise. The original polling loop
+##!   (`getData` every `--poll-ms`) and KeywordRecognizer handle the same script;
+##!   detection latency, missed keywords, stale re-fires and robot RPC calls are reported.
+##! - **throughput**: a high-rate stream of recognitions raised through ALMemory
+##!   callbacks, checking that debouncing, the confidence threshold and the worker
+##!   pool keep up (events per second handled, callback-to-handler latency).
+##! Results are printed as JSON.
+##!
+##! ### Usage
+##! ```bash
+##! python bench_asr_events.py --keywords 20 --poll-ms 500 --rate-hz 2000 --events 20000
+##! ```
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "naoqi_tests"))
+from asr_service import KeywordRecognizer, parse_recognition # noqa: E402  (import after sys.path setup)
+from mock_naoqi import MockMemory # noqa: E402
+
+## @var VOCABULARY
+# Keywords used for the synthetic recognitions (as in test_asr.py).
+VOCABULARY: List[str] = ["hello", "story", "robot"]
+
+## @var THRESHOLD
+# Confidence threshold shared by both strategies.
+THRESHOLD: float = 0.6
+
+
+def keyword_script(rng: random.Random, keywords: int, spacing_ms: float) -> List[Tuple[float, List[Any], Optional[str]]]:
+    """
+    Builds the latency scenario: one spoken keyword every *spacing_ms*, each raised as a
+    burst of 2–3 duplicate events (as ALSpeechRecognition does), with low-confidence noise in between.
+
+    @param rng Random generator.
+    @param keywords Number of spoken keywords.
+    @param spacing_ms Time between keywords.
+    @return (offset in seconds, event value, keyword or None for noise) tuples, sorted by offset.
+    """
+    script: List[Tuple[float, List[Any], Optional[str]]] = []
+    for i in range(keywords):
+        at = i * spacing_ms / 1000.0
+        word = VOCABULARY[i % len(VOCABULARY)]
+        for repeat in range(rng.choice((2, 3))):
+            script.append((at + repeat * 0.03, [f"<...> {word} <...>", round(rng.uniform(0.65, 0.95), 2)], word if repeat == 0 else None))
+        script.append((at + spacing_ms / 2000.0, [rng.choice(VOCABULARY), round(rng.uniform(0.2, 0.5), 2)], None))
+    return sorted(script, key=lambda item: item[0])
+
+
+def play_script(memory: MockMemory, script: List[Tuple[float, List[Any], Optional[str]]]) -> List[float]:
+    """
+    Raises the scripted events in real time.
+
+    @return perf_counter() timestamp at which each spoken keyword (first event of a burst) was raised.
+    """
+    spoken_at: List[float] = []
+    start = time.perf_counter()
+    for offset, value, keyword in script:
+        delay = start + offset - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        if keyword:
+            spoken_at.append(time.perf_counter())
+        memory.raiseEvent("WordRecognized", list(value))
+    return spoken_at
+
+
+def latency_summary(spoken_at: List[float], handled_at: List[float]) -> Dict[str, Any]:
+    """
+    Matches each spoken keyword to the first handler call after it (and before the next keyword).
+
+    @return Detected/missed counts and detection latency percentiles in ms.
+    """
+    latencies: List[float] = []
+    for i, said in enumerate(spoken_at):
+        until = spoken_at[i + 1] if i + 1 < len(spoken_at) else float("inf")
+        hits = [t for t in handled_at if said <= t < until]
+        if hits:
+            latencies.append((hits[0] - said) * 1000.0)
+    return {
+        "keywords": len(spoken_at),
+        "detected": len(latencies),
+        "missed": len(spoken_at) - len(latencies),
+        "handler_calls": len(handled_at),
+        "latency_p50_ms": round(statistics.median(latencies), 2) if latencies else None,
+        "latency_max_ms": round(max(latencies), 2) if latencies else None,
+    }
+
+
+def run_polling(script: List[Tuple[float, List[Any], Optional[str]]], poll_ms: float) -> Dict[str, Any]:
+    """
+    Replays the script against the original polling loop (getData, threshold, sleep).
+
+    @return Latency summary plus RPC calls and stale re-fires.
+    """
+    memory = MockMemory()
+    handled_at: List[float] = []
+    stale_refires = 0
+    seen: List[Any] = []
+    stop = threading.Event()
+
+    def poll() -> None:
+        nonlocal stale_refires
+        while not stop.is_set():
+            value = memory.getData("WordRecognized")
+            parsed = parse_recognition(value)
+            if parsed and parsed[1] >= THRESHOLD:
+                if any(value is old for old in seen):
+                    stale_refires += 1 # Same value as an earlier poll: the old loop handles it again
+                seen.append(value)
+                handled_at.append(time.perf_counter())
+            time.sleep(poll_ms / 1000.0)
+
+    poller = threading.Thread(target=poll, daemon=True)
+    poller.start()
+    spoken_at = play_script(memory, script)
+    time.sleep(poll_ms / 1000.0 + 0.05)
+    stop.set()
+    poller.join()
+    summary = latency_summary(spoken_at, handled_at)
+    summary.update({"rpc_calls": memory.rpc_calls, "stale_refires": stale_refires})
+    return summary
+
+
+def run_events(script: List[Tuple[float, List[Any], Optional[str]]], debounce_s: float) -> Dict[str, Any]:
+    """
+    Replays the script against KeywordRecognizer subscribed through ALMemory callbacks.
+
+    @return Latency summary plus the recogniser's counters.
+    """
+    memory = MockMemory()
+    handled_at: List[float] = []
+    recognizer = KeywordRecognizer(memory, lambda word, confidence: handled_at.append(time.perf_counter()),
+                                   confidence_threshold=THRESHOLD, debounce_s=debounce_s)
+    memory.register_module("StorytellerASR", recognizer)
+    recognizer.start("StorytellerASR", "on_word_recognized")
+    spoken_at = play_script(memory, script)
+    recognizer.stop()
+    summary = latency_summary(spoken_at, sorted(handled_at))
+    summary.update({"rpc_calls": memory.rpc_calls, "recognizer": recognizer.stats()})
+    return summary
+
+
+def run_throughput(rng: random.Random, events: int, rate_hz: float, debounce_s: float, workers: int) -> Dict[str, Any]:
+    """
+    Publishes a high-rate stream of synthetic recognitions (a fifth of them below the
+    threshold, words drawn from a larger vocabulary so some pass the debounce).
+
+    @return Achieved event rate and the recogniser's counters.
+    """
+    memory = MockMemory()
+    handled = [0]
+    lock = threading.Lock()
+
+    def handler(word: str, confidence: float) -> None:
+        with lock:
+            handled[0] += 1
+
+    recognizer = KeywordRecognizer(memory, handler, confidence_threshold=THRESHOLD, debounce_s=debounce_s, workers=workers)
+    memory.register_module("StorytellerASR", recognizer)
+    recognizer.start("StorytellerASR", "on_word_recognized")
+    words = [f"word{i}" for i in range(200)]
+    recognitions = [(rng.choice(words), rng.uniform(0.3, 0.6) if rng.random() < 0.2 else rng.uniform(0.6, 1.0))
+                    for _ in range(events)]
+    start = time.perf_counter()
+    memory.publish_recognitions(recognitions, rate_hz).join()
+    published = time.perf_counter() - start
+    recognizer.stop()
+    return {
+        "events": events,
+        "target_rate_hz": rate_hz,
+        "achieved_rate_hz": round(events / published, 1),
+        "handled": handled[0],
+        "recognizer": recognizer.stats(),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Parses arguments, runs both scenarios and prints the results as JSON."""
+    parser = argparse.ArgumentParser(description="Benchmark polling vs event-driven keyword recognition.")
+    parser.add_argument("--keywords", type=int, default=20, help="spoken keywords in the latency scenario (default: %(default)s)")
+    parser.add_argument("--spacing-ms", type=float, default=700.0, help="time between spoken keywords (default: %(default)s)")
+    parser.add_argument("--poll-ms", type=float, default=500.0, help="polling interval of the old loop (default: %(default)s)")
+    parser.add_argument("--debounce-s", type=float, default=0.3, help="debounce window (default: %(default)s)")
+    parser.add_argument("--events", type=int, default=20000, help="events in the throughput scenario (default: %(default)s)")
+    parser.add_argument("--rate-hz", type=float, default=2000.0, help="publish rate in the throughput scenario (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=2, help="recogniser worker threads (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=7, help="random seed (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    script = keyword_script(rng, args.keywords, args.spacing_ms)
+    results = {
+        "config": vars(args),
+        "latency": {
+            "polling": run_polling(script, args.poll_ms),
+            "events": run_events(script, args.debounce_s),
+        },
+        "throughput": run_throughput(rng, args.events, args.rate_hz, args.debounce_s, args.workers),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+##! @file bench_chunker.py
+##! @brief Chunking throughput and memory: SentenceChunker vs LangChain's RecursiveCharacterTextSplitter.
+##! @details
+##! Streams a synthetic corpus of `--corpus-mb` megabytes through each chunking
+##! path used by upload_stories.py, each in a fresh process so that its peak
+##! memory is measured on its own:
+##! - **langchain_documents**: the original split_story_into_chunks(): a new
+##!   RecursiveCharacterTextSplitter per story, create_documents() on the whole
+##!   story text, then the Documents unpacked into id/text/metadata lists;
+##! - **langchain_stream**: the streaming iter_story_chunks() that replaced it
+##!   (the splitter re-run on a buffer of about 8 chunks as pages arrive);
+##! - **sentence_chunker**: story_chunker.SentenceChunker.iter_records() on the same page stream.
+##! Stories are `--story-kb` kilobytes of pages (paragraphs of sentences of mixed
+##! length) drawn from a pool of pre-generated pages, so text generation does not
+##! count towards the measured time and the corpus can be far larger than RAM.
+##! Reported per path: MB/s, chunks/s, chunk count, mean chunk length, share of
+##! chunks ending at a sentence end, peak RSS and RSS growth over the process's
+##! baseline (Linux). Results are printed as JSON.
+##!
+##! ### Usage
+##! ```bash
+##! python bench_chunker.py --corpus-mb 512
+##! python bench_chunker.py --corpus-mb 4096 --paths langchain_stream sentence_chunker
+##! ```
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "database"))
+from story_chunker import SentenceChunker, story_id # noqa: E402  (import after sys.path setup)
+
+## @var PATHS
+# Chunking paths that can be benchmarked.
+PATHS: List[str] = ["langchain_documents", "langchain_stream", "sentence_chunker"]
+
+## @var WORDS
+# Vocabulary of the synthetic sentences.
+WORDS: List[str] = ("the a and then little fox owl rabbit went said with was into over under very happy old small big "
+                    "friend home day night walked looked found saw river forest castle king queen dragon brave kind "
+                    "gentle wind carried bread bakery stars shone quiet village listened story").split()
+
+
+def page_pool(rng: random.Random, pages: int, page_chars: int) -> List[str]:
+    """@return *pages* synthetic pages of about *page_chars* characters: paragraphs of 1-8 sentences, some dialogue."""
+    pool = []
+    for _ in range(pages):
+        paragraphs, size = [], 0
+        while size < page_chars:
+            sentences = []
+            for _ in range(rng.randint(1, 8)):
+                sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 30))).capitalize()
+                sentence += rng.choice([".", ".", ".", "!", "?"])
+                sentences.append(f'"{sentence}"' if rng.random() < 0.15 else sentence)
+            paragraphs.append(" ".join(sentences))
+            size += len(paragraphs[-1]) + 2
+        pool.append("\n\n".join(paragraphs))
+    return pool
+
+
+def stories(rng: random.Random, pool: List[str], corpus_chars: int, story_chars: int) -> Iterator[Dict[str, Any]]:
+    """Yields stories (title, metadata, page indexes) until *corpus_chars* characters have been produced."""
+    produced, number = 0, 0
+    while produced < corpus_chars:
+        pages, size = [], 0
+        while size < story_chars:
+            pages.append(rng.randrange(len(pool)))
+            size += len(pool[pages[-1]]) + 1
+        produced += size
+        number += 1
+        title = f"Story {number:06d}"
+        yield {"title": title, "pages": pages, "chars": size,
+               "metadata": {"title": title, "author": "Unknown", "year": "Unknown", "genre": "Unknown", "subgenre": "Unknown"}}
+
+
+def _rss_mb() -> float:
+    """@return The current resident set size in MB (Linux; 0 elsewhere)."""
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return 0.0
+
+
+def run_path(path: str, args: Dict[str, Any]) -> Dict[str, Any]:
+    """Chunks the whole corpus along one path (in a child process) and returns its measurements."""
+    rng = random.Random(args["seed"])
+    pool = page_pool(rng, args["pool_pages"], args["page_chars"])
+    chunker = SentenceChunker(args["chunk_size"], args["chunk_overlap"])
+    if path != "sentence_chunker":
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+    baseline_rss = _rss_mb()
+    chars = chunks = chunk_chars = sentence_ends = 0
+    start = time.perf_counter()
+    for story in stories(rng, pool, args["corpus_mb"] * 2**20, args["story_kb"] * 1024):
+        segments = (pool[i] for i in story["pages"])
+        if path == "langchain_documents":
+            splitter = RecursiveCharacterTextSplitter(chunk_size=args["chunk_size"], chunk_overlap=args["chunk_overlap"])
+            documents = splitter.create_documents(["\n".join(segments)], metadatas=[story["metadata"]])
+            ids = [f"{story['title']}_{i}" for i in range(len(documents))]
+            texts = [document.page_content for document in documents]
+            metas = [document.metadata for document in documents]
+        elif path == "langchain_stream":
+            splitter = RecursiveCharacterTextSplitter(chunk_size=args["chunk_size"], chunk_overlap=args["chunk_overlap"])
+            texts, buffer = [], ""
+            for segment in segments:
+                buffer = f"{buffer}\n{segment}" if buffer else segment.lstrip()
+                if len(buffer) < args["chunk_size"] * 8:
+                    continue
+                pieces = splitter.split_text(buffer)
+                if len(pieces) < 2:
+                    continue
+                texts += pieces[:-1]
+                buffer = pieces[-1]
+            if buffer.strip():
+                texts += splitter.split_text(buffer)
+            ids = [f"{story['title']}_{i}" for i in range(len(texts))]
+            metas = [dict(story["metadata"]) for _ in texts]
+        else:
+            records = list(chunker.iter_records(segments, story_id(story["title"], "Unknown"), story["metadata"]))
+            ids = [record[0] for record in records]
+            texts = [record[1] for record in records]
+            metas = [record[2] for record in records]
+        chars += story["chars"]
+        chunks += len(ids)
+        chunk_chars += sum(len(text) for text in texts)
+        sentence_ends += sum(1 for text in texts if text.rstrip('"').endswith((".", "!", "?")))
+        del ids, texts, metas
+    seconds = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # KB on Linux
+    return {
+        "mb": round(chars / 2**20, 1),
+        "seconds": round(seconds, 2),
+        "mb_per_s": round(chars / 2**20 / seconds, 2),
+        "chunks": chunks,
+        "chunks_per_s": round(chunks / seconds),
+        "mean_chunk_chars": round(chunk_chars / max(1, chunks)),
+        "ends_at_sentence": round(sentence_ends / max(1, chunks), 3),
+        "peak_rss_mb": round(peak_rss, 1),
+        "rss_growth_mb": round(peak_rss - baseline_rss, 1),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Runs every requested path in its own process and prints the results as JSON."""
+    parser = argparse.ArgumentParser(description="Benchmark story chunking: SentenceChunker vs RecursiveCharacterTextSplitter.")
+    parser.add_argument("--corpus-mb", type=int, default=512, help="corpus size in MB (default: %(default)s)")
+    parser.add_argument("--story-kb", type=int, default=500, help="story size in KB (default: %(default)s)")
+    parser.add_argument("--page-chars", type=int, default=3000, help="characters per page/segment (default: %(default)s)")
+    parser.add_argument("--pool-pages", type=int, default=2000, help="distinct pre-generated pages (default: %(default)s)")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="chunk size (default: %(default)s)")
+    parser.add_argument("--chunk-overlap", type=int, default=200, help="chunk overlap (default: %(default)s)")
+    parser.add_argument("--paths", nargs="+", choices=PATHS, default=PATHS, help="paths to run (default: all)")
+    parser.add_argument("--seed", type=int, default=7, help="random seed (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    results: Dict[str, Any] = {"config": vars(args)}
+    context = multiprocessing.get_context("spawn") # A fresh interpreter per path: independent peak RSS
+    for path in args.paths:
+        with context.Pool(1) as pool:
+            results[path] = pool.apply(run_path, (path, vars(args)))
+        print(f"{path}: {results[path]}", file=sys.stderr)
+    if "sentence_chunker" in results:
+        for path in ("langchain_documents", "langchain_stream"):
+            if path in results:
+                results[f"speedup_vs_{path}"] = round(results["sentence_chunker"]["mb_per_s"] / results[path]["mb_per_s"], 1)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+##! @file bench_filtered_search.py
+##! @brief Latency and completeness of metadata-filtered story search: pushed-down `where` vs post-filtering.
+##! @details
+##! Fills a scratch collection with `--chunks` synthetic chunks (random 384-dimensional
+##! embeddings, `--chunks-per-story` chunks per story) whose stories have a genre,
+##! a subgenre, an author (a few prolific ones, many with one or two books) and a
+##! year, as upload_stories.py stores them. The wrapper's FacetIndex is built from
+##! the collection, and each filter case is resolved with the wrapper's
+##! resolve_filters() exactly as /query does:
+##! - **none**: no filter (the baseline);
+##! - **genre**: one genre (about 1/12 of the archive);
+##! - **author**: one mid-ranked author (a few stories);
+##! - **genre_years**: a genre and a 20-year range (years become an `$in` list);
+##! - **author_years**: an author and a 60-year range.
+##! For every case, on the ChromaDB collection and on the LocalVectorIndex replica:
+##! - **pushdown**: wrapper.vector_search() with the `where` clause;
+##! - **postfilter**: an unfiltered search for STORY_OVERFETCH_FACTOR * k chunks,
+##!   filtered in Python afterwards (what a client without `where` would do).
+##! Reported: latency p50/p95 and the share of queries that got k matching chunks.
+##! Facet index build time and where_clause()/values() lookup times are reported too.
+##! Results are printed as JSON.
+##!
+##! By default the collection lives in an in-process ChromaDB client; `--server`
+##! starts a throwaway `chroma run` server (see bench_local_index.py) and queries it over HTTP.
+##!
+##! ### Usage
+##! ```bash
+##! python bench_filtered_search.py --chunks 50000 --queries 200
+##! python bench_filtered_search.py --chunks 50000 --server
+##! ```
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import chromadb
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "chromadb_rest_wrapper"))
+import main as wrapper # noqa: E402  (import after sys.path setup)
+from bench_local_index import _free_port, random_unit_vectors, start_chroma_server # noqa: E402  (import after sys.path setup)
+from facet_index import FacetIndex, matches_where # noqa: E402  (import after sys.path setup)
+from local_index import LocalVectorIndex # noqa: E402  (import after sys.path setup)
+
+## @var BENCH_COLLECTION
+# Scratch collection created (and deleted) by the benchmark.
+BENCH_COLLECTION: str = "bench_filtered_search"
+
+## @var GENRES
+# Genres with their subgenres.
+GENRES: Dict[str, List[str]] = {
+    "Fantasy": ["Fairy Tale", "High Fantasy", "Fable"], "Science Fiction": ["Space Opera", "Dystopia", "Time Travel"],
+    "Mystery": ["Detective", "Cozy", "Noir"], "Adventure": ["Sea", "Jungle", "Treasure Hunt"],
+    "Horror": ["Gothic", "Ghost Story", "Cosmic"], "Romance": ["Regency", "Contemporary", "Comedy"],
+    "Historical": ["Medieval", "War", "Biography"], "Humor": ["Satire", "Parody", "Slapstick"],
+    "Mythology": ["Greek", "Norse", "Egyptian"], "Western": ["Frontier", "Outlaw", "Ranch"],
+    "Poetry": ["Ballad", "Epic", "Nursery Rhyme"], "Drama": ["Tragedy", "Family", "Coming of Age"],
+}
+
+
+class QueryVectors:
+    """Embedding function that returns a prepared vector per query text (no model needed)."""
+
+    def __init__(self, vectors: Dict[str, List[float]]):
+        self.vectors = vectors
+
+    def __call__(self, input: List[str]) -> List[List[float]]: # ChromaDB embedding-function signature
+        return [self.vectors[text] for text in input]
+
+
+def synthetic_metadata(rng: random.Random, stories: int) -> List[Dict[str, str]]:
+    """@return One metadata dict (title, author, year, genre, subgenre) per story; author popularity is Zipf-like."""
+    authors = [f"Author {i:04d}" for i in range(max(1, stories // 4))]
+    weights = [1.0 / (rank + 1) for rank in range(len(authors))]
+    catalogue = []
+    for i in range(stories):
+        genre = rng.choice(list(GENRES))
+        catalogue.append({"title": f"Story {i:05d}", "author": rng.choices(authors, weights)[0],
+                          "year": str(rng.randint(1800, 2020)), "genre": genre, "subgenre": rng.choice(GENRES[genre])})
+    return catalogue
+
+
+def populate(collection: Any, catalogue: List[Dict[str, str]], embeddings: np.ndarray, chunks_per_story: int,
+             batch_size: int = 1000) -> None:
+    """Adds `chunks_per_story` chunks per story with the given embeddings."""
+    for start in range(0, len(embeddings), batch_size):
+        stop = min(start + batch_size, len(embeddings))
+        collection.add(
+            ids=[f"{catalogue[i // chunks_per_story]['title']}_{i % chunks_per_story}" for i in range(start, stop)],
+            embeddings=embeddings[start:stop].tolist(),
+            documents=[f"Once upon a time, chunk {i % chunks_per_story} of story {i // chunks_per_story}." for i in range(start, stop)],
+            metadatas=[catalogue[i // chunks_per_story] for i in range(start, stop)],
+        )
+
+
+def filter_cases(catalogue: List[Dict[str, str]]) -> Dict[str, wrapper.StoryFilters]:
+    """@return The request filters of every case (the author is the 20th most prolific)."""
+    books: Dict[str, int] = {}
+    for story in catalogue:
+        books[story["author"]] = books.get(story["author"], 0) + 1
+    author = sorted(books, key=lambda name: -books[name])[min(19, len(books) - 1)]
+    return {
+        "none": wrapper.StoryFilters(),
+        "genre": wrapper.StoryFilters(genre="mystery"),
+        "author": wrapper.StoryFilters(author=author),
+        "genre_years": wrapper.StoryFilters(genre="fantasy", year_from=1900, year_to=1919),
+        "author_years": wrapper.StoryFilters(author=author, year_from=1900, year_to=1959),
+    }
+
+
+def time_searches(search: Callable[[str], List[Dict[str, Any]]], queries: List[str], k: int) -> Dict[str, Any]:
+    """Runs one search per query and summarises latency and how often k chunks came back."""
+    latencies, full = [], 0
+    for query in queries:
+        start = time.perf_counter()
+        chunks = search(query)
+        latencies.append((time.perf_counter() - start) * 1000.0)
+        full += len(chunks) >= k
+    ordered = sorted(latencies)
+    return {
+        "p50_ms": round(statistics.median(latencies), 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        "full_results": round(full / len(queries), 3),
+    }
+
+
+def run(args: argparse.Namespace, client: Any) -> Dict[str, Any]:
+    """
+    Runs the benchmark against a ChromaDB client.
+
+    @param args Parsed command-line arguments.
+    @param client The ChromaDB client.
+    @return The benchmark results.
+    """
+    rng = random.Random(args.seed)
+    vector_rng = np.random.default_rng(args.seed)
+    catalogue = synthetic_metadata(rng, max(1, args.chunks // args.chunks_per_story))
+    try:
+        client.delete_collection(BENCH_COLLECTION)
+    except Exception:
+        pass
+    collection = client.create_collection(BENCH_COLLECTION, embedding_function=None, metadata={"hnsw:space": "cosine"})
+    try:
+        started = time.perf_counter()
+        populate(collection, catalogue, random_unit_vectors(vector_rng, len(catalogue) * args.chunks_per_story, args.dim),
+                 args.chunks_per_story)
+        populate_seconds = time.perf_counter() - started
+        replica = LocalVectorIndex(space="cosine")
+        replica.refresh(collection)
+
+        facets = FacetIndex()
+        facet_build = facets.rebuild(collection, "bench")
+        wrapper.FACET_INDEX = facets
+        wrapper.KEYWORD_INDEX = None # Vector search only: the filter cost is what is measured
+        queries = [f"query {i}" for i in range(args.queries)]
+        wrapper.EMBEDDING_FUNCTION = QueryVectors(dict(zip(queries, random_unit_vectors(vector_rng, args.queries, args.dim).tolist())))
+        overfetch = args.k * max(1, wrapper.STORY_OVERFETCH_FACTOR)
+
+        results: Dict[str, Any] = {
+            "config": vars(args),
+            "chunks": collection.count(),
+            "stories": len(catalogue),
+            "populate_seconds": round(populate_seconds, 2),
+            "facet_index_build": facet_build,
+        }
+        cases = filter_cases(catalogue)
+        start = time.perf_counter()
+        for _ in range(1000):
+            for filters in cases.values():
+                wrapper.resolve_filters(filters)
+        results["resolve_filters_us"] = round((time.perf_counter() - start) / (1000 * len(cases)) * 1e6, 2)
+        start = time.perf_counter()
+        for _ in range(1000):
+            facets.values("author", "auth", 20)
+        results["facet_values_us"] = round((time.perf_counter() - start) / 1000 * 1e6, 2)
+
+        for name, filters in cases.items():
+            where, problem = wrapper.resolve_filters(filters)
+            matching = sum(1 for story in catalogue if where is None or matches_where(story, where)) * args.chunks_per_story
+            case: Dict[str, Any] = {"where": json.dumps(where) if where else None, "problem": problem, "matching_chunks": matching}
+            for target_name, target in (("chroma", collection), ("local_index", replica)):
+                case[target_name] = {
+                    "pushdown": time_searches(lambda q: wrapper.vector_search(target, [q], args.k, where)[0], queries, args.k),
+                    "postfilter": time_searches(
+                        lambda q: [chunk for chunk in wrapper.vector_search(target, [q], overfetch)[0]
+                                   if where is None or matches_where(chunk["metadata"], where)][:args.k],
+                        queries, args.k),
+                }
+            results[name] = case
+        return results
+    finally:
+        client.delete_collection(BENCH_COLLECTION)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Parses arguments, runs the benchmark and prints the results as JSON."""
+    parser = argparse.ArgumentParser(description="Benchmark metadata-filtered story search (pushed-down where vs post-filtering).")
+    parser.add_argument("--chunks", type=int, default=50000, help="synthetic chunks to index (default: %(default)s)")
+    parser.add_argument("--chunks-per-story", type=int, default=25, help="chunks per story (default: %(default)s)")
+    parser.add_argument("--dim", type=int, default=384, help="embedding dimension (default: %(default)s)")
+    parser.add_argument("--queries", type=int, default=200, help="queries per case and path (default: %(default)s)")
+    parser.add_argument("--k", type=int, default=3, help="chunks per query (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=7, help="random seed (default: %(default)s)")
+    parser.add_argument("--server", action="store_true", help="query a throwaway `chroma run` server over HTTP")
+    args = parser.parse_args(argv)
+
+    if not args.server:
+        print(json.dumps(run(args, chromadb.EphemeralClient()), indent=2))
+        return
+    with tempfile.TemporaryDirectory() as path:
+        port = _free_port()
+        server = start_chroma_server(path, port)
+        try:
+            results = run(args, chromadb.HttpClient(host="127.0.0.1", port=port))
+        finally:
+            server.terminate()
+            server.wait()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
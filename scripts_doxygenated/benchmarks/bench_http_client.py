@@ -0,0 +1,186 @@
+##! @file bench_http_client.py
+##! @brief Measures what pooled keep-alive connections, retries and the circuit breaker save.
+##! @details
+##! Runs against fake_openai_server.py (optionally over HTTPS with a throwaway
+##! self-signed certificate, so TLS handshakes are included) and reports:
+##! - **keepalive**: sequential ChatCompletion calls with a fresh `requests.post()`
+##!   each vs naoqi_tests/http_client.PooledHttpClient; per-call latency,
+##!   connections opened and total connection-setup time;
+##! - **retries**: calls against a server failing a share of requests with 503;
+##!   success rate without retries vs with jittered retries;
+##! - **breaker**: calls to a port nobody listens on; how fast callers fail once
+##!   the circuit breaker is open.
+##! Results are printed as JSON.
+##!
+##! ### Usage
+##! ```bash
+##! python bench_http_client.py --calls 200 --tls --error-rate 0.3
+##! ```
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import argparse
+import json
+import os
+import socket
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+
+from fake_openai_server import start_fake_openai
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "naoqi_tests"))
+from http_client import CircuitBreaker, PooledHttpClient # noqa: E402  (import after sys.path setup)
+
+## @var REQUEST_BODY
+# Minimal ChatCompletion request.
+REQUEST_BODY: Dict[str, Any] = {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": "A story about a robot."}]}
+
+
+def make_tls_context(directory: str) -> tuple:
+    """
+    Creates a self-signed certificate for 127.0.0.1 with the openssl CLI.
+
+    @param directory Where the key and certificate are written.
+    @return (server SSLContext, certificate path for client verification).
+    """
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1",
+                    "-addext", "subjectAltName=IP:127.0.0.1", "-keyout", key, "-out", cert],
+                   check=True, capture_output=True)
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert, key)
+    return context, cert
+
+
+def time_calls(call: Callable[[], requests.Response], calls: int) -> Dict[str, Any]:
+    """
+    @param call Sends one request.
+    @param calls Number of sequential calls.
+    @return Latency percentiles (ms) and the number of successful (200) calls.
+    """
+    latencies: List[float] = []
+    ok = 0
+    for _ in range(calls):
+        start = time.perf_counter()
+        try:
+            resp = call()
+            resp.content # Read the body so the connection can go back to the pool
+            ok += resp.status_code == 200
+        except requests.RequestException:
+            pass
+        latencies.append((time.perf_counter() - start) * 1000.0)
+    ordered = sorted(latencies)
+    return {
+        "calls": calls,
+        "ok": ok,
+        "p50_ms": round(statistics.median(ordered), 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        "mean_ms": round(statistics.fmean(ordered), 3),
+    }
+
+
+def bench_keepalive(url: str, calls: int, verify: Any) -> Dict[str, Any]:
+    """Fresh connection per call vs the pooled client."""
+    fresh = time_calls(lambda: requests.post(url, json=REQUEST_BODY, timeout=(3.05, 30), verify=verify), calls)
+    fresh.update({"connections_opened": calls})
+
+    client = PooledHttpClient("bench", max_retries=0)
+    pooled = time_calls(lambda: client.post(url, json=REQUEST_BODY, verify=verify), calls)
+    stats = client.stats()
+    pooled.update({key: stats[key] for key in ("connections_opened", "connections_reused", "connection_setup_ms_total",
+                                               "connection_setup_ms_mean")})
+    client.close()
+
+    # Setup cost of a fresh connection, measured the same way, for the saving estimate
+    setup_ms: List[float] = []
+    for _ in range(min(calls, 20)):
+        probe = PooledHttpClient("probe", max_retries=0, pool_size=1)
+        probe.post(url, json=REQUEST_BODY, verify=verify).content
+        setup_ms.append(probe.stats()["connection_setup_ms_mean"])
+        probe.close()
+    setup_mean = round(statistics.fmean(setup_ms), 3)
+    return {"fresh_connection": fresh, "pooled": pooled, "setup_ms_per_new_connection": setup_mean,
+            "estimated_setup_ms_saved": round(setup_mean * (calls - pooled["connections_opened"]), 1)}
+
+
+def bench_retries(url: str, calls: int, verify: Any) -> Dict[str, Any]:
+    """Success rate against a flaky server, without and with retries."""
+    results: Dict[str, Any] = {}
+    for label, retries in (("no_retries", 0), ("with_retries", 3)):
+        client = PooledHttpClient(label, max_retries=retries, backoff_base_s=0.01, backoff_max_s=0.1,
+                                  breaker=CircuitBreaker(failure_threshold=0))
+        summary = time_calls(lambda: client.post(url, json=REQUEST_BODY, verify=verify), calls)
+        stats = client.stats()
+        summary.update({"success_rate": round(summary["ok"] / calls, 3), "retries": stats["retries"],
+                        "attempts": stats["attempts"]})
+        results[label] = summary
+        client.close()
+    return results
+
+
+def bench_breaker(calls: int) -> Dict[str, Any]:
+    """Calls to a dead port: time per call before and after the breaker opens."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        dead_port = sock.getsockname()[1]
+    client = PooledHttpClient("dead", max_retries=1, backoff_base_s=0.05, backoff_max_s=0.05,
+                              breaker=CircuitBreaker(failure_threshold=3, reset_timeout_s=60))
+    per_call: List[float] = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        try:
+            client.post(f"http://127.0.0.1:{dead_port}/v1/chat/completions", json=REQUEST_BODY)
+        except requests.RequestException:
+            pass
+        per_call.append((time.perf_counter() - start) * 1000.0)
+    stats = client.stats()
+    return {
+        "calls": calls,
+        "failing_calls_mean_ms": round(statistics.fmean(per_call[:3]), 3),
+        "rejected_calls_mean_ms": round(statistics.fmean(per_call[3:]), 3) if calls > 3 else None,
+        "circuit_rejections": stats["circuit_rejections"],
+        "circuit_state": stats["circuit_state"],
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Starts the fake server(s), runs the three scenarios and prints the results as JSON."""
+    parser = argparse.ArgumentParser(description="Benchmark the pooled HTTP client against fresh connections.")
+    parser.add_argument("--calls", type=int, default=200, help="calls per scenario (default: %(default)s)")
+    parser.add_argument("--error-rate", type=float, default=0.3, help="share of 503s in the retry scenario (default: %(default)s)")
+    parser.add_argument("--tls", action="store_true", help="serve HTTPS with a self-signed certificate (needs openssl)")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        context, verify = make_tls_context(directory) if args.tls else (None, True)
+        scheme = "https" if args.tls else "http"
+        healthy = start_fake_openai(first_token_ms=0, token_ms=0, ssl_context=context)
+        flaky = start_fake_openai(first_token_ms=0, token_ms=0, error_rate=args.error_rate, ssl_context=context)
+        try:
+            results = {
+                "config": {"calls": args.calls, "tls": args.tls, "error_rate": args.error_rate},
+                "keepalive": bench_keepalive(f"{scheme}://127.0.0.1:{healthy.server_address[1]}/v1/chat/completions",
+                                             args.calls, verify),
+                "retries": bench_retries(f"{scheme}://127.0.0.1:{flaky.server_address[1]}/v1/chat/completions",
+                                         args.calls, verify),
+                "breaker": bench_breaker(min(args.calls, 20)),
+            }
+        finally:
+            healthy.shutdown()
+            flaky.shutdown()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+##! @file bench_hybrid_search.py
+##! @brief Recall and latency of vector-only vs hybrid (BM25 + vector) vs keyword-only chunk search.
+##! @details
+##! Builds a synthetic archive of `--stories` stories in an in-memory ChromaDB
+##! collection. Every story has an invented protagonist name and one of a few
+##! themes and morals, so many stories share their theme and moral and only the
+##! name tells them apart. The wrapper's KeywordIndex is synced from the
+##! collection, and the wrapper's own hybrid_search() answers three query sets:
+##! - **dialogflow**: `protagonist theme moral`, as built by /query;
+##! - **name**: the protagonist alone;
+##! - **theme**: `theme moral` without a name (any story with both is relevant).
+##! Each query set runs in every SEARCH_MODE ("vector" is the previous path).
+##! Reported per mode: hit rate (a relevant chunk in the top `--n-results`),
+##! precision (share of the top chunks that are relevant), per-query latency
+##! p50/p95 and embedder calls. Results are printed as JSON.
+##!
+##! The default `--embedder synthetic` stands in for a small sentence encoder
+##! without downloading one: known words map to fixed random vectors, while
+##! out-of-vocabulary words (the invented names) only contribute weak
+##! character-trigram vectors, which is how such models tend to treat rare
+##! names. `--embed-ms` adds the per-call cost of a real model on CPU.
+##! `--embedder default` uses ChromaDB's all-MiniLM-L6-v2 instead (needs the
+##! model download).
+##!
+##! ### Usage
+##! ```bash
+##! python bench_hybrid_search.py --stories 300 --queries 200 --embed-ms 8
+##! python bench_hybrid_search.py --embedder default
+##! ```
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import chromadb
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "chromadb_rest_wrapper"))
+import main as wrapper # noqa: E402  (import after sys.path setup)
+from keyword_index import KeywordIndex # noqa: E402  (import after sys.path setup)
+
+## @var THEMES
+# Story themes; each is shared by many stories.
+THEMES: List[str] = ["forest", "ocean", "castle", "desert", "mountain", "village", "space", "river"]
+
+## @var MORALS
+# Story morals; each is shared by many stories.
+MORALS: List[str] = ["courage", "honesty", "kindness", "patience", "friendship", "sharing"]
+
+## @var FILLER
+# Sentences every story is built from ({name}, {theme} and {moral} are filled in).
+FILLER: List[str] = [
+    "{name} walked through the {theme} as the sun rose over the hills.",
+    "The old owl told {name} that {moral} matters more than gold.",
+    "Everyone in the {theme} wondered what the little traveller would do next.",
+    "It took {moral} to cross the bridge, and the friends held hands.",
+    "A gentle wind carried the smell of bread from the {theme} bakery.",
+    "{name} remembered the lesson about {moral} and smiled.",
+    "Night fell, and the stars shone above the quiet {theme}.",
+    "The animals gathered to listen to the story of the brave young friend.",
+]
+
+## @var DIM
+# Dimension of the synthetic embeddings (as all-MiniLM-L6-v2).
+DIM: int = 384
+
+
+def invented_names(rng: random.Random, count: int) -> List[str]:
+    """@return *count* distinct made-up protagonist names (e.g., "Zorbadel")."""
+    syllables = ["zor", "bel", "mi", "ka", "tru", "flo", "pen", "qui", "dar", "lo", "vex", "nu", "sha", "ri", "go"]
+    names: Set[str] = set()
+    while len(names) < count:
+        names.add("".join(rng.choice(syllables) for _ in range(rng.randint(2, 3))).capitalize())
+    return sorted(names)
+
+
+def synthetic_archive(rng: random.Random, stories: int, chunks_per_story: int) -> Tuple[List[Dict[str, Any]], List[Dict[str, str]]]:
+    """
+    @return (chunks as dicts with "id", "text" and "metadata"; stories as dicts with "title", "name", "theme", "moral").
+    """
+    chunks: List[Dict[str, Any]] = []
+    catalogue: List[Dict[str, str]] = []
+    for name in invented_names(rng, stories):
+        theme, moral = rng.choice(THEMES), rng.choice(MORALS)
+        title = f"The Tale of {name}" if rng.random() < 0.5 else f"A {theme.capitalize()} Adventure"
+        catalogue.append({"title": title, "name": name, "theme": theme, "moral": moral})
+        for i in range(chunks_per_story):
+            sentences = [rng.choice(FILLER) for _ in range(8)]
+            text = " ".join(s.format(name=name if rng.random() < 0.6 else "the child", theme=theme, moral=moral) for s in sentences)
+            chunks.append({"id": f"{name}_{i}", "text": text, "metadata": {"title": title, "protagonist": name}})
+    return chunks, catalogue
+
+
+class SyntheticEmbedder:
+    """
+    Bag-of-words embedder: known words get strong random vectors, unknown words
+    weak character-trigram ones. Counts its calls; can sleep to model a real encoder.
+    """
+
+    def __init__(self, vocabulary: Set[str], oov_weight: float = 0.25, embed_ms: float = 0.0):
+        self.vocabulary = vocabulary
+        self.oov_weight = oov_weight
+        self.embed_s = embed_ms / 1000.0
+        self.calls = 0
+        self._vectors: Dict[str, np.ndarray] = {}
+
+    def _vector(self, key: str) -> np.ndarray:
+        if key not in self._vectors:
+            seed = int.from_bytes(hashlib.sha256(key.encode("utf-8")).digest()[:8], "little")
+            self._vectors[key] = np.random.default_rng(seed).standard_normal(DIM).astype(np.float32)
+        return self._vectors[key]
+
+    def embed(self, text: str) -> List[float]:
+        """@return The unit-length embedding of *text*."""
+        total = np.zeros(DIM, dtype=np.float32)
+        for word in "".join(c if c.isalnum() else " " for c in text.lower()).split():
+            if word in self.vocabulary:
+                total += self._vector(word)
+            else:
+                padded = f"#{word}#"
+                for j in range(len(padded) - 2):
+                    total += self.oov_weight * self._vector("tri:" + padded[j:j + 3])
+        norm = float(np.linalg.norm(total)) or 1.0
+        return (total / norm).tolist()
+
+    def __call__(self, input: List[str]) -> List[List[float]]: # ChromaDB embedding-function signature
+        self.calls += 1
+        if self.embed_s:
+            time.sleep(self.embed_s)
+        return [self.embed(text) for text in input]
+
+
+class CountingEmbedder:
+    """Wraps an embedding function to count its calls."""
+
+    def __init__(self, function: Callable[[List[str]], Any]):
+        self.function = function
+        self.calls = 0
+
+    def __call__(self, input: List[str]) -> Any:
+        self.calls += 1
+        return self.function(input)
+
+
+def query_sets(rng: random.Random, catalogue: List[Dict[str, str]], count: int) -> Dict[str, List[Tuple[str, Set[str]]]]:
+    """@return Per query set, (query, titles of the relevant stories) pairs."""
+    picks = [rng.choice(catalogue) for _ in range(count)]
+    by_theme_moral: Dict[Tuple[str, str], Set[str]] = {}
+    for story in catalogue:
+        by_theme_moral.setdefault((story["theme"], story["moral"]), set()).add(story["name"])
+    return {
+        "dialogflow": [(wrapper.build_query_string(s["name"], s["theme"], s["moral"]), {s["name"]}) for s in picks],
+        "name": [(s["name"], {s["name"]}) for s in picks],
+        "theme": [(f"{s['theme']} {s['moral']}", by_theme_moral[(s["theme"], s["moral"])]) for s in picks],
+    }
+
+
+def run_mode(collection: Any, queries: List[Tuple[str, Set[str]]], n_results: int, embedder: Any) -> Dict[str, Any]:
+    """Answers every query with wrapper.hybrid_search() in the current SEARCH_MODE."""
+    hits, precision, latency = 0, [], []
+    calls_before = embedder.calls
+    for query, relevant in queries:
+        start = time.perf_counter()
+        chunks = wrapper.hybrid_search(collection, [query], n_results)[0]
+        latency.append((time.perf_counter() - start) * 1000.0)
+        good = sum(1 for chunk in chunks if chunk["metadata"].get("protagonist") in relevant)
+        hits += good > 0
+        precision.append(good / n_results)
+    ordered = sorted(latency)
+    return {
+        "hit_rate": round(hits / len(queries), 3),
+        "precision": round(statistics.fmean(precision), 3),
+        "latency_p50_ms": round(statistics.median(latency), 2),
+        "latency_p95_ms": round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))], 2),
+        "embedder_calls": embedder.calls - calls_before,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Builds the archive, runs every query set in every mode and prints the results as JSON."""
+    parser = argparse.ArgumentParser(description="Benchmark hybrid BM25 + vector chunk search against vector-only search.")
+    parser.add_argument("--stories", type=int, default=300, help="synthetic stories (default: %(default)s)")
+    parser.add_argument("--chunks-per-story", type=int, default=10, help="chunks per story (default: %(default)s)")
+    parser.add_argument("--queries", type=int, default=200, help="queries per query set (default: %(default)s)")
+    parser.add_argument("--n-results", type=int, default=3, help="chunks returned per query (default: %(default)s)")
+    parser.add_argument("--embedder", choices=["synthetic", "default"], default="synthetic",
+                        help="synthetic bag-of-words or ChromaDB's all-MiniLM-L6-v2 (default: %(default)s)")
+    parser.add_argument("--embed-ms", type=float, default=0.0, help="added cost per synthetic embedder call (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=7, help="random seed (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    chunks, catalogue = synthetic_archive(rng, args.stories, args.chunks_per_story)
+    if args.embedder == "default":
+        from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+        embedder: Any = CountingEmbedder(DefaultEmbeddingFunction())
+    else:
+        vocabulary = {w for s in FILLER for w in s.lower().replace(".", " ").replace(",", " ").split()} | set(THEMES) | set(MORALS)
+        embedder = SyntheticEmbedder(vocabulary, embed_ms=args.embed_ms)
+
+    collection = chromadb.EphemeralClient().create_collection("bench_hybrid_search", metadata={"hnsw:space": "cosine"})
+    start = time.perf_counter()
+    for i in range(0, len(chunks), 1000):
+        batch = chunks[i:i + 1000]
+        texts = [c["text"] for c in batch]
+        vectors = embedder(texts)
+        collection.add(ids=[c["id"] for c in batch], documents=texts, metadatas=[c["metadata"] for c in batch],
+                       embeddings=[[float(x) for x in v] for v in vectors])
+    load_seconds = time.perf_counter() - start
+
+    results: Dict[str, Any] = {"config": vars(args), "chunks": len(chunks), "load_s": round(load_seconds, 2)}
+    with tempfile.TemporaryDirectory() as directory:
+        index = KeywordIndex(os.path.join(directory, "keyword_index.sqlite3"), wrapper.KEYWORD_RARE_TERM_RATIO)
+        start = time.perf_counter()
+        results["keyword_index_sync"] = dict(index.sync(collection), seconds=round(time.perf_counter() - start, 2))
+        wrapper.EMBEDDING_FUNCTION = embedder
+        wrapper.KEYWORD_INDEX = index
+        for set_name, queries in query_sets(rng, catalogue, args.queries).items():
+            results[set_name] = {}
+            for mode in ("vector", "hybrid", "auto", "keyword"):
+                wrapper.SEARCH_MODE = mode
+                results[set_name][mode] = run_mode(collection, queries, args.n_results, embedder)
+        index.close()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
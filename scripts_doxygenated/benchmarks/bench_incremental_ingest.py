@@ -0,0 +1,208 @@
+##! @file bench_incremental_ingest.py
+##! @brief Writes needed to re-ingest lightly edited books: content-derived chunk IDs with diff-based upsert.
+##! @details
+##! Writes `--books` synthetic EPUBs (chapters of paragraphs, about `--book-kb`
+##! kilobytes each) to a temporary stories directory and ingests them with
+##! upload_stories.main_ingestion_loop() into an in-process ChromaDB collection,
+##! with a fresh manifest. Every book then gets one light edit, cycling through:
+##! - **typo**: one word replaced in one paragraph;
+##! - **insert_sentence**: a sentence added to one paragraph;
+##! - **delete_paragraph**: one paragraph removed;
+##! - **append_chapter**: a chapter added at the end.
+##! The edits land in a random chapter (not the last), and the books are ingested again.
+##! Every upsert and delete reaching the collection is counted per book. For each
+##! edit kind the mean number of chunks upserted, chunks deleted and unchanged
+##! chunks skipped (and the median and maximum writes per book) are reported, next to what the positional `{title}_{i}` IDs
+##! used before cost for the same edit: every chunk of the book upserted again,
+##! plus the IDs past its new end deleted. The run also checks that the collection
+##! holds exactly the chunks the manifest records (no orphans). Results are printed as JSON.
+##!
+##! Embeddings are a hash of the chunk text, so no model download is needed;
+##! the embedding cache and the keyword index are disabled.
+##!
+##! ### Usage
+##! ```bash
+##! python bench_incremental_ingest.py --books 40 --book-kb 300
+##! ```
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import chromadb
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "database"))
+import upload_stories # noqa: E402  (import after sys.path setup)
+from bench_chunker import page_pool # noqa: E402  (import after sys.path setup)
+from ingest_manifest import IngestManifest # noqa: E402  (import after sys.path setup)
+from story_chunker import story_id # noqa: E402  (import after sys.path setup)
+from synthetic_corpus import synthetic_book, write_epub # noqa: E402  (import after sys.path setup)
+
+## @var EDITS
+# Edit kinds, applied to the books in turn.
+EDITS: List[str] = ["typo", "insert_sentence", "delete_paragraph", "append_chapter"]
+
+## @var EMBEDDING_DIM
+# Dimension of the hash embeddings.
+EMBEDDING_DIM: int = 16
+
+
+class CountingCollection:
+    """ChromaDB collection wrapper that embeds with a text hash and counts upserted and deleted IDs per story."""
+
+    def __init__(self, collection: Any):
+        self._collection = collection
+        self._lock = threading.Lock()
+        self.upserted: Dict[str, int] = {}
+        self.deleted: Dict[str, int] = {}
+        self.upsert_calls = 0
+        self.delete_calls = 0
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._collection, name)
+
+    def upsert(self, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]], embeddings: Any = None) -> None:
+        if embeddings is None:
+            embeddings = [[byte / 255.0 for byte in hashlib.blake2b(text.encode("utf-8"), digest_size=EMBEDDING_DIM).digest()]
+                          for text in documents]
+        self._collection.upsert(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+        with self._lock:
+            self.upsert_calls += 1
+            for metadata in metadatas:
+                self.upserted[metadata["story_id"]] = self.upserted.get(metadata["story_id"], 0) + 1
+
+    def delete(self, ids: List[str]) -> None:
+        self._collection.delete(ids=ids)
+        with self._lock:
+            self.delete_calls += 1
+            for chunk_id in ids:
+                story = chunk_id.split(":", 1)[0]
+                self.deleted[story] = self.deleted.get(story, 0) + 1
+
+    def reset(self) -> None:
+        """Clears the counters."""
+        self.upserted, self.deleted = {}, {}
+        self.upsert_calls = self.delete_calls = 0
+
+
+def edit_book(rng: random.Random, pool: List[str], chapters: List[List[str]], kind: str) -> None:
+    """Applies one light edit of the given kind to a book, in place."""
+    chapter = chapters[rng.randrange(max(1, len(chapters) - 1))]
+    index = rng.randrange(len(chapter))
+    if kind == "typo":
+        words = chapter[index].split(" ")
+        position = rng.randrange(len(words))
+        words[position] = "harbour" if words[position] != "harbour" else "lighthouse"
+        chapter[index] = " ".join(words)
+    elif kind == "insert_sentence":
+        sentences = chapter[index].split(". ")
+        sentences.insert(rng.randrange(len(sentences) + 1), "The lighthouse keeper waved from the harbour wall")
+        chapter[index] = ". ".join(sentences)
+    elif kind == "delete_paragraph" and len(chapter) > 1:
+        del chapter[index]
+    else: # append_chapter
+        used = {"\n\n".join(paragraphs) for paragraphs in chapters}
+        chapters.append(rng.choice([page for page in pool if page not in used]).split("\n\n"))
+
+
+def ingest(manifest: IngestManifest, stories_dir: str, workers: int) -> float:
+    """Runs the ingestion pipeline quietly and returns its wall time."""
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        upload_stories.main_ingestion_loop(manifest, workers=workers, uploaders=2, stories_dir=stories_dir)
+    return time.perf_counter() - start
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Ingests the books, edits them, re-ingests them and prints the write counts as JSON."""
+    parser = argparse.ArgumentParser(description="Benchmark re-ingesting lightly edited books (diff-based upsert).")
+    parser.add_argument("--books", type=int, default=40, help="synthetic books (default: %(default)s)")
+    parser.add_argument("--book-kb", type=int, default=300, help="book size in KB (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=2, help="extraction worker processes (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=7, help="random seed (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    pool = page_pool(rng, args.book_kb // 2 + 50, 3000) # About twice the pages a book needs
+    collection = CountingCollection(chromadb.EphemeralClient().get_or_create_collection(
+        "bench_incremental_ingest", embedding_function=None))
+    upload_stories.vector_store = collection
+    upload_stories.embedding_cache = None
+    upload_stories.keyword_index = None
+
+    with tempfile.TemporaryDirectory() as workdir:
+        stories_dir = os.path.join(workdir, "stories")
+        os.makedirs(stories_dir)
+        manifest = IngestManifest(os.path.join(workdir, "manifest.sqlite3"), "bench")
+        books = []
+        for i in range(args.books):
+            title, author = f"Book {i:04d}", f"Author {i % 7}"
+            books.append({"title": title, "author": author, "edit": EDITS[i % len(EDITS)],
+                          "path": os.path.join(stories_dir, f"{author}_{title}.epub"),
+                          "chapters": synthetic_book(rng, pool, args.book_kb * 1024)})
+            write_epub(books[-1]["path"], title, author, books[-1]["chapters"])
+        initial_seconds = ingest(manifest, stories_dir, args.workers)
+        initial_chunks = collection.count()
+        for book in books:
+            book["story_id"] = story_id(book["title"], book["author"])
+            book["chunks_before"] = len(manifest.chunks(book["path"]))
+
+        collection.reset()
+        for book in books:
+            edit_book(rng, pool, book["chapters"], book["edit"])
+            time.sleep(0.001) # A distinct mtime even on coarse-grained filesystems
+            write_epub(book["path"], book["title"], book["author"], book["chapters"])
+        reingest_seconds = ingest(manifest, stories_dir, args.workers)
+
+        recorded = set()
+        per_edit: Dict[str, Dict[str, List[int]]] = {kind: {} for kind in EDITS}
+        for book in books:
+            chunks_after = manifest.chunks(book["path"])
+            recorded.update(chunks_after)
+            upserted = collection.upserted.get(book["story_id"], 0)
+            deleted = collection.deleted.get(book["story_id"], 0)
+            legacy = len(chunks_after) + max(0, book["chunks_before"] - len(chunks_after))
+            for key, value in (("chunks", len(chunks_after)), ("upserted", upserted), ("deleted", deleted),
+                               ("unchanged", len(chunks_after) - upserted), ("writes", upserted + deleted),
+                               ("legacy_writes", legacy)):
+                per_edit[book["edit"]].setdefault(key, []).append(value)
+        stored = set(collection.get(include=[])["ids"])
+        manifest.close()
+
+    results: Dict[str, Any] = {
+        "config": vars(args),
+        "initial": {"chunks": initial_chunks, "seconds": round(initial_seconds, 2)},
+        "reingest": {"seconds": round(reingest_seconds, 2), "upsert_calls": collection.upsert_calls,
+                     "delete_calls": collection.delete_calls, "chunks_upserted": sum(collection.upserted.values()),
+                     "chunks_deleted": sum(collection.deleted.values())},
+        "collection_matches_manifest": stored == recorded,
+    }
+    for kind, values in per_edit.items():
+        if values:
+            results[kind] = {f"{key}_mean": round(sum(numbers) / len(numbers), 1) for key, numbers in values.items()}
+            results[kind]["writes_p50"] = statistics.median(values["writes"])
+            results[kind]["writes_max"] = max(values["writes"])
+            results[kind]["write_reduction"] = round(sum(values["legacy_writes"]) / max(1, sum(values["writes"])), 1)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+##! @file bench_ingest.py
+##! @brief End-to-end ingestion benchmark on a synthetic corpus, with JSON output comparable across commits.
+##! @details
+##! Generates a synthetic EPUB/PDF corpus with synthetic_corpus.generate_corpus()
+##! (`--books`, `--book-kb`, `--chapter-kb`, `--formats`, `--dirs`) in a temporary
+##! directory and runs upload_stories.main_ingestion_loop() on it against a local
+##! in-process ChromaDB (`chromadb.PersistentClient` in the same temporary
+##! directory), with a fresh manifest, the embedding cache and the keyword index,
+##! as `python upload_stories.py` would. Two passes, each in a freshly spawned
+##! process so that its peak memory is measured on its own:
+##! - **initial**: every file is extracted, chunked, embedded and uploaded;
+##! - **unchanged**: the same directory again, where every file should be skipped
+##!   on its size/mtime fingerprint (the cost of a no-op re-run).
+##! Reported per pass: files/s, chunks/s and MB/s (the corpus's books, and the
+##! size of the files ingested for them, over the pass's wall time), the time each pipeline stage was busy (discover,
+##! extract, chunk, upload, delete; stages overlap, so the shares can add up to
+##! more than 1), upsert requests, embedding cache stats, peak RSS of the pass's
+##! process and of its largest extraction worker, and the collection size afterwards.
+##!
+##! By default chunks are embedded with a 384-dimensional hash of their text
+##! (`--embedding hash`), so the numbers measure the pipeline rather than the
+##! model and need no download; `--embedding default` uses ChromaDB's default
+##! all-MiniLM-L6-v2 like production.
+##!
+##! The JSON report (printed, and written to `--output`) records the git commit,
+##! the environment and the configuration. With `--baseline` pointing at the
+##! report of another commit, the ratios of the headline metrics (current /
+##! baseline; above 1 is faster, or more memory for RSS) are added under "comparison".
+##!
+##! ### Usage
+##! ```bash
+##! python bench_ingest.py --books 40 --book-kb 200 --output ingest_$(git rev-parse --short HEAD).json
+##! python bench_ingest.py --books 40 --book-kb 200 --baseline ingest_abc1234.json
+##! python bench_ingest.py --books 500 --book-kb 100 --formats pdf --workers 8 --dirs 20
+##! ```
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+from synthetic_corpus import FORMATS, generate_corpus # noqa: E402  (import after sys.path setup)
+
+## @var PASSES
+# Ingestion passes run over the corpus, in order.
+PASSES: List[str] = ["initial", "unchanged"]
+
+## @var EMBEDDING_DIM
+# Dimension of the hash embeddings (all-MiniLM-L6-v2's).
+EMBEDDING_DIM: int = 384
+
+## @var COMPARED_METRICS
+# Per-pass metrics compared against a baseline report.
+COMPARED_METRICS: List[str] = ["files_per_s", "chunks_per_s", "mb_per_s", "peak_rss_mb"]
+
+
+def hash_embeddings(texts: List[str]) -> List[List[float]]:
+    """Embedding function stand-in: a fixed-length vector derived from a hash of each text."""
+    return [[byte / 127.5 - 1.0 for byte in hashlib.shake_128(text.encode("utf-8")).digest(EMBEDDING_DIM)]
+            for text in texts]
+
+
+def _peak_rss_mb(who: int) -> float:
+    """@return Peak RSS in MB of this process (RUSAGE_SELF) or of its largest waited-for child (RUSAGE_CHILDREN)."""
+    peak = resource.getrusage(who).ru_maxrss
+    return round(peak / (2**20 if sys.platform == "darwin" else 1024), 1) # Bytes on macOS, KB on Linux
+
+
+def run_pass(config: Dict[str, Any], corpus: Dict[str, Any], results: Any) -> None:
+    """Runs one ingestion pass over the corpus (in a child process) and puts its measurements on *results*."""
+    os.dup2(os.open(os.devnull, os.O_WRONLY), 1) # Silences the pipeline's progress output, extraction workers' included
+    import chromadb
+    sys.path.insert(0, os.path.join(HERE, "..", "database"))
+    import upload_stories
+    from ingest_manifest import IngestManifest
+
+    workdir = config["workdir"]
+    client = chromadb.PersistentClient(path=os.path.join(workdir, "chroma"))
+    if config["embedding"] == "hash":
+        upload_stories.vector_store = client.get_or_create_collection("bench_ingest", embedding_function=None)
+        upload_stories.embedding_function = hash_embeddings
+        upload_stories.embedding_cache = upload_stories.EmbeddingCache(os.path.join(workdir, "embedding_cache.bin"), "bench-hash")
+    else:
+        upload_stories.vector_store = client.get_or_create_collection("bench_ingest")
+        upload_stories.init_embedding_cache(os.path.join(workdir, "embedding_cache.bin"))
+    upload_stories.init_keyword_index(os.path.join(workdir, "keyword_index.sqlite3") if config["keyword_index"] else "")
+    manifest = IngestManifest(os.path.join(workdir, "manifest.sqlite3"), "bench_ingest")
+    try:
+        report = upload_stories.main_ingestion_loop(manifest, workers=config["workers"], uploaders=config["uploaders"],
+                                                    stories_dir=os.path.join(workdir, "stories"))
+    finally:
+        manifest.close()
+        if upload_stories.keyword_index is not None:
+            upload_stories.keyword_index.close()
+
+    wall = max(report["wall_seconds"], 1e-9)
+    report.update({
+        "files_per_s": round(corpus["books"] / wall, 2),
+        "chunks_per_s": round(report["chunks"] / wall, 1),
+        "mb_per_s": round(corpus["ingest_bytes"] / 2**20 / wall, 2),
+        "peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF),
+        "worker_peak_rss_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN),
+        "collection_count": upload_stories.vector_store.count(),
+    })
+    for stats in report["stages"].values():
+        stats["share"] = round(stats["busy_seconds"] / wall, 3)
+    if upload_stories.embedding_cache is not None:
+        report["embedding_cache"] = upload_stories.embedding_cache.stats()
+    results.put(report)
+
+
+def wait_for_result(process: Any, results: Any) -> Dict[str, Any]:
+    """@return The report a pass's process puts on *results*. @raises RuntimeError If the process exits without one."""
+    while True:
+        try:
+            return results.get(timeout=1.0)
+        except queue.Empty:
+            if not process.is_alive():
+                raise RuntimeError(f"Ingestion pass process exited with code {process.exitcode} without a report.")
+
+
+def git_commit() -> Dict[str, Any]:
+    """@return The current git commit and whether the working tree has uncommitted changes (None outside a checkout)."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=HERE, capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=HERE,
+                                capture_output=True, text=True, check=True).stdout
+        return {"commit": commit, "dirty": bool(status.strip())}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]) -> Dict[str, Any]:
+    """@return Current / baseline ratios of COMPARED_METRICS per pass, and whether the two configurations match."""
+    keys = ("books", "book_kb", "chapter_kb", "formats", "dirs", "seed", "workers", "uploaders", "embedding", "keyword_index")
+    comparison: Dict[str, Any] = {
+        "baseline_commit": baseline.get("git", {}).get("commit"),
+        "same_config": all(results["config"].get(key) == baseline.get("config", {}).get(key) for key in keys),
+    }
+    for name in PASSES:
+        if name in results and name in baseline:
+            comparison[name] = {metric: round(results[name][metric] / baseline[name][metric], 3)
+                                for metric in COMPARED_METRICS if baseline[name].get(metric)}
+    return comparison
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Generates the corpus, runs each pass in its own process and prints (and optionally writes) the JSON report."""
+    parser = argparse.ArgumentParser(description="Benchmark story ingestion end to end on a synthetic corpus.")
+    parser.add_argument("--books", type=int, default=40, help="synthetic books (default: %(default)s)")
+    parser.add_argument("--book-kb", type=int, default=200, help="book size in KB (default: %(default)s)")
+    parser.add_argument("--chapter-kb", type=int, default=3, help="chapter size in KB (default: %(default)s)")
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=["epub", "pdf"],
+                        help="formats cycled over the books (default: %(default)s)")
+    parser.add_argument("--dirs", type=int, default=4, help="subdirectories to spread the books over (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="extraction worker processes (default: %(default)s)")
+    parser.add_argument("--uploaders", type=int, default=2, help="uploader threads (default: %(default)s)")
+    parser.add_argument("--embedding", choices=["hash", "default"], default="hash",
+                        help="hash embeddings or ChromaDB's default model (default: %(default)s)")
+    parser.add_argument("--no-keyword-index", dest="keyword_index", action="store_false", help="disable the keyword index")
+    parser.add_argument("--seed", type=int, default=7, help="random seed (default: %(default)s)")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    parser.add_argument("--baseline", help="JSON report of an earlier run to compare against")
+    args = parser.parse_args(argv)
+
+    results: Dict[str, Any] = {
+        "benchmark": "ingest",
+        "git": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+    }
+    try:
+        import chromadb
+        results["environment"]["chromadb"] = chromadb.__version__
+    except ImportError:
+        pass
+
+    context = multiprocessing.get_context("spawn") # A fresh interpreter per pass: independent peak RSS
+    with tempfile.TemporaryDirectory() as workdir:
+        start = time.perf_counter()
+        corpus = generate_corpus(os.path.join(workdir, "stories"), args.books, args.book_kb, args.chapter_kb,
+                                 args.formats, args.dirs, args.seed)
+        corpus["mb"] = round(corpus["bytes"] / 2**20, 2)
+        corpus["generate_seconds"] = round(time.perf_counter() - start, 2)
+        results["corpus"] = corpus
+        config = {**results["config"], "workdir": workdir}
+        for name in PASSES:
+            pass_results = context.Queue()
+            process = context.Process(target=run_pass, args=(config, corpus, pass_results))
+            process.start()
+            try:
+                results[name] = wait_for_result(process, pass_results)
+            finally:
+                process.join()
+            print(f"{name}: {results[name]['files_per_s']} files/s, {results[name]['chunks_per_s']} chunks/s, "
+                  f"{results[name]['mb_per_s']} MB/s, peak RSS {results[name]['peak_rss_mb']} MB", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as fh:
+            results["comparison"] = compare(results, json.load(fh))
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as fh:
+            fh.write(report + "\n")
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
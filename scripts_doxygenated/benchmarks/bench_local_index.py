@@ -0,0 +1,211 @@
+##! @file bench_local_index.py
+##! @brief Compares /query search latency: remote ChromaDB HttpClient vs the in-process replica.
+##! @details
+##! Starts a throwaway ChromaDB server (`chroma run`) on a temporary directory, or
+##! uses an existing server given with `--host`/`--port`, and fills a scratch
+##! collection with synthetic 384-dimensional embeddings. It then measures:
+##! - per-query latency of `collection.query(query_embeddings=...)` over HTTP;
+##! - per-query latency of LocalVectorIndex.query() on the replicated data;
+##! - the initial sync time and an incremental sync after a share of the chunks changed;
+##! - how often the two paths return the same top-k ids (HNSW is approximate, the replica exact).
+##! Results are printed as JSON.
+##!
+##! ### Usage
+##! ```bash
+##! python bench_local_index.py --records 20000 --queries 500
+##! python bench_local_index.py --host 34.118.162.201 --port 8000
+##! ```
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import chromadb
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "chromadb_rest_wrapper"))
+from local_index import LocalVectorIndex # noqa: E402  (import after sys.path setup)
+
+## @var BENCH_COLLECTION
+# Scratch collection created (and deleted) by the benchmark.
+BENCH_COLLECTION: str = "bench_local_index"
+
+
+def _free_port() -> int:
+    """@return An unused localhost TCP port."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_chroma_server(path: str, port: int) -> subprocess.Popen:
+    """
+    Starts `chroma run` in a child process and waits until it accepts connections.
+
+    @param path Persistence directory for the server.
+    @param port Port to listen on.
+    @return The server process.
+    @raises RuntimeError If the chroma CLI is missing or the server does not come up.
+    """
+    chroma_cli = shutil.which("chroma") or os.path.join(os.path.dirname(sys.executable), "chroma")
+    if not os.path.exists(chroma_cli):
+        raise RuntimeError("The 'chroma' CLI was not found; install chromadb or pass --host/--port.")
+    server = subprocess.Popen([chroma_cli, "run", "--path", path, "--port", str(port)],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while True:
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return server
+        if server.poll() is not None or time.monotonic() > deadline:
+            server.terminate()
+            raise RuntimeError("ChromaDB server failed to start.")
+        time.sleep(0.2)
+
+
+def random_unit_vectors(rng: np.random.Generator, count: int, dim: int) -> np.ndarray:
+    """
+    @param rng Random generator.
+    @param count Number of vectors.
+    @param dim Dimension.
+    @return A float32 array of L2-normalised random vectors (like sentence-transformer embeddings).
+    """
+    vectors = rng.standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def populate(collection: Any, embeddings: np.ndarray, batch_size: int = 1000) -> None:
+    """
+    Adds synthetic story chunks with the given embeddings.
+
+    @param collection The scratch collection.
+    @param embeddings One embedding per chunk.
+    @param batch_size Records per add() call.
+    """
+    for start in range(0, len(embeddings), batch_size):
+        stop = min(start + batch_size, len(embeddings))
+        collection.add(
+            ids=[f"Story {i // 50}_{i % 50}" for i in range(start, stop)],
+            embeddings=embeddings[start:stop].tolist(),
+            documents=[f"Once upon a time, chunk {i} of story {i // 50}." for i in range(start, stop)],
+            metadatas=[{"title": f"Story {i // 50}", "chunk_index": i % 50} for i in range(start, stop)],
+        )
+
+
+def time_queries(search: Callable[[List[float]], Dict[str, Any]], queries: np.ndarray) -> Dict[str, Any]:
+    """
+    Runs one search per query vector, sequentially, and summarises the latencies.
+
+    @param search Callable taking one query embedding.
+    @param queries Query embeddings.
+    @return Latency percentiles (ms) and the top-k ids of every query.
+    """
+    latencies: List[float] = []
+    top_ids: List[List[str]] = []
+    for query in queries.tolist():
+        start = time.perf_counter()
+        results = search(query)
+        latencies.append((time.perf_counter() - start) * 1000.0)
+        top_ids.append(results["ids"][0])
+    ordered = sorted(latencies)
+    return {
+        "p50_ms": round(ordered[len(ordered) // 2], 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        "p99_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))], 3),
+        "mean_ms": round(statistics.fmean(latencies), 3),
+        "top_ids": top_ids,
+    }
+
+
+def run(args: argparse.Namespace, client: Any) -> Dict[str, Any]:
+    """
+    Runs the benchmark against a ChromaDB client.
+
+    @param args Parsed command-line arguments.
+    @param client The ChromaDB HttpClient.
+    @return The benchmark results.
+    """
+    rng = np.random.default_rng(args.seed)
+    try:
+        client.delete_collection(BENCH_COLLECTION)
+    except Exception:
+        pass
+    collection = client.create_collection(BENCH_COLLECTION, embedding_function=None)
+    try:
+        started = time.perf_counter()
+        populate(collection, random_unit_vectors(rng, args.records, args.dim))
+        populate_seconds = time.perf_counter() - started
+
+        index = LocalVectorIndex(space="l2")
+        initial_sync = index.refresh(collection)
+
+        queries = random_unit_vectors(rng, args.queries, args.dim)
+        remote = time_queries(lambda q: collection.query(query_embeddings=[q], n_results=args.k), queries)
+        local = time_queries(lambda q: index.query(query_embeddings=[q], n_results=args.k), queries)
+        overlap = [len(set(r) & set(l)) / args.k for r, l in zip(remote.pop("top_ids"), local.pop("top_ids"))]
+
+        changed = max(1, int(args.records * args.change_fraction))
+        changed_ids = [f"Story {i // 50}_{i % 50}" for i in rng.choice(args.records, changed, replace=False)]
+        collection.upsert(ids=changed_ids, embeddings=random_unit_vectors(rng, changed, args.dim).tolist(),
+                          documents=[f"Rewritten chunk {id_}." for id_ in changed_ids])
+        incremental_sync = index.refresh(collection)
+
+        return {
+            "config": {"records": args.records, "dim": args.dim, "queries": args.queries, "k": args.k},
+            "populate_seconds": round(populate_seconds, 2),
+            "remote_httpclient": remote,
+            "local_index": local,
+            "speedup_p50": round(remote["p50_ms"] / local["p50_ms"], 1) if local["p50_ms"] else None,
+            "top_k_agreement": round(statistics.fmean(overlap), 4),
+            "initial_sync": initial_sync,
+            "incremental_sync": incremental_sync,
+        }
+    finally:
+        client.delete_collection(BENCH_COLLECTION)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Parses arguments, runs the benchmark and prints the results as JSON."""
+    parser = argparse.ArgumentParser(description="Benchmark remote ChromaDB queries against the in-process replica.")
+    parser.add_argument("--records", type=int, default=20000, help="synthetic chunks to index (default: %(default)s)")
+    parser.add_argument("--dim", type=int, default=384, help="embedding dimension (default: %(default)s)")
+    parser.add_argument("--queries", type=int, default=300, help="queries per path (default: %(default)s)")
+    parser.add_argument("--k", type=int, default=3, help="results per query (default: %(default)s)")
+    parser.add_argument("--change-fraction", type=float, default=0.01,
+                        help="share of chunks rewritten before the incremental sync (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=7, help="random seed (default: %(default)s)")
+    parser.add_argument("--host", help="use an existing ChromaDB server instead of starting one")
+    parser.add_argument("--port", type=int, default=8000, help="port of the existing server (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    if args.host:
+        print(json.dumps(run(args, chromadb.HttpClient(host=args.host, port=args.port)), indent=2))
+        return
+
+    with tempfile.TemporaryDirectory() as path:
+        port = _free_port()
+        server = start_chroma_server(path, port)
+        try:
+            results = run(args, chromadb.HttpClient(host="127.0.0.1", port=port))
+        finally:
+            server.terminate()
+            server.wait()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+##! @file bench_prompt_builder.py
+##! @brief Prompt tokens of the unbounded history vs PromptBuilder on synthetic long histories.
+##! @details
+##! Builds synthetic users whose histories hold `--lengths` exchanges. Story
+##! requests come from a small, skewed set of themes, so children repeat
+##! themselves, and replies are story-length. For each history length it reports:
+##! - **naive**: the old `messages.extend(user_memory)` prompt, in tokens;
+##! - **builder**: PromptBuilder without a summarizer (recent turns plus budget only);
+##! - **builder_summary**: PromptBuilder with a stub summarizer, plus summarizer calls
+##!   and cache hits while the history grew one exchange per request;
+##! - the build time per request.
+##! Results are printed as JSON.
+##!
+##! ### Usage
+##! ```bash
+##! python bench_prompt_builder.py --lengths 10 50 200 1000 --budget 3000
+##! ```
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database"))
+from prompt_builder import PromptBuilder, message_tokens # noqa: E402  (import after sys.path setup)
+
+## @var SYSTEM_PROMPT
+# System prompt of search_stories.py.
+SYSTEM_PROMPT: str = "You are a skilled storyteller that remembers users' preferences."
+
+## @var THEMES
+# Story themes children ask for, most popular first.
+THEMES: List[str] = ["dragons", "a brave knight", "space robots", "a lost puppy", "pirates", "a magic forest",
+                     "dinosaurs", "a friendly ghost", "mermaids", "a talking cat"]
+
+## @var SENTENCES
+# Building blocks of the synthetic replies.
+SENTENCES: List[str] = [
+    "Once upon a time, in a land far away, there lived a curious little hero.",
+    "Every morning the hero walked past the old oak tree and wondered what lay beyond the hills.",
+    "One day a strange sound echoed through the valley, and the hero decided to find out what it was.",
+    "Along the way, new friends offered help, and together they crossed rivers and climbed mountains.",
+    "At last they discovered that kindness and courage were the greatest treasures of all.",
+    "The villagers cheered, and the hero went home with a heart full of joy.",
+]
+
+
+def synthetic_history(rng: random.Random, exchanges: int) -> List[Dict[str, str]]:
+    """
+    @return *exchanges* request/reply pairs, oldest first, with themes repeating (Zipf-like).
+    """
+    weights = [1.0 / (rank + 1) for rank in range(len(THEMES))]
+    history: List[Dict[str, str]] = []
+    for _ in range(exchanges):
+        theme = rng.choices(THEMES, weights)[0]
+        request = rng.choice(["Tell me a story about {}.", "tell me a story about {}", "A story about {}, please!"])
+        reply = " ".join(rng.choice(SENTENCES) for _ in range(rng.randint(8, 14))).replace("hero", theme.split()[-1])
+        history += [{"role": "user", "content": request.format(theme)}, {"role": "assistant", "content": reply}]
+    return history
+
+
+def stub_summarize(previous: Optional[str], turns: List[Dict[str, str]]) -> str:
+    """Summariser stand-in: notes of bounded size (as an LLM asked for short notes would return)."""
+    themes = sorted({t["content"].lower().split("about ")[-1].strip(" .!,please") for t in turns if t["role"] == "user"})
+    notes = f"Heard stories about {', '.join(themes)}." + (" " + previous if previous else "")
+    return notes[:600]
+
+
+def naive_tokens(history: List[Dict[str, str]], prompt: str) -> int:
+    """Tokens of the old prompt: system prompt, whole history, request."""
+    return sum(message_tokens(m) for m in [{"content": SYSTEM_PROMPT}, *history, {"content": prompt}])
+
+
+def bench_length(rng: random.Random, exchanges: int, users: int, budget: int) -> Dict[str, Any]:
+    """Token counts and build times for *users* synthetic users with *exchanges* exchanges each."""
+    plain = PromptBuilder(SYSTEM_PROMPT, budget_tokens=budget)
+    naive: List[int] = []
+    built_plain: List[int] = []
+    build_ms: List[float] = []
+    deduplicated: List[int] = []
+    for _ in range(users):
+        history = synthetic_history(rng, exchanges)
+        prompt = f"Tell me a story about {rng.choice(THEMES)}."
+        naive.append(naive_tokens(history, prompt))
+        start = time.perf_counter()
+        result = plain.build(prompt, history)
+        build_ms.append((time.perf_counter() - start) * 1000.0)
+        built_plain.append(result.tokens)
+        deduplicated.append(result.deduplicated)
+
+    # One user whose history grows by an exchange per request, with the summarizer and its cache
+    summarizing = PromptBuilder(SYSTEM_PROMPT, budget_tokens=budget, summarizer=stub_summarize)
+    history = synthetic_history(rng, exchanges)
+    summary_tokens: List[int] = []
+    for end in range(0, len(history) + 1, 2):
+        result = summarizing.build("Tell me a story about dragons.", history[:end])
+        summary_tokens.append(result.tokens)
+    stats = summarizing.stats()
+
+    mean_naive, mean_plain = statistics.fmean(naive), statistics.fmean(built_plain)
+    return {
+        "exchanges": exchanges,
+        "naive_tokens_mean": round(mean_naive),
+        "naive_tokens_max": max(naive),
+        "builder_tokens_mean": round(mean_plain),
+        "builder_tokens_max": max(built_plain),
+        "reduction": round(1 - mean_plain / mean_naive, 3),
+        "deduplicated_messages_mean": round(statistics.fmean(deduplicated), 1),
+        "build_ms_mean": round(statistics.fmean(build_ms), 3),
+        "builder_summary_tokens_last": summary_tokens[-1],
+        "summarizer_requests": len(summary_tokens),
+        "summarizer_calls": stats["summary_calls"],
+        "summarizer_cache_hits": stats["summary_cache_hits"],
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Runs every history length and prints the results as JSON."""
+    parser = argparse.ArgumentParser(description="Benchmark token-budgeted prompt assembly on long histories.")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[10, 50, 200, 1000], help="exchanges per history")
+    parser.add_argument("--users", type=int, default=20, help="synthetic users per length (default: %(default)s)")
+    parser.add_argument("--budget", type=int, default=3000, help="prompt token budget (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=7, help="random seed (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    results = {"config": vars(args), "lengths": [bench_length(rng, n, args.users, args.budget) for n in args.lengths]}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
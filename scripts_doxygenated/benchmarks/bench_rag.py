@@ -0,0 +1,199 @@
+##! @file bench_rag.py
+##! @brief Per-stage latency of the /rag endpoint, with and without overlapping retrieval and connection warm-up.
+##! @details
+##! Starts three servers:
+##! - a fake chunk retriever with the wrapper's `POST /query/chunks` interface,
+##!   answering after `--retrieve-latency-ms`;
+##! - fake_openai_server.py over HTTPS (self-signed certificate), with
+##!   `--first-token-ms` and `--token-ms`; every new connection additionally
+##!   waits `--connect-ms`, the handshake round trips to a distant API;
+##! - webhook_asgi.py on uvicorn (child process), twice:
+##!   - **sequential**: warm-up disabled; the generation opens its connection
+##!     after retrieval and reranking;
+##!   - **overlapped**: the OpenAI connection is opened while the chunks are
+##!     being retrieved (`RAG_WARMUP_IDLE_SECONDS=0`, i.e., every request arrives
+##!     at an idle connection, as after a pause in conversation).
+##! Each mode sends `--requests` /rag requests one after another and reports
+##! the client's time to first token and total time (p50/p95), plus the
+##! server's per-stage statistics from GET /rag/stats, as JSON.
+##!
+##! ### Usage
+##! ```bash
+##! python bench_rag.py --requests 40 --retrieve-latency-ms 40 --first-token-ms 300 --connect-ms 120
+##! ```
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import argparse
+import json
+import os
+import socket
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+import requests
+
+## @var HERE
+# Directory of this script (the fake LLM lives next to it).
+HERE: str = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.insert(0, HERE)
+from fake_openai_server import start_fake_openai # noqa: E402  (import after sys.path setup)
+
+## @var BODY
+# /rag request body.
+BODY: Dict[str, Any] = {"sessionInfo": {"parameters": {"username": "Mia", "theme": "forest", "moral": "courage"}}}
+
+## @var CHUNK_TEXT
+# Text of each synthetic chunk (about 150 tokens).
+CHUNK_TEXT: str = ("In the deep forest the little badger found the courage to cross the river. " * 8).strip()
+
+
+class _RetrieverHandler(BaseHTTPRequestHandler):
+    """Fake `/query/chunks`: synthetic chunks after a fixed delay. (Internal)"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args: Any) -> None: # Keep benchmark output clean
+        pass
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        time.sleep(self.server.latency_s) # type: ignore[attr-defined]
+        chunks = [{"id": f"story{i}_chunk0", "text": f"{CHUNK_TEXT} ({i})", "metadata": {"title": f"Story {i}"},
+                   "distance": 0.1 * i} for i in range(int(body.get("n_results", 12)))]
+        data = json.dumps({"query": body.get("query", ""), "chunks": chunks}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_fake_retriever(latency_ms: float) -> ThreadingHTTPServer:
+    """Starts the fake chunk retriever on a free port, on a daemon thread."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _RetrieverHandler)
+    server.daemon_threads = True
+    server.latency_s = latency_ms / 1000.0 # type: ignore[attr-defined]
+    threading.Thread(target=server.serve_forever, name="fake-retriever", daemon=True).start()
+    return server
+
+
+def tls_context(directory: str) -> Any:
+    """
+    Creates a self-signed certificate for 127.0.0.1 with the openssl CLI.
+
+    @return (server SSLContext, certificate path for client verification).
+    """
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1",
+                    "-addext", "subjectAltName=IP:127.0.0.1", "-keyout", key, "-out", cert],
+                   check=True, capture_output=True)
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert, key)
+    return context, cert
+
+
+def _free_port() -> int:
+    """@return An unused localhost TCP port."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def spawn_asgi(port: int, env: Dict[str, str]) -> subprocess.Popen:
+    """
+    Starts webhook_asgi.py on uvicorn in a child process and waits until it accepts connections.
+
+    @raises RuntimeError If it exits or does not come up within 60 s.
+    """
+    child = subprocess.Popen([sys.executable, "-m", "uvicorn", "webhook_asgi:app", "--host", "127.0.0.1",
+                              "--port", str(port), "--log-level", "warning"],
+                             cwd=os.path.join(HERE, ".."), env=env, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while True:
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return child
+        if child.poll() is not None or time.monotonic() > deadline:
+            child.terminate()
+            raise RuntimeError("webhook_asgi failed to start.")
+        time.sleep(0.1)
+
+
+def run_requests(base: str, count: int) -> Dict[str, Any]:
+    """Sends *count* /rag requests one after another; client-side time to first token and total (ms)."""
+    first_token: List[float] = []
+    total: List[float] = []
+    failures = 0
+    with requests.Session() as session:
+        for _ in range(count):
+            start = time.perf_counter()
+            got_token = False
+            with session.post(f"{base}/rag", json=BODY, stream=True, timeout=60) as resp:
+                for line in resp.iter_lines():
+                    if not got_token and line == b"event: token":
+                        first_token.append((time.perf_counter() - start) * 1000.0)
+                        got_token = True
+                    elif line == b"event: error":
+                        failures += 1
+            total.append((time.perf_counter() - start) * 1000.0)
+
+    def pct(values: List[float], q: float) -> float:
+        ordered = sorted(values)
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 1) if ordered else 0.0
+
+    return {"requests": count, "failures": failures,
+            "first_token_p50_ms": round(statistics.median(first_token), 1) if first_token else None,
+            "first_token_p95_ms": pct(first_token, 0.95),
+            "total_p50_ms": round(statistics.median(total), 1), "total_p95_ms": pct(total, 0.95)}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Runs both modes and prints the results as JSON."""
+    parser = argparse.ArgumentParser(description="Benchmark the /rag endpoint stage by stage.")
+    parser.add_argument("--requests", type=int, default=40, help="requests per mode (default: %(default)s)")
+    parser.add_argument("--retrieve-latency-ms", type=float, default=40.0, help="fake retriever latency (default: %(default)s)")
+    parser.add_argument("--first-token-ms", type=float, default=300.0, help="fake LLM time to first token (default: %(default)s)")
+    parser.add_argument("--token-ms", type=float, default=5.0, help="fake LLM delay between tokens (default: %(default)s)")
+    parser.add_argument("--connect-ms", type=float, default=120.0, help="fake LLM connection setup (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        context, cert = tls_context(directory)
+        llm = start_fake_openai(first_token_ms=args.first_token_ms, token_ms=args.token_ms, ssl_context=context,
+                                connect_ms=args.connect_ms)
+        retriever = start_fake_retriever(args.retrieve_latency_ms)
+        base_env = dict(os.environ, OPENAI_API_KEY="sk-fake", SSL_CERT_FILE=cert,
+                        OPENAI_API_BASE=f"https://127.0.0.1:{llm.server_address[1]}/v1",
+                        RAG_RETRIEVER_URL=f"http://127.0.0.1:{retriever.server_address[1]}/query/chunks")
+        results: Dict[str, Any] = {"config": vars(args)}
+        for mode, idle in (("sequential", "1e9"), ("overlapped", "0")):
+            port = _free_port()
+            child = spawn_asgi(port, dict(base_env, RAG_WARMUP_IDLE_SECONDS=idle))
+            try:
+                run_requests(f"http://127.0.0.1:{port}", 2) # Warm the server and the retriever connection
+                client = run_requests(f"http://127.0.0.1:{port}", args.requests)
+                server = requests.get(f"http://127.0.0.1:{port}/rag/stats", timeout=10).json()
+                results[mode] = {"client": client, "server_stages": server["stages"]}
+            finally:
+                child.terminate()
+                child.wait()
+        llm.shutdown()
+        retriever.shutdown()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
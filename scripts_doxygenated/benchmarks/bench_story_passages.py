@@ -0,0 +1,163 @@
+##! @file bench_story_passages.py
+##! @brief /query snippet size and story diversity: top-k chunks joined vs distinct stitched stories.
+##! @details
+##! Splits `--stories` synthetic stories with the same chunker as upload_stories.py
+##! (story_chunker.SentenceChunker: 1000 characters, 200 overlap, content-derived ids linked by `prev_chunk`)
+##! into an in-memory ChromaDB collection. Each story has its own vocabulary, and
+##! the words in use drift from paragraph to paragraph, so neighbouring chunks of
+##! one book are nearer each other than distant ones, as in the real archive.
+##! Each query is a few words taken from one chunk. Two ways of answering are compared:
+##! - **chunks**: the previous /query path, the top `--n-results` chunks joined with blank lines;
+##! - **stories**: the wrapper's search_stories_batch(), which over-fetches, groups by
+##!   title and stitches adjacent chunks (see story_passages.py), once per
+##!   `--max-chunks` value (STORY_MAX_CHUNKS).
+##! Reported per path: snippet bytes (mean/p95), distinct stories per snippet,
+##! characters repeated inside a snippet (32-character windows seen earlier in
+##! it, i.e., the chunk overlap), whether the queried story is present, and latency. Results are printed as JSON.
+##!
+##! Embeddings come from bench_hybrid_search.SyntheticEmbedder (a random vector
+##! per story word; common words only weakly), so no model download is needed.
+##!
+##! ### Usage
+##! ```bash
+##! python bench_story_passages.py --stories 200 --queries 300
+##! ```
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import chromadb
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "chromadb_rest_wrapper"))
+sys.path.insert(0, os.path.join(HERE, "..", "database"))
+import main as wrapper # noqa: E402  (import after sys.path setup)
+from bench_hybrid_search import SyntheticEmbedder # noqa: E402  (import after sys.path setup)
+from story_chunker import SentenceChunker, story_id # noqa: E402  (import after sys.path setup)
+
+## @var COMMON_WORDS
+# Words shared by every story.
+COMMON_WORDS: List[str] = ("the a and then little went said with was into over under very happy old small big "
+                           "friend home day night walked looked found saw").split()
+
+
+def synthetic_story(rng: random.Random, index: int, paragraphs: int) -> Tuple[str, str]:
+    """@return (title, text) of a story mixing common words with a window of its own vocabulary that drifts per paragraph."""
+    own = ["".join(rng.choice("bcdfghklmnprstvz") + rng.choice("aeiou") for _ in range(3)) for _ in range(paragraphs * 4 + 20)]
+    text = "\n\n".join(
+        " ".join(
+            " ".join(rng.choice(own[p * 4:p * 4 + 20]) if rng.random() < 0.6 else rng.choice(COMMON_WORDS)
+                     for _ in range(rng.randint(8, 16))).capitalize() + "."
+            for _ in range(rng.randint(1, 3))
+        )
+        for p in range(paragraphs)
+    )
+    return f"Story {index:04d}", text
+
+
+def repeated_chars(snippet: str, window: int = 32) -> int:
+    """Characters of *snippet* whose following *window* characters already appeared earlier in it."""
+    seen = set()
+    repeated = 0
+    for i in range(len(snippet) - window + 1):
+        piece = snippet[i:i + window]
+        repeated += piece in seen
+        seen.add(piece)
+    return repeated
+
+
+def summarize(sizes: List[int], stories: List[int], repeated: List[int], found: List[bool], latency: List[float]) -> Dict[str, Any]:
+    """Aggregates the per-query measurements of one path."""
+    ordered = sorted(sizes)
+    return {
+        "bytes_mean": round(statistics.fmean(sizes)),
+        "bytes_p95": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+        "distinct_stories_mean": round(statistics.fmean(stories), 2),
+        "bytes_per_story": round(sum(sizes) / max(1, sum(stories))),
+        "repeated_chars_mean": round(statistics.fmean(repeated), 1),
+        "queried_story_found": round(sum(found) / len(found), 3),
+        "latency_p50_ms": round(statistics.median(latency), 2),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Builds the collection, answers every query both ways and prints the results as JSON."""
+    parser = argparse.ArgumentParser(description="Benchmark /query snippets: joined chunks vs distinct stitched stories.")
+    parser.add_argument("--stories", type=int, default=200, help="synthetic stories (default: %(default)s)")
+    parser.add_argument("--paragraphs", type=int, default=60, help="paragraphs per story (default: %(default)s)")
+    parser.add_argument("--queries", type=int, default=300, help="queries (default: %(default)s)")
+    parser.add_argument("--n-results", type=int, default=3, help="chunks / stories per snippet (default: %(default)s)")
+    parser.add_argument("--max-chunks", type=int, nargs="+", default=[1, 2, 3], help="STORY_MAX_CHUNKS values to run")
+    parser.add_argument("--seed", type=int, default=7, help="random seed (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    chunker = SentenceChunker(1000, 200)
+    collection = chromadb.EphemeralClient().create_collection("bench_story_passages", metadata={"hnsw:space": "cosine"})
+    chunks: List[Tuple[str, str, str, Dict[str, str]]] = []
+    for i in range(args.stories):
+        title, text = synthetic_story(rng, i, args.paragraphs)
+        records = chunker.iter_records([text], story_id(title, "Unknown"), {"title": title})
+        chunks += [(chunk_id, title, piece, metadata) for chunk_id, piece, metadata in records]
+    embedder = SyntheticEmbedder({word.strip(".").lower() for _, _, text, _ in chunks for word in text.split()} - set(COMMON_WORDS))
+    for start in range(0, len(chunks), 1000):
+        batch = chunks[start:start + 1000]
+        collection.add(ids=[c[0] for c in batch], documents=[c[2] for c in batch], metadatas=[c[3] for c in batch],
+                       embeddings=embedder([c[2] for c in batch]))
+
+    wrapper.EMBEDDING_FUNCTION = embedder
+    wrapper.KEYWORD_INDEX = None # Compare the post-processing only, on the vector ranking
+    queries = []
+    for _ in range(args.queries):
+        _, title, text, _ = rng.choice(chunks)
+        words = text.split()
+        start = rng.randrange(max(1, len(words) - 12))
+        queries.append((" ".join(words[start:start + 12]), title))
+
+    measured: Dict[str, Tuple[List[int], List[int], List[int], List[bool], List[float]]] = {"chunks": ([], [], [], [], [])}
+    for query, title in queries:
+        start = time.perf_counter()
+        hits = wrapper.vector_search(collection, [query], args.n_results)[0]
+        snippet = wrapper.merge_snippets([hit["text"] for hit in hits])
+        elapsed = (time.perf_counter() - start) * 1000.0
+        titles = {hit["metadata"]["title"] for hit in hits}
+        sizes, stories, repeats, found, latency = measured["chunks"]
+        sizes.append(len(snippet.encode("utf-8"))); stories.append(len(titles)); repeats.append(repeated_chars(snippet))
+        found.append(title in titles); latency.append(elapsed)
+
+    for max_chunks in args.max_chunks:
+        wrapper.STORY_MAX_CHUNKS = max_chunks
+        sizes, stories, repeats, found, latency = measured[f"stories_max_chunks_{max_chunks}"] = ([], [], [], [], [])
+        for query, title in queries:
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()): # The wrapper logs every search
+                snippet = wrapper.search_stories_batch(collection, [query], args.n_results)[0]
+            latency.append((time.perf_counter() - start) * 1000.0)
+            passages = wrapper.search_story_passages(collection, [query], args.n_results)[0]
+            sizes.append(len(snippet.encode("utf-8"))); stories.append(len(passages)); repeats.append(repeated_chars(snippet))
+            found.append(any(p["title"] == title for p in passages))
+
+    results: Dict[str, Any] = {"config": vars(args), "chunks_in_collection": len(chunks),
+                               "STORY_OVERFETCH_FACTOR": wrapper.STORY_OVERFETCH_FACTOR}
+    for path, values in measured.items():
+        results[path] = summarize(*values)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+##! @file bench_story_pool.py
+##! @brief Response times of the story webhooks with and without the pre-generated story pool.
+##! @details
+##! Starts fake_openai_server.py with a per-story latency and replays robot-like
+##! traffic, one request every `--interval-ms` for a random vocabulary word
+##! (`POST /generate_story`) or theme/moral pair (`POST /webhook`). Each route is run:
+##! - **live**: no pool (StoryPool(size=0)), every request waits for the LLM;
+##! - **pool**: a warmed pool of `--pool-size` stories per key, refilled by `--workers` threads;
+##! - **restart**: the saved pool file is loaded by a fresh pool (as after a
+##!   webhook restart) and `--restart-requests` requests are sent back to back.
+##! The apps run in process through Flask's test client. Latency percentiles
+##! (ms), hit rates and pool counters are printed as JSON.
+##!
+##! ### Usage
+##! ```bash
+##! python bench_story_pool.py --requests 60 --interval-ms 1000 --llm-latency-ms 1500 --pool-size 3
+##! ```
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fake_openai_server import start_fake_openai
+
+## @var VOCABULARY
+# Robot vocabulary (as in test_asr.py).
+VOCABULARY: List[str] = ["hello", "story", "robot"]
+
+## @var THEMES
+# Common theme/moral pairs for the Dialogflow webhook.
+THEMES: List[Tuple[str, str]] = [("fantasy", "courage"), ("forest", "kindness"), ("space", "honesty")]
+
+
+def percentiles(latencies: List[float]) -> Dict[str, Any]:
+    """
+    @param latencies Latencies in ms.
+    @return p50/p95/p99/max in ms.
+    """
+    ordered = sorted(latencies)
+    pick = lambda q: round(ordered[min(len(ordered) - 1, int(len(ordered) * q))], 2)
+    return {"requests": len(ordered), "p50_ms": round(statistics.median(ordered), 2), "p95_ms": pick(0.95),
+            "p99_ms": pick(0.99), "max_ms": round(ordered[-1], 2)}
+
+
+def replay(send: Callable[[random.Random], Any], rng: random.Random, requests_total: int, interval_ms: float) -> List[float]:
+    """
+    Sends *requests_total* requests, starting one every *interval_ms* (or right after the previous one if it was slower).
+
+    @param send Sends one request and checks the reply.
+    @return Latencies in ms.
+    """
+    latencies: List[float] = []
+    next_at = time.perf_counter()
+    for _ in range(requests_total):
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        start = time.perf_counter()
+        send(rng)
+        latencies.append((time.perf_counter() - start) * 1000.0)
+        next_at = start + interval_ms / 1000.0
+    return latencies
+
+
+def wait_until_full(pool: Any, timeout_s: float) -> float:
+    """
+    @return Seconds until every registered key held a full pool (or timeout_s).
+    """
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout_s:
+        if all(pool.available(key) >= pool.size for key in pool.keys()):
+            break
+        time.sleep(0.05)
+    return round(time.perf_counter() - start, 2)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Starts the fake LLM, runs the live, pooled and restarted scenarios and prints the results as JSON."""
+    parser = argparse.ArgumentParser(description="Benchmark the story webhooks with and without the story pool.")
+    parser.add_argument("--requests", type=int, default=60, help="requests per route and mode (default: %(default)s)")
+    parser.add_argument("--interval-ms", type=float, default=1000.0, help="time between requests (default: %(default)s)")
+    parser.add_argument("--llm-latency-ms", type=float, default=1500.0, help="fake LLM time per story (default: %(default)s)")
+    parser.add_argument("--pool-size", type=int, default=3, help="stories per key (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=2, help="pool refill threads (default: %(default)s)")
+    parser.add_argument("--restart-requests", type=int, default=6, help="requests after the restart (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=7, help="random seed (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    fake = start_fake_openai(first_token_ms=args.llm_latency_ms, token_ms=0)
+    os.environ["OPENAI_API_BASE"] = f"http://127.0.0.1:{fake.server_address[1]}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+    os.environ.setdefault("AI_STORYTELLER_TEST_KEY_CV", "sk-fake")
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.join(here, ".."))
+    sys.path.insert(0, os.path.join(here, "..", "naoqi_tests"))
+    import chatgpt_webhook # noqa: E402  (must be imported after the environment is set)
+    import webhook # noqa: E402
+    from story_pool import StoryPool # noqa: E402
+
+    def send_word(client: Any) -> Callable[[random.Random], Any]:
+        def send(rng: random.Random) -> None:
+            story = client.post("/generate_story", json={"word": rng.choice(VOCABULARY)}).get_json()["story"]
+            assert not story.startswith("Error"), story
+        return send
+
+    def send_theme(client: Any) -> Callable[[random.Random], Any]:
+        def send(rng: random.Random) -> None:
+            theme, moral = rng.choice(THEMES)
+            body = {"sessionInfo": {"parameters": {"username": "Mia", "theme": theme, "moral": moral}}}
+            text = client.post("/webhook", json=body).get_json()["fulfillment_response"]["messages"][0]["text"]["text"][0]
+            assert text != webhook.FALLBACK_MESSAGE, text
+        return send
+
+    routes = {
+        "generate_story": (chatgpt_webhook.create_app, send_word, chatgpt_webhook.create_story_pool, VOCABULARY),
+        "webhook": (webhook.create_app, send_theme, webhook.create_story_pool, THEMES),
+    }
+    results: Dict[str, Any] = {"config": vars(args)}
+    with tempfile.TemporaryDirectory() as directory:
+        for route, (make_app, make_send, make_pool, keys) in routes.items():
+            path = os.path.join(directory, f"{route}.json")
+            live_app = make_app(StoryPool(size=0))
+            live = percentiles(replay(make_send(live_app.test_client()), random.Random(args.seed), args.requests,
+                                      args.interval_ms))
+
+            pool = make_pool(keys, path, size=args.pool_size, workers=args.workers)
+            warmup_s = wait_until_full(pool, timeout_s=120)
+            pooled = percentiles(replay(make_send(make_app(pool).test_client()), random.Random(args.seed), args.requests,
+                                        args.interval_ms))
+            pooled.update({"warmup_s": warmup_s, "hit_rate": pool.stats()["hit_rate"],
+                           "generated": pool.stats()["generated"]})
+            pool.close(wait=True)
+
+            # Restart: a new pool loads the saved file before any story could be regenerated
+            restarted = make_pool(keys, path, size=args.pool_size, workers=args.workers)
+            loaded = restarted.stats()["loaded"]
+            client = make_app(restarted).test_client()
+            restart = percentiles(replay(make_send(client), random.Random(args.seed + 1), args.restart_requests, 0))
+            restart.update({"loaded_from_disk": loaded, "hit_rate": restarted.stats()["hit_rate"]})
+            restarted.close(wait=True)
+
+            results[route] = {"live": live, "pool": pooled, "restart": restart}
+    fake.shutdown()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+##! @file bench_streaming_webhook.py
+##! @brief Measures time-to-first-word of the blocking vs streaming story webhook.
+##! @details
+##! Starts fake_openai_server.py and the Flask app from webhook.py (pointed at the
+##! fake server through OPENAI_API_BASE) on local threads, then times:
+##! - `POST /webhook`: the whole story arrives at once, so the first word costs
+##!   the full generation time;
+##! - `POST /webhook/stream` (SSE): time to the first `token` event, the first
+##!   `sentence` event and the final `done` event;
+##! - `POST /webhook/stream?format=text`: time to the first complete line.
+##! Medians over several runs are printed as JSON.
+##!
+##! ### Usage
+##! ```bash
+##! python bench_streaming_webhook.py --runs 5 --first-token-ms 400 --token-ms 30
+##! ```
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import requests
+from werkzeug.serving import make_server
+
+from fake_openai_server import start_fake_openai
+
+## @var PAYLOAD
+# Dialogflow CX webhook body sent to both routes.
+PAYLOAD: Dict[str, Any] = {"sessionInfo": {"parameters": {"username": "Mia", "theme": "forest", "moral": "courage"}}}
+
+
+def time_blocking(url: str) -> Dict[str, float]:
+    """
+    @param url The /webhook URL.
+    @return Seconds until the (complete) reply arrived.
+    """
+    start = time.perf_counter()
+    resp = requests.post(url, json=PAYLOAD, timeout=120)
+    resp.raise_for_status()
+    resp.json()
+    elapsed = time.perf_counter() - start
+    return {"first_word_s": elapsed, "total_s": elapsed}
+
+
+def time_sse(url: str) -> Dict[str, float]:
+    """
+    @param url The /webhook/stream URL.
+    @return Seconds until the first token, first sentence and done events.
+    """
+    marks: Dict[str, float] = {}
+    start = time.perf_counter()
+    with requests.post(url, json=PAYLOAD, stream=True, timeout=120) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines(chunk_size=1, decode_unicode=True):
+            if not line or not line.startswith("event: "):
+                continue
+            event = line[len("event: "):]
+            key = {"token": "first_token_s", "sentence": "first_sentence_s", "done": "total_s"}.get(event)
+            if key and key not in marks:
+                marks[key] = time.perf_counter() - start
+            if event == "error":
+                raise RuntimeError("Stream reported an error event.")
+    marks["first_word_s"] = marks["first_token_s"]
+    return marks
+
+
+def time_text(url: str) -> Dict[str, float]:
+    """
+    @param url The /webhook/stream?format=text URL.
+    @return Seconds until the first complete sentence line and the end of the body.
+    """
+    marks: Dict[str, float] = {}
+    start = time.perf_counter()
+    with requests.post(url, json=PAYLOAD, stream=True, timeout=120) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines(chunk_size=1, decode_unicode=True):
+            if line and "first_sentence_s" not in marks:
+                marks["first_sentence_s"] = time.perf_counter() - start
+    marks["total_s"] = time.perf_counter() - start
+    marks["first_word_s"] = marks["first_sentence_s"]
+    return marks
+
+
+def median_marks(samples: List[Dict[str, float]]) -> Dict[str, float]:
+    """
+    @param samples Per-run timing dictionaries.
+    @return The median of every key, converted to milliseconds ("_s" suffix becomes "_ms").
+    """
+    return {key[:-2] + "_ms": round(statistics.median(s[key] for s in samples) * 1000.0, 1) for key in samples[0]}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Starts both servers, runs the measurements and prints the results as JSON."""
+    parser = argparse.ArgumentParser(description="Compare time-to-first-word of the blocking and streaming webhooks.")
+    parser.add_argument("--runs", type=int, default=5, help="runs per route (default: %(default)s)")
+    parser.add_argument("--first-token-ms", type=float, default=400.0, help="fake model time to first token (default: %(default)s)")
+    parser.add_argument("--token-ms", type=float, default=30.0, help="fake model delay between tokens (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    fake = start_fake_openai(first_token_ms=args.first_token_ms, token_ms=args.token_ms)
+    os.environ["OPENAI_API_BASE"] = f"http://127.0.0.1:{fake.server_address[1]}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    import webhook # noqa: E402  (must be imported after the environment is set)
+    from story_pool import StoryPool # noqa: E402  (on sys.path once webhook is imported)
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING) # No per-request access log
+    server = make_server("127.0.0.1", 0, webhook.create_app(StoryPool(size=0)), threaded=True) # Live generation only
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    try:
+        results = {
+            "config": {"runs": args.runs, "first_token_ms": args.first_token_ms, "token_ms": args.token_ms},
+            "blocking": median_marks([time_blocking(f"{base}/webhook") for _ in range(args.runs)]),
+            "stream_sse": median_marks([time_sse(f"{base}/webhook/stream") for _ in range(args.runs)]),
+            "stream_text": median_marks([time_text(f"{base}/webhook/stream?format=text") for _ in range(args.runs)]),
+        }
+    finally:
+        server.shutdown()
+        fake.shutdown()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+##! @file bench_tts_pipeline.py
+##! @brief Measures NAO's time to first spoken word: blocking say() vs the sentence pipeline.
+##! @details
+##! Starts fake_openai_server.py and the Flask app from webhook.py on local threads
+##! and speaks the generated story on mock_naoqi.MockTextToSpeech, which takes real
+##! time per word. Three ways of telling the story are compared:
+##! - **blocking**: fetch the whole story from `/webhook`, then one `tts.say(story)`
+##!   (the original test_asr.py behaviour);
+##! - **pipeline**: fetch the whole story, then SentencePipeline (post.say per sentence);
+##! - **pipeline_streaming**: SentencePipeline fed from `/webhook/stream?format=text`.
+##! For each mode the median time to first spoken word, total time, how long the
+##! caller was blocked and the gaps between sentences are printed as JSON (ms).
+##!
+##! ### Usage
+##! ```bash
+##! python bench_tts_pipeline.py --runs 3 --first-token-ms 400 --token-ms 30 --words-per-second 20
+##! ```
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import requests
+from werkzeug.serving import make_server
+
+from fake_openai_server import start_fake_openai
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "naoqi_tests"))
+from mock_naoqi import MockALProxy # noqa: E402  (import after sys.path setup)
+from tts_pipeline import SentencePipeline # noqa: E402
+
+## @var PAYLOAD
+# Dialogflow CX webhook body, as test_asr.py sends it for a recognised keyword.
+PAYLOAD: Dict[str, Any] = {"sessionInfo": {"parameters": {"theme": "forest"}}}
+
+
+def fetch_story(base: str) -> str:
+    """@return The complete story from the blocking /webhook route."""
+    resp = requests.post(f"{base}/webhook", json=PAYLOAD, timeout=120)
+    resp.raise_for_status()
+    return resp.json()["fulfillment_response"]["messages"][0]["text"]["text"][0]
+
+
+def fetched_story(base: str) -> Iterator[str]:
+    """@return The complete story as a single chunk, fetched lazily (on the pipeline's producer thread)."""
+    yield fetch_story(base)
+
+
+def stream_story(base: str) -> Iterator[str]:
+    """@return Story chunks from the streaming /webhook/stream?format=text route, as they arrive."""
+    with requests.post(f"{base}/webhook/stream?format=text", json=PAYLOAD, stream=True, timeout=120) as resp:
+        resp.raise_for_status()
+        resp.encoding = "utf-8"
+        yield from resp.iter_content(chunk_size=None, decode_unicode=True)
+
+
+def time_blocking(base: str, words_per_second: float) -> Dict[str, float]:
+    """
+    @param base Webhook base URL.
+    @param words_per_second Simulated speaking rate.
+    @return Timings (seconds) of one fetch-then-say run.
+    """
+    tts = MockALProxy("ALTextToSpeech", words_per_second=words_per_second)
+    start = time.perf_counter()
+    tts.say(fetch_story(base).replace("\n", " "))
+    end = time.perf_counter()
+    return {"first_word_s": tts.spoken[0][2] - start, "total_s": end - start, "caller_blocked_s": end - start,
+            "max_gap_s": 0.0}
+
+
+def time_pipeline(story_source: Callable[[], Any], words_per_second: float) -> Dict[str, float]:
+    """
+    @param story_source Returns what SentencePipeline.play() receives (a string or a chunk iterator).
+    @param words_per_second Simulated speaking rate.
+    @return Timings (seconds) of one pipelined run.
+    """
+    tts = MockALProxy("ALTextToSpeech", words_per_second=words_per_second)
+    pipeline = SentencePipeline(tts)
+    start = time.perf_counter()
+    pipeline.play(story_source())
+    blocked = time.perf_counter() - start
+    pipeline.wait()
+    if pipeline.error:
+        raise RuntimeError(f"Pipeline failed: {pipeline.error}")
+    stats = pipeline.stats()
+    gaps = [b[2] - a[3] for a, b in zip(tts.spoken, tts.spoken[1:])] # Silence between sentences
+    return {"first_word_s": tts.spoken[0][2] - start, "total_s": tts.spoken[-1][3] - start,
+            "caller_blocked_s": blocked, "max_gap_s": max(gaps) if gaps else 0.0, "sentences": stats["sentences"]}
+
+
+def median_marks(samples: List[Dict[str, float]]) -> Dict[str, float]:
+    """
+    @param samples Per-run timing dictionaries.
+    @return The median of every key; "_s" keys are converted to milliseconds ("_ms").
+    """
+    medians: Dict[str, float] = {}
+    for key in samples[0]:
+        value = statistics.median(s[key] for s in samples)
+        if key.endswith("_s"):
+            medians[key[:-2] + "_ms"] = round(value * 1000.0, 1)
+        else:
+            medians[key] = value
+    return medians
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Starts the servers, runs the measurements and prints the results as JSON."""
+    parser = argparse.ArgumentParser(description="Compare time to first spoken word with and without the TTS pipeline.")
+    parser.add_argument("--runs", type=int, default=3, help="runs per mode (default: %(default)s)")
+    parser.add_argument("--first-token-ms", type=float, default=400.0, help="fake model time to first token (default: %(default)s)")
+    parser.add_argument("--token-ms", type=float, default=30.0, help="fake model delay between tokens (default: %(default)s)")
+    parser.add_argument("--words-per-second", type=float, default=20.0,
+                        help="simulated speaking rate; NAO speaks about 2.5, higher keeps runs short (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    fake = start_fake_openai(first_token_ms=args.first_token_ms, token_ms=args.token_ms)
+    os.environ["OPENAI_API_BASE"] = f"http://127.0.0.1:{fake.server_address[1]}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    import webhook # noqa: E402  (must be imported after the environment is set)
+    from story_pool import StoryPool # noqa: E402  (on sys.path once webhook is imported)
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING) # No per-request access log
+    server = make_server("127.0.0.1", 0, webhook.create_app(StoryPool(size=0)), threaded=True) # Live generation only
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    wps = args.words_per_second
+    try:
+        results = {
+            "config": {"runs": args.runs, "first_token_ms": args.first_token_ms, "token_ms": args.token_ms,
+                       "words_per_second": wps},
+            "blocking": median_marks([time_blocking(base, wps) for _ in range(args.runs)]),
+            "pipeline": median_marks([time_pipeline(lambda: fetched_story(base), wps) for _ in range(args.runs)]),
+            "pipeline_streaming": median_marks([time_pipeline(lambda: stream_story(base), wps) for _ in range(args.runs)]),
+        }
+    finally:
+        server.shutdown()
+        fake.shutdown()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+##! @file bench_user_memory.py
+##! @brief Compares the old JSON user-memory file with the SQLite UserMemoryStore.
+##! @details
+##! Reports, as JSON:
+##! - **save**: time to save one exchange as the history grows. The JSON version
+##!   re-reads and rewrites the whole file (as search_stories.py used to), while
+##!   the store runs one INSERT transaction;
+##! - **concurrent**: several processes saving exchanges for the same users at
+##!   once, counting the turns that survive in each backend;
+##! - **prompt**: tokens of remembered history sent with the last request. JSON
+##!   sends everything; the store sends a summary plus the newest turns within
+##!   its budget, with a stub summariser standing in for the LLM.
+##!
+##! ### Usage
+##! ```bash
+##! python bench_user_memory.py --users 20 --exchanges 300 --processes 4
+##! ```
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database"))
+from prompt_builder import count_tokens # noqa: E402  (import after sys.path setup)
+from user_memory import UserMemoryStore # noqa: E402  (import after sys.path setup)
+
+## @var REPLY
+# Stand-in assistant reply (about a short story's length).
+REPLY: str = "Once upon a time, a small robot learned to be brave. " * 12
+
+
+def json_save(path: str, username: str, memory: List[Dict[str, str]]) -> None:
+    """The legacy save: read the whole file, replace the user's list, write the whole file."""
+    mem: Dict[str, Any] = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as fh:
+            mem = json.load(fh)
+    mem[username] = memory
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump(mem, fh, indent=4)
+
+
+def json_load(path: str, username: str) -> List[Dict[str, str]]:
+    """The legacy load: the user's whole history."""
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as fh:
+            return json.load(fh).get(username, [])
+    return []
+
+
+def exchange(i: int) -> List[Dict[str, str]]:
+    """@return The i-th prompt/reply pair."""
+    return [{"role": "user", "content": f"Tell me story number {i} about dragons."}, {"role": "assistant", "content": REPLY}]
+
+
+def stub_summarize(previous: Optional[str], turns: List[Dict[str, str]]) -> str:
+    """Summariser stand-in: a short note of fixed size."""
+    return f"Likes dragon stories; heard {len(turns)} more turns. " + (previous or "")[:200]
+
+
+def bench_save(directory: str, users: int, exchanges: int) -> Dict[str, Any]:
+    """Per-save latency at the start and end of a growing history, round-robin over users."""
+    json_path, db_path = os.path.join(directory, "save.json"), os.path.join(directory, "save.sqlite3")
+    store = UserMemoryStore(db_path)
+    histories: Dict[str, List[Dict[str, str]]] = {f"user{u}": [] for u in range(users)}
+    timings: Dict[str, List[float]] = {"json": [], "sqlite": []}
+    for i in range(exchanges):
+        username = f"user{i % users}"
+        histories[username].extend(exchange(i))
+        start = time.perf_counter()
+        json_save(json_path, username, histories[username])
+        timings["json"].append((time.perf_counter() - start) * 1000.0)
+        start = time.perf_counter()
+        store.extend(username, exchange(i))
+        timings["sqlite"].append((time.perf_counter() - start) * 1000.0)
+    store.close()
+    window = max(1, exchanges // 10)
+    return {
+        backend: {"first_saves_ms": round(statistics.fmean(values[:window]), 3),
+                  "last_saves_ms": round(statistics.fmean(values[-window:]), 3)}
+        for backend, values in timings.items()
+    } | {"json_file_kb": round(os.path.getsize(json_path) / 1024, 1)}
+
+
+def _json_worker(path: str, worker: int, exchanges: int) -> None:
+    """One CLI session with the legacy file: load at start, save after each exchange."""
+    try:
+        memory = json_load(path, "shared")
+    except ValueError: # Another session was mid-write: start from an empty history
+        memory = []
+    for i in range(exchanges):
+        memory.extend(exchange(worker * 10000 + i))
+        try:
+            json_save(path, "shared", memory)
+        except ValueError: # Read another session's half-written file: this save is lost
+            pass
+
+
+def _sqlite_worker(path: str, worker: int, exchanges: int) -> None:
+    """One CLI session with the store: append after each exchange."""
+    store = UserMemoryStore(path)
+    for i in range(exchanges):
+        store.extend("shared", exchange(worker * 10000 + i))
+    store.close()
+
+
+def bench_concurrent(directory: str, processes: int, exchanges: int) -> Dict[str, Any]:
+    """Turns written vs turns kept when several processes save for the same user at once."""
+    results: Dict[str, Any] = {"turns_written": processes * exchanges * 2}
+    for backend, target, path in (("json", _json_worker, os.path.join(directory, "concurrent.json")),
+                                  ("sqlite", _sqlite_worker, os.path.join(directory, "concurrent.sqlite3"))):
+        workers = [multiprocessing.Process(target=target, args=(path, w, exchanges)) for w in range(processes)]
+        start = time.perf_counter()
+        for proc in workers:
+            proc.start()
+        for proc in workers:
+            proc.join()
+        elapsed = time.perf_counter() - start
+        try:
+            kept = len(json_load(path, "shared")) if backend == "json" else len(UserMemoryStore(path).history("shared"))
+        except ValueError: # A reader caught the JSON file half-written
+            kept = 0
+        results[backend] = {"turns_kept": kept, "seconds": round(elapsed, 2)}
+    return results
+
+
+def bench_prompt(directory: str, exchanges: int, budget: int) -> Dict[str, Any]:
+    """Remembered-history tokens sent with the request after *exchanges* exchanges."""
+    store = UserMemoryStore(os.path.join(directory, "prompt.sqlite3"), budget_tokens=budget)
+    history: List[Dict[str, str]] = []
+    compactions = 0
+    for i in range(exchanges):
+        history.extend(exchange(i))
+        store.extend("alice", exchange(i))
+        if store.needs_compaction("alice"):
+            compactions += store.compact("alice", stub_summarize)
+    sent = store.context("alice")
+    return {
+        "exchanges": exchanges,
+        "json_tokens_sent": sum(count_tokens(m["content"]) + 4 for m in history),
+        "sqlite_tokens_sent": sum(count_tokens(m["content"]) + 4 for m in sent),
+        "sqlite_messages_sent": len(sent),
+        "budget_tokens": budget,
+        "compactions": compactions,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Runs the three scenarios in a temporary directory and prints the results as JSON."""
+    parser = argparse.ArgumentParser(description="Benchmark the JSON user-memory file against the SQLite store.")
+    parser.add_argument("--users", type=int, default=20, help="users in the save scenario (default: %(default)s)")
+    parser.add_argument("--exchanges", type=int, default=300, help="exchanges per scenario (default: %(default)s)")
+    parser.add_argument("--processes", type=int, default=4, help="concurrent sessions (default: %(default)s)")
+    parser.add_argument("--budget", type=int, default=1500, help="store token budget (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = {
+            "config": vars(args),
+            "save": bench_save(directory, args.users, args.exchanges),
+            "concurrent": bench_concurrent(directory, args.processes, max(1, args.exchanges // args.processes)),
+            "prompt": bench_prompt(directory, args.exchanges, args.budget),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+##! @file fake_openai_server.py
+##! @brief Local OpenAI-compatible ChatCompletion server for testing and benchmarks.
+##! @details
+##! Serves `POST /v1/chat/completions` with a canned children's story, both as a
+##! regular JSON completion and, with `"stream": true`, as server-sent events in
+##! OpenAI's chunk format (ending with `data: [DONE]`). Tokens are released at a
+##! configurable rate after a configurable time to first token, so the
+##! blocking and streaming webhook paths can be compared without an API key,
+##! network access or token costs. Non-streamed replies keep the connection
+##! alive (HTTP/1.1), and a share of requests can be failed with a 429/5xx
+##! status to exercise client retries. `GET /v1/models` answers with a one-model
+##! list (used to warm connections). Uses only the standard library.
+##!
+##! Point a client at it with `OPENAI_API_BASE=http://127.0.0.1:<port>/v1`
+##! (legacy openai package) or by swapping the API URL.
+##!
+##! ### Usage
+##! ```bash
+##! python fake_openai_server.py --port 8001 --first-token-ms 400 --token-ms 30
+##! ```
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import argparse
+import json
+import random
+import re
+import ssl
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+__all__ = ["FAKE_STORY", "start_fake_openai", "tokenize"]
+
+## @var FAKE_STORY
+# Canned story returned for every prompt.
+FAKE_STORY: str = (
+    "Once upon a time, in a forest full of whispering pines, there lived a small fox named Juniper. "
+    "Juniper was curious about everything, but she was afraid of the dark. "
+    "One evening, her little brother did not come home before sunset! "
+    "Juniper took a deep breath, lit a glowing mushroom lantern, and stepped into the shadows. "
+    "She found him stuck under a fallen branch, and together they pushed it away. "
+    "\"You were brave,\" he whispered. Juniper smiled, because being brave did not mean she was never scared. "
+    "And from that night on, the forest did not seem quite so dark."
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits text into word-sized pieces (each word with its trailing whitespace),
+    roughly like the deltas of a streamed completion.
+
+    @param text The text to split.
+    @return The pieces, which concatenate back to the original text.
+    """
+    return re.findall(r"\S+\s*", text)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Request handler; timing settings live on the server object. (Internal)"""
+
+    protocol_version = "HTTP/1.1" # Keep-alive, like the real API
+    disable_nagle_algorithm = True # Headers and body are separate writes; avoid delayed-ACK stalls
+
+    def log_message(self, format: str, *args: Any) -> None: # Keep benchmark output clean
+        pass
+
+    def setup(self) -> None:
+        super().setup()
+        time.sleep(self.server.connect_s) # New connection: simulated network round trips # type: ignore[attr-defined]
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/") not in ("/v1/models", "/models"):
+            self.send_error(404)
+            return
+        self._send_json(200, {"object": "list", "data": [{"id": "gpt-4o-mini", "object": "model"}]})
+
+    def do_POST(self) -> None:
+        if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+            self.send_error(404)
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        body: Dict[str, Any] = json.loads(self.rfile.read(length) or b"{}")
+        model = body.get("model", "gpt-4o-mini")
+        tokens = tokenize(self.server.story) # type: ignore[attr-defined]
+        self.server.requests_served += 1 # type: ignore[attr-defined]
+        if random.random() < self.server.error_rate: # type: ignore[attr-defined]
+            self._send_json(self.server.error_status, {"error": {"message": "Injected failure", "type": "server_error"}}) # type: ignore[attr-defined]
+            return
+
+        time.sleep(self.server.first_token_s) # type: ignore[attr-defined]
+        if body.get("stream"):
+            self._stream(model, tokens)
+        else:
+            time.sleep(self.server.token_s * max(0, len(tokens) - 1)) # type: ignore[attr-defined]
+            self._send_json(200, {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+            })
+
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, model: str, tokens: List[str]) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True # No Content-Length: the end of the body is the end of the connection
+
+        def chunk(delta: Dict[str, str], finish_reason: Optional[str] = None) -> None:
+            payload = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                       "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        chunk({"role": "assistant"})
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(self.server.token_s) # type: ignore[attr-defined]
+            chunk({"content": token})
+        chunk({}, "stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+class _Server(ThreadingHTTPServer):
+    """Threaded server with a listen backlog deep enough for hundreds of concurrent clients. (Internal)"""
+
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def start_fake_openai(host: str = "127.0.0.1", port: int = 0, first_token_ms: float = 400.0,
+                      token_ms: float = 30.0, story: str = FAKE_STORY, error_rate: float = 0.0,
+                      error_status: int = 503, ssl_context: Optional[ssl.SSLContext] = None,
+                      connect_ms: float = 0.0) -> ThreadingHTTPServer:
+    """
+    Starts the fake server on a daemon thread.
+
+    @param host Interface to bind.
+    @param port Port to bind (0 picks a free one; read it from server.server_address).
+    @param first_token_ms Delay before the first token (model "thinking" time).
+    @param token_ms Delay between subsequent tokens.
+    @param story Text returned for every request.
+    @param error_rate Share of requests (0–1) answered with error_status instead of a story.
+    @param error_status HTTP status of injected failures (e.g., 429 or 503).
+    @param ssl_context Optional server-side TLS context, to serve HTTPS like the real API.
+    @param connect_ms Delay before a new connection's first request is read (handshake round trips to a distant API).
+    @return The running server; call shutdown() to stop it.
+    """
+    server = _Server((host, port), _Handler)
+    if ssl_context is not None:
+        server.socket = ssl_context.wrap_socket(server.socket, server_side=True)
+    server.first_token_s = first_token_ms / 1000.0 # type: ignore[attr-defined]
+    server.token_s = token_ms / 1000.0 # type: ignore[attr-defined]
+    server.story = story # type: ignore[attr-defined]
+    server.error_rate = error_rate # type: ignore[attr-defined]
+    server.error_status = error_status # type: ignore[attr-defined]
+    server.connect_s = connect_ms / 1000.0 # type: ignore[attr-defined]
+    server.requests_served = 0 # type: ignore[attr-defined]
+    threading.Thread(target=server.serve_forever, name="fake-openai", daemon=True).start()
+    return server
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Runs the fake server in the foreground."""
+    parser = argparse.ArgumentParser(description="Serve a fake OpenAI-compatible ChatCompletion API.")
+    parser.add_argument("--host", default="127.0.0.1", help="interface to bind (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=8001, help="port to bind (default: %(default)s)")
+    parser.add_argument("--first-token-ms", type=float, default=400.0, help="time to first token (default: %(default)s)")
+    parser.add_argument("--token-ms", type=float, default=30.0, help="delay between tokens (default: %(default)s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests failed on purpose (default: %(default)s)")
+    parser.add_argument("--error-status", type=int, default=503, help="status of injected failures (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    server = start_fake_openai(args.host, args.port, args.first_token_ms, args.token_ms,
+                               error_rate=args.error_rate, error_status=args.error_status)
+    print(f"🤖 Fake OpenAI API on http://{args.host}:{server.server_address[1]}/v1 (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+##! @file load_test_query.py
+##! @brief Concurrent load test for the ChromaDB REST wrapper's /query endpoint.
+##! @details
+##! Fires N concurrent Dialogflow-style webhook calls at /query and reports
+##! latency percentiles and throughput. By default the FastAPI app is served by
+##! uvicorn in a child process, against a local ChromaDB stand-in whose
+##! `query()` blocks for a configurable time, like a real HttpClient round-trip,
+##! plus a small per-query cost, and which serves a limited number of calls at
+##! once (like a ChromaDB server with a few workers). Three server modes are
+##! compared: micro-batching (concurrent queries coalesced into one call), the
+##! plain thread pool (one call per request) and the old inline
+##! (event-loop-blocking) call path. The query cache is disabled and every request
+##! uses distinct parameters, so each one reaches the search path.
+##! Pass `--url` to load-test a running server instead.
+##!
+##! ### Usage
+##! ```bash
+##! python load_test_query.py --concurrency 200 --latency-ms 50 --batch-window-ms 5
+##! python load_test_query.py --url http://localhost:8080/query --concurrency 200
+##! ```
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+import uvicorn
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "chromadb_rest_wrapper"))
+import main as wrapper # noqa: E402  (import after sys.path setup)
+from query_cache import QueryCache # noqa: E402
+
+## @var SAMPLE_PAYLOADS
+# Parameter sets cycled through by the load generator.
+SAMPLE_PAYLOADS: List[Dict[str, str]] = [
+    {"protagonist": "dragon", "theme": "friendship", "moral": "courage"},
+    {"protagonist": "Pinocchio", "theme": "adventure", "moral": "honesty"},
+    {"protagonist": "fox", "theme": "forest", "moral": "kindness"},
+    {"protagonist": "robot", "theme": "space", "moral": "teamwork"},
+]
+
+
+class StandInCollection:
+    """
+    Local stand-in for a ChromaDB collection. `query()` sleeps to simulate the
+    network round-trip of HttpClient (blocking the calling thread, as the real
+    client does) plus a per-query search cost, admits at most `max_concurrent`
+    calls at a time, and returns a fixed result set.
+    """
+
+    def __init__(self, latency_s: float, per_query_s: float = 0.0, max_concurrent: int = 0, n_docs: int = 3):
+        self.latency_s = latency_s
+        self.per_query_s = per_query_s
+        self.slots = threading.BoundedSemaphore(max_concurrent) if max_concurrent > 0 else None
+        self.documents = [f"Once upon a time, story snippet number {i}." for i in range(n_docs)]
+
+    def query(self, query_texts: List[str], n_results: int = 3, **_: Any) -> Dict[str, Any]:
+        if self.slots is not None:
+            with self.slots:
+                time.sleep(self.latency_s + self.per_query_s * len(query_texts))
+        else:
+            time.sleep(self.latency_s + self.per_query_s * len(query_texts))
+        docs = self.documents[:n_results]
+        return {
+            "ids": [[f"story_{i}" for i in range(len(docs))] for _ in query_texts],
+            "documents": [docs for _ in query_texts],
+            "metadatas": [[{"title": f"Story {i}"} for i in range(len(docs))] for _ in query_texts],
+            "distances": [[0.1 * (i + 1) for i in range(len(docs))] for _ in query_texts],
+        }
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """
+    Nearest-rank percentile.
+
+    @param values Sample values (need not be sorted).
+    @param pct Percentile in [0, 100].
+    @return The percentile value, or 0.0 for an empty sample.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+async def run_load(client: httpx.AsyncClient, url: str, concurrency: int, requests_total: int) -> Dict[str, Any]:
+    """
+    Sends `requests_total` POSTs with at most `concurrency` in flight and measures each latency.
+
+    @param client The HTTP client to use.
+    @param url The /query URL.
+    @param concurrency Maximum number of simultaneous requests.
+    @param requests_total Total number of requests to send.
+    @return A dictionary of latency percentiles (ms), throughput and error count.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def one(i: int) -> None:
+        nonlocal errors
+        parameters = dict(SAMPLE_PAYLOADS[i % len(SAMPLE_PAYLOADS)])
+        parameters["theme"] = f"{parameters['theme']} {i}" # Distinct queries: no cache or batch dedup hits
+        payload = {"sessionInfo": {"parameters": parameters}}
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                resp = await client.post(url, json=payload)
+                if resp.status_code != 200 or "story_snippet" not in resp.json():
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000.0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests_total)))
+    wall = time.perf_counter() - started
+    return {
+        "requests": requests_total,
+        "concurrency": concurrency,
+        "errors": errors,
+        "throughput_rps": round(requests_total / wall, 1) if wall > 0 else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+        "max_ms": round(max(latencies, default=0.0), 1),
+        "mean_ms": round(statistics.fmean(latencies), 1) if latencies else 0.0,
+    }
+
+
+def _free_port() -> int:
+    """@return An unused localhost TCP port."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve(args: argparse.Namespace) -> None:
+    """
+    Child-process entry point: serves the wrapper app with the stand-in collection.
+
+    @param args Parsed command-line arguments (uses port, latency_ms, per_query_ms,
+           server_concurrency, batch_window_ms and blocking).
+    """
+    wrapper.COLLECTION = StandInCollection(args.latency_ms / 1000.0, args.per_query_ms / 1000.0, args.server_concurrency)
+    wrapper.QUERY_CACHE = QueryCache(max_entries=0) # Measure the search path, not the cache
+    wrapper.QUERY_BATCH_WINDOW_MS = args.batch_window_ms
+    if args.blocking:
+        # The pre-threadpool behaviour: call the blocking client on the event loop.
+        async def inline_search(collection, query, n_results=wrapper.DEFAULT_N_RESULTS):
+            return wrapper.search_stories(collection, query, n_results)
+        wrapper.search_stories_async = inline_search
+    # lifespan="off" skips the startup hook, which would try to reach a real ChromaDB.
+    uvicorn.run(wrapper.app, host="127.0.0.1", port=args.port, lifespan="off",
+                log_level="warning", backlog=4096)
+
+
+def run_in_process(args: argparse.Namespace, blocking: bool, batch_window_ms: float = 0.0) -> Dict[str, Any]:
+    """
+    Load-tests the app against the stand-in collection. The server runs in a
+    child process so the load generator does not compete with it for the GIL.
+
+    @param args Parsed command-line arguments.
+    @param blocking If True, the server calls search_stories() inline on the event loop.
+    @param batch_window_ms Micro-batching window for the server; 0 sends one ChromaDB call per request.
+    @return The load results.
+    """
+    port = _free_port()
+    command = [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port),
+               "--latency-ms", str(args.latency_ms), "--per-query-ms", str(args.per_query_ms),
+               "--server-concurrency", str(args.server_concurrency), "--batch-window-ms", str(batch_window_ms)]
+    if blocking:
+        command.append("--blocking")
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL) # The wrapper logs every request
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            with socket.socket() as sock:
+                if sock.connect_ex(("127.0.0.1", port)) == 0:
+                    break
+            if server.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError("Benchmark server failed to start.")
+            time.sleep(0.1)
+        args.url = f"http://127.0.0.1:{port}/query"
+        return asyncio.run(run_remote(args))
+    finally:
+        args.url = None
+        server.terminate()
+        server.wait()
+
+
+async def run_remote(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Load-tests a running server.
+
+    @param args Parsed command-line arguments (uses args.url).
+    @return The load results.
+    """
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=args.timeout) as client:
+        return await run_load(client, args.url, args.concurrency, args.requests)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Parses arguments, runs the load test(s) and prints the results as JSON."""
+    parser = argparse.ArgumentParser(description="Load-test the /query endpoint of the ChromaDB REST wrapper.")
+    parser.add_argument("--concurrency", type=int, default=200, help="simultaneous requests (default: %(default)s)")
+    parser.add_argument("--requests", type=int, default=1000, help="total requests per run (default: %(default)s)")
+    parser.add_argument("--latency-ms", type=float, default=50.0,
+                        help="simulated ChromaDB round-trip latency for the in-process stand-in (default: %(default)s)")
+    parser.add_argument("--per-query-ms", type=float, default=2.0,
+                        help="simulated extra search cost per query in a call (default: %(default)s)")
+    parser.add_argument("--server-concurrency", type=int, default=1,
+                        help="calls the stand-in serves at once, 0 for unlimited (default: %(default)s)")
+    parser.add_argument("--batch-window-ms", type=float, default=5.0,
+                        help="micro-batching window for the batched run (default: %(default)s)")
+    parser.add_argument("--url", help="load-test a running server at this /query URL instead of the in-process app")
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request timeout (default: %(default)s)")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS) # Internal: child server mode
+    parser.add_argument("--port", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--blocking", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args)
+        return
+
+    if args.url:
+        results = {"remote": asyncio.run(run_remote(args))}
+    else:
+        results = {
+            "config": {"latency_ms": args.latency_ms, "per_query_ms": args.per_query_ms,
+                       "server_concurrency": args.server_concurrency, "batch_window_ms": args.batch_window_ms,
+                       "query_workers": wrapper.CHROMA_QUERY_WORKERS},
+            "microbatch": run_in_process(args, blocking=False, batch_window_ms=args.batch_window_ms),
+            "threadpool": run_in_process(args, blocking=False),
+            "blocking": run_in_process(args, blocking=True),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+##! @file synthetic_corpus.py
+##! @brief Synthetic EPUB and PDF story corpora for the ingestion benchmarks.
+##! @details
+##! Writes books made of chapters of paragraphs (text from bench_chunker.page_pool())
+##! in the two formats upload_stories.py ingests:
+##! - **EPUB**: a minimal EPUB 3, one XHTML document per chapter, with title,
+##!   author, year and genre/subgenre in the OPF metadata;
+##! - **PDF**: a plain PDF 1.4 written by hand (no PDF library needed), Helvetica
+##!   text wrapped at PDF_LINE_CHARS characters, PDF_PAGE_LINES lines per page,
+##!   Flate-compressed content streams. Chapters start on a new page.
+##! Files are named `Author_Title_Year_Genre_Subgenre.ext`, the pattern
+##! extract_metadata_from_filename() parses, so PDFs get full metadata too.
+##!
+##! generate_corpus() controls the corpus size and structure: number of books,
+##! book and chapter size, the format mix (cycled over the books, "both" writing
+##! an EPUB and a PDF of the same book, of which only the EPUB is ingested) and
+##! how many subdirectories the books are spread over. The same seed gives the
+##! same corpus, byte for byte.
+##!
+##! ### Usage
+##! ```bash
+##! python synthetic_corpus.py /tmp/stories --books 200 --book-kb 400 --formats epub pdf --dirs 8
+##! ```
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import argparse
+import json
+import os
+import random
+import sys
+import textwrap
+import zipfile
+import zlib
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+from bench_chunker import page_pool # noqa: E402  (import after sys.path setup)
+
+## @var FORMATS
+# File formats generate_corpus() can write; "both" writes an EPUB and a PDF of the same book.
+FORMATS: List[str] = ["epub", "pdf", "both"]
+
+## @var GENRES
+# (genre, subgenre) pairs assigned to the books in turn.
+GENRES: List[Tuple[str, str]] = [("Fantasy", "Fable"), ("Adventure", "Quest"), ("Mystery", "Cozy"),
+                                 ("ScienceFiction", "Space"), ("Fairytale", "Classic")]
+
+## @var PDF_LINE_CHARS
+# Characters per wrapped PDF text line (10 pt Helvetica on a US Letter page).
+PDF_LINE_CHARS: int = 95
+
+## @var PDF_PAGE_LINES
+# Text lines per PDF page.
+PDF_PAGE_LINES: int = 60
+
+
+def synthetic_book(rng: random.Random, pool: List[str], book_chars: int) -> List[List[str]]:
+    """
+    @return A book as chapters of paragraphs, one distinct page of the pool per chapter
+            (a real book does not repeat whole chapters, whose identical chunks would get occurrence-numbered IDs).
+    """
+    chapters, size = [], 0
+    for page in rng.sample(range(len(pool)), len(pool)):
+        if size >= book_chars:
+            break
+        chapters.append(pool[page].split("\n\n"))
+        size += sum(len(paragraph) + 2 for paragraph in chapters[-1])
+    return chapters
+
+
+def write_epub(path: str, title: str, author: str, chapters: List[List[str]],
+               year: str = "1901", genre: str = "Fantasy", subgenre: str = "Fable") -> None:
+    """Writes a minimal EPUB 3 with one XHTML document per chapter."""
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("mimetype", "application/epub+zip")
+        archive.writestr("META-INF/container.xml",
+                         '<?xml version="1.0"?><container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+                         '<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles></container>')
+        items = "".join(f'<item id="c{i}" href="c{i}.xhtml" media-type="application/xhtml+xml"/>' for i in range(len(chapters)))
+        spine = "".join(f'<itemref idref="c{i}"/>' for i in range(len(chapters)))
+        archive.writestr("OEBPS/content.opf",
+                         '<?xml version="1.0"?><package xmlns="http://www.idpf.org/2007/opf" version="3.0">'
+                         f'<metadata xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:title>{title}</dc:title><dc:creator>{author}</dc:creator>'
+                         f'<dc:date>{year}</dc:date><dc:subject>{genre}</dc:subject><dc:subject>{subgenre}</dc:subject></metadata>'
+                         f'<manifest>{items}</manifest><spine>{spine}</spine></package>')
+        for i, paragraphs in enumerate(chapters):
+            body = "\n\n".join(f"<p>{paragraph}</p>" for paragraph in paragraphs)
+            archive.writestr(f"OEBPS/c{i}.xhtml", f'<html xmlns="http://www.w3.org/1999/xhtml"><body>{body}</body></html>')
+
+
+def _pdf_string(line: str) -> bytes:
+    """Encodes a line as a PDF literal string. (Internal)"""
+    escaped = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    return b"(" + escaped.encode("latin-1", errors="replace") + b")"
+
+
+def write_pdf(path: str, chapters: List[List[str]]) -> None:
+    """Writes a text-only PDF: the chapters' paragraphs wrapped into lines, each chapter starting a new page."""
+    pages: List[List[str]] = []
+    for paragraphs in chapters:
+        lines: List[str] = []
+        for paragraph in paragraphs:
+            lines.extend(textwrap.wrap(paragraph, PDF_LINE_CHARS))
+        pages.extend(lines[i:i + PDF_PAGE_LINES] for i in range(0, max(1, len(lines)), PDF_PAGE_LINES))
+
+    # Objects 1-3 are the catalog, the page tree and the font; each page adds a page and a content stream object.
+    objects: List[bytes] = [b"<< /Type /Catalog /Pages 2 0 R >>", b"",
+                            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>"]
+    kids = []
+    for lines in pages:
+        content = zlib.compress(b"BT /F1 10 Tf 12 TL 50 750 Td\n"
+                                + b"".join(_pdf_string(line) + b" Tj T*\n" for line in lines) + b"ET")
+        kids.append(f"{len(objects) + 1} 0 R".encode())
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> "
+                       f"/Contents {len(objects) + 2} 0 R >>".encode())
+        objects.append(f"<< /Length {len(content)} /Filter /FlateDecode >>\nstream\n".encode() + content + b"\nendstream")
+    objects[1] = b"<< /Type /Pages /Kids [" + b" ".join(kids) + f"] /Count {len(kids)} >>".encode()
+
+    output = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    output += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, "wb") as fh:
+        fh.write(output)
+
+
+def generate_corpus(directory: str, books: int, book_kb: int = 300, chapter_kb: int = 3,
+                    formats: Sequence[str] = ("epub",), dirs: int = 1, seed: int = 7) -> Dict[str, Any]:
+    """
+    Writes a synthetic story corpus.
+
+    @param directory The stories directory to write to (created if missing).
+    @param books Number of books.
+    @param book_kb Approximate text size of each book in KB.
+    @param chapter_kb Approximate text size of each chapter in KB.
+    @param formats Formats cycled over the books ("epub", "pdf" or "both").
+    @param dirs Number of subdirectories the books are spread over (1: all in *directory*).
+    @param seed Random seed.
+    @return Corpus totals: books, files (and EPUB/PDF files), bytes on disk ("bytes") and in the files
+            upload_stories.py ingests, EPUB over PDF ("ingest_bytes"), text characters and chapters.
+    @raises ValueError If a format is not one of FORMATS.
+    """
+    unknown = set(formats) - set(FORMATS)
+    if unknown:
+        raise ValueError(f"Unknown corpus format(s): {sorted(unknown)}. Expected {FORMATS}.")
+    rng = random.Random(seed)
+    pool = page_pool(rng, max(2, book_kb // max(1, chapter_kb)) * 2 + 50, chapter_kb * 1024)
+    totals: Dict[str, Any] = {"books": books, "files": 0, "bytes": 0, "ingest_bytes": 0, "chars": 0, "chapters": 0,
+                              "epub_files": 0, "pdf_files": 0}
+    for i in range(books):
+        folder = os.path.join(directory, f"shelf_{i % dirs:03d}") if dirs > 1 else directory
+        os.makedirs(folder, exist_ok=True)
+        title, author, year = f"Book {i:05d}", f"Author {i % 97}", str(1850 + i % 150)
+        genre, subgenre = GENRES[i % len(GENRES)]
+        stem = os.path.join(folder, f"{author}_{title}_{year}_{genre}_{subgenre}")
+        chapters = synthetic_book(rng, pool, book_kb * 1024)
+        book_format = formats[i % len(formats)]
+        if book_format in ("epub", "both"):
+            write_epub(f"{stem}.epub", title, author, chapters, year, genre, subgenre)
+            totals["epub_files"] += 1
+            totals["ingest_bytes"] += os.path.getsize(f"{stem}.epub")
+        if book_format in ("pdf", "both"):
+            write_pdf(f"{stem}.pdf", chapters)
+            totals["pdf_files"] += 1
+            if book_format == "pdf":
+                totals["ingest_bytes"] += os.path.getsize(f"{stem}.pdf")
+            else: # The EPUB is preferred; the PDF only adds to the bytes on disk
+                totals["bytes"] += os.path.getsize(f"{stem}.pdf")
+        totals["chars"] += sum(len(paragraph) + 2 for paragraphs in chapters for paragraph in paragraphs)
+        totals["chapters"] += len(chapters)
+    totals["files"] = totals["epub_files"] + totals["pdf_files"]
+    totals["bytes"] += totals["ingest_bytes"]
+    return totals
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Writes a corpus to the given directory and prints its totals as JSON."""
+    parser = argparse.ArgumentParser(description="Write a synthetic EPUB/PDF story corpus.")
+    parser.add_argument("directory", help="stories directory to write to")
+    parser.add_argument("--books", type=int, default=100, help="books (default: %(default)s)")
+    parser.add_argument("--book-kb", type=int, default=300, help="book size in KB (default: %(default)s)")
+    parser.add_argument("--chapter-kb", type=int, default=3, help="chapter size in KB (default: %(default)s)")
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=["epub", "pdf"],
+                        help="formats cycled over the books (default: %(default)s)")
+    parser.add_argument("--dirs", type=int, default=1, help="subdirectories to spread the books over (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=7, help="random seed (default: %(default)s)")
+    args = parser.parse_args(argv)
+    print(json.dumps(generate_corpus(args.directory, args.books, args.book_kb, args.chapter_kb,
+                                     args.formats, args.dirs, args.seed), indent=2))
+
+
+if __name__ == "__main__":
+    main()
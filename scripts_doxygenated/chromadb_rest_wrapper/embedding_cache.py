@@ -0,0 +1,287 @@
+##! @file embedding_cache.py
+##! @brief Content-addressed, memory-mapped cache of embedding vectors.
+##! @details
+##! Every `collection.query(query_texts=...)` and `collection.add(documents=...)`
+##! call makes ChromaDB's embedding function run again, even for text it has
+##! embedded many times before (popular queries, unchanged chunks of a re-ingested
+##! story, re-runs of setup_chroma.py that pay OpenAI per token). EmbeddingCache
+##! maps SHA-256(namespace + text) to a float32 vector so callers can pass
+##! precomputed `embeddings=` / `query_embeddings=` and only embed what is new.
+##!
+##! ### File format
+##! One append-only file: a 16-byte header (magic, version, dimension) followed by
+##! fixed-size records of a 32-byte key and `dimension` little-endian float32
+##! values. The file is memory-mapped for reads; appends take an exclusive
+##! `flock` so several processes (uvicorn workers, ingestion runs) can share it.
+##! The namespace (normally the embedding model name) is part of every key, so
+##! vectors from different models never collide. Delete the file to reset it.
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+try:
+    import fcntl
+except ImportError: # Windows: no cross-process locking, single-process use only
+    fcntl = None
+
+__all__ = ["EmbeddingCache"]
+
+## @var _MAGIC
+# File signature written at the start of the cache file. (Internal constant)
+_MAGIC: bytes = b"EMBC"
+
+## @var _VERSION
+# File format version. (Internal constant)
+_VERSION: int = 1
+
+## @var _HEADER
+# Header layout: magic, version, dimension, reserved. (Internal constant)
+_HEADER = struct.Struct("<4sIII")
+
+## @var _LOCK_SH
+# flock operations, or 0 where fcntl is unavailable. (Internal constants)
+_LOCK_SH: int = fcntl.LOCK_SH if fcntl else 0
+_LOCK_EX: int = fcntl.LOCK_EX if fcntl else 0
+_LOCK_UN: int = fcntl.LOCK_UN if fcntl else 0
+
+## @var _KEY_SIZE
+# Size in bytes of a record key (a SHA-256 digest). (Internal constant)
+_KEY_SIZE: int = 32
+
+
+class EmbeddingCache:
+    """
+    Maps text to embedding vectors through a shared, memory-mapped file.
+    Thread-safe; safe to share between processes on one host where fcntl is available.
+    """
+
+    def __init__(self, path: str, namespace: str):
+        """
+        Opens (or creates) the cache file. Existing records are indexed immediately.
+
+        @param path Filesystem path of the cache file.
+        @param namespace Identifier of the embedding model; part of every key.
+        """
+        self.path = path
+        self.namespace = namespace
+        self.dim: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+        self._index: Dict[bytes, int] = {}
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+        self._mm: Optional[mmap.mmap] = None
+        self._mapped_records = 0
+        self._warned_dim = False
+        with self._lock:
+            self._refresh()
+
+    # --- Internal helpers (caller holds self._lock) ---
+
+    def _flock(self, operation: int) -> None:
+        if fcntl is not None:
+            fcntl.flock(self._fd, operation)
+
+    def _record_size(self) -> int:
+        return _KEY_SIZE + 4 * (self.dim or 0)
+
+    def _pread(self, size: int, offset: int) -> bytes:
+        if hasattr(os, "pread"):
+            return os.pread(self._fd, size, offset)
+        os.lseek(self._fd, offset, os.SEEK_SET) # Windows: no pread; self._lock serializes the seek
+        return os.read(self._fd, size)
+
+    def _pwrite(self, data: bytes, offset: int) -> None:
+        if hasattr(os, "pwrite"):
+            os.pwrite(self._fd, data, offset)
+            return
+        os.lseek(self._fd, offset, os.SEEK_SET) # Windows: no pwrite; self._lock serializes the seek
+        os.write(self._fd, data)
+
+    def _read_header(self, size: int) -> None:
+        if self.dim is not None or size < _HEADER.size:
+            return
+        magic, version, dim, _ = _HEADER.unpack(self._pread(_HEADER.size, 0))
+        if magic != _MAGIC or version != _VERSION or dim <= 0:
+            raise ValueError(f"{self.path} is not an embedding cache file (or has an unsupported version).")
+        self.dim = dim
+
+    def _refresh(self) -> None:
+        """Maps and indexes records appended (by any process) since the last refresh."""
+        self._flock(_LOCK_SH)
+        try:
+            self._map_new_records()
+        finally:
+            self._flock(_LOCK_UN)
+
+    def _map_new_records(self) -> None:
+        """Maps and indexes the file's records beyond the ones already indexed. Caller holds a file lock."""
+        size = os.fstat(self._fd).st_size
+        self._read_header(size)
+        if self.dim is None:
+            return
+        count = (size - _HEADER.size) // self._record_size() # Ignores a torn trailing record
+        if count <= self._mapped_records:
+            return
+        if self._mm is not None:
+            self._mm.close()
+        self._mm = mmap.mmap(self._fd, _HEADER.size + count * self._record_size(), access=mmap.ACCESS_READ)
+        record_size = self._record_size()
+        for row in range(self._mapped_records, count):
+            offset = _HEADER.size + row * record_size
+            self._index.setdefault(self._mm[offset:offset + _KEY_SIZE], row)
+        self._mapped_records = count
+
+    def _read_vector(self, row: int) -> List[float]:
+        offset = _HEADER.size + row * self._record_size() + _KEY_SIZE
+        vector = array("f")
+        vector.frombytes(self._mm[offset:offset + 4 * self.dim])
+        if sys.byteorder != "little":
+            vector.byteswap()
+        return vector.tolist()
+
+    def _lookup(self, key: bytes) -> Optional[List[float]]:
+        row = self._index.get(key)
+        if row is None:
+            return None
+        if row >= self._mapped_records:
+            self._refresh()
+        return self._read_vector(row)
+
+    def _append(self, items: Dict[bytes, Sequence[float]]) -> None:
+        """Appends new vectors under an exclusive file lock, skipping keys another writer already stored."""
+        self._flock(_LOCK_EX)
+        try:
+            self._map_new_records() # Index what other writers appended, so their keys are skipped
+            first_dim = len(next(iter(items.values())))
+            if self.dim is None:
+                self.dim = first_dim
+                self._pwrite(_HEADER.pack(_MAGIC, _VERSION, self.dim, 0), 0)
+            if first_dim != self.dim:
+                if not self._warned_dim:
+                    print(f"⚠️ Warning: Embedding dimension {first_dim} does not match cache file {self.path} "
+                          f"(dimension {self.dim}); new vectors will not be cached.", file=sys.stderr)
+                    self._warned_dim = True
+                return
+            record_size = self._record_size()
+            count = self._mapped_records # Overwrites a torn trailing record, if any
+            payload = bytearray()
+            new_rows: Dict[bytes, int] = {}
+            for key, vector in items.items():
+                if key in self._index or key in new_rows:
+                    continue
+                values = array("f", (float(v) for v in vector))
+                if sys.byteorder != "little":
+                    values.byteswap()
+                payload += key
+                payload += values.tobytes()
+                new_rows[key] = count + len(new_rows)
+            if payload:
+                self._pwrite(bytes(payload), _HEADER.size + count * record_size)
+                self._index.update(new_rows)
+        finally:
+            self._flock(_LOCK_UN)
+
+    # --- Public API ---
+
+    def make_key(self, text: str) -> bytes:
+        """
+        Builds the content-addressed key for a text.
+
+        @param text The text that is (or will be) embedded.
+        @return The 32-byte SHA-256 digest of namespace and text.
+        """
+        return hashlib.sha256(f"{self.namespace}\0{text}".encode("utf-8")).digest()
+
+    def get(self, text: str) -> Optional[List[float]]:
+        """
+        Looks up the cached vector for a text.
+
+        @param text The text to look up.
+        @return The vector, or None if it has not been cached.
+        """
+        key = self.make_key(text)
+        with self._lock:
+            vector = self._lookup(key)
+            if vector is None:
+                self._refresh() # Another process may have added it
+                vector = self._lookup(key)
+            if vector is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return vector
+
+    def embed(self, texts: Sequence[str], embedding_function: Callable[[List[str]], Any]) -> List[List[float]]:
+        """
+        Returns vectors for all texts, computing (and caching) only the ones not
+        already cached. Duplicate texts within one call are embedded once.
+
+        @param texts The texts to embed.
+        @param embedding_function Called with the list of uncached texts; returns one vector per text
+               (e.g., a ChromaDB EmbeddingFunction).
+        @return One vector per input text, in order.
+        """
+        keys = [self.make_key(text) for text in texts]
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+        with self._lock:
+            self._refresh()
+            for i, key in enumerate(keys):
+                vectors[i] = self._lookup(key)
+
+        pending: Dict[bytes, str] = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                pending.setdefault(keys[i], texts[i])
+        with self._lock:
+            self.hits += len(texts) - sum(1 for v in vectors if v is None)
+            self.misses += len(pending)
+
+        if pending:
+            # Embed outside the lock so other threads can keep reading the cache.
+            computed = embedding_function(list(pending.values()))
+            fresh = {key: [float(x) for x in vector] for key, vector in zip(pending, computed)}
+            with self._lock:
+                self._append(fresh)
+            for i, key in enumerate(keys):
+                if vectors[i] is None:
+                    vectors[i] = fresh[key]
+        return vectors
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        @return Hit/miss counters and file details, suitable for a JSON response.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "path": self.path,
+                "namespace": self.namespace,
+                "dimension": self.dim,
+                "entries": len(self._index),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def close(self) -> None:
+        """Unmaps and closes the cache file."""
+        with self._lock:
+            if self._mm is not None:
+                self._mm.close()
+                self._mm = None
+            if self._fd >= 0:
+                os.close(self._fd)
+                self._fd = -1
@@ -0,0 +1,279 @@
+##! @file facet_index.py
+##! @brief Cached facet index (distinct metadata values and counts) and metadata filters for story search.
+##! @details
+##! upload_stories.py gives every chunk a title, author, year, genre and
+##! subgenre. FacetIndex keeps, for each filterable field, the distinct values
+##! with their story and chunk counts. It is built from the collection's
+##! metadatas (no documents or embeddings), saved to a JSON file together with
+##! the ingest generation it was built for, and rebuilt only when that
+##! generation changes. The REST wrapper uses it to:
+##! - validate filter values and map them to the spelling stored in ChromaDB
+##!   (case-insensitive exact matches only; a value that does not match is
+##!   rejected with the stored values starting with one of its words as suggestions);
+##! - turn a year range into an `$in` list of the stored years (years are
+##!   stored as strings, which ChromaDB cannot compare as numbers);
+##! - serve autocompletion (GET /facets) without scanning the collection.
+##!
+##! where_clause() produces a ChromaDB `where` filter; matches_where() evaluates
+##! filters (`$and`/`$or`, `$eq`/`$ne`, `$in`/`$nin`) in Python for the local replica.
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+__all__ = ["FACET_FIELDS", "FacetIndex", "matches_where"]
+
+## @var FACET_FIELDS
+# Metadata fields that can be filtered on.
+FACET_FIELDS: Tuple[str, ...] = ("genre", "subgenre", "author", "year")
+
+## @var _PAGE_SIZE
+# Records fetched per collection.get() call while building. (Internal constant)
+_PAGE_SIZE: int = 5000
+
+## @var _SUGGESTIONS
+# Maximum number of near-matches offered when a filter value matches nothing. (Internal constant)
+_SUGGESTIONS: int = 5
+
+## @var _WORD
+# Words of a facet value or filter text, for suggestions ("Non-Fiction" has "non" and "fiction"). (Internal constant)
+_WORD = re.compile(r"\w+")
+
+## @var _MISSING_VALUES
+# Placeholder values upload_stories.py stores for unknown fields; not offered as facets. (Internal constant)
+_MISSING_VALUES = frozenset(("", "unknown"))
+
+
+def matches_where(metadata: Optional[Dict[str, Any]], where: Dict[str, Any]) -> bool:
+    """
+    Evaluates a ChromaDB `where` filter against one metadata dict.
+    Supports `$and`, `$or`, `$eq`, `$ne`, `$in`, `$nin` and plain equality.
+
+    @param metadata The record's metadata (None matches nothing but `$ne`/`$nin`).
+    @param where The filter.
+    @return True if the record passes the filter.
+    @raises ValueError For other operators.
+    """
+    metadata = metadata or {}
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, part) for part in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(matches_where(metadata, part) for part in condition):
+                return False
+            continue
+        value = metadata.get(key)
+        operator, operand = next(iter(condition.items())) if isinstance(condition, dict) else ("$eq", condition)
+        if operator == "$eq":
+            passed = value == operand
+        elif operator == "$ne":
+            passed = value != operand
+        elif operator == "$in":
+            passed = value in operand
+        elif operator == "$nin":
+            passed = value not in operand
+        else:
+            raise ValueError(f"Unsupported where operator: {operator}")
+        if not passed:
+            return False
+    return True
+
+
+class FacetIndex:
+    """
+    Distinct values of the filterable metadata fields with story and chunk counts.
+    Thread-safe: lookups read an immutable mapping swapped on rebuild.
+    """
+
+    def __init__(self, path: Optional[str] = None, fields: Tuple[str, ...] = FACET_FIELDS):
+        """
+        @param path Optional JSON file the index is saved to after each rebuild and loaded from at startup.
+        @param fields Metadata fields to index.
+        """
+        self.path = path
+        self.fields = fields
+        self.generation: Optional[str] = None
+        self.built_at: Optional[float] = None
+        self.chunks = 0
+        self._facets: Dict[str, Dict[str, Dict[str, int]]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        """True once the index has been built or loaded."""
+        return self.built_at is not None
+
+    def rebuild(self, collection: Any, generation: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Recounts the facets from the collection's metadatas and saves the result to `path`.
+
+        @param collection The collection (anything with `get(include=..., limit=..., offset=...)`).
+        @param generation The ingest generation the collection is at, stored with the index.
+        @return Chunk count, distinct values per field and build time.
+        """
+        start = time.perf_counter()
+        stories: Dict[str, Dict[str, set]] = {field: {} for field in self.fields}
+        chunks: Dict[str, Dict[str, int]] = {field: {} for field in self.fields}
+        total = 0
+        offset = 0
+        while True:
+            page = collection.get(include=["metadatas"], limit=_PAGE_SIZE, offset=offset)
+            for metadata in page.get("metadatas") or []:
+                metadata = metadata or {}
+                story = str(metadata.get("story_id") or metadata.get("title", ""))
+                for field in self.fields:
+                    value = metadata.get(field)
+                    if value is None or str(value).strip().lower() in _MISSING_VALUES:
+                        continue
+                    stories[field].setdefault(str(value), set()).add(story)
+                    chunks[field][str(value)] = chunks[field].get(str(value), 0) + 1
+            total += len(page["ids"])
+            if len(page["ids"]) < _PAGE_SIZE:
+                break
+            offset += _PAGE_SIZE
+        facets = {
+            field: {value: {"stories": len(stories[field][value]), "chunks": chunks[field][value]} for value in stories[field]}
+            for field in self.fields
+        }
+        with self._lock:
+            self._facets, self.generation, self.chunks, self.built_at = facets, generation, total, time.time()
+        if self.path:
+            self.save(self.path)
+        return {"chunks": total, "values": {field: len(values) for field, values in facets.items()},
+                "seconds": round(time.perf_counter() - start, 3)}
+
+    def save(self, path: str) -> None:
+        """Writes the index to a JSON file (atomically, via a temporary file)."""
+        with self._lock:
+            data = {"generation": self.generation, "built_at": self.built_at, "chunks": self.chunks, "facets": self._facets}
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump(data, fh)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str, generation: Optional[str] = None) -> bool:
+        """
+        Loads an index saved by save() if it was built for *generation*.
+
+        @return True if loaded; False if the file is missing, unreadable or from another generation.
+        """
+        try:
+            with open(path, encoding="utf-8") as fh:
+                data = json.load(fh)
+        except (OSError, ValueError):
+            return False
+        if data.get("generation") != generation:
+            return False
+        with self._lock:
+            self._facets = {field: data["facets"].get(field, {}) for field in self.fields}
+            self.generation, self.chunks, self.built_at = generation, data.get("chunks", 0), data.get("built_at") or time.time()
+        return True
+
+    def values(self, field: str, prefix: str = "", limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        Values of a field for autocompletion, most stories first.
+
+        @param field The metadata field.
+        @param prefix Only values with a word starting with this text (case-insensitive).
+        @param limit Maximum number of values.
+        @return Dicts with "value", "stories" and "chunks".
+        """
+        prefix = prefix.strip().lower()
+        with self._lock:
+            facet = self._facets.get(field, {})
+        matching = [
+            {"value": value, **counts} for value, counts in facet.items()
+            if not prefix or any(word.startswith(prefix) for word in value.lower().split()) or value.lower().startswith(prefix)
+        ]
+        matching.sort(key=lambda item: (-item["stories"], item["value"]))
+        return matching[:limit]
+
+    def resolve(self, field: str, text: str) -> List[str]:
+        """
+        Maps a filter value to the stored values it means: the case-insensitive exact
+        matches (a field can hold the same value in several spellings).
+
+        @return The stored values (empty if nothing matches).
+        """
+        wanted = text.strip().lower()
+        with self._lock:
+            facet = self._facets.get(field, {})
+        return sorted(value for value in facet if value.lower() == wanted)
+
+    def suggestions(self, field: str, text: str, limit: int = _SUGGESTIONS) -> List[str]:
+        """
+        Near-matches of a filter value that resolve() rejected: stored values with a word
+        starting with one of the text's words, most stories first.
+
+        @return Up to *limit* stored values.
+        """
+        words = _WORD.findall(text.lower())
+        with self._lock:
+            facet = self._facets.get(field, {})
+        near = [value for value in facet
+                if any(stored.startswith(word) for stored in _WORD.findall(value.lower()) for word in words)]
+        near.sort(key=lambda value: (-facet[value]["stories"], value))
+        return near[:limit]
+
+    def years(self, year_from: Optional[int], year_to: Optional[int]) -> List[str]:
+        """@return The stored year values within [year_from, year_to] (either bound may be None)."""
+        with self._lock:
+            facet = self._facets.get("year", {})
+        low = year_from if year_from is not None else -10**9
+        high = year_to if year_to is not None else 10**9
+        return sorted(value for value in facet if value.strip().lstrip("-").isdigit() and low <= int(value) <= high)
+
+    def where_clause(self, filters: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        Builds a ChromaDB `where` filter from request filters.
+
+        @param filters Optional "genre", "subgenre", "author" (text) and "year_from"/"year_to" (int) values.
+        @return (where, None) — where is None without filters — or (None, reason) if a
+                filter matches no stored value exactly. The reason is a noun phrase that
+                completes "there is …" (e.g., "no genre matching 'fiction' (did you mean
+                'Science Fiction', 'Non-Fiction'?)", "no story from 1900 to 1950").
+        """
+        conditions: List[Dict[str, Any]] = []
+        for field in ("genre", "subgenre", "author"):
+            text = (filters.get(field) or "").strip()
+            if not text:
+                continue
+            if not self.ready: # Nothing to validate against: filter on the value as given
+                conditions.append({field: {"$eq": text}})
+                continue
+            stored = self.resolve(field, text)
+            if not stored:
+                near = self.suggestions(field, text)
+                hint = f" (did you mean {', '.join(repr(value) for value in near)}?)" if near else ""
+                return None, f"no {field} matching '{text}'{hint}"
+            conditions.append({field: {"$in": stored}})
+        year_from, year_to = filters.get("year_from"), filters.get("year_to")
+        if year_from is not None or year_to is not None:
+            if not self.ready:
+                return None, "no year information yet"
+            stored = self.years(year_from, year_to)
+            if not stored:
+                if year_from is not None and year_to is not None:
+                    return None, f"no story from {year_from} to {year_to}"
+                return None, f"no story from {year_from} onwards" if year_from is not None else f"no story up to {year_to}"
+            conditions.append({"year": {"$in": stored}})
+        if not conditions:
+            return None, None
+        return (conditions[0] if len(conditions) == 1 else {"$and": conditions}), None
+
+    def stats(self) -> Dict[str, Any]:
+        """@return Readiness, the generation and chunk count it was built from, and distinct values per field."""
+        with self._lock:
+            return {"ready": self.ready, "generation": self.generation, "chunks": self.chunks, "built_at": self.built_at,
+                    "values": {field: len(values) for field, values in self._facets.items()}, "path": self.path}
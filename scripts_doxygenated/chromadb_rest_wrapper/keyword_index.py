@@ -0,0 +1,320 @@
+##! @file keyword_index.py
+##! @brief Local BM25 inverted index over story chunks, for hybrid keyword + vector search.
+##! @details
+##! Dense search over `protagonist theme moral` often misses exact names: a
+##! small sentence encoder gives "Pinocchio" little weight next to the theme
+##! words, and every query pays for an embedding. KeywordIndex keeps a SQLite
+##! FTS5 inverted index (Porter-stemmed, diacritics folded) over the chunk text
+##! and the story title, and ranks matches with BM25. Titles weigh
+##! KEYWORD_TITLE_WEIGHT times as much as body text.
+##!
+##! upload_stories.py writes to the index in the same batches it upserts into
+##! ChromaDB, so by default it lives next to the ingestion manifest. The REST
+##! wrapper opens it (or its own copy, kept current with sync()) and merges
+##! the two rankings with fuse_rankings() (reciprocal rank fusion). A query with
+##! a rare term (a name found in few chunks) can be answered from the index
+##! alone without calling the embedder; see KeywordResult.selective.
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import json
+import re
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+__all__ = ["KeywordIndex", "KeywordResult", "fuse_rankings", "query_terms"]
+
+## @var KEYWORD_TITLE_WEIGHT
+# BM25 weight of the title column relative to the chunk text.
+KEYWORD_TITLE_WEIGHT: float = 2.0
+
+## @var RRF_K
+# Rank offset of reciprocal rank fusion; 60 is the value from the original RRF paper.
+RRF_K: int = 60
+
+## @var _PAGE_SIZE
+# Records fetched per collection.get() call while syncing. (Internal constant)
+_PAGE_SIZE: int = 1000
+
+## @var _WORD
+# Query terms: runs of letters and digits. (Internal constant)
+_WORD = re.compile(r"\w+")
+
+## @var _STOPWORDS
+# Words dropped from queries; they match nearly every chunk. (Internal constant)
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has he her his in is it its of on or she that the their they "
+    "to was were will with about story stories".split()
+)
+
+
+def query_terms(text: str) -> List[str]:
+    """
+    Splits a query into lower-cased search terms, without stopwords or duplicates.
+
+    @param text The query string.
+    @return The terms, in query order.
+    """
+    return list(dict.fromkeys(word for word in _WORD.findall(text.lower()) if word not in _STOPWORDS))
+
+
+@dataclass
+class KeywordResult:
+    """BM25 matches of one query."""
+
+    hits: List[Dict[str, Any]] = field(default_factory=list)
+    """Matching chunks, best first, as dicts with "id", "text", "metadata", "distance" (None) and "score"."""
+
+    rare_terms: List[str] = field(default_factory=list)
+    """Query terms found in at most the rare-term share of the chunks (e.g., names)."""
+
+    rare_matches: int = 0
+    """Chunks containing a rare term (counted up to the requested number of hits)."""
+
+    def selective(self, n_results: int) -> bool:
+        """
+        True when the rare terms alone pick at least *n_results* chunks, so the
+        BM25 ranking can answer the query without a vector search.
+        """
+        return bool(self.rare_terms) and self.rare_matches >= n_results
+
+
+class KeywordIndex:
+    """
+    SQLite FTS5 index of chunk text searched with BM25.
+    Thread-safe; several processes can share the file (WAL mode).
+    """
+
+    def __init__(self, path: str, rare_term_ratio: float = 0.01):
+        """
+        Opens (or creates) the index database.
+
+        @param path Filesystem path of the SQLite database.
+        @param rare_term_ratio Largest share of the chunks a term may occur in to count as rare.
+        @raises sqlite3.OperationalError If this SQLite build lacks FTS5.
+        """
+        self.path = path
+        self.rare_term_ratio = rare_term_ratio
+        self.searches = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS chunks (
+                    rowid    INTEGER PRIMARY KEY,
+                    id       TEXT NOT NULL UNIQUE,
+                    title    TEXT NOT NULL,
+                    document TEXT NOT NULL,
+                    metadata TEXT NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(title, document, content='chunks', "
+                "content_rowid='rowid', tokenize='porter unicode61 remove_diacritics 2')"
+            )
+            # External-content table: the triggers keep the inverted index in step with `chunks`.
+            self._conn.executescript(
+                """
+                CREATE TRIGGER IF NOT EXISTS chunks_ai AFTER INSERT ON chunks BEGIN
+                    INSERT INTO chunks_fts(rowid, title, document) VALUES (new.rowid, new.title, new.document);
+                END;
+                CREATE TRIGGER IF NOT EXISTS chunks_ad AFTER DELETE ON chunks BEGIN
+                    INSERT INTO chunks_fts(chunks_fts, rowid, title, document) VALUES ('delete', old.rowid, old.title, old.document);
+                END;
+                CREATE TRIGGER IF NOT EXISTS chunks_au AFTER UPDATE ON chunks BEGIN
+                    INSERT INTO chunks_fts(chunks_fts, rowid, title, document) VALUES ('delete', old.rowid, old.title, old.document);
+                    INSERT INTO chunks_fts(rowid, title, document) VALUES (new.rowid, new.title, new.document);
+                END;
+                """
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def upsert(self, ids: Sequence[str], documents: Sequence[str], metadatas: Sequence[Optional[Dict[str, Any]]]) -> int:
+        """
+        Adds or replaces chunks. Unchanged chunks are left alone (no index churn).
+
+        @param ids Chunk IDs, as in the ChromaDB collection.
+        @param documents Chunk texts.
+        @param metadatas Chunk metadata dicts; "title" is indexed with the text.
+        @return The number of chunks added or changed.
+        """
+        rows = [
+            (id_, str((metadata or {}).get("title", "")), document or "", json.dumps(metadata or {}, sort_keys=True))
+            for id_, document, metadata in zip(ids, documents, metadatas)
+        ]
+        with self._lock, self._conn:
+            cursor = self._conn.executemany(
+                """
+                INSERT INTO chunks (id, title, document, metadata) VALUES (?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    title = excluded.title, document = excluded.document, metadata = excluded.metadata
+                WHERE chunks.document IS NOT excluded.document OR chunks.metadata IS NOT excluded.metadata
+                """,
+                rows,
+            )
+        return max(cursor.rowcount, 0)
+
+    def delete(self, ids: Sequence[str]) -> None:
+        """
+        Removes chunks; unknown IDs are ignored.
+
+        @param ids Chunk IDs to remove.
+        """
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM chunks WHERE id = ?", [(id_,) for id_ in ids])
+
+    def _document_frequency(self, term: str, limit: int) -> int:
+        """Chunks containing *term*, counted up to *limit*. (Caller holds self._lock)"""
+        row = self._conn.execute(
+            "SELECT COUNT(*) FROM (SELECT 1 FROM chunks_fts WHERE chunks_fts MATCH ? LIMIT ?)", (f'"{term}"', limit)
+        ).fetchone()
+        return row[0]
+
+    def search(self, query: str, n_results: int, where: Optional[Dict[str, Any]] = None) -> KeywordResult:
+        """
+        Ranks chunks containing any query term by BM25.
+
+        @param query The query string.
+        @param n_results The number of chunks to return.
+        @param where Optional ChromaDB metadata filter (`$and`/`$or`, `$eq`/`$ne`, `$in`/`$nin`).
+        @return The matches and the query's rare terms.
+        """
+        terms = query_terms(query)
+        if not terms or n_results <= 0:
+            return KeywordResult()
+        match = " OR ".join(f'"{term}"' for term in terms)
+        filter_sql, filter_params = _where_sql(where) if where else ("1", [])
+        with self._lock:
+            self.searches += 1
+            total = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0] or 0
+            rare_limit = max(1, int(total * self.rare_term_ratio))
+            rare_terms = [term for term in terms if 0 < self._document_frequency(term, rare_limit + 1) <= rare_limit]
+            rare_matches = 0
+            if rare_terms:
+                rare_match = " OR ".join(f'"{term}"' for term in rare_terms)
+                rare_matches = self._conn.execute(
+                    f"""
+                    SELECT COUNT(*) FROM (SELECT 1 FROM chunks_fts JOIN chunks c ON c.rowid = chunks_fts.rowid
+                                          WHERE chunks_fts MATCH ? AND {filter_sql} LIMIT ?)
+                    """,
+                    (rare_match, *filter_params, n_results),
+                ).fetchone()[0]
+            rows = self._conn.execute(
+                f"""
+                SELECT c.id, c.document, c.metadata, bm25(chunks_fts, {KEYWORD_TITLE_WEIGHT}, 1.0) AS rank
+                FROM chunks_fts JOIN chunks c ON c.rowid = chunks_fts.rowid
+                WHERE chunks_fts MATCH ? AND {filter_sql} ORDER BY rank LIMIT ?
+                """,
+                (match, *filter_params, n_results),
+            ).fetchall()
+        hits = [
+            {"id": id_, "text": document, "metadata": json.loads(metadata), "distance": None, "score": round(-rank, 6)}
+            for id_, document, metadata, rank in rows
+        ]
+        return KeywordResult(hits, rare_terms, rare_matches)
+
+    def sync(self, collection: Any) -> Dict[str, int]:
+        """
+        Brings the index in line with a ChromaDB collection (or anything with its
+        `get(include=..., limit=..., offset=...)`): new and changed chunks are
+        indexed, chunks no longer in the collection are removed. Only documents
+        and metadatas are downloaded, never embeddings.
+
+        @param collection The collection to mirror.
+        @return Counts of "chunks" in the collection, "upserted" and "deleted".
+        """
+        seen = set()
+        upserted = 0
+        offset = 0
+        while True:
+            page = collection.get(include=["documents", "metadatas"], limit=_PAGE_SIZE, offset=offset)
+            ids = page["ids"]
+            documents = page.get("documents") or [None] * len(ids)
+            metadatas = page.get("metadatas") or [None] * len(ids)
+            upserted += self.upsert(ids, [d or "" for d in documents], metadatas)
+            seen.update(ids)
+            if len(ids) < _PAGE_SIZE:
+                break
+            offset += _PAGE_SIZE
+        with self._lock:
+            stale = [row[0] for row in self._conn.execute("SELECT id FROM chunks") if row[0] not in seen]
+        self.delete(stale)
+        return {"chunks": len(seen), "upserted": upserted, "deleted": len(stale)}
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        @return Number of indexed chunks, searches served and the file path.
+        """
+        return {"chunks": len(self), "searches": self.searches, "path": self.path}
+
+    def close(self) -> None:
+        """Closes the database connection."""
+        with self._lock:
+            self._conn.close()
+
+
+def _where_sql(where: Dict[str, Any]) -> Tuple[str, List[Any]]:
+    """
+    Translates a ChromaDB `where` filter into an SQL condition on `c.metadata`. (Internal)
+
+    @return (SQL expression, parameters). Field names are passed as JSON paths, never spliced into the SQL.
+    @raises ValueError For unsupported operators.
+    """
+    parts: List[str] = []
+    params: List[Any] = []
+    for key, condition in where.items():
+        if key in ("$and", "$or"):
+            clauses = [_where_sql(part) for part in condition]
+            parts.append("(" + f" {key[1:].upper()} ".join(sql for sql, _ in clauses) + ")" if clauses else "1")
+            params += [param for _, clause_params in clauses for param in clause_params]
+            continue
+        operator, operand = next(iter(condition.items())) if isinstance(condition, dict) else ("$eq", condition)
+        field = "json_extract(c.metadata, ?)"
+        params.append(f'$."{key}"')
+        if operator in ("$eq", "$ne"):
+            parts.append(f"{field} {'=' if operator == '$eq' else 'IS NOT'} ?")
+            params.append(operand)
+        elif operator in ("$in", "$nin"):
+            placeholders = ", ".join("?" for _ in operand) or "NULL"
+            parts.append(f"{field} {'IN' if operator == '$in' else 'NOT IN'} ({placeholders})")
+            params += list(operand)
+        else:
+            raise ValueError(f"Unsupported where operator: {operator}")
+    return " AND ".join(parts) or "1", params
+
+
+def fuse_rankings(vector_hits: List[Dict[str, Any]], keyword_hits: List[Dict[str, Any]], n_results: int,
+                  keyword_weight: float = 1.0, k: int = RRF_K) -> List[Dict[str, Any]]:
+    """
+    Merges a vector ranking and a BM25 ranking by reciprocal rank fusion: each
+    chunk scores sum(weight / (k + rank)) over the rankings it appears in. Ranks
+    are used rather than raw scores, as distances and BM25 scores are not comparable.
+
+    @param vector_hits Chunks from the vector search, nearest first.
+    @param keyword_hits Chunks from KeywordIndex.search(), best first.
+    @param n_results The number of chunks to return.
+    @param keyword_weight Weight of the BM25 ranking (the vector ranking weighs 1).
+    @param k Rank offset; larger values flatten the difference between top and lower ranks.
+    @return Up to *n_results* chunk dicts, best first, with the fused "score" set.
+        Chunks found by the vector search keep their "distance".
+    """
+    scores: Dict[str, float] = {}
+    chunks: Dict[str, Dict[str, Any]] = {}
+    for weight, hits in ((1.0, vector_hits), (keyword_weight, keyword_hits)):
+        for rank, hit in enumerate(hits, 1):
+            scores[hit["id"]] = scores.get(hit["id"], 0.0) + weight / (k + rank)
+            chunks.setdefault(hit["id"], hit)
+    best = sorted(scores, key=scores.__getitem__, reverse=True)[:n_results]
+    return [dict(chunks[id_], score=round(scores[id_], 6)) for id_ in best]
@@ -0,0 +1,251 @@
+##! @file local_index.py
+##! @brief In-process read replica of a ChromaDB collection for local top-k search.
+##! @details
+##! In read-replica mode the REST wrapper keeps a copy of the story collection's
+##! embeddings, documents and metadatas in memory and answers queries with a
+##! NumPy brute-force search instead of an HTTP round-trip to the ChromaDB VM.
+##! For a collection of classroom size (tens of thousands of chunks) one matrix
+##! product is well under a millisecond per query, and no HNSW build is needed.
+##!
+##! LocalVectorIndex exposes the subset of the Collection API used by the wrapper
+##! (`query(query_embeddings=..., n_results=..., where=...)` and `count()`), so it can be
+##! passed anywhere a collection is expected. refresh() syncs it incrementally:
+##! ids, documents and metadatas are compared, and embeddings are only downloaded
+##! for chunks that are new or whose text changed. An optional snapshot file lets
+##! the wrapper start serving even when the ChromaDB VM is unreachable.
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from facet_index import matches_where
+
+__all__ = ["LocalVectorIndex"]
+
+## @var _PAGE_SIZE
+# Records fetched per collection.get() call while syncing. (Internal constant)
+_PAGE_SIZE: int = 1000
+
+## @var _MAX_CACHED_MASKS
+# Distinct `where` filters whose record masks are kept per snapshot. (Internal constant)
+_MAX_CACHED_MASKS: int = 256
+
+
+class _Snapshot:
+    """Immutable view of the replicated collection. Swapped atomically on refresh. (Internal)"""
+
+    def __init__(self, ids: List[str], documents: List[Optional[str]], metadatas: List[Optional[Dict[str, Any]]],
+                 embeddings: np.ndarray):
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.embeddings = embeddings
+        self.norms = np.linalg.norm(embeddings, axis=1) if len(embeddings) else np.zeros(0, dtype=np.float32)
+        self.positions = {id_: i for i, id_ in enumerate(ids)}
+        self.masks: Dict[str, np.ndarray] = {} # `where` filter (as JSON) -> records passing it
+
+    def mask(self, where: Dict[str, Any]) -> np.ndarray:
+        """Boolean mask of the records passing a `where` filter, cached per filter."""
+        key = json.dumps(where, sort_keys=True)
+        mask = self.masks.get(key)
+        if mask is None:
+            if len(self.masks) >= _MAX_CACHED_MASKS:
+                self.masks.clear()
+            mask = np.fromiter((matches_where(m, where) for m in self.metadatas), dtype=bool, count=len(self.metadatas))
+            self.masks[key] = mask
+        return mask
+
+
+class LocalVectorIndex:
+    """
+    Read replica of a ChromaDB collection searched in process. Thread-safe:
+    queries read an immutable snapshot while refresh() builds the next one.
+    """
+
+    def __init__(self, space: str = "l2", snapshot_path: Optional[str] = None):
+        """
+        @param space Distance function matching the collection's "hnsw:space" ("l2", "cosine" or "ip").
+        @param snapshot_path Optional .npz file the replica is saved to after each refresh and loaded from at startup.
+        """
+        if space not in ("l2", "cosine", "ip"):
+            raise ValueError(f"Unsupported distance space '{space}'.")
+        self.space = space
+        self.snapshot_path = snapshot_path
+        self.last_refresh: Optional[float] = None
+        self.last_refresh_stats: Dict[str, Any] = {}
+        self._snapshot: Optional[_Snapshot] = None
+        self._refresh_lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        """True once the replica holds a snapshot (possibly empty) to serve from."""
+        return self._snapshot is not None
+
+    def count(self) -> int:
+        """@return The number of records in the replica."""
+        snapshot = self._snapshot
+        return len(snapshot.ids) if snapshot else 0
+
+    # --- Search ---
+
+    def _distances(self, snapshot: _Snapshot, queries: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Computes ChromaDB-compatible distances between each query and every record (or the records at *rows*)."""
+        embeddings = snapshot.embeddings if rows is None else snapshot.embeddings[rows]
+        norms = snapshot.norms if rows is None else snapshot.norms[rows]
+        dots = queries @ embeddings.T
+        if self.space == "ip":
+            return 1.0 - dots
+        if self.space == "cosine":
+            query_norms = np.linalg.norm(queries, axis=1)[:, None]
+            return 1.0 - dots / np.maximum(query_norms * norms[None, :], 1e-12)
+        # Squared L2, as reported by ChromaDB.
+        return np.maximum((queries ** 2).sum(axis=1)[:, None] - 2.0 * dots + (norms ** 2)[None, :], 0.0)
+
+    def query(self, query_embeddings: Sequence[Sequence[float]], n_results: int = 10,
+              where: Optional[Dict[str, Any]] = None, **_: Any) -> Dict[str, Any]:
+        """
+        Returns the nearest records for each query embedding, in the same shape as
+        Collection.query() (ids, documents, metadatas and distances as lists of lists).
+
+        @param query_embeddings One embedding per query.
+        @param n_results The number of results per query.
+        @param where Optional ChromaDB metadata filter (see facet_index.matches_where()).
+        @return The query results.
+        @raises RuntimeError If the replica has not been loaded yet.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            raise RuntimeError("Local index is not loaded yet.")
+        results: Dict[str, Any] = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        rows = np.flatnonzero(snapshot.mask(where)) if where else None # Records passing the filter
+        k = min(n_results, len(snapshot.ids) if rows is None else len(rows))
+        if k == 0:
+            for key in results:
+                results[key] = [[] for _ in query_embeddings]
+            return results
+
+        distances = self._distances(snapshot, np.asarray(query_embeddings, dtype=np.float32), rows)
+        nearest = np.argpartition(distances, k - 1, axis=1)[:, :k] if k < distances.shape[1] else np.tile(np.arange(k), (len(distances), 1))
+        for row, candidates in zip(distances, nearest):
+            ordered = candidates[np.argsort(row[candidates], kind="stable")]
+            records = ordered if rows is None else rows[ordered]
+            results["ids"].append([snapshot.ids[i] for i in records])
+            results["documents"].append([snapshot.documents[i] for i in records])
+            results["metadatas"].append([snapshot.metadatas[i] for i in records])
+            results["distances"].append([float(row[i]) for i in ordered])
+        return results
+
+    # --- Synchronisation ---
+
+    def refresh(self, collection: Any) -> Dict[str, Any]:
+        """
+        Brings the replica up to date with the collection. Only records that are new
+        or whose document text changed have their embeddings downloaded.
+
+        @param collection The remote ChromaDB collection.
+        @return Counts of added, updated, removed and total records, and the elapsed seconds.
+        """
+        with self._refresh_lock:
+            started = time.perf_counter()
+            previous = self._snapshot
+            ids: List[str] = []
+            documents: List[Optional[str]] = []
+            metadatas: List[Optional[Dict[str, Any]]] = []
+            offset = 0
+            while True:
+                page = collection.get(include=["documents", "metadatas"], limit=_PAGE_SIZE, offset=offset)
+                ids.extend(page["ids"])
+                documents.extend(page.get("documents") or [None] * len(page["ids"]))
+                metadatas.extend(page.get("metadatas") or [None] * len(page["ids"]))
+                if len(page["ids"]) < _PAGE_SIZE:
+                    break
+                offset += _PAGE_SIZE
+
+            reused: Dict[str, np.ndarray] = {}
+            to_fetch: List[str] = []
+            for id_, document in zip(ids, documents):
+                position = previous.positions.get(id_) if previous else None
+                if position is not None and previous.documents[position] == document:
+                    reused[id_] = previous.embeddings[position]
+                else:
+                    to_fetch.append(id_)
+
+            fetched: Dict[str, np.ndarray] = {}
+            for start in range(0, len(to_fetch), _PAGE_SIZE):
+                page = collection.get(ids=to_fetch[start:start + _PAGE_SIZE], include=["embeddings"])
+                for id_, embedding in zip(page["ids"], page["embeddings"]):
+                    fetched[id_] = np.asarray(embedding, dtype=np.float32)
+
+            vectors = [reused.get(id_, fetched.get(id_)) for id_ in ids]
+            keep = [i for i, vector in enumerate(vectors) if vector is not None] # Drop records deleted mid-sync
+            embeddings = np.vstack([vectors[i] for i in keep]).astype(np.float32) if keep else np.zeros((0, 0), dtype=np.float32)
+            self._snapshot = _Snapshot([ids[i] for i in keep], [documents[i] for i in keep],
+                                       [metadatas[i] for i in keep], embeddings)
+
+            updated = sum(1 for id_ in fetched if previous and id_ in previous.positions)
+            self.last_refresh = time.time()
+            self.last_refresh_stats = {
+                "added": len(fetched) - updated,
+                "updated": updated,
+                "removed": len(set(previous.ids) - set(ids)) if previous else 0,
+                "total": len(keep),
+                "seconds": round(time.perf_counter() - started, 3),
+            }
+            if self.snapshot_path:
+                self.save(self.snapshot_path)
+            return self.last_refresh_stats
+
+    def save(self, path: str) -> None:
+        """
+        Writes the current replica to an .npz file (written to a temporary file, then renamed).
+
+        @param path Destination path.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            return
+        records = json.dumps({"ids": snapshot.ids, "documents": snapshot.documents, "metadatas": snapshot.metadatas})
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, embeddings=snapshot.embeddings, space=np.array(self.space),
+                 records=np.frombuffer(records.encode("utf-8"), dtype=np.uint8))
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> bool:
+        """
+        Loads a replica saved by save(), if the file exists and matches this index's distance space.
+
+        @param path Snapshot path.
+        @return True if a snapshot was loaded.
+        """
+        if not os.path.exists(path):
+            return False
+        with np.load(path, allow_pickle=False) as data:
+            if str(data["space"]) != self.space:
+                return False
+            records = json.loads(data["records"].tobytes().decode("utf-8"))
+            self._snapshot = _Snapshot(records["ids"], records["documents"], records["metadatas"],
+                                       data["embeddings"].astype(np.float32))
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        @return Replica size and last refresh details, suitable for a JSON response.
+        """
+        return {
+            "ready": self.ready,
+            "space": self.space,
+            "records": self.count(),
+            "last_refresh": self.last_refresh,
+            "last_refresh_stats": self.last_refresh_stats,
+            "snapshot_path": self.snapshot_path,
+        }
@@ -14,33 +14,111 @@
 ##! - Modular design with helper functions for clarity and testability.
 ##! - Configuration via environment variables.
 ##! - Consistent JSON response formatting for Dialogflow CX.
+##! - Non-blocking queries: the synchronous ChromaDB client is called from a
+##!   bounded thread pool (CHROMA_QUERY_WORKERS), so concurrent requests do not
+##!   stall the event loop. All threads share one HttpClient and therefore one
+##!   keep-alive connection pool to the ChromaDB server.
+##! - Result cache (see query_cache.py): an in-process LRU + TTL cache keyed on
+##!   the normalized query, optionally shared between workers through SQLite,
+##!   and invalidated when upload_stories.py bumps the collection's ingest
+##!   generation. Hit/miss counters are served at GET /cache/stats.
+##! - Embedding cache (see embedding_cache.py): query texts are embedded in the
+##!   wrapper through a memory-mapped, content-addressed vector cache and sent as
+##!   `query_embeddings`, so a repeated query is never re-embedded.
+##! - Micro-batching (see micro_batcher.py): concurrent /query requests arriving
+##!   within QUERY_BATCH_WINDOW_MS are coalesced into one multi-query ChromaDB
+##!   call; POST /query/batch accepts several webhook requests at once.
+##! - Read-replica mode (LOCAL_INDEX_ENABLED, see local_index.py): the collection
+##!   is mirrored in process and searched locally with NumPy, so /query does not
+##!   depend on a round-trip to (or the availability of) the ChromaDB VM. The
+##!   mirror is refreshed incrementally in the background.
+##! - Chunk retrieval for RAG: POST /query/chunks returns the top-k chunks of a
+##!   free-text query with their ids, metadata and distances (instead of one
+##!   merged snippet), for the /rag endpoint of webhook_asgi.py.
+##! - Hybrid search (see keyword_index.py): a local BM25 index over the chunk
+##!   text (built by upload_stories.py, or synced from the collection in the
+##!   background after startup and after each ingest; searches are vector-only
+##!   until the first sync completes) is fused with the vector ranking, so exact names
+##!   such as a protagonist are not lost. In SEARCH_MODE "auto", a query with a
+##!   rare term that already picks enough chunks is answered from the index
+##!   alone, without embedding it or querying ChromaDB.
+##! - Distinct stories (see story_passages.py): /query over-fetches chunks,
+##!   groups them by story and stitches adjacent chunks into passages
+##!   without their 200-character overlap, so a snippet holds DEFAULT_N_RESULTS
+##!   different stories instead of repeated text from one book.
+##! - Metadata filters (see facet_index.py): /query, /query/batch and
+##!   /query/chunks accept genre, subgenre, author and year-range filters, which
+##!   are pushed down to ChromaDB as a `where` clause. Filter values are checked
+##!   against a cached facet index (distinct values and counts, loaded or built
+##!   in the background after startup and rebuilt after each ingest), which also
+##!   serves autocompletion at GET /facets.
 ##!
 ##! @author Calvin Vandor
 ##! @date   2025-05-10
 ##! @version 1.1
 ##! @copyright MIT License
 
+import asyncio
 import chromadb
+import json
 import os
 import sys
-from typing import List, Dict, Any, Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
 
 from fastapi import FastAPI
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel, Field
 
+from embedding_cache import EmbeddingCache
+from facet_index import FACET_FIELDS, FacetIndex
+from keyword_index import KeywordIndex, fuse_rankings
+from local_index import LocalVectorIndex
+from micro_batcher import QueryBatcher
+from query_cache import GENERATION_METADATA_KEY, QueryCache
+from story_passages import stitch_stories
+
 # --- Module Exports ---
 __all__ = [
+    "StoryFilters",
     "DialogflowParameters",
     "DialogflowSessionInfo",
     "DialogflowWebhookRequest",
+    "BatchQueryRequest",
+    "ChunkQueryRequest",
     "create_chroma_collection",
     "build_query_string",
+    "merge_snippets",
     "search_stories",
+    "search_stories_batch",
+    "search_stories_async",
+    "search_stories_batch_async",
+    "search_chunks",
+    "search_story_passages",
+    "vector_search",
+    "hybrid_search",
+    "resolve_filters",
+    "get_query_executor",
+    "get_query_batcher",
+    "get_search_collection",
+    "embed_queries",
+    "fetch_ingest_generation",
     "format_dialogflow_error_response",
+    "format_query_response",
     "app",
     "query_endpoint",
-    "COLLECTION"
+    "batch_query_endpoint",
+    "chunks_query_endpoint",
+    "cache_stats_endpoint",
+    "facets_endpoint",
+    "COLLECTION",
+    "QUERY_CACHE",
+    "EMBEDDING_CACHE",
+    "LOCAL_INDEX",
+    "KEYWORD_INDEX",
+    "FACET_INDEX"
 ]
 
 # --- Configuration Constants ---
@@ -49,11 +127,49 @@ CHROMA_HOST: str = os.getenv("CHROMA_HOST", "localhost") # Defaulted for easier
 CHROMA_PORT: int = int(os.getenv("CHROMA_PORT", "8000"))
 COLLECTION_NAME: str = os.getenv("COLLECTION_NAME", "stories")
 DEFAULT_N_RESULTS: int = int(os.getenv("DEFAULT_N_RESULTS", "3"))
+CHROMA_QUERY_WORKERS: int = int(os.getenv("CHROMA_QUERY_WORKERS", "32")) # Max concurrent blocking ChromaDB calls
+QUERY_CACHE_SIZE: int = int(os.getenv("QUERY_CACHE_SIZE", "1024")) # 0 disables the result cache
+QUERY_CACHE_TTL_SECONDS: float = float(os.getenv("QUERY_CACHE_TTL_SECONDS", "3600"))
+QUERY_CACHE_PATH: Optional[str] = os.getenv("QUERY_CACHE_PATH") or None # SQLite file shared by workers on one host
+QUERY_CACHE_POLL_SECONDS: float = float(os.getenv("QUERY_CACHE_POLL_SECONDS", "30")) # Ingest generation check interval
+QUERY_BATCH_WINDOW_MS: float = float(os.getenv("QUERY_BATCH_WINDOW_MS", "5")) # Micro-batching window; 0 disables coalescing
+QUERY_BATCH_MAX_SIZE: int = int(os.getenv("QUERY_BATCH_MAX_SIZE", "32")) # Max queries per ChromaDB call
+QUERY_BATCH_MAX_IN_FLIGHT: int = int(os.getenv("QUERY_BATCH_MAX_IN_FLIGHT", "4")) # Concurrent batched ChromaDB calls
+EMBEDDING_CACHE_PATH: str = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.bin") # Empty string disables the embedding cache
+EMBEDDING_MODEL_ID: str = os.getenv("EMBEDDING_MODEL_ID", "all-MiniLM-L6-v2") # Must match the model used by upload_stories.py
+LOCAL_INDEX_ENABLED: bool = os.getenv("LOCAL_INDEX_ENABLED", "false").lower() in ("1", "true", "yes") # Read-replica mode
+LOCAL_INDEX_REFRESH_SECONDS: float = float(os.getenv("LOCAL_INDEX_REFRESH_SECONDS", "300")) # Max time between replica syncs
+LOCAL_INDEX_SNAPSHOT_PATH: Optional[str] = os.getenv("LOCAL_INDEX_SNAPSHOT_PATH") or None # Lets the replica start without ChromaDB
+KEYWORD_INDEX_PATH: str = os.getenv("KEYWORD_INDEX_PATH", "keyword_index.sqlite3") # BM25 index file; empty string disables hybrid search
+KEYWORD_INDEX_SYNC: bool = os.getenv("KEYWORD_INDEX_SYNC", "true").lower() in ("1", "true", "yes") # Sync the index from the collection
+KEYWORD_RARE_TERM_RATIO: float = float(os.getenv("KEYWORD_RARE_TERM_RATIO", "0.01")) # Max share of chunks a "rare" term occurs in
+SEARCH_MODE: str = os.getenv("SEARCH_MODE", "auto").lower() # "vector", "hybrid", "auto" (skip the embedder when keywords suffice) or "keyword"
+HYBRID_CANDIDATES_FACTOR: int = int(os.getenv("HYBRID_CANDIDATES_FACTOR", "4")) # Candidates fetched per ranking, as a multiple of n_results
+HYBRID_KEYWORD_WEIGHT: float = float(os.getenv("HYBRID_KEYWORD_WEIGHT", "1.0")) # Weight of the BM25 ranking in the fusion (vector = 1)
+STORY_OVERFETCH_FACTOR: int = int(os.getenv("STORY_OVERFETCH_FACTOR", "4")) # Chunks fetched per requested story before grouping
+STORY_MAX_CHUNKS: int = int(os.getenv("STORY_MAX_CHUNKS", "2")) # Best chunks kept (and stitched) per story
+CHUNK_OVERLAP_CHARS: int = int(os.getenv("CHUNK_OVERLAP_CHARS", "200")) # Must match upload_stories.py's chunk_overlap
+FACET_INDEX_PATH: str = os.getenv("FACET_INDEX_PATH", "facet_index.json") # Facet index cache file; empty string keeps it in memory only
+
+# --- User-Facing Messages ---
+MSG_UNCLEAR_QUERY: str = "It seems the details for the story were unclear. Could you please provide more information?"
+MSG_NO_MATCH: str = "I searched the archives, but couldn't find anything matching that specific combination of details."
+MSG_SEARCH_FAILED: str = "I encountered an unexpected issue while searching the story archives. Please try again."
+MSG_NO_FILTER_MATCH: str = "I searched the archives, but there is {problem}. Could you try a different choice?"
+USER_FACING_ERROR_MESSAGES = (MSG_UNCLEAR_QUERY, MSG_NO_MATCH, MSG_SEARCH_FAILED)
 
 # --- Pydantic Models for Dialogflow Webhook Request ---
 
-class DialogflowParameters(BaseModel):
-    """Pydantic model for parameters within Dialogflow sessionInfo."""
+class StoryFilters(BaseModel):
+    """Pydantic model for the optional metadata filters of a search (empty values do not filter)."""
+    genre: Optional[str] = Field(default="", description="Only stories of this genre (case-insensitive, whole name; near-matches are suggested in the error).")
+    subgenre: Optional[str] = Field(default="", description="Only stories of this subgenre.")
+    author: Optional[str] = Field(default="", description="Only stories by this author (case-insensitive, full name as stored).")
+    year_from: Optional[int] = Field(default=None, description="Only stories published in or after this year.")
+    year_to: Optional[int] = Field(default=None, description="Only stories published in or before this year.")
+
+class DialogflowParameters(StoryFilters):
+    """Pydantic model for parameters within Dialogflow sessionInfo (story details plus optional filters)."""
     protagonist: Optional[str] = Field(default="", description="The protagonist of the story.")
     theme: Optional[str] = Field(default="", description="The main theme of the story.")
     moral: Optional[str] = Field(default="", description="The moral or lesson of the story.")
@@ -67,6 +183,17 @@ class DialogflowWebhookRequest(BaseModel):
     sessionInfo: DialogflowSessionInfo = Field(default_factory=DialogflowSessionInfo)
     # Add other Dialogflow fields if needed, e.g., fulfillmentInfo.tag, messages, etc.
 
+class BatchQueryRequest(BaseModel):
+    """Pydantic model for the /query/batch endpoint: several webhook requests answered together."""
+    requests: List[DialogflowWebhookRequest] = Field(default_factory=list, description="Webhook requests to answer, in order.")
+
+class ChunkQueryRequest(BaseModel):
+    """Pydantic model for the /query/chunks endpoint: one free-text query for retrieval-augmented generation."""
+    query: str = Field(default="", description="The text to search for.")
+    n_results: int = Field(default=DEFAULT_N_RESULTS, ge=1, le=100, description="The number of chunks (or stories) to return.")
+    stories: bool = Field(default=False, description="Return distinct stories with stitched passages instead of single chunks.")
+    filters: StoryFilters = Field(default_factory=StoryFilters, description="Optional metadata filters.")
+
 # --- ChromaDB and Helper Functions ---
 
 ## @var COLLECTION
@@ -74,6 +201,98 @@ class DialogflowWebhookRequest(BaseModel):
 # Initialized at application startup.
 COLLECTION: Optional[chromadb.api.models.Collection.Collection] = None
 
+## @var CHROMA_CLIENT
+# Global ChromaDB client used to create COLLECTION, kept for re-reading collection metadata.
+CHROMA_CLIENT = None
+
+## @var QUERY_CACHE
+# Process-wide cache of search results.
+QUERY_CACHE: QueryCache = QueryCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL_SECONDS, QUERY_CACHE_PATH)
+
+## @var EMBEDDING_CACHE
+# Memory-mapped cache of query embeddings. Opened at startup when EMBEDDING_CACHE_PATH is set.
+EMBEDDING_CACHE: Optional[EmbeddingCache] = None
+
+## @var EMBEDDING_FUNCTION
+# ChromaDB embedding function used on cache misses (ChromaDB's default all-MiniLM-L6-v2 model).
+EMBEDDING_FUNCTION = None
+
+## @var LOCAL_INDEX
+# In-process replica of the collection, used for searches in read-replica mode.
+LOCAL_INDEX: Optional[LocalVectorIndex] = None
+
+## @var _LOCAL_INDEX_REFRESHER
+# Background task keeping LOCAL_INDEX in sync with the collection. (Internal)
+_LOCAL_INDEX_REFRESHER: Optional[asyncio.Task] = None
+
+## @var KEYWORD_INDEX
+# Local BM25 index of the chunk text, used for hybrid search. Opened at startup when KEYWORD_INDEX_PATH is set.
+KEYWORD_INDEX: Optional[KeywordIndex] = None
+
+## @var FACET_INDEX
+# Distinct genre/subgenre/author/year values with counts, for filter validation and autocompletion.
+FACET_INDEX: FacetIndex = FacetIndex(FACET_INDEX_PATH or None)
+
+## @var _KEYWORD_INDEX_SYNCED
+# Set once KEYWORD_INDEX can be searched: after its first sync from the collection, or at once if it is not synced. (Internal)
+_KEYWORD_INDEX_SYNCED = threading.Event()
+
+## @var _DERIVED_INDEX_REFRESHER
+# Background task re-syncing KEYWORD_INDEX and rebuilding FACET_INDEX after each ingest. (Internal)
+_DERIVED_INDEX_REFRESHER: Optional[asyncio.Task] = None
+
+## @var SEARCH_ROUTES
+# Queries answered by vector search only, by hybrid search and by the keyword index alone.
+SEARCH_ROUTES: Dict[str, int] = {"vector": 0, "hybrid": 0, "keyword": 0}
+_SEARCH_ROUTES_LOCK = threading.Lock()
+
+## @var _GENERATION_WATCHER
+# Background task polling the collection's ingest generation. (Internal)
+_GENERATION_WATCHER: Optional[asyncio.Task] = None
+
+## @var QUERY_EXECUTOR
+# Bounded thread pool that runs blocking ChromaDB calls off the event loop.
+# Created lazily by get_query_executor() and shut down with the application.
+QUERY_EXECUTOR: Optional[ThreadPoolExecutor] = None
+
+## @var QUERY_BATCHER
+# Micro-batcher coalescing concurrent /query searches. Created lazily by get_query_batcher().
+QUERY_BATCHER: Optional[QueryBatcher] = None
+
+def get_query_executor() -> ThreadPoolExecutor:
+    """
+    Returns the shared ChromaDB query thread pool, creating it on first use.
+
+    @return A ThreadPoolExecutor with CHROMA_QUERY_WORKERS threads.
+    """
+    global QUERY_EXECUTOR
+    if QUERY_EXECUTOR is None:
+        QUERY_EXECUTOR = ThreadPoolExecutor(max_workers=CHROMA_QUERY_WORKERS, thread_name_prefix="chroma-query")
+    return QUERY_EXECUTOR
+
+def get_query_batcher() -> Optional[QueryBatcher]:
+    """
+    Returns the shared query micro-batcher, creating it on first use.
+
+    @return The QueryBatcher, or None if QUERY_BATCH_WINDOW_MS is 0 (batching disabled).
+    """
+    global QUERY_BATCHER
+    if QUERY_BATCHER is None and QUERY_BATCH_WINDOW_MS > 0:
+        QUERY_BATCHER = QueryBatcher(search_stories_batch, get_query_executor(), QUERY_BATCH_WINDOW_MS,
+                                     QUERY_BATCH_MAX_SIZE, QUERY_BATCH_MAX_IN_FLIGHT)
+    return QUERY_BATCHER
+
+def get_search_collection():
+    """
+    Returns what searches should run against: the local replica once it is loaded
+    (in read-replica mode), otherwise the remote ChromaDB collection.
+
+    @return A LocalVectorIndex or ChromaDB collection, or None if neither is available.
+    """
+    if LOCAL_INDEX is not None and LOCAL_INDEX.ready:
+        return LOCAL_INDEX
+    return COLLECTION
+
 def create_chroma_collection(host: str, port: int, name: str) -> Optional[chromadb.api.models.Collection.Collection]:
     """
     Attempts to connect to ChromaDB and retrieve the specified collection.
@@ -83,9 +302,11 @@ def create_chroma_collection(host: str, port: int, name: str) -> Optional[chroma
     @param name The name of the collection to retrieve.
     @return The ChromaDB collection object if successful, None otherwise.
     """
+    global CHROMA_CLIENT
     try:
         print(f"Attempting to connect to ChromaDB at {host}:{port}...")
         client = chromadb.HttpClient(host=host, port=port)
+        CHROMA_CLIENT = client
         # You might want to add a client.heartbeat() or similar check if your ChromaDB version supports it
         print(f"Successfully created ChromaDB client. Getting collection '{name}'...")
         collection = client.get_collection(name)
@@ -95,6 +316,33 @@ def create_chroma_collection(host: str, port: int, name: str) -> Optional[chroma
         print(f"❌ Error connecting to ChromaDB or getting collection '{name}': {e}", file=sys.stderr)
         return None
 
+def fetch_ingest_generation(client, name: str) -> Optional[str]:
+    """
+    Reads the ingest generation stamp that upload_stories.py stores in the
+    collection metadata whenever it changes the collection.
+
+    @param client The ChromaDB client.
+    @param name The name of the collection.
+    @return The generation stamp, or None if the collection has never been stamped.
+    """
+    metadata = client.get_collection(name).metadata or {}
+    generation = metadata.get(GENERATION_METADATA_KEY)
+    return str(generation) if generation is not None else None
+
+def embed_queries(queries: List[str]) -> Optional[List[List[float]]]:
+    """
+    Embeds query strings in the wrapper, through the embedding cache when it is enabled.
+
+    @param queries The query strings.
+    @return One embedding per query, or None if no local embedding function is loaded
+            (ChromaDB then embeds the query texts itself).
+    """
+    if EMBEDDING_CACHE is not None:
+        return EMBEDDING_CACHE.embed(queries, EMBEDDING_FUNCTION)
+    if EMBEDDING_FUNCTION is not None:
+        return [[float(x) for x in vector] for vector in EMBEDDING_FUNCTION(queries)]
+    return None
+
 def build_query_string(protagonist: str, theme: str, moral: str) -> str:
     """
     Concatenates protagonist, theme, and moral into a single search string.
@@ -111,7 +359,169 @@ def build_query_string(protagonist: str, theme: str, moral: str) -> str:
     if moral and moral.strip(): query_parts.append(moral.strip())
     return " ".join(query_parts) # No need to strip here if parts are already stripped
 
-def search_stories(collection: chromadb.api.models.Collection.Collection, query: str, n_results: int = DEFAULT_N_RESULTS) -> str:
+def resolve_filters(filters: StoryFilters) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    Turns request filters into a ChromaDB `where` clause, using FACET_INDEX to map
+    the values to the ones stored (see FacetIndex.where_clause()).
+
+    @param filters The request's filters (or DialogflowParameters, which include them).
+    @return (where, None) — where is None without filters — or (None, problem) if a filter matches no story.
+    """
+    return FACET_INDEX.where_clause({field: getattr(filters, field) for field in StoryFilters.model_fields})
+
+def filtered_cache_key(prefix: str, query: str, n_results: int, where: Optional[Dict[str, Any]]) -> str:
+    """
+    Builds the query cache key of a (possibly filtered) search.
+
+    @param prefix Distinguishes result shapes (e.g., "chunks:"); empty for /query snippets.
+    @param query The query string.
+    @param n_results The number of results requested.
+    @param where The resolved filter, or None.
+    @return The cache key.
+    """
+    key = QUERY_CACHE.make_key(prefix + query, n_results)
+    return f"{key}|{json.dumps(where, sort_keys=True)}" if where else key
+
+def merge_snippets(documents: Any) -> str:
+    """
+    Merges the documents ChromaDB returned for one query into a single snippet.
+
+    @param documents The per-query document list from a ChromaDB query result.
+    @return The merged snippets, or MSG_NO_MATCH if there are no usable documents.
+    """
+    if isinstance(documents, list) and len(documents) > 0:
+        valid_snippets = [doc for doc in documents if isinstance(doc, str) and doc.strip()]
+        if valid_snippets:
+            return "\n\n".join(valid_snippets)
+        print("⚠️ Documents list was present but contained no valid (non-empty string) snippets.")
+    elif isinstance(documents, list):
+        print("⚠️ Documents list for the query was empty.")
+    else:
+        print(f"⚠️ Expected list of documents for the query, but got: {type(documents)}")
+    return MSG_NO_MATCH
+
+def _chunks_of(results: Dict[str, Any], i: int) -> List[Dict[str, Any]]:
+    """Non-empty chunks of the i-th query of a ChromaDB query result, as dicts. (Internal)"""
+    columns = [((results.get(key) or [])[i:i + 1] or [[]])[0] or [] for key in ("ids", "documents", "metadatas", "distances")]
+    return [
+        {"id": chunk_id, "text": document, "metadata": metadata or {}, "distance": distance}
+        for chunk_id, document, metadata, distance in zip(*columns)
+        if isinstance(document, str) and document.strip()
+    ]
+
+def vector_search(collection: chromadb.api.models.Collection.Collection, queries: List[str], n_results: int,
+                  where: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+    """
+    Runs one multi-query vector search.
+
+    @param collection The ChromaDB collection (or local replica) to query.
+    @param queries Non-empty query strings.
+    @param n_results The number of chunks to retrieve per query.
+    @param where Optional metadata filter (see resolve_filters()).
+    @return One list of chunk dicts ("id", "text", "metadata", "distance") per query, nearest first.
+    @raises Exception Whatever the ChromaDB query raises.
+    """
+    query_embeddings = embed_queries(queries)
+    query_args: Dict[str, Any] = {"query_embeddings": query_embeddings} if query_embeddings is not None else {"query_texts": queries}
+    if where:
+        query_args["where"] = where
+    results: Dict[str, Any] = collection.query(**query_args, n_results=n_results)
+    return [_chunks_of(results, i) for i in range(len(queries))]
+
+def _count_route(route: str, queries: int = 1) -> None:
+    """Adds to the SEARCH_ROUTES counter of *route*. (Internal)"""
+    with _SEARCH_ROUTES_LOCK:
+        SEARCH_ROUTES[route] += queries
+
+def hybrid_search(collection: chromadb.api.models.Collection.Collection, queries: List[str], n_results: int,
+                  where: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+    """
+    Searches chunks for several queries according to SEARCH_MODE. With a keyword
+    index, HYBRID_CANDIDATES_FACTOR * n_results candidates are taken from both the
+    BM25 and the vector ranking and fused (reciprocal rank fusion). In "auto" mode,
+    queries whose rare terms (names) already select n_results chunks skip the
+    vector search; in "keyword" mode every query does. Without an index, or until its
+    first sync from the collection completes, this is vector_search().
+
+    @param collection The ChromaDB collection (or local replica) to query.
+    @param queries Non-empty query strings.
+    @param n_results The number of chunks to return per query.
+    @param where Optional metadata filter, applied to both rankings.
+    @return One list of chunk dicts per query, best first. Fused chunks carry a "score";
+            chunks found by keyword only have a "distance" of None.
+    @raises Exception Whatever the ChromaDB query raises.
+    """
+    if KEYWORD_INDEX is None or SEARCH_MODE == "vector" or not _KEYWORD_INDEX_SYNCED.is_set():
+        _count_route("vector", len(queries))
+        return vector_search(collection, queries, n_results, where)
+    candidates = n_results * max(1, HYBRID_CANDIDATES_FACTOR)
+    keyword_results = [KEYWORD_INDEX.search(query, candidates, where) for query in queries]
+    dense_queries = [
+        query for query, keyword in zip(queries, keyword_results)
+        if SEARCH_MODE != "keyword" and not (SEARCH_MODE == "auto" and keyword.selective(n_results))
+    ]
+    dense = dict(zip(dense_queries, vector_search(collection, dense_queries, candidates, where))) if dense_queries else {}
+    answers: List[List[Dict[str, Any]]] = []
+    for query, keyword in zip(queries, keyword_results):
+        if query in dense:
+            _count_route("hybrid")
+            answers.append(fuse_rankings(dense[query], keyword.hits, n_results, HYBRID_KEYWORD_WEIGHT))
+        else:
+            _count_route("keyword")
+            answers.append(keyword.hits[:n_results])
+    return answers
+
+def search_story_passages(collection: chromadb.api.models.Collection.Collection, queries: List[str], n_results: int,
+                          where: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+    """
+    Searches STORY_OVERFETCH_FACTOR * n_results chunks per query (see hybrid_search())
+    and reduces them to the best n_results distinct stories, adjacent chunks stitched.
+
+    @param collection The ChromaDB collection (or local replica) to query.
+    @param queries Non-empty query strings.
+    @param n_results The number of stories to return per query.
+    @param where Optional metadata filter.
+    @return One list of story dicts (see story_passages.stitch_stories()) per query, best first.
+    @raises Exception Whatever the ChromaDB query raises.
+    """
+    chunk_lists = hybrid_search(collection, queries, n_results * max(1, STORY_OVERFETCH_FACTOR), where)
+    return [stitch_stories(chunks, n_results, STORY_MAX_CHUNKS, CHUNK_OVERLAP_CHARS) for chunks in chunk_lists]
+
+def search_stories_batch(collection: chromadb.api.models.Collection.Collection, queries: List[str], n_results: int = DEFAULT_N_RESULTS,
+                         where: Optional[Dict[str, Any]] = None) -> List[str]:
+    """
+    Searches the collection for several query strings at once (see search_story_passages())
+    and returns one merged snippet (or user-facing fallback message) per query.
+    Empty queries are answered without querying; duplicates are searched once.
+
+    @param collection The ChromaDB collection object to query.
+    @param queries The query strings to search for.
+    @param n_results The number of distinct stories to retrieve per query.
+    @param where Optional metadata filter applied to every query.
+    @return A list with one snippet or user-facing message per input query, in order.
+    """
+    answers: Dict[str, str] = {}
+    unique_queries = [query for query in dict.fromkeys(queries) if query]
+    if any(not query for query in queries):
+        print("⚠️ Query string is empty. Returning fallback message.")
+
+    if unique_queries:
+        try:
+            print(f"Querying ChromaDB collection with {len(unique_queries)} text(s): {unique_queries}, n_results: {n_results}, where: {where}")
+            story_lists = search_story_passages(collection, unique_queries, n_results, where)
+            print(f"Search results (chunk ids per story): {[[story['ids'] for story in stories] for stories in story_lists]}")
+            for query, stories in zip(unique_queries, story_lists):
+                answers[query] = merge_snippets([story["text"] for story in stories])
+        except Exception as e:
+            print(f"❌ Error during ChromaDB query or processing results: {e}", file=sys.stderr)
+            import traceback
+            traceback.print_exc()
+            answers = {query: MSG_SEARCH_FAILED for query in unique_queries}
+
+    return [answers.get(query, MSG_UNCLEAR_QUERY) for query in queries]
+
+def search_stories(collection: chromadb.api.models.Collection.Collection, query: str, n_results: int = DEFAULT_N_RESULTS,
+                   where: Optional[Dict[str, Any]] = None) -> str:
     """
     Queries the ChromaDB collection and returns a merged snippet of story documents
     or a user-facing fallback message if no relevant stories are found or an error occurs.
@@ -119,40 +529,67 @@ def search_stories(collection: chromadb.api.models.Collection.Collection, query:
     @param collection The ChromaDB collection object to query.
     @param query The query string to search for.
     @param n_results The number of results to retrieve from ChromaDB.
+    @param where Optional metadata filter.
     @return A string containing merged story snippets or a user-facing fallback/error message.
     """
-    if not query: # Query effectively empty after build_query_string
-        print("⚠️ Query string is empty. Returning fallback message.")
-        return "It seems the details for the story were unclear. Could you please provide more information?"
+    return search_stories_batch(collection, [query], n_results, where)[0]
 
-    try:
-        print(f"Querying ChromaDB collection with text: '{query}', n_results: {n_results}")
-        results: Dict[str, Any] = collection.query(query_texts=[query], n_results=n_results)
-        print(f"ChromaDB query raw results: {results}")
-
-        documents = results.get("documents")
-
-        if documents and isinstance(documents, list) and len(documents) > 0:
-            first_query_results = documents[0] # ChromaDB returns a list of lists for documents
-            if isinstance(first_query_results, list) and len(first_query_results) > 0:
-                valid_snippets = [doc for doc in first_query_results if isinstance(doc, str) and doc.strip()]
-                if valid_snippets:
-                    return "\n\n".join(valid_snippets)
-                else:
-                    print("⚠️ Documents list was present but contained no valid (non-empty string) snippets.")
-            elif isinstance(first_query_results, list) and len(first_query_results) == 0:
-                 print("⚠️ Documents list for the first query was empty.")
-            else:
-                print(f"⚠️ Expected list of documents for the first query, but got: {type(first_query_results)}")
-        else:
-            print("⚠️ No documents found or 'documents' key missing/empty/invalid in ChromaDB results.")
+def search_chunks(collection: chromadb.api.models.Collection.Collection, query: str, n_results: int = DEFAULT_N_RESULTS,
+                  where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Searches the collection (see hybrid_search()) and returns the individual chunks found, best first.
 
-        return "I searched the archives, but couldn't find anything matching that specific combination of details."
-    except Exception as e:
-        print(f"❌ Error during ChromaDB query or processing results: {e}", file=sys.stderr)
-        import traceback
-        traceback.print_exc()
-        return "I encountered an unexpected issue while searching the story archives. Please try again."
+    @param collection The ChromaDB collection (or local replica) to query.
+    @param query The query string to search for.
+    @param n_results The number of chunks to retrieve.
+    @param where Optional metadata filter.
+    @return One dict per non-empty chunk with "id", "text", "metadata" and "distance" (plus "score" for hybrid results).
+    @raises Exception Whatever the ChromaDB query raises.
+    """
+    if not query:
+        return []
+    return hybrid_search(collection, [query], n_results, where)[0]
+
+async def search_stories_async(collection: chromadb.api.models.Collection.Collection, query: str, n_results: int = DEFAULT_N_RESULTS,
+                               where: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Non-blocking wrapper around search_stories(). The blocking HttpClient call
+    runs on the bounded query thread pool, so the event loop keeps serving other
+    requests while ChromaDB answers. When micro-batching is enabled, the query
+    joins other concurrent queries in a single multi-query ChromaDB call
+    (filtered queries are not batched: the filter applies to the whole call).
+
+    @param collection The ChromaDB collection object to query.
+    @param query The query string to search for.
+    @param n_results The number of results to retrieve from ChromaDB.
+    @param where Optional metadata filter.
+    @return The same snippet or user-facing message as search_stories().
+    """
+    batcher = get_query_batcher()
+    if batcher is not None and query and not where:
+        return await batcher.submit(collection, query, n_results)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_query_executor(), search_stories, collection, query, n_results, where)
+
+async def search_stories_batch_async(collection: chromadb.api.models.Collection.Collection, queries: List[str], n_results: int = DEFAULT_N_RESULTS,
+                                     where: Optional[Dict[str, Any]] = None) -> List[str]:
+    """
+    Non-blocking wrapper around search_stories_batch(). Large batches are split into
+    slices of QUERY_BATCH_MAX_SIZE that run concurrently on the query thread pool.
+
+    @param collection The ChromaDB collection object to query.
+    @param queries The query strings to search for.
+    @param n_results The number of results to retrieve per query.
+    @param where Optional metadata filter applied to every query.
+    @return One snippet or user-facing message per query, in order.
+    """
+    loop = asyncio.get_running_loop()
+    step = max(1, QUERY_BATCH_MAX_SIZE)
+    slices = await asyncio.gather(*(
+        loop.run_in_executor(get_query_executor(), search_stories_batch, collection, queries[i:i + step], n_results, where)
+        for i in range(0, len(queries), step)
+    ))
+    return [answer for answers in slices for answer in answers]
 
 
 def format_dialogflow_error_response(message: str) -> Dict[str, Any]:
@@ -169,6 +606,19 @@ def format_dialogflow_error_response(message: str) -> Dict[str, Any]:
         }
     }
 
+def format_query_response(snippet_or_message: str) -> Dict[str, Any]:
+    """
+    Formats a search_stories() result as a /query response body: the story snippet,
+    or a Dialogflow CX fulfillment message for the user-facing fallback messages.
+
+    @param snippet_or_message A snippet or user-facing message from search_stories().
+    @return The response body.
+    """
+    if snippet_or_message in USER_FACING_ERROR_MESSAGES:
+        return format_dialogflow_error_response(snippet_or_message)
+    # This format implies setting an output parameter or similar in Dialogflow.
+    return {"story_snippet": snippet_or_message}
+
 # --- FastAPI Application Setup ---
 
 app = FastAPI(
@@ -181,15 +631,160 @@ app = FastAPI(
 async def startup_event():
     """
     Application startup event handler.
-    Initializes the connection to ChromaDB and retrieves the collection.
+    Initializes the connection to ChromaDB and retrieves the collection,
+    then starts the query thread pool and the cache's generation watcher,
+    opens the keyword index and starts refresh_derived_indexes(), which syncs it and
+    loads (or builds) the facet index in the background.
     """
-    global COLLECTION
+    global COLLECTION, EMBEDDING_CACHE, EMBEDDING_FUNCTION, LOCAL_INDEX, KEYWORD_INDEX, _GENERATION_WATCHER, _LOCAL_INDEX_REFRESHER, _DERIVED_INDEX_REFRESHER
     print("FastAPI application starting up...")
     COLLECTION = create_chroma_collection(CHROMA_HOST, CHROMA_PORT, COLLECTION_NAME)
     if COLLECTION:
         print(f"✅ ChromaDB collection '{COLLECTION_NAME}' initialized and ready.")
     else:
         print(f"⚠️ CRITICAL WARNING: ChromaDB collection '{COLLECTION_NAME}' could NOT be initialized. The API will report errors for all queries.")
+    get_query_executor()
+    print(f"Query thread pool ready ({CHROMA_QUERY_WORKERS} workers).")
+    if QUERY_CACHE.enabled and COLLECTION is not None:
+        _GENERATION_WATCHER = asyncio.create_task(watch_ingest_generation())
+        print(f"Query cache enabled: {QUERY_CACHE.stats()}")
+    if EMBEDDING_CACHE_PATH or LOCAL_INDEX_ENABLED:
+        from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+        EMBEDDING_FUNCTION = DefaultEmbeddingFunction()
+    if EMBEDDING_CACHE_PATH:
+        try:
+            EMBEDDING_CACHE = EmbeddingCache(EMBEDDING_CACHE_PATH, EMBEDDING_MODEL_ID)
+            print(f"Embedding cache enabled: {EMBEDDING_CACHE.stats()}")
+        except Exception as e:
+            print(f"⚠️ Could not open embedding cache at '{EMBEDDING_CACHE_PATH}': {e}. Queries will be embedded without caching.", file=sys.stderr)
+    if LOCAL_INDEX_ENABLED:
+        space = (COLLECTION.metadata or {}).get("hnsw:space", "l2") if COLLECTION is not None else "l2"
+        LOCAL_INDEX = LocalVectorIndex(space, LOCAL_INDEX_SNAPSHOT_PATH)
+        if LOCAL_INDEX_SNAPSHOT_PATH and LOCAL_INDEX.load(LOCAL_INDEX_SNAPSHOT_PATH):
+            print(f"📦 Loaded local index snapshot ({LOCAL_INDEX.count()} records) from '{LOCAL_INDEX_SNAPSHOT_PATH}'.")
+        if COLLECTION is not None:
+            try:
+                loop = asyncio.get_running_loop()
+                stats = await loop.run_in_executor(get_query_executor(), LOCAL_INDEX.refresh, COLLECTION)
+                print(f"✅ Local index synced: {stats}")
+            except Exception as e:
+                print(f"⚠️ Could not sync local index at startup: {e}", file=sys.stderr)
+            _LOCAL_INDEX_REFRESHER = asyncio.create_task(refresh_local_index())
+        if not LOCAL_INDEX.ready:
+            print("⚠️ Local index has no data; searches will go to ChromaDB until it syncs.", file=sys.stderr)
+    if KEYWORD_INDEX_PATH and SEARCH_MODE != "vector":
+        try:
+            KEYWORD_INDEX = KeywordIndex(KEYWORD_INDEX_PATH, KEYWORD_RARE_TERM_RATIO)
+        except Exception as e:
+            print(f"⚠️ Could not open keyword index at '{KEYWORD_INDEX_PATH}': {e}. Searches will be vector-only.", file=sys.stderr)
+    if KEYWORD_INDEX is not None:
+        if KEYWORD_INDEX_SYNC and COLLECTION is not None:
+            print(f"Hybrid search enabled ({SEARCH_MODE} mode) once the keyword index has synced; vector-only until then.")
+        else:
+            _KEYWORD_INDEX_SYNCED.set()
+            print(f"Hybrid search enabled ({SEARCH_MODE} mode): {KEYWORD_INDEX.stats()}")
+    if COLLECTION is not None:
+        _DERIVED_INDEX_REFRESHER = asyncio.create_task(refresh_derived_indexes())
+
+async def watch_ingest_generation():
+    """
+    Background task: polls the collection's ingest generation every
+    QUERY_CACHE_POLL_SECONDS and invalidates the query cache when it changes.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            generation = await loop.run_in_executor(get_query_executor(), fetch_ingest_generation, CHROMA_CLIENT, COLLECTION_NAME)
+            if QUERY_CACHE.set_generation(generation):
+                print(f"♻️ Ingest generation is now '{generation}'; query cache invalidated.")
+        except Exception as e:
+            print(f"⚠️ Could not check ingest generation: {e}", file=sys.stderr)
+        await asyncio.sleep(QUERY_CACHE_POLL_SECONDS)
+
+async def refresh_local_index():
+    """
+    Background task: keeps the local replica in sync. Every QUERY_CACHE_POLL_SECONDS
+    it checks the collection's ingest generation and syncs when the generation
+    changed or LOCAL_INDEX_REFRESH_SECONDS have passed since the last sync.
+    """
+    loop = asyncio.get_running_loop()
+    synced_generation = await loop.run_in_executor(get_query_executor(), fetch_ingest_generation, CHROMA_CLIENT, COLLECTION_NAME)
+    while True:
+        await asyncio.sleep(QUERY_CACHE_POLL_SECONDS)
+        try:
+            generation = await loop.run_in_executor(get_query_executor(), fetch_ingest_generation, CHROMA_CLIENT, COLLECTION_NAME)
+            overdue = LOCAL_INDEX.last_refresh is None or time.time() - LOCAL_INDEX.last_refresh >= LOCAL_INDEX_REFRESH_SECONDS
+            if generation != synced_generation or overdue:
+                stats = await loop.run_in_executor(get_query_executor(), LOCAL_INDEX.refresh, COLLECTION)
+                synced_generation = generation
+                print(f"♻️ Local index synced: {stats}")
+        except Exception as e:
+            print(f"⚠️ Could not sync local index: {e}. Serving the last snapshot.", file=sys.stderr)
+
+async def refresh_derived_indexes():
+    """
+    Background task, started at startup: straight away it loads the facet index
+    from FACET_INDEX_PATH if that was saved for the current ingest generation
+    (or else builds it) and runs the keyword index's first sync. Then, whenever
+    the generation changes (checked every QUERY_CACHE_POLL_SECONDS), it re-syncs
+    the keyword index from the collection (if KEYWORD_INDEX_SYNC) and rebuilds
+    the facet index. Failed steps are retried every poll. Until they complete,
+    hybrid search is vector-only and filters are applied unchecked.
+    """
+    loop = asyncio.get_running_loop()
+    synced_generation: Optional[str] = None
+    delay = 0.0
+    while True:
+        await asyncio.sleep(delay)
+        delay = QUERY_CACHE_POLL_SECONDS
+        try:
+            generation = await loop.run_in_executor(get_query_executor(), fetch_ingest_generation, CHROMA_CLIENT, COLLECTION_NAME)
+            if not FACET_INDEX.ready and FACET_INDEX_PATH and FACET_INDEX.load(FACET_INDEX_PATH, generation):
+                synced_generation = generation
+                print(f"📦 Loaded facet index from '{FACET_INDEX_PATH}': {FACET_INDEX.stats()['values']}")
+            keyword_pending = KEYWORD_INDEX is not None and not _KEYWORD_INDEX_SYNCED.is_set()
+            if generation == synced_generation and FACET_INDEX.ready and not keyword_pending:
+                continue
+            if KEYWORD_INDEX is not None and KEYWORD_INDEX_SYNC and (keyword_pending or generation != synced_generation):
+                stats = await loop.run_in_executor(get_query_executor(), KEYWORD_INDEX.sync, COLLECTION)
+                _KEYWORD_INDEX_SYNCED.set()
+                print(f"♻️ Keyword index synced: {stats}")
+            if generation == synced_generation and FACET_INDEX.ready:
+                continue
+            stats = await loop.run_in_executor(get_query_executor(), FACET_INDEX.rebuild, COLLECTION, generation)
+            synced_generation = generation
+            print(f"♻️ Facet index rebuilt: {stats}")
+        except Exception as e:
+            print(f"⚠️ Could not refresh keyword/facet indexes: {e}. Serving them as they are.", file=sys.stderr)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """
+    Application shutdown event handler.
+    Stops the background tasks, the ChromaDB query thread pool, both caches and the keyword index.
+    """
+    global QUERY_EXECUTOR, QUERY_BATCHER, EMBEDDING_CACHE, KEYWORD_INDEX, _GENERATION_WATCHER, _LOCAL_INDEX_REFRESHER, _DERIVED_INDEX_REFRESHER
+    if _GENERATION_WATCHER is not None:
+        _GENERATION_WATCHER.cancel()
+        _GENERATION_WATCHER = None
+    if _LOCAL_INDEX_REFRESHER is not None:
+        _LOCAL_INDEX_REFRESHER.cancel()
+        _LOCAL_INDEX_REFRESHER = None
+    if _DERIVED_INDEX_REFRESHER is not None:
+        _DERIVED_INDEX_REFRESHER.cancel()
+        _DERIVED_INDEX_REFRESHER = None
+    if QUERY_EXECUTOR is not None:
+        QUERY_EXECUTOR.shutdown(wait=False)
+        QUERY_EXECUTOR = None
+    QUERY_BATCHER = None # Bound to the executor just shut down
+    QUERY_CACHE.close()
+    if EMBEDDING_CACHE is not None:
+        EMBEDDING_CACHE.close()
+        EMBEDDING_CACHE = None
+    if KEYWORD_INDEX is not None:
+        KEYWORD_INDEX.close()
+        KEYWORD_INDEX = None
+    _KEYWORD_INDEX_SYNCED.clear()
 
 @app.post("/query")
 async def query_endpoint(request: DialogflowWebhookRequest):
@@ -205,7 +800,8 @@ async def query_endpoint(request: DialogflowWebhookRequest):
     # Pydantic model_dump_json is useful for complete, pretty-printed request logging
     print(f"Received request payload: {request.model_dump_json(indent=2)}")
 
-    if COLLECTION is None:
+    collection = get_search_collection()
+    if collection is None:
         print("❌ Error: ChromaDB collection is not available (failed at startup).", file=sys.stderr)
         return JSONResponse(
             status_code=200, # Dialogflow often expects 200 OK for functional errors in payload
@@ -224,28 +820,28 @@ async def query_endpoint(request: DialogflowWebhookRequest):
 
         query_str = build_query_string(protagonist, theme, moral)
         print(f"📥 Constructed query string for ChromaDB: '{query_str}'")
+        where, problem = resolve_filters(params)
+        if problem:
+            print(f"⚠️ Filters match no story: {problem}")
+            return JSONResponse(status_code=200, content=format_dialogflow_error_response(MSG_NO_FILTER_MATCH.format(problem=problem)))
+        if where:
+            print(f"🔎 Metadata filter: {where}")
 
         # search_stories now returns a user-facing message if the query_str is empty,
         # if no results are found, or if an internal error occurred during search.
-        snippet_or_message = search_stories(COLLECTION, query_str, n_results=DEFAULT_N_RESULTS)
+        cache_key = filtered_cache_key("", query_str, DEFAULT_N_RESULTS, where)
+        generation = QUERY_CACHE.generation # Results are cached under the generation their search started at
+        snippet_or_message = QUERY_CACHE.get(cache_key) if query_str else None
+        if snippet_or_message is not None:
+            print("⚡ Served from query cache.")
+        else:
+            snippet_or_message = await search_stories_async(collection, query_str, n_results=DEFAULT_N_RESULTS, where=where)
+            if query_str and snippet_or_message != MSG_SEARCH_FAILED: # Never cache transient failures
+                QUERY_CACHE.set(cache_key, snippet_or_message, generation)
         print(f"📝 Result from search_stories: '{snippet_or_message[:300]}...'")
 
-        # Check if the result from search_stories is one of the predefined fallback/error messages.
-        user_facing_error_messages = [
-            "It seems the details for the story were unclear. Could you please provide more information?",
-            "I searched the archives, but couldn't find anything matching that specific combination of details.",
-            "I encountered an unexpected issue while searching the story archives. Please try again."
-        ]
-
-        if snippet_or_message in user_facing_error_messages:
-            return JSONResponse(
-                status_code=200,
-                content=format_dialogflow_error_response(snippet_or_message)
-            )
-        else:
-            # Success: return the story snippet directly.
-            # This format implies setting an output parameter or similar in Dialogflow.
-            return {"story_snippet": snippet_or_message}
+        # Fallback/error messages become a Dialogflow fulfillment response; snippets are returned directly.
+        return JSONResponse(status_code=200, content=format_query_response(snippet_or_message))
 
     except Exception as e:
         # Catch-all for any other unexpected errors during request processing logic in this endpoint
@@ -259,6 +855,143 @@ async def query_endpoint(request: DialogflowWebhookRequest):
             )
         )
 
+@app.post("/query/batch")
+async def batch_query_endpoint(request: BatchQueryRequest):
+    """
+    Handles POST requests to the /query/batch endpoint: answers several Dialogflow-style
+    webhook requests with one multi-query ChromaDB call per distinct filter (split
+    into slices of QUERY_BATCH_MAX_SIZE), consulting the query cache first.
+
+    @param request The batch of webhook requests.
+    @return A JSON object whose "results" list holds one /query-shaped response per request, in order.
+    """
+    collection = get_search_collection()
+    if collection is None:
+        print("❌ Error: ChromaDB collection is not available (failed at startup).", file=sys.stderr)
+        unavailable = format_dialogflow_error_response(
+            "I'm sorry, but the story database is currently unavailable. Please try again later."
+        )
+        return {"results": [unavailable for _ in request.requests]}
+
+    try:
+        query_strs = [
+            build_query_string(r.sessionInfo.parameters.protagonist, r.sessionInfo.parameters.theme, r.sessionInfo.parameters.moral)
+            for r in request.requests
+        ]
+        print(f"📥 Received batch of {len(query_strs)} queries.")
+        filters = [resolve_filters(r.sessionInfo.parameters) for r in request.requests]
+        cache_keys = [filtered_cache_key("", q, DEFAULT_N_RESULTS, where) for q, (where, _) in zip(query_strs, filters)]
+        generation = QUERY_CACHE.generation # Results are cached under the generation their search started at
+        answers: List[Optional[str]] = [
+            MSG_NO_FILTER_MATCH.format(problem=problem) if problem else QUERY_CACHE.get(key) if q else None
+            for q, key, (_, problem) in zip(query_strs, cache_keys, filters)
+        ]
+        missing = [i for i, answer in enumerate(answers) if answer is None]
+        print(f"⚡ {len(query_strs) - len(missing)} of {len(query_strs)} served from query cache (or rejected by filters).")
+        groups: Dict[str, List[int]] = {} # One search per distinct filter
+        for i in missing:
+            groups.setdefault(json.dumps(filters[i][0], sort_keys=True), []).append(i)
+        for indexes in groups.values():
+            where = filters[indexes[0]][0]
+            searched = await search_stories_batch_async(collection, [query_strs[i] for i in indexes], n_results=DEFAULT_N_RESULTS, where=where)
+            for i, snippet_or_message in zip(indexes, searched):
+                answers[i] = snippet_or_message
+                if query_strs[i] and snippet_or_message != MSG_SEARCH_FAILED: # Never cache transient failures
+                    QUERY_CACHE.set(cache_keys[i], snippet_or_message, generation)
+        return {"results": [
+            format_dialogflow_error_response(answer) if filters[i][1] else format_query_response(answer)
+            for i, answer in enumerate(answers)
+        ]}
+
+    except Exception as e:
+        print(f"❌ Unexpected error processing request in /query/batch endpoint: {e}", file=sys.stderr)
+        import traceback
+        traceback.print_exc()
+        failed = format_dialogflow_error_response(
+            "I'm terribly sorry, but a mysterious gremlin seems to have tinkered with my scrolls! Please try asking again."
+        )
+        return {"results": [failed for _ in request.requests]}
+
+@app.post("/query/chunks")
+async def chunks_query_endpoint(request: ChunkQueryRequest):
+    """
+    Handles POST requests to the /query/chunks endpoint: the top-k chunks for a
+    free-text query, with ids, metadata and distances, for retrieval-augmented
+    generation. With "stories", each entry is instead a distinct story whose
+    retrieved chunks are stitched together (its "id" is the first chunk's,
+    "ids" lists them all). Optional "filters" restrict the search by metadata.
+    Results are cached like /query results.
+
+    @param request The query, number of results, grouping and filters.
+    @return {"query": ..., "chunks": [...]} (plus "filter_error" if a filter matches no story, with no chunks);
+            HTTP 503 if no collection is available, 500 if the search fails.
+    """
+    collection = get_search_collection()
+    if collection is None:
+        print("❌ Error: ChromaDB collection is not available (failed at startup).", file=sys.stderr)
+        return JSONResponse(status_code=503, content={"error": "The story database is currently unavailable."})
+
+    query_str = request.query.strip()
+    where, problem = resolve_filters(request.filters)
+    if problem:
+        return {"query": query_str, "chunks": [], "filter_error": problem}
+    cache_key = filtered_cache_key("stories:" if request.stories else "chunks:", query_str, request.n_results, where)
+    generation = QUERY_CACHE.generation # Results are cached under the generation their search started at
+    cached = QUERY_CACHE.get(cache_key) if query_str else None
+    if cached is not None:
+        return {"query": query_str, "chunks": json.loads(cached)}
+    try:
+        loop = asyncio.get_running_loop()
+        if request.stories and query_str:
+            stories = (await loop.run_in_executor(get_query_executor(), search_story_passages, collection, [query_str], request.n_results, where))[0]
+            chunks = [dict(id=story["ids"][0], **story) for story in stories]
+        else:
+            chunks = await loop.run_in_executor(get_query_executor(), search_chunks, collection, query_str, request.n_results, where)
+    except Exception as e:
+        print(f"❌ Error during chunk search for '{query_str}': {e}", file=sys.stderr)
+        return JSONResponse(status_code=500, content={"error": MSG_SEARCH_FAILED})
+    if query_str:
+        QUERY_CACHE.set(cache_key, json.dumps(chunks), generation)
+    return {"query": query_str, "chunks": chunks}
+
+@app.get("/cache/stats")
+async def cache_stats_endpoint():
+    """
+    Reports the query cache's hit/miss counters, size and current ingest generation,
+    plus the embedding cache's counters under "embedding_cache" and the
+    micro-batcher's counters under "query_batcher", the read replica's state
+    under "local_index", the keyword index's state, search mode and
+    per-route query counts under "keyword_index" and the facet index's state under "facet_index".
+
+    @return A JSON object with the cache statistics.
+    """
+    stats = QUERY_CACHE.stats()
+    stats["embedding_cache"] = EMBEDDING_CACHE.stats() if EMBEDDING_CACHE is not None else None
+    stats["query_batcher"] = QUERY_BATCHER.stats() if QUERY_BATCHER is not None else None
+    stats["local_index"] = LOCAL_INDEX.stats() if LOCAL_INDEX is not None else None
+    with _SEARCH_ROUTES_LOCK:
+        routes = dict(SEARCH_ROUTES)
+    stats["keyword_index"] = dict(KEYWORD_INDEX.stats(), mode=SEARCH_MODE, routes=routes,
+                                                                 synced=_KEYWORD_INDEX_SYNCED.is_set()) if KEYWORD_INDEX is not None else None
+    stats["facet_index"] = FACET_INDEX.stats()
+    return stats
+
+@app.get("/facets")
+async def facets_endpoint(field: str = "", prefix: str = "", limit: int = 20):
+    """
+    Serves filter values for autocompletion from the facet index, without querying ChromaDB.
+
+    @param field One of genre, subgenre, author or year; empty for every field.
+    @param prefix Only values with a word starting with this text (case-insensitive).
+    @param limit Maximum values per field (most stories first).
+    @return {"ready": ..., "facets": {field: [{"value", "stories", "chunks"}, ...]}}; HTTP 400 for an unknown field.
+    """
+    if field and field not in FACET_FIELDS:
+        return JSONResponse(status_code=400, content={"error": f"Unknown facet '{field}'. Use one of: {', '.join(FACET_FIELDS)}."})
+    fields = [field] if field else list(FACET_FIELDS)
+    limit = max(1, min(limit, 1000))
+    return {"ready": FACET_INDEX.ready, "facets": {name: FACET_INDEX.values(name, prefix, limit) for name in fields}}
+
 # --- Uvicorn Runner for Local Development ---
 if __name__ == "__main__":
     import uvicorn
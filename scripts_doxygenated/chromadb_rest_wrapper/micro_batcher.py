@@ -0,0 +1,151 @@
+##! @file micro_batcher.py
+##! @brief Coalesces concurrent single-query searches into batched ChromaDB calls.
+##! @details
+##! When several robots and kiosks ask for stories at the same moment, each /query
+##! request would otherwise make its own `collection.query` round-trip. QueryBatcher
+##! collects the queries that arrive within a short window (a few milliseconds),
+##! sends them as one multi-query call on the query thread pool, and resolves each
+##! caller's future with its own result. Identical queries within a batch are
+##! searched once. A batch is sent early once it reaches the maximum size, and
+##! at most a few batches run at once: while they are busy, new queries keep
+##! joining the waiting batch, so batches grow with load instead of queueing.
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import asyncio
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+__all__ = ["QueryBatcher"]
+
+## @var BatchKey
+# (id of the collection, n_results) pair identifying queries that can share a batch.
+BatchKey = Tuple[int, int]
+
+
+class QueryBatcher:
+    """
+    Event-loop-side micro-batcher. Must be used from a single event loop;
+    the batched search function runs on the given executor.
+    """
+
+    def __init__(self, search_batch: Callable[[Any, List[str], int], List[str]], executor: Optional[Executor],
+                 window_ms: float = 5.0, max_batch_size: int = 32, max_in_flight: int = 4):
+        """
+        @param search_batch Blocking function taking (collection, queries, n_results) and returning
+               one result per query.
+        @param executor Executor the search function runs on (None for the loop's default).
+        @param window_ms How long the first query of a batch waits for others to join.
+        @param max_batch_size Maximum queries per call; a full batch is sent without waiting for the window.
+        @param max_in_flight Maximum batches running at once. While all are busy, due batches keep
+               collecting queries instead of queueing on the executor, so batches grow with load.
+        """
+        self.search_batch = search_batch
+        self.executor = executor
+        self.window_s = window_ms / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_in_flight = max(1, max_in_flight)
+        self.batches = 0
+        self.queries = 0
+        self.largest_batch = 0
+        self._in_flight = 0
+        self._pending: Dict[BatchKey, List[Tuple[str, asyncio.Future]]] = {}
+        self._collections: Dict[BatchKey, Any] = {}
+        self._timers: Dict[BatchKey, asyncio.TimerHandle] = {}
+        self._due: Dict[BatchKey, None] = {} # Insertion-ordered set of keys whose window has closed
+
+    async def submit(self, collection: Any, query: str, n_results: int) -> str:
+        """
+        Queues a query for the next batch and waits for its result.
+
+        @param collection The collection to search. Queries are only batched with others
+               for the same collection and number of results.
+        @param query The query string.
+        @param n_results The number of results to retrieve.
+        @return The result produced by the search function for this query.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        key = (id(collection), n_results)
+        bucket = self._pending.setdefault(key, [])
+        self._collections[key] = collection
+        bucket.append((query, future))
+        if len(bucket) >= self.max_batch_size:
+            self._mark_due(key)
+        elif key not in self._due and key not in self._timers:
+            self._timers[key] = loop.call_later(self.window_s, self._mark_due, key)
+        return await future
+
+    def _mark_due(self, key: BatchKey) -> None:
+        """Closes the collection window for a key and sends whatever can be sent."""
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        self._due[key] = None
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Sends due batches to the executor while fewer than max_in_flight are running."""
+        while self._due and self._in_flight < self.max_in_flight:
+            key = next(iter(self._due))
+            bucket = self._pending.get(key, [])
+            batch, rest = bucket[:self.max_batch_size], bucket[self.max_batch_size:]
+            if rest:
+                self._pending[key] = rest # Still due: sent on the next pass
+            else:
+                self._pending.pop(key, None)
+                del self._due[key]
+            collection = self._collections[key] if rest else self._collections.pop(key, None)
+            if batch:
+                self._send(collection, key[1], batch)
+
+    def _send(self, collection: Any, n_results: int, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        """Runs one batch on the executor and arranges for its results to be fanned out."""
+        unique_queries = list(dict.fromkeys(query for query, _ in batch))
+        self.batches += 1
+        self.queries += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+        self._in_flight += 1
+        task = asyncio.get_running_loop().run_in_executor(self.executor, self.search_batch, collection, unique_queries, n_results)
+        task.add_done_callback(lambda done: self._finish(done, batch, unique_queries))
+
+    def _finish(self, done: asyncio.Future, batch: List[Tuple[str, asyncio.Future]], unique_queries: List[str]) -> None:
+        """Delivers a finished batch and sends the next due one."""
+        self._in_flight -= 1
+        self._deliver(done, batch, unique_queries)
+        self._dispatch()
+
+    @staticmethod
+    def _deliver(done: asyncio.Future, batch: List[Tuple[str, asyncio.Future]], unique_queries: List[str]) -> None:
+        """Fans the batch result (or its exception) back out to the waiting callers; a cancelled batch cancels them."""
+        cancelled = done.cancelled() # e.g., the executor shut down with cancel_futures=True
+        error = None if cancelled else done.exception()
+        results = {} if cancelled or error else dict(zip(unique_queries, done.result()))
+        for query, future in batch:
+            if future.done(): # The caller went away (e.g., request cancelled)
+                continue
+            if cancelled:
+                future.cancel()
+            elif error:
+                future.set_exception(error)
+            else:
+                future.set_result(results[query])
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        @return Batch counters, suitable for a JSON response.
+        """
+        return {
+            "window_ms": self.window_s * 1000.0,
+            "max_batch_size": self.max_batch_size,
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self._in_flight,
+            "batches": self.batches,
+            "queries": self.queries,
+            "mean_batch_size": round(self.queries / self.batches, 2) if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+        }
@@ -0,0 +1,214 @@
+##! @file query_cache.py
+##! @brief LRU + TTL cache for /query results, with an optional shared SQLite tier.
+##! @details
+##! Children ask for the same protagonist/theme/moral combinations over and over,
+##! and each request re-embeds the query and re-runs the vector search. QueryCache
+##! keeps recent results in an in-process LRU (bounded by entry count, with a TTL)
+##! and, when a path is configured, in a SQLite file on local disk so several
+##! uvicorn workers on the same host can share hits.
+##!
+##! Every entry is tagged with the collection's *ingest generation*, a stamp that
+##! upload_stories.py writes into the collection metadata after it changes the
+##! collection. When the application sees a new generation, older entries stop
+##! matching, which invalidates the cache without any coordination between processes.
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+__all__ = ["GENERATION_METADATA_KEY", "QueryCache", "normalize_query"]
+
+## @var GENERATION_METADATA_KEY
+# Collection metadata key holding the ingest generation stamp written by upload_stories.py.
+GENERATION_METADATA_KEY: str = "ingest_generation"
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalizes a query string for use as a cache key: lower-cased, with runs of
+    whitespace collapsed to single spaces.
+
+    @param query The query string, typically from build_query_string().
+    @return The normalized query.
+    """
+    return " ".join(query.lower().split())
+
+
+class QueryCache:
+    """
+    Two-tier result cache: an in-process LRU with TTL, optionally backed by a
+    SQLite file shared between worker processes. Thread-safe.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600.0, sqlite_path: Optional[str] = None):
+        """
+        @param max_entries Maximum entries per tier. 0 disables caching entirely.
+        @param ttl_seconds Time-to-live of an entry, in seconds.
+        @param sqlite_path Path of the shared SQLite cache file, or None for in-process only.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.sqlite_path = sqlite_path
+        self.generation: Optional[str] = None
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        if sqlite_path and max_entries > 0:
+            self._conn = sqlite3.connect(sqlite_path, check_same_thread=False, timeout=5.0)
+            with self._conn:
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS query_cache (
+                        key        TEXT PRIMARY KEY,
+                        generation TEXT NOT NULL,
+                        value      TEXT NOT NULL,
+                        created_at REAL NOT NULL,
+                        accessed_at REAL NOT NULL
+                    )
+                    """
+                )
+
+    @property
+    def enabled(self) -> bool:
+        """True unless the cache was configured with max_entries = 0."""
+        return self.max_entries > 0
+
+    @staticmethod
+    def make_key(query: str, n_results: int) -> str:
+        """
+        Builds the cache key for a query.
+
+        @param query The query string (normalized here).
+        @param n_results The number of results requested.
+        @return The cache key.
+        """
+        return f"{n_results}|{normalize_query(query)}"
+
+    def set_generation(self, generation: Optional[str]) -> bool:
+        """
+        Records the collection's current ingest generation. On a change, the
+        in-process tier is cleared and shared rows from older generations are pruned.
+
+        @param generation The generation stamp read from the collection metadata (may be None).
+        @return True if the generation changed.
+        """
+        with self._lock:
+            if generation == self.generation:
+                return False
+            self.generation = generation
+            self._entries.clear()
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute("DELETE FROM query_cache WHERE generation != ?", (generation or "",))
+        return True
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Looks up a cached result, first in process, then in the shared tier.
+
+        @param key A key from make_key().
+        @return The cached result, or None on a miss.
+        """
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[0] < self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[key]
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT value, created_at FROM query_cache WHERE key = ? AND generation = ?",
+                    (key, self.generation or ""),
+                ).fetchone()
+                if row and now - row[1] < self.ttl_seconds:
+                    with self._conn:
+                        self._conn.execute("UPDATE query_cache SET accessed_at = ? WHERE key = ?", (now, key))
+                    self._store_local(key, row[1], row[0])
+                    self.hits += 1
+                    self.shared_hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: str, generation: Optional[str]) -> None:
+        """
+        Stores a result in both tiers, unless the ingest generation changed while
+        it was being computed (a search started before an ingest must not be
+        cached under the new generation).
+
+        @param key A key from make_key().
+        @param value The result to cache.
+        @param generation The generation read when the search started (`generation` next to get()).
+        """
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._store_local(key, now, value)
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO query_cache VALUES (?, ?, ?, ?, ?)",
+                        (key, self.generation or "", value, now, now),
+                    )
+                    # Evict least-recently-used rows beyond the size limit.
+                    self._conn.execute(
+                        """
+                        DELETE FROM query_cache WHERE key IN (
+                            SELECT key FROM query_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                        )
+                        """,
+                        (self.max_entries,),
+                    )
+
+    def _store_local(self, key: str, created_at: float, value: str) -> None:
+        """Inserts into the in-process LRU, evicting the oldest entry if full. Caller holds the lock."""
+        self._entries[key] = (created_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        @return Hit/miss counters and sizes, suitable for a JSON response.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "shared_path": self.sqlite_path if self._conn is not None else None,
+                "generation": self.generation,
+            }
+
+    def close(self) -> None:
+        """Closes the shared tier's database connection, if any."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,137 @@
+##! @file story_passages.py
+##! @brief Groups retrieved chunks by story and stitches adjacent chunks into passages.
+##! @details
+##! upload_stories.py splits every story with a 200-character overlap. A plain
+##! top-k search therefore often returns neighbouring chunks of one book, and
+##! joining them repeats the overlapping text. stitch_stories() post-processes an
+##! over-fetched hit list:
+##! 1. hits are grouped by story (`metadata["story_id"]`, or the title for chunks
+##!    uploaded before story IDs existed), and stories are ranked by their best hit;
+##! 2. each story keeps its best `max_chunks` hits;
+##! 3. consecutive hits are merged into one passage, and the text the second
+##!    chunk repeats from the first is dropped. A chunk follows another if its
+##!    `metadata["prev_chunk"]` is that chunk's ID; older chunks have positional
+##!    `{title}_{i}` IDs, and consecutive numbers are used instead;
+##! 4. the top `n_stories` distinct stories are returned.
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+from typing import Any, Dict, List, Optional, Tuple
+
+__all__ = ["chunk_position", "chunk_runs", "merge_overlap", "stitch_stories"]
+
+## @var MIN_OVERLAP_CHARS
+# Shortest repeated text treated as chunk overlap; shorter matches are coincidence.
+MIN_OVERLAP_CHARS: int = 10
+
+## @var PASSAGE_SEPARATOR
+# Placed between passages of one story that are not contiguous.
+PASSAGE_SEPARATOR: str = "\n\n"
+
+
+def chunk_position(chunk_id: str) -> Tuple[str, Optional[int]]:
+    """
+    Splits a positional chunk ID of the form `{title}_{i}` (chunks uploaded before content-derived IDs).
+
+    @param chunk_id The chunk ID.
+    @return (prefix, chunk number), or (chunk_id, None) if the ID has no number suffix.
+    """
+    prefix, _, number = chunk_id.rpartition("_")
+    return (prefix, int(number)) if prefix and number.isdigit() else (chunk_id, None)
+
+
+def merge_overlap(first: str, second: str, max_overlap: int = 200) -> str:
+    """
+    Joins two consecutive chunks, dropping the start of *second* that repeats the end of *first*.
+
+    @param first The earlier chunk.
+    @param second The following chunk.
+    @param max_overlap The splitter's chunk overlap, in characters.
+    @return The joined text; if no overlap is found, the chunks are joined with a paragraph break.
+    """
+    for size in range(min(max_overlap, len(first), len(second)), MIN_OVERLAP_CHARS - 1, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return f"{first}{PASSAGE_SEPARATOR}{second}"
+
+
+def chunk_runs(hits: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """
+    Orders one story's hits into runs of consecutive chunks.
+
+    @param hits The story's chunk dicts, best first.
+    @return Lists of consecutive chunks. Runs of positional chunks are in story order;
+            runs of linked chunks (whose position in the story is unknown) in order of their best hit.
+    """
+    by_id = {chunk["id"]: chunk for chunk in hits}
+    positions = {chunk["id"]: chunk_position(chunk["id"]) for chunk in hits}
+    by_position = {position: chunk_id for chunk_id, position in positions.items() if position[1] is not None}
+    successor: Dict[str, Dict[str, Any]] = {}
+    for chunk in hits:
+        previous = (chunk.get("metadata") or {}).get("prev_chunk")
+        if previous is None: # Positional ID
+            prefix, number = positions[chunk["id"]]
+            previous = by_position.get((prefix, number - 1)) if number is not None else None
+        if previous in by_id:
+            successor[previous] = chunk
+    followers = {chunk["id"] for chunk in successor.values()}
+    heads = [chunk for chunk in hits if chunk["id"] not in followers]
+    heads.sort(key=lambda chunk: (positions[chunk["id"]][1] is None, positions[chunk["id"]][1] or 0))
+    runs = []
+    for chunk in heads:
+        run = [chunk]
+        while run[-1]["id"] in successor and len(run) < len(hits):
+            run.append(successor[run[-1]["id"]])
+        runs.append(run)
+    return runs
+
+
+def stitch_stories(chunks: List[Dict[str, Any]], n_stories: int, max_chunks: int = 2,
+                   max_overlap: int = 200) -> List[Dict[str, Any]]:
+    """
+    Turns a chunk ranking into a ranking of distinct stories with stitched passages.
+
+    @param chunks Chunk dicts ("id", "text", "metadata", optionally "distance"/"score"), best first.
+    @param n_stories The number of stories to return.
+    @param max_chunks The number of best-ranked chunks kept per story.
+    @param max_overlap The splitter's chunk overlap, in characters.
+    @return Up to *n_stories* dicts, best first, with the story's "title", its best chunk's
+            "metadata", the "ids" of the chunks used (in passage order, see chunk_runs()), the
+            stitched "text", and the best chunk's "distance" and "score" where present.
+    """
+    stories: Dict[str, List[Dict[str, Any]]] = {}
+    seen = set()
+    for chunk in chunks:
+        if chunk["id"] in seen:
+            continue
+        seen.add(chunk["id"])
+        metadata = chunk.get("metadata") or {}
+        story = str(metadata.get("story_id") or metadata.get("title") or chunk_position(chunk["id"])[0])
+        if story in stories or len(stories) < n_stories:
+            hits = stories.setdefault(story, [])
+            if len(hits) < max_chunks:
+                hits.append(chunk)
+
+    results: List[Dict[str, Any]] = []
+    for story_key, hits in stories.items():
+        passages: List[str] = []
+        ids: List[str] = []
+        for run in chunk_runs(hits):
+            text = run[0]["text"].strip()
+            for chunk in run[1:]:
+                text = merge_overlap(text, chunk["text"].strip(), max_overlap)
+            passages.append(text)
+            ids += [chunk["id"] for chunk in run]
+        best = hits[0]
+        metadata = best.get("metadata") or {}
+        story = {"title": str(metadata.get("title") or story_key), "metadata": metadata, "ids": ids,
+                 "text": PASSAGE_SEPARATOR.join(passages)}
+        for key in ("distance", "score"):
+            if key in best:
+                story[key] = best[key]
+        results.append(story)
+    return results
@@ -0,0 +1,140 @@
+##! @file epub_reader.py
+##! @brief Lightweight EPUB reader that serves metadata and text from one open archive.
+##! @details
+##! `ebooklib.epub.read_epub` loads and parses every item in the book up front,
+##! which is wasteful when only the title is needed to decide whether a story is
+##! a duplicate. EpubReader opens the EPUB's zip archive once and reads just the
+##! OPF package file for metadata; chapter XHTML is only read (and parsed with
+##! BeautifulSoup) when the text is actually iterated, in spine order.
+##!
+##! ### Example
+##! ```python
+##! with EpubReader("MyStory.epub") as reader:
+##!     title = reader.dc("title")
+##!     for chapter_text in reader.iter_documents():
+##!         ...
+##! ```
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import posixpath
+import xml.etree.ElementTree as ET
+import zipfile
+from typing import Dict, Iterator, List, Tuple
+from urllib.parse import unquote
+
+from bs4 import BeautifulSoup
+
+__all__ = ["EpubReader"]
+
+## @var _CONTAINER_PATH
+# Location of the OCF container file that points at the OPF package. (Internal constant)
+_CONTAINER_PATH: str = "META-INF/container.xml"
+
+## @var _NS
+# XML namespaces used by the container and OPF package files. (Internal constant)
+_NS: Dict[str, str] = {
+    "container": "urn:oasis:names:tc:opendocument:xmlns:container",
+    "opf": "http://www.idpf.org/2007/opf",
+    "dc": "http://purl.org/dc/elements/1.1/",
+}
+
+## @var _DOCUMENT_MEDIA_TYPES
+# Manifest media types treated as readable chapter documents. (Internal constant)
+_DOCUMENT_MEDIA_TYPES: Tuple[str, ...] = ("application/xhtml+xml", "text/html")
+
+
+class EpubReader:
+    """
+    Reads an EPUB file's metadata and chapter text from a single open zip archive.
+    Only the container and OPF package files are parsed on construction.
+    """
+
+    def __init__(self, filepath: str):
+        """
+        Opens the EPUB and parses its OPF package file.
+
+        @param filepath The path to the EPUB file.
+        @raises zipfile.BadZipFile If the file is not a zip archive.
+        @raises KeyError If the container or package file is missing.
+        @raises xml.etree.ElementTree.ParseError If the container or package XML is malformed.
+        """
+        self.filepath = filepath
+        self._zip = zipfile.ZipFile(filepath)
+        try:
+            container = ET.fromstring(self._zip.read(_CONTAINER_PATH))
+            rootfile = container.find("container:rootfiles/container:rootfile", _NS)
+            if rootfile is None or not rootfile.get("full-path"):
+                raise KeyError(f"No rootfile entry in {_CONTAINER_PATH}")
+            self._opf_path = rootfile.get("full-path")
+            self._package = ET.fromstring(self._zip.read(self._opf_path))
+        except Exception:
+            self._zip.close()
+            raise
+
+    def __enter__(self) -> "EpubReader":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Closes the underlying zip archive."""
+        self._zip.close()
+
+    def dc(self, name: str) -> List[str]:
+        """
+        Returns the values of a Dublin Core metadata element from the OPF package.
+
+        @param name The element name without namespace (e.g., "title", "creator", "subject").
+        @return The stripped, non-empty text values in document order.
+        """
+        metadata = self._package.find("opf:metadata", _NS)
+        if metadata is None:
+            return []
+        values = (element.text or "" for element in metadata.findall(f"dc:{name}", _NS))
+        return [value.strip() for value in values if value.strip()]
+
+    def document_paths(self) -> List[str]:
+        """
+        Lists the archive paths of the book's XHTML documents, in spine (reading)
+        order followed by any documents not referenced from the spine. The EPUB 3
+        navigation document is excluded.
+
+        @return A list of paths inside the zip archive.
+        """
+        opf_dir = posixpath.dirname(self._opf_path)
+        documents: Dict[str, str] = {}
+        for item in self._package.iterfind("opf:manifest/opf:item", _NS):
+            if item.get("media-type") not in _DOCUMENT_MEDIA_TYPES:
+                continue
+            if "nav" in (item.get("properties") or "").split():
+                continue
+            href = unquote(item.get("href", ""))
+            documents[item.get("id", "")] = posixpath.normpath(posixpath.join(opf_dir, href))
+
+        ordered: List[str] = []
+        for itemref in self._package.iterfind("opf:spine/opf:itemref", _NS):
+            path = documents.pop(itemref.get("idref", ""), None)
+            if path:
+                ordered.append(path)
+        ordered.extend(documents.values())
+        return ordered
+
+    def iter_documents(self) -> Iterator[str]:
+        """
+        Yields the plaintext of each document's body, reading and parsing one at a time.
+        Documents listed in the manifest but missing from the archive are skipped.
+
+        @return A generator of document texts.
+        """
+        names = set(self._zip.namelist())
+        for path in self.document_paths():
+            if path not in names:
+                continue
+            soup = BeautifulSoup(self._zip.read(path), "html.parser")
+            yield (soup.body or soup).get_text() # Skip <head> (e.g., <title>) when there is a body
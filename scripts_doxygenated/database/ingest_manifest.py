@@ -0,0 +1,270 @@
+##! @file ingest_manifest.py
+##! @brief Local SQLite manifest of ingested story files for incremental uploads.
+##! @details
+##! Records, per story file, the file's size, modification time and SHA-256
+##! content hash together with the title and number of chunks uploaded for it.
+##! upload_stories.py consults the manifest to skip unchanged files without
+##! contacting ChromaDB, and to know which chunk IDs a modified story previously
+##! owned so stale chunks can be removed after re-upload.
+##! For every file, the ID and metadata fingerprint of each of its chunks is kept
+##! too: re-ingesting a modified story then only upserts chunks whose ID or
+##! fingerprint is new, and deletes the IDs the story no longer produces.
+##! Entries written before chunk IDs became content-derived have no chunk rows
+##! (and no story_id); their chunks are the positional `{title}_{i}` IDs.
+##! While a story uploads, every chunk ChromaDB acknowledges is checkpointed, so a
+##! run that is interrupted (or gives up on a failing batch) resumes the story
+##! without resending them. A file's checkpoint is cleared when its entry is recorded.
+##!
+##! Entries are keyed by (collection, path) so one manifest can track several
+##! ChromaDB targets.
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Mapping, Optional, Tuple
+
+__all__ = ["FileFingerprint", "IngestManifest", "file_sha256", "stat_file"]
+
+## @var _HASH_BLOCK_SIZE
+# Read size used when hashing story files. (Internal constant)
+_HASH_BLOCK_SIZE: int = 1 << 20
+
+## @var FileFingerprint
+# (mtime_ns, size) pair from os.stat, used as the cheap change check before hashing.
+FileFingerprint = Tuple[int, int]
+
+
+def stat_file(filepath: str) -> FileFingerprint:
+    """
+    Returns the cheap change-detection fingerprint of a file.
+
+    @param filepath The path to the file.
+    @return A (mtime_ns, size) tuple.
+    """
+    st = os.stat(filepath)
+    return st.st_mtime_ns, st.st_size
+
+
+def file_sha256(filepath: str) -> str:
+    """
+    Computes the SHA-256 hex digest of a file's contents, reading it in blocks.
+
+    @param filepath The path to the file.
+    @return The hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as fh:
+        while block := fh.read(_HASH_BLOCK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IngestManifest:
+    """
+    SQLite-backed record of which story files have been uploaded to a collection.
+    Safe to share between the ingestion main thread and uploader threads.
+    """
+
+    def __init__(self, path: str, collection: str):
+        """
+        Opens (or creates) the manifest database.
+
+        @param path Filesystem path of the SQLite database.
+        @param collection Identifier of the ChromaDB target (e.g., "host:port/stories").
+        """
+        self.path = path
+        self.collection = collection
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS files (
+                    collection   TEXT NOT NULL,
+                    path         TEXT NOT NULL,
+                    mtime_ns     INTEGER NOT NULL,
+                    size         INTEGER NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    title        TEXT NOT NULL,
+                    chunk_count  INTEGER NOT NULL,
+                    updated_at   REAL NOT NULL,
+                    PRIMARY KEY (collection, path)
+                )
+                """
+            )
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(files)")}
+            if "story_id" not in columns: # Manifests created before stable chunk IDs
+                self._conn.execute("ALTER TABLE files ADD COLUMN story_id TEXT")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS files_title ON files (collection, title COLLATE NOCASE)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS files_story ON files (collection, story_id)")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS chunks (
+                    collection  TEXT NOT NULL,
+                    path        TEXT NOT NULL,
+                    chunk_id    TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    PRIMARY KEY (collection, path, chunk_id)
+                ) WITHOUT ROWID
+                """
+            )
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    collection  TEXT NOT NULL,
+                    path        TEXT NOT NULL,
+                    chunk_id    TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    PRIMARY KEY (collection, path, chunk_id)
+                ) WITHOUT ROWID
+                """
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM files WHERE collection = ?", (self.collection,)
+            ).fetchone()
+        return row[0]
+
+    def get(self, filepath: str) -> Optional[Dict[str, object]]:
+        """
+        Looks up the manifest entry for a file.
+
+        @param filepath The path to the story file.
+        @return The entry as a dictionary, or None if the file has never been ingested.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM files WHERE collection = ? AND path = ?",
+                (self.collection, os.path.abspath(filepath)),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def story_owner(self, story_id: str, title: str) -> Optional[str]:
+        """
+        Finds which file (if any) already supplied this story. Entries recorded
+        without a story_id only know their title, so they match by title alone.
+
+        @param story_id The story's identifier (see story_chunker.story_id()).
+        @param title The story title (compared case-insensitively for older entries).
+        @return The owning file path, or None.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT path FROM files WHERE collection = ? AND (story_id = ? OR (story_id IS NULL AND title = ? COLLATE NOCASE)) LIMIT 1",
+                (self.collection, story_id, title.strip()),
+            ).fetchone()
+        return row["path"] if row else None
+
+    def chunks(self, filepath: str) -> Dict[str, str]:
+        """
+        Returns the chunks last uploaded for a file.
+
+        @param filepath The path to the story file.
+        @return Chunk IDs mapped to their metadata fingerprints; empty for new files and older entries.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chunk_id, fingerprint FROM chunks WHERE collection = ? AND path = ?",
+                (self.collection, os.path.abspath(filepath)),
+            ).fetchall()
+        return {row["chunk_id"]: row["fingerprint"] for row in rows}
+
+    def checkpoint(self, filepath: str, chunks: Mapping[str, str]) -> None:
+        """
+        Records chunks of a file whose upload ChromaDB has acknowledged, before the whole story is done.
+
+        @param filepath The path to the story file.
+        @param chunks The acknowledged chunk IDs mapped to their metadata fingerprints.
+        """
+        path = os.path.abspath(filepath)
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?)",
+                ((self.collection, path, chunk_id, chunk_fingerprint) for chunk_id, chunk_fingerprint in chunks.items()),
+            )
+
+    def checkpointed(self, filepath: str) -> Dict[str, str]:
+        """
+        Returns the chunks acknowledged by an upload of the file that did not complete.
+
+        @param filepath The path to the story file.
+        @return Chunk IDs mapped to their metadata fingerprints; empty if there is no checkpoint.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chunk_id, fingerprint FROM checkpoints WHERE collection = ? AND path = ?",
+                (self.collection, os.path.abspath(filepath)),
+            ).fetchall()
+        return {row["chunk_id"]: row["fingerprint"] for row in rows}
+
+    def is_unchanged(self, filepath: str, entry: Optional[Dict[str, object]]) -> Tuple[bool, FileFingerprint, Optional[str]]:
+        """
+        Decides whether a file still matches its manifest entry. The size and
+        mtime are compared first; the file is only hashed when they differ, and a
+        touched-but-identical file is refreshed in place.
+
+        @param filepath The path to the story file.
+        @param entry The file's manifest entry from get(), or None.
+        @return A tuple (unchanged, fingerprint, content_hash). content_hash is None
+                when the file was not hashed (i.e., the fingerprint matched).
+        """
+        fingerprint = stat_file(filepath)
+        if entry and (entry["mtime_ns"], entry["size"]) == fingerprint:
+            return True, fingerprint, None
+        content_hash = file_sha256(filepath)
+        if entry and entry["content_hash"] == content_hash:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "UPDATE files SET mtime_ns = ?, size = ?, updated_at = ? WHERE collection = ? AND path = ?",
+                    (*fingerprint, time.time(), self.collection, os.path.abspath(filepath)),
+                )
+            return True, fingerprint, content_hash
+        return False, fingerprint, content_hash
+
+    def record(self, filepath: str, fingerprint: FileFingerprint, content_hash: str, title: str, chunk_count: int,
+               story_id: Optional[str] = None, chunks: Optional[Mapping[str, str]] = None) -> None:
+        """
+        Inserts or replaces the entry for a successfully uploaded file and clears its checkpoint.
+
+        @param filepath The path to the story file.
+        @param fingerprint The (mtime_ns, size) fingerprint taken before extraction.
+        @param content_hash The file's SHA-256 hex digest.
+        @param title The story title the chunks were uploaded under.
+        @param chunk_count The number of chunks uploaded.
+        @param story_id The story's identifier, if known.
+        @param chunks The story's chunk IDs mapped to their metadata fingerprints, replacing the previous
+               ones; None leaves no chunk rows (stories adopted from a collection without a manifest).
+        """
+        path = os.path.abspath(filepath)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (collection, path, mtime_ns, size, content_hash, title, chunk_count, updated_at, story_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.collection, path, *fingerprint, content_hash, title, chunk_count, time.time(), story_id),
+            )
+            self._conn.execute("DELETE FROM chunks WHERE collection = ? AND path = ?", (self.collection, path))
+            self._conn.execute("DELETE FROM checkpoints WHERE collection = ? AND path = ?", (self.collection, path))
+            if chunks:
+                self._conn.executemany(
+                    "INSERT INTO chunks VALUES (?, ?, ?, ?)",
+                    ((self.collection, path, chunk_id, chunk_fingerprint) for chunk_id, chunk_fingerprint in chunks.items()),
+                )
+
+    def close(self) -> None:
+        """Closes the underlying database connection."""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,296 @@
+##! @file prompt_builder.py
+##! @brief Token-budgeted assembly of ChatCompletion messages from a system prompt, history and a request.
+##! @details
+##! Sending a returning user's whole history made prompts, cost and latency grow
+##! until requests failed on context length. PromptBuilder.build() assembles
+##! the messages for one request within a fixed token budget:
+##! 1. the system prompt and the new request are always kept verbatim;
+##! 2. among the turns sent verbatim, repeated story requests collapse to their
+##!    latest occurrence, along with the reply that followed. Asking for "a dragon
+##!    story" five times leaves only the last dragon exchange, which the model
+##!    still sees, so it can avoid retelling it;
+##! 3. the newest `recent_turns` (deduplicated) messages are kept verbatim while they fit;
+##! 4. older turns are replaced by a summary: the caller's (e.g.,
+##!    UserMemoryStore's rolling summary), extended by the optional summarizer.
+##!    The summarizer folds older turns in fixed blocks of `summary_block`
+##!    messages, counted from the start of the history. Each block's result is
+##!    cached by content, so a growing history costs at most one new summarizer
+##!    call per block instead of one per request;
+##! 5. turns that are neither kept nor summarised are sent verbatim if they still
+##!    fit, and dropped otherwise.
+##! Tokens are counted locally with tiktoken (o200k_base) when it is installed
+##! and its encoding loads, and estimated at four characters per token otherwise
+##! (including after a failed encoding download, which is not retried).
+##!
+##! Shared by search_stories.py, webhook.py, naoqi_tests/chatgpt_webhook.py and webhook_asgi.py.
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+try:
+    import tiktoken
+except ImportError: # Optional: fall back to a character-based estimate
+    tiktoken = None
+
+__all__ = ["PROMPT_TOKEN_BUDGET", "SUMMARY_PREFIX", "BuiltPrompt", "PromptBuilder", "Summarizer",
+           "build_summary_messages", "count_tokens", "message_tokens"]
+
+## @var PROMPT_TOKEN_BUDGET
+# Default token budget of the assembled messages (excluding the reply).
+PROMPT_TOKEN_BUDGET: int = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+
+## @var _MESSAGE_OVERHEAD_TOKENS
+# Tokens the chat format adds per message (role and separators). (Internal constant)
+_MESSAGE_OVERHEAD_TOKENS: int = 4
+
+## @var SUMMARY_PREFIX
+# Introduces the history summary in the assembled messages.
+SUMMARY_PREFIX: str = "Summary of earlier conversations with this user: "
+
+## @var _REQUEST_NOISE
+# Characters ignored when comparing story requests. (Internal constant)
+_REQUEST_NOISE = re.compile(r"[^\w\s]+")
+
+## @var Summarizer
+# (previous summary or None, turns to fold in, oldest first) -> new summary.
+Summarizer = Callable[[Optional[str], List[Dict[str, str]]], str]
+
+#: The o200k_base encoding once loaded; None before the first count, False if it could not be loaded
+_encoding: Any = None
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding() -> Any:
+    """@return The tiktoken encoding, or False if tiktoken is missing or its encoding could not be loaded. (Internal)"""
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    _encoding = tiktoken.get_encoding("o200k_base") if tiktoken is not None else False
+                except Exception as exc: # First use downloads the encoding; offline, that fails
+                    print(f"⚠️ Could not load the o200k_base token encoding ({exc}); estimating tokens from characters.")
+                    _encoding = False
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """
+    Counts the tokens of *text* for the chat models (o200k_base), or estimates them.
+
+    @param text The text.
+    @return The token count (tiktoken), or about one token per four characters if
+            tiktoken is missing or its encoding failed to load (not retried).
+    """
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def message_tokens(message: Dict[str, str]) -> int:
+    """
+    @param message A chat message with "content".
+    @return Its tokens including the per-message overhead.
+    """
+    return count_tokens(message["content"]) + _MESSAGE_OVERHEAD_TOKENS
+
+
+def build_summary_messages(previous: Optional[str], turns: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """
+    Builds the ChatCompletion messages that fold *turns* into a user's running notes
+    (the summarizer prompt shared by the CLI and the webhooks).
+
+    @param previous The current notes, or None.
+    @param turns Turns to fold in, oldest first.
+    @return Messages for a short ChatCompletion whose reply is the new summary.
+    """
+    transcript = "\n".join(f"{t['role']}: {t['content']}" for t in turns)
+    return [
+        {"role": "system", "content": "You keep short notes on a user's story preferences."},
+        {"role": "user", "content": (
+            f"Current notes: {previous or '(none)'}\n\nNew conversation:\n{transcript}\n\n"
+            "Rewrite the notes to include anything new about the user's name, favourite themes, "
+            "characters and stories already told. Reply with the notes only."
+        )},
+    ]
+
+
+def _request_key(text: str) -> str:
+    """@return *text* normalised for duplicate detection (case, punctuation and spacing ignored)."""
+    return " ".join(_REQUEST_NOISE.sub(" ", text.lower()).split())
+
+
+@dataclass
+class BuiltPrompt:
+    """Messages for one request plus what the builder did to fit them."""
+
+    messages: List[Dict[str, str]]
+    tokens: int
+    history_messages: int = 0          # Messages in the history passed in
+    kept_messages: int = 0             # History messages sent verbatim
+    deduplicated: int = 0              # History messages removed as repeated requests (and their replies)
+    summarized: int = 0                # History messages replaced by the summary
+    dropped: int = 0                   # History messages left out for lack of budget
+    summary_tokens: int = 0
+
+
+class PromptBuilder:
+    """
+    Assembles ChatCompletion messages within a token budget. Thread-safe; one
+    instance can be shared by all requests of a process.
+    """
+
+    def __init__(self, system_prompt: Optional[str] = None, budget_tokens: int = PROMPT_TOKEN_BUDGET,
+                 recent_turns: int = 6, summarizer: Optional[Summarizer] = None, summary_block: int = 8,
+                 summary_cache_size: int = 256):
+        """
+        @param system_prompt System message sent first, verbatim (None for none).
+        @param budget_tokens Maximum tokens of the assembled messages.
+        @param recent_turns Newest history messages kept verbatim (when they fit).
+        @param summarizer Folds older turns into the summary; None leaves them to the budget (usually dropped).
+        @param summary_block Older messages folded per summarizer call.
+        @param summary_cache_size Summaries remembered by content, so unchanged histories are not re-summarised.
+        """
+        self.system_prompt = system_prompt
+        self.budget_tokens = budget_tokens
+        self.recent_turns = recent_turns
+        self.summarizer = summarizer
+        self.summary_block = max(1, summary_block)
+        self.summary_cache_size = summary_cache_size
+        self._summaries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.summary_calls = 0
+        self.summary_cache_hits = 0
+
+    def build(self, prompt: str, history: Sequence[Dict[str, str]] = (), summary: Optional[str] = None) -> BuiltPrompt:
+        """
+        Assembles the messages for *prompt*.
+
+        @param prompt The new user request (always sent verbatim).
+        @param history Earlier turns ("role"/"content" dicts), oldest first.
+        @param summary Existing summary of turns before *history* (e.g., UserMemoryStore.summary()).
+        @return The messages (system, summary, kept history, request) and what was removed.
+        """
+        head = [{"role": "system", "content": self.system_prompt}] if self.system_prompt else []
+        request = {"role": "user", "content": prompt}
+        budget = self.budget_tokens - sum(message_tokens(m) for m in head) - message_tokens(request)
+
+        turns = list(history)
+        unique = self._latest_indices(turns)
+
+        # Newest turns verbatim, as long as they fit
+        recent: List[int] = []
+        for index in reversed(unique[-self.recent_turns:] if self.recent_turns > 0 else []):
+            cost = message_tokens(turns[index])
+            if cost > budget:
+                break
+            budget -= cost
+            recent.append(index)
+        recent.reverse()
+        boundary = recent[0] if recent else len(turns)
+
+        # Older turns, in whole blocks aligned to the start of the history, are folded into
+        # the summary. History only grows at the end, so the blocks (and their cache keys) stay put.
+        summary_text = summary
+        folded = boundary // self.summary_block * self.summary_block if self.summarizer is not None else 0
+        for start in range(0, folded, self.summary_block):
+            summary_text = self._summarize(summary_text, turns[start:start + self.summary_block])
+        summary_message: List[Dict[str, str]] = []
+        if summary_text:
+            candidate = {"role": "system", "content": SUMMARY_PREFIX + summary_text}
+            if message_tokens(candidate) <= budget:
+                budget -= message_tokens(candidate)
+                summary_message = [candidate]
+        summarized = folded if summary_message else 0
+
+        # The rest of the older turns: verbatim while they fit, newest first
+        older = [index for index in unique if summarized <= index < boundary]
+        leftover: List[int] = []
+        for index in reversed(older):
+            cost = message_tokens(turns[index])
+            if cost > budget:
+                break
+            budget -= cost
+            leftover.append(index)
+        leftover.reverse()
+        kept = leftover + recent
+
+        messages = head + summary_message + [turns[index] for index in kept] + [request]
+        return BuiltPrompt(
+            messages=messages,
+            tokens=self.budget_tokens - budget,
+            history_messages=len(turns),
+            kept_messages=len(kept),
+            deduplicated=len(turns) - summarized - sum(1 for index in unique if index >= summarized),
+            summarized=summarized,
+            dropped=len(older) - len(leftover),
+            summary_tokens=message_tokens(summary_message[0]) if summary_message else 0,
+        )
+
+    @staticmethod
+    def deduplicate(turns: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """
+        Keeps only the latest occurrence of each user request, dropping the reply
+        that followed each earlier occurrence with it.
+
+        @param turns History, oldest first.
+        @return The remaining turns, oldest first.
+        """
+        return [turns[index] for index in PromptBuilder._latest_indices(turns)]
+
+    @staticmethod
+    def _latest_indices(turns: List[Dict[str, str]]) -> List[int]:
+        """@return Ascending indices of *turns* that deduplicate() keeps."""
+        seen = set()
+        kept: List[int] = []
+        for index in range(len(turns) - 1, -1, -1):
+            message = turns[index]
+            if message["role"] == "user":
+                key = _request_key(message["content"])
+                if key in seen:
+                    if kept and kept[-1] == index + 1 and turns[index + 1]["role"] == "assistant":
+                        kept.pop() # The reply to the repeated request
+                    continue
+                seen.add(key)
+            kept.append(index)
+        kept.reverse()
+        return kept
+
+    def _summarize(self, previous: Optional[str], turns: List[Dict[str, str]]) -> str:
+        """Summarises *turns* (onto *previous*), reusing the cached result for identical input."""
+        digest = hashlib.sha256()
+        digest.update((previous or "").encode("utf-8"))
+        for message in turns:
+            digest.update(f"\0{message['role']}\0{message['content']}".encode("utf-8"))
+        key = digest.hexdigest()
+        with self._lock:
+            if key in self._summaries:
+                self._summaries.move_to_end(key)
+                self.summary_cache_hits += 1
+                return self._summaries[key]
+        summary = self.summarizer(previous, turns).strip() # type: ignore[misc]  (checked by the caller)
+        with self._lock:
+            self.summary_calls += 1
+            self._summaries[key] = summary
+            while len(self._summaries) > self.summary_cache_size:
+                self._summaries.popitem(last=False)
+        return summary
+
+    def stats(self) -> Dict[str, Any]:
+        """@return Summariser calls and summary-cache hits, suitable for a JSON response."""
+        with self._lock:
+            return {"budget_tokens": self.budget_tokens, "recent_turns": self.recent_turns,
+                    "summary_calls": self.summary_calls, "summary_cache_hits": self.summary_cache_hits,
+                    "cached_summaries": len(self._summaries)}
@@ -8,6 +8,13 @@
 ##!     Doxygen can attach clear `@param` / `@return` tables.
 ##!   • Fixes the `openai_api_key` variable mismatch in the original code.
 ##!
+##! User memory lives in a SQLite database (user_memory.py). Each exchange is
+##! appended as it happens. Prompts are assembled by prompt_builder.py within a
+##! token budget: the system prompt, the rolling summary, the newest turns
+##! verbatim and the request, with repeated story requests collapsed. Several
+##! CLI sessions can share the file. An existing user_memory.json is imported
+##! on first run.
+##!
 ##! @author Calvin Vandor
 ##! @date   2025‑05‑08
 ##! @copyright MIT License
@@ -22,12 +29,14 @@
 ##! ---------------------------------------------------------------------------
 
 import os
-import json
 import openai
 import chromadb
 from dotenv import load_dotenv
 from langchain_openai import OpenAIEmbeddings
 
+from prompt_builder import PROMPT_TOKEN_BUDGET, PromptBuilder, build_summary_messages
+from user_memory import USER_MEMORY_TOKEN_BUDGET, UserMemoryStore
+
 load_dotenv()
 
 # --------------------------------------------------------------------------- #
@@ -37,9 +46,15 @@ load_dotenv()
 #: ChromaDB host (remote VM)
 CHROMA_HOST = "34.118.162.201"  # ➟ replace with your IP if different
 
-#: Local JSON file that stores per‑user memory of past prompts / answers
+#: Legacy JSON file of per‑user memory (imported into MEMORY_DB once)
 MEMORY_FILE = "user_memory.json"
 
+#: Local SQLite database that stores per‑user memory of past prompts / answers
+MEMORY_DB = os.getenv("USER_MEMORY_DB", "user_memory.sqlite3")
+
+#: Maximum tokens of the rolling summary of older turns
+MEMORY_SUMMARY_MAX_TOKENS = 200
+
 #: Number of hits to fetch from ChromaDB when searching
 N_RESULTS = 3
 
@@ -59,44 +74,57 @@ vector_store   = chroma_client.get_or_create_collection("stories")
 # Persistence helpers                                                        #
 # --------------------------------------------------------------------------- #
 
-def load_user_memory(username):
-    """Return a list of chat history dicts for *username* (or empty list)."""
-    if os.path.exists(MEMORY_FILE):
-        with open(MEMORY_FILE, "r", encoding="utf-8") as fh:
-            return json.load(fh).get(username, [])
-    return []
-
-def save_user_memory(username, memory):
-    """Persist *memory* (list of dicts) under *username* in :pydata:`MEMORY_FILE`."""
-    mem = {}
-    if os.path.exists(MEMORY_FILE):
-        with open(MEMORY_FILE, "r", encoding="utf-8") as fh:
-            mem = json.load(fh)
-    mem[username] = memory
-    with open(MEMORY_FILE, "w", encoding="utf-8") as fh:
-        json.dump(mem, fh, indent=4)
+def open_user_memory(path=MEMORY_DB):
+    """Open the user-memory store, importing :pydata:`MEMORY_FILE` into a new one."""
+    store = UserMemoryStore(path, budget_tokens=USER_MEMORY_TOKEN_BUDGET)
+    if os.path.exists(MEMORY_FILE) and not store.users():
+        print(f"Imported {store.import_json(MEMORY_FILE)} remembered messages from {MEMORY_FILE}.")
+    return store
+
+user_memory = open_user_memory()
+
+#: Assembles each request: system prompt, memory summary, recent turns, request
+prompt_builder = PromptBuilder(
+    system_prompt="You are a skilled storyteller that remembers users' preferences.",
+    budget_tokens=PROMPT_TOKEN_BUDGET,
+)
+
+def summarize_turns(previous_summary, turns):
+    """Fold *turns* (oldest first) into *previous_summary* with ChatGPT; return the new summary."""
+    response = openai.ChatCompletion.create(
+        model="gpt-4o-mini",
+        messages=build_summary_messages(previous_summary, turns),
+        max_tokens=MEMORY_SUMMARY_MAX_TOKENS,
+    )
+    return response.choices[0].message.content
+
+def save_user_memory(username, prompt, reply):
+    """Append one exchange for *username*; summarise older turns once over budget."""
+    user_memory.extend(username, [{"role": "user", "content": prompt}, {"role": "assistant", "content": reply}])
+    if user_memory.needs_compaction(username):
+        try:
+            user_memory.compact(username, summarize_turns)
+        except Exception as exc:  # Memory stays complete; the prompt builder still caps what is sent
+            print(f"Could not summarise older memory: {exc}")
 
 # --------------------------------------------------------------------------- #
 # OpenAI interaction                                                         #
 # --------------------------------------------------------------------------- #
 
-def ask_chatgpt(prompt, user_memory):
-    """Pass *prompt* plus *user_memory* to ChatGPT and append the exchange."""
-    messages = [{"role": "system", "content": "You are a skilled storyteller that remembers users' preferences."}]
-    messages.extend(user_memory)
-    messages.append({"role": "user", "content": prompt})
+def ask_chatgpt(prompt, username):
+    """Pass *prompt* plus *username*'s remembered context to ChatGPT and store the exchange."""
+    summary, history = user_memory.recall(username)
+    built = prompt_builder.build(prompt, history, summary)
 
     response = openai.ChatCompletion.create(
         model="gpt-4o-mini",
-        messages=messages,
+        messages=built.messages,
         max_tokens=300,
     )
 
-    # Store interaction
-    user_memory.append({"role": "user", "content": prompt})
-    user_memory.append({"role": "assistant", "content": response.choices[0].message.content})
-
-    return response.choices[0].message.content
+    reply = response.choices[0].message.content
+    save_user_memory(username, prompt, reply)
+    return reply
 
 # --------------------------------------------------------------------------- #
 # ChromaDB search                                                            #
@@ -135,8 +163,6 @@ def main():  # noqa: C901  # (yes, it's a long function; fine for CLI demo)
     username = input("Name: ").strip().lower() or "guest"
     print(f"Hello, {username.capitalize()}! I will remember your preferences.")
 
-    memory = load_user_memory(username)
-
     if input("Would you like to hear a story? (yes/no): ").lower() not in {"yes", "y"}:
         print("Maybe next time — goodbye!")
         return
@@ -154,21 +180,19 @@ def main():  # noqa: C901  # (yes, it's a long function; fine for CLI demo)
                 print("\n" + story["full_text"])
             else:
                 story_request = refine_story_request(story_request)
-                print(ask_chatgpt(f"Tell me a story about {story_request}", memory))
+                print(ask_chatgpt(f"Tell me a story about {story_request}", username))
         else:
             print("Creating a new story…")
-            print(ask_chatgpt(f"Tell me a story about {story_request}", memory))
+            print(ask_chatgpt(f"Tell me a story about {story_request}", username))
     else:
         print("\nNo matching story; I'll invent one.")
-        summary = ask_chatgpt(f"Summarise a story about {story_request} in 2 sentences.", memory)
+        summary = ask_chatgpt(f"Summarise a story about {story_request} in 2 sentences.", username)
         print("Idea: " + summary)
         if input("Tell this story? (yes/no): ").lower().startswith("y"):
-            print(ask_chatgpt(f"Tell me a full story about {story_request}", memory))
+            print(ask_chatgpt(f"Tell me a full story about {story_request}", username))
         else:
             story_request = refine_story_request(story_request)
-            print(ask_chatgpt(f"Tell me a story about {story_request}", memory))
-
-    save_user_memory(username, memory)
+            print(ask_chatgpt(f"Tell me a story about {story_request}", username))
 
 
 if __name__ == "__main__":
@@ -6,17 +6,26 @@
 ##! helper functions so Doxygen can produce clear parameter / return tables and
 ##! call graphs. Runtime behaviour and emoji markers remain unchanged.
 ##!
+##! OpenAI embeddings go through a memory‑mapped, content‑addressed cache
+##! (chromadb_rest_wrapper/embedding_cache.py), so re‑running the script only
+##! pays for chunks that have not been embedded before.
+##!
 ##! @author Calvin Vandor
 ##! @date   2025‑05‑08
 ##! @copyright MIT License
 ##!
 
 import os
-from typing import List
+import sys
+from typing import List, Optional
+from langchain_core.embeddings import Embeddings
 from langchain_openai import OpenAIEmbeddings
 from langchain_chroma import Chroma
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "chromadb_rest_wrapper"))
+from embedding_cache import EmbeddingCache  # noqa: E402
+
 # ---------------------------------------------------------------------------
 # Configuration constants
 # ---------------------------------------------------------------------------
@@ -30,6 +39,12 @@ PERSIST_DIR: str = "./chroma_db"
 #: Folder containing plain‑text stories
 STORIES_DIR: str = os.path.join(os.path.dirname(__file__), "stories")
 
+#: Memory‑mapped embedding cache file (empty string disables caching)
+EMBEDDING_CACHE_PATH: str = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(PERSIST_DIR, "openai_embedding_cache.bin"))
+
+#: OpenAI embedding model, also the cache namespace
+OPENAI_EMBEDDING_MODEL: str = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-ada-002")
+
 # ---------------------------------------------------------------------------
 # Initialisation helpers
 # ---------------------------------------------------------------------------
@@ -42,15 +57,49 @@ def get_openai_key() -> str:
     return key
 
 
+class CachedEmbeddings(Embeddings):
+    """LangChain embeddings adapter that consults an :class:`EmbeddingCache`
+    before calling the wrapped model, so only unseen texts are sent to OpenAI.
+    Queries are embedded with the model's own ``embed_query`` and cached apart
+    from documents, since a model may embed the two differently.
+    """
+
+    def __init__(self, inner: Embeddings, cache: EmbeddingCache, query_cache: Optional[EmbeddingCache] = None):
+        """
+        @param inner:       The embeddings model used on cache misses.
+        @param cache:       The embedding cache for documents.
+        @param query_cache: The embedding cache for queries, under its own namespace
+                            (``None`` embeds every query without caching).
+        """
+        self.inner = inner
+        self.cache = cache
+        self.query_cache = query_cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed *texts*, reusing cached vectors."""
+        return self.cache.embed(texts, self.inner.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single query string with the model's query embedding, reusing a cached vector."""
+        if self.query_cache is None:
+            return self.inner.embed_query(text)
+        return self.query_cache.embed([text], lambda texts: [self.inner.embed_query(t) for t in texts])[0]
+
+
 def init_vector_store(api_key: str) -> Chroma:
     """Create (or open) a persistent Chroma vector store.
 
     @param api_key: Valid OpenAI API key for embeddings.
     @return:        Ready‑to‑use :class:`Chroma` instance.
     """
+    embeddings: Embeddings = OpenAIEmbeddings(openai_api_key=api_key, model=OPENAI_EMBEDDING_MODEL)
+    if EMBEDDING_CACHE_PATH:
+        os.makedirs(os.path.dirname(EMBEDDING_CACHE_PATH) or ".", exist_ok=True)
+        embeddings = CachedEmbeddings(embeddings, EmbeddingCache(EMBEDDING_CACHE_PATH, OPENAI_EMBEDDING_MODEL),
+                                      EmbeddingCache(EMBEDDING_CACHE_PATH, f"{OPENAI_EMBEDDING_MODEL}:query"))
     return Chroma(
         collection_name=COLLECTION_NAME,
-        embedding_function=OpenAIEmbeddings(openai_api_key=api_key),
+        embedding_function=embeddings,
         persist_directory=PERSIST_DIR,
     )
 
@@ -0,0 +1,223 @@
+##! @file story_chunker.py
+##! @brief Offset-based, sentence-aware story chunker used by upload_stories.py.
+##! @details
+##! SentenceChunker replaces LangChain's RecursiveCharacterTextSplitter for
+##! ingestion. The splitter re-splits its input on every separator and builds new
+##! strings at each level (and a Document per chunk with create_documents()).
+##! This chunker instead walks the text once and works on offsets:
+##! - a chunk starts at `start` and may end anywhere up to `start + chunk_size`;
+##!   its end is the last paragraph break (blank line) in the second half of that
+##!   window, otherwise the last sentence end, line break or space there, and
+##!   only as a last resort a hard cut at `chunk_size`;
+##! - the next chunk starts at the first sentence (or, failing that, word)
+##!   start within the last `chunk_overlap` characters of the previous chunk, so
+##!   consecutive chunks overlap by whole sentences where possible;
+##! - boundaries are found with str.rfind() and compiled regular expressions
+##!   bounded by `pos`/`endpos`, so the only copy made is the chunk text itself.
+##!
+##! iter_chunks() consumes a stream of segments (PDF pages, EPUB documents) and
+##! only keeps the text of the current window in memory. Its output is the
+##! same as chunking the segments joined with newlines in one piece.
+##! iter_records() yields `(id, text, metadata)` tuples ready for upload batches.
+##! One chunker can be reused for every story (and shared between threads: it holds no per-story state).
+##!
+##! Chunk IDs are derived from content, not position: `{story_id}:{digest}`, where
+##! story_id() hashes the story's title and author and the digest hashes the chunk
+##! text. Editing a story therefore only changes the IDs of the chunks whose text
+##! changed (chunk boundaries re-synchronise at the next paragraph or sentence
+##! break), instead of shifting every later `{title}_{i}` ID, and two books with
+##! the same title by different authors no longer overwrite each other. Each
+##! chunk's metadata records the story_id and the ID of the chunk before it
+##! (`prev_chunk`), which is how readers find adjacent chunks.
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import hashlib
+import re
+from typing import Any, Dict, Iterable, Iterator, Tuple
+
+__all__ = ["SentenceChunker", "ChunkRecord", "chunk_id", "story_id"]
+
+## @var ChunkRecord
+# (chunk id, chunk text, metadata) as queued for upload.
+ChunkRecord = Tuple[str, str, Dict[str, Any]]
+
+## @var _LAST_SENTENCE_END
+# Everything up to the last sentence end (terminal punctuation and any closing quotes/brackets, followed
+# by whitespace); the greedy prefix makes the engine scan backwards from the end of the window. (Internal constant)
+_LAST_SENTENCE_END = re.compile(r".*[.!?…][\"'”’)\]]*(?=\s)", re.DOTALL)
+
+## @var _SENTENCE_START
+# Whitespace after a sentence end or a line break; the match ends where the next sentence starts. (Internal constant)
+_SENTENCE_START = re.compile(r"[.!?…\n][\"'”’)\]]*\s+(?=\S)")
+
+## @var _LOOKBEHIND_CHARS
+# How far before the overlap window a sentence-start match may begin (punctuation and quotes). (Internal constant)
+_LOOKBEHIND_CHARS: int = 8
+
+## @var _WHITESPACE
+# Runs of whitespace, collapsed when normalising titles and authors. (Internal constant)
+_WHITESPACE = re.compile(r"\s+")
+
+
+def story_id(title: str, author: str) -> str:
+    """
+    Derives a story's stable identifier from its title and author (case and spacing insensitive).
+
+    @param title The story title.
+    @param author The story author ("Unknown" if not known).
+    @return A 16-character hex identifier.
+    """
+    key = "\x1f".join(_WHITESPACE.sub(" ", value).strip().casefold() for value in (title, author))
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def chunk_id(story: str, text: str, occurrence: int = 0) -> str:
+    """
+    Derives a chunk's ID from its story and its text.
+
+    @param story The story_id() of the chunk's story.
+    @param text The chunk text.
+    @param occurrence How many earlier chunks of the story had the same text (repeated refrains, separators).
+    @return `{story}:{digest}`, with `.{occurrence}` appended for repeats.
+    """
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+    return f"{story}:{digest}.{occurrence}" if occurrence else f"{story}:{digest}"
+
+
+class SentenceChunker:
+    """
+    Splits story text into overlapping chunks of at most `chunk_size` characters,
+    cut at paragraph, sentence or word boundaries.
+    """
+
+    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200):
+        """
+        @param chunk_size Maximum chunk length in characters.
+        @param chunk_overlap Maximum number of characters a chunk repeats from the previous one.
+        @raises ValueError If the overlap is not smaller than half the chunk size.
+        """
+        if chunk_size <= 0 or not 0 <= chunk_overlap < chunk_size // 2:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) must be >= 0 and less than half of chunk_size ({chunk_size}).")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self._min_fill = chunk_size // 2
+        self._flush_chars = chunk_size * 16
+
+    # --- Boundaries ---
+
+    def _chunk_end(self, text: str, start: int, limit: int) -> int:
+        """Best end offset for a chunk starting at *start* whose window ends at *limit*. (Internal)"""
+        low = start + self._min_fill
+        paragraph = text.rfind("\n\n", low, limit)
+        if paragraph != -1:
+            return paragraph
+        match = _LAST_SENTENCE_END.match(text, low, limit)
+        if match:
+            return match.end()
+        for separator in ("\n", " "):
+            position = text.rfind(separator, low, limit)
+            if position != -1:
+                return position
+        return limit
+
+    def _next_start(self, text: str, start: int, end: int) -> int:
+        """Start of the chunk following text[start:end], within its last chunk_overlap characters. (Internal)"""
+        low = max(start + 1, end - self.chunk_overlap)
+        if low >= end:
+            return end
+        position = max(start, low - _LOOKBEHIND_CHARS)
+        while True:
+            match = _SENTENCE_START.search(text, position, end)
+            if match is None:
+                break
+            if match.end() >= low:
+                return match.end()
+            position = match.end()
+        space = text.find(" ", low, end)
+        return space + 1 if space != -1 else end
+
+    def spans(self, text: str, final: bool = True) -> Iterator[Tuple[int, int, int]]:
+        """
+        Computes chunk boundaries without copying text.
+
+        @param text The text to chunk.
+        @param final False if more text will follow: spans whose window reaches the end
+               of *text* are then held back, since later text could change them.
+        @return A generator of (start, end, next_start) offsets; the chunk is text[start:end]
+                (whitespace-trimmed) and the following chunk begins at next_start.
+        """
+        length = len(text)
+        while length and text[length - 1].isspace():
+            length -= 1
+        start = 0
+        while start < length:
+            while start < length and text[start].isspace():
+                start += 1
+            if start >= length:
+                return
+            limit = start + self.chunk_size
+            if limit >= length:
+                if final:
+                    yield start, length, length
+                return
+            end = self._chunk_end(text, start, limit)
+            next_start = self._next_start(text, start, end)
+            while end > start and text[end - 1].isspace():
+                end -= 1
+            if end > start:
+                yield start, end, next_start
+            start = next_start
+
+    # --- Chunks ---
+
+    def chunks(self, text: str) -> Iterator[str]:
+        """@return A generator of the chunk texts of *text*."""
+        for start, end, _ in self.spans(text):
+            yield text[start:end]
+
+    def iter_chunks(self, segments: Iterable[str]) -> Iterator[str]:
+        """
+        Chunks a stream of text segments (pages, chapters) joined by newlines.
+        Only the unchunked tail of the text (about 16 chunks' worth) is buffered.
+
+        @param segments The segments, in reading order.
+        @return A generator of chunk texts.
+        """
+        buffer = ""
+        for segment in segments:
+            buffer = f"{buffer}\n{segment}" if buffer else segment
+            if len(buffer) < self._flush_chars:
+                continue
+            consumed = 0
+            for start, end, next_start in self.spans(buffer, final=False):
+                yield buffer[start:end]
+                consumed = next_start
+            buffer = buffer[consumed:]
+        if buffer:
+            yield from self.chunks(buffer)
+
+    def iter_records(self, segments: Iterable[str], story: str, metadata: Dict[str, Any]) -> Iterator[ChunkRecord]:
+        """
+        Chunks a story into upload records with content-derived IDs (see chunk_id()).
+
+        @param segments The story text as a stream of segments.
+        @param story The story_id() of the story.
+        @param metadata The story metadata; each record gets a copy with "story_id" and
+               "prev_chunk" (the previous chunk's ID, "" for the first chunk) added.
+        @return A generator of (id, text, metadata) tuples.
+        """
+        seen: Dict[str, int] = {}
+        previous = ""
+        for text in self.iter_chunks(segments):
+            current = chunk_id(story, text)
+            occurrence = seen.get(current, 0)
+            seen[current] = occurrence + 1
+            if occurrence:
+                current = chunk_id(story, text, occurrence)
+            yield current, text, {**metadata, "story_id": story, "prev_chunk": previous}
+            previous = current
@@ -3,28 +3,83 @@
 ##! @details
 ##! This script scans a specified directory for story subfolders containing EPUB or PDF files.
 ##! It extracts text content and metadata (preferring EPUB internal metadata, then
-##! falling back to filename-derived metadata if EPUB title is poor).
+##! falling back to filename-derived metadata if EPUB title is poor). EPUB metadata
+##! is read from the OPF package file only (see epub_reader.py), so duplicate
+##! detection never parses chapter HTML.
 ##! The extracted text is split into chunks and uploaded to a ChromaDB collection in batches.
-##! The script avoids uploading duplicate stories based on titles already present in the database.
+##! The script avoids uploading duplicate stories: a story is identified by its
+##! title and author, so same-title books by different authors are both kept.
+##! A local SQLite manifest (see ingest_manifest.py) records the size, mtime and
+##! content hash of every uploaded file, so re-runs skip unchanged files without
+##! contacting ChromaDB and only modified stories are re-chunked.
+##! Chunk IDs are derived from the story and the chunk text (see story_chunker.py),
+##! and the manifest keeps each file's chunk IDs with a fingerprint of their
+##! metadata. A modified story is diffed against that set: only new or changed
+##! chunks are upserted and the IDs it no longer produces are deleted, so a light
+##! edit to a book costs a handful of writes rather than a re-upload of every chunk.
 ##! Configuration for ChromaDB connection, story directory, and batch size can be
 ##! set via environment variables.
 ##!
+##! Ingestion runs as a staged pipeline: a process pool extracts and chunks
+##! stories in parallel (pdfplumber / BeautifulSoup parsing is CPU-bound), and
+##! the resulting batches are fed through a bounded queue to a set of uploader
+##! threads calling `vector_store.upsert`, so several requests are in flight at once.
+##! Uploaders split each batch into requests by payload bytes; a shared BatchSizer
+##! grows the request size while the server answers within UPLOAD_TARGET_SECONDS
+##! and shrinks it when it slows down or fails. Failed requests are retried with
+##! exponential backoff, and every acknowledged request is checkpointed in the
+##! manifest, so a story interrupted mid-upload (network outage, crash, Ctrl-C)
+##! resumes with its unacknowledged chunks on the next run.
+##! Per-stage throughput, request sizes and retry counts are printed at the end,
+##! and main_ingestion_loop() returns them as a report (see benchmarks/bench_ingest.py).
+##! Stories are streamed page by page (PDF) or document by document (EPUB): text is
+##! chunked incrementally and each batch is queued as soon as it fills, so peak
+##! memory is bounded by the batch and queue sizes rather than by the book size.
+##! Chunking is done by one shared SentenceChunker (see story_chunker.py), which
+##! cuts at paragraph and sentence boundaries on offsets and yields
+##! `(id, text, metadata)` records straight into the upload batches.
+##! Chunks are embedded locally through a memory-mapped embedding cache (see
+##! chromadb_rest_wrapper/embedding_cache.py) and upserted with precomputed
+##! `embeddings`, so unchanged chunks of a modified story are never re-embedded.
+##! Every uploaded batch is also written to a local BM25 keyword index (see
+##! chromadb_rest_wrapper/keyword_index.py) kept next to the manifest, which
+##! the REST wrapper uses for hybrid keyword + vector search.
+##!
+##! ### Usage
+##! ```bash
+##! python upload_stories.py --workers 8 --uploaders 4
+##! ```
+##!
 ##! @author Calvin Vandor
 ##! @date 2025-05-10
-##! @version 1.2
+##! @version 1.5
 ##! @copyright MIT License
 
 from __future__ import annotations # For postponed evaluation of type hints
 
+import argparse
+import hashlib
+import json
+import multiprocessing
 import os
+import random
 import re
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+
 import chromadb
 import pdfplumber
-import ebooklib
-from ebooklib import epub
-from bs4 import BeautifulSoup
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from typing import Dict, List, Tuple, Optional, Set
+from epub_reader import EpubReader
+from ingest_manifest import IngestManifest
+from story_chunker import ChunkRecord, SentenceChunker, story_id
+
+# The embedding cache lives next to the REST wrapper (its Docker build context) and is shared from there.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "chromadb_rest_wrapper"))
+from embedding_cache import EmbeddingCache # noqa: E402  (import after sys.path setup)
+from keyword_index import KeywordIndex # noqa: E402  (import after sys.path setup)
+from typing import Any, Callable, Collection, Dict, Iterable, Iterator, List, Tuple, Optional, Set
 
 # --- Configuration (from Environment Variables with Defaults) ---
 
@@ -50,106 +105,307 @@ DEFAULT_STORIES_DIR: str = os.path.join(os.path.dirname(os.path.abspath(__file__
 STORIES_DIR: str = os.getenv("STORIES_DIR", DEFAULT_STORIES_DIR)
 
 ## @var BATCH_SIZE
-# Number of document chunks to upload to ChromaDB in a single batch.
-BATCH_SIZE: int = int(os.getenv("BATCH_SIZE", "100"))
+# Maximum number of chunks per batch handed from the extraction workers to the uploaders,
+# which send it to ChromaDB in one or more requests of adaptive size.
+BATCH_SIZE: int = int(os.getenv("BATCH_SIZE", "500"))
+
+## @var UPLOAD_BATCH_BYTES
+# Initial payload size of one upsert request, in bytes (text, metadata and embeddings).
+UPLOAD_BATCH_BYTES: int = int(os.getenv("UPLOAD_BATCH_BYTES", str(1 << 20)))
+
+## @var UPLOAD_MIN_BATCH_BYTES
+# Smallest payload size the uploaders shrink requests to.
+UPLOAD_MIN_BATCH_BYTES: int = int(os.getenv("UPLOAD_MIN_BATCH_BYTES", str(32 << 10)))
+
+## @var UPLOAD_MAX_BATCH_BYTES
+# Largest payload size the uploaders grow requests to.
+UPLOAD_MAX_BATCH_BYTES: int = int(os.getenv("UPLOAD_MAX_BATCH_BYTES", str(8 << 20)))
+
+## @var UPLOAD_TARGET_SECONDS
+# Request latency the payload size is tuned towards.
+UPLOAD_TARGET_SECONDS: float = float(os.getenv("UPLOAD_TARGET_SECONDS", "1.0"))
+
+## @var UPLOAD_RETRIES
+# Retries of a failed upsert request before its batch is given up (and left to the next run).
+UPLOAD_RETRIES: int = int(os.getenv("UPLOAD_RETRIES", "5"))
+
+## @var UPLOAD_RETRY_BACKOFF
+# Delay before the first retry, in seconds; doubled for every further retry (with jitter).
+UPLOAD_RETRY_BACKOFF: float = float(os.getenv("UPLOAD_RETRY_BACKOFF", "0.5"))
+
+## @var CHUNK_SIZE
+# Maximum chunk length in characters.
+CHUNK_SIZE: int = int(os.getenv("CHUNK_SIZE", "1000"))
+
+## @var CHUNK_OVERLAP
+# Maximum overlap between consecutive chunks, in characters. Must match the REST wrapper's CHUNK_OVERLAP_CHARS.
+CHUNK_OVERLAP: int = int(os.getenv("CHUNK_OVERLAP", "200"))
+
+## @var INGEST_WORKERS
+# Default number of extraction/chunking worker processes.
+INGEST_WORKERS: int = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1)))
+
+## @var UPLOAD_WORKERS
+# Default number of concurrent uploader threads draining the batch queue.
+UPLOAD_WORKERS: int = int(os.getenv("UPLOAD_WORKERS", "4"))
+
+## @var UPLOAD_QUEUE_SIZE
+# Maximum number of chunk batches buffered between the extraction and upload stages.
+UPLOAD_QUEUE_SIZE: int = int(os.getenv("UPLOAD_QUEUE_SIZE", "32"))
+
+## @var MANIFEST_PATH
+# SQLite manifest recording which story files have already been uploaded.
+MANIFEST_PATH: str = os.getenv("INGEST_MANIFEST", os.path.join(os.path.dirname(os.path.abspath(__file__)), "ingest_manifest.sqlite3"))
+
+## @var EMBEDDING_CACHE_PATH
+# Memory-mapped embedding cache file. An empty value disables the cache (ChromaDB embeds server-side).
+EMBEDDING_CACHE_PATH: str = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "embedding_cache.bin"))
+
+## @var KEYWORD_INDEX_PATH
+# SQLite BM25 index of the uploaded chunk text, for the REST wrapper's hybrid search. An empty value disables it.
+KEYWORD_INDEX_PATH: str = os.getenv("KEYWORD_INDEX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "keyword_index.sqlite3"))
+
+## @var EMBEDDING_MODEL_ID
+# Name of the embedding model, used as the cache namespace. Must match the REST wrapper's.
+EMBEDDING_MODEL_ID: str = os.getenv("EMBEDDING_MODEL_ID", "all-MiniLM-L6-v2")
+
+## @var EMBEDDING_JSON_BYTES
+# Approximate bytes one embedding dimension takes in an upsert request (a JSON float).
+EMBEDDING_JSON_BYTES: int = 20
+
+## @var GENERATION_METADATA_KEY
+# Collection metadata key for the ingest generation stamp. Bumped after every run that
+# changes the collection; the REST wrapper watches it to invalidate its query cache.
+GENERATION_METADATA_KEY: str = "ingest_generation"
+
+## @var story_chunker
+# Chunker shared by every story (it keeps no per-story state).
+story_chunker: SentenceChunker = SentenceChunker(CHUNK_SIZE, CHUNK_OVERLAP)
+
+## @var vector_store
+# The ChromaDB collection stories are uploaded to. Set by init_vector_store().
+vector_store = None
+
+## @var embedding_cache
+# Cache of chunk embeddings. Set by init_embedding_cache(); None when disabled.
+embedding_cache: Optional[EmbeddingCache] = None
+
+## @var embedding_function
+# ChromaDB embedding function used for chunks missing from the cache.
+embedding_function = None
+
+## @var keyword_index
+# Local BM25 index updated with every uploaded batch. Set by init_keyword_index(); None when disabled.
+keyword_index: Optional[KeywordIndex] = None
+
+## @var existing_titles
+# Lower-cased titles already present in the collection, mapped to their chunk counts.
+# Only populated by load_existing_titles() when bootstrapping an empty manifest.
+existing_titles: Dict[str, int] = {}
+
 
 # --- ChromaDB Client Initialization ---
-print(f"🔗 Connecting to ChromaDB at {CHROMA_HOST}:{CHROMA_PORT} ...")
-try:
-    chroma_client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
-    vector_store = chroma_client.get_or_create_collection(COLLECTION_NAME)
-    print(f"✅ Successfully connected and using collection '{COLLECTION_NAME}'.")
-except Exception as e:
-    print(f"❌ CRITICAL: Could not connect to ChromaDB or get/create collection: {e}")
-    print("   Please ensure ChromaDB is running and accessible, and configuration is correct.")
-    exit(1) # Exit if DB connection fails at startup
-
-# --- Load Existing Story Titles to Prevent Duplicates ---
-print("ℹ️ Loading existing story titles from ChromaDB to prevent duplicates...")
-try:
-    existing_docs_data = vector_store.get() # Fetch all docs to get metadatas
-    existing_titles: Set[str] = {
-        metadata.get("title", "").strip().lower()
-        for metadata in existing_docs_data.get("metadatas", [])
-        if metadata and metadata.get("title") # Ensure metadata and title exist
-    }
-    print(f"Loaded {len(existing_titles)} existing titles.")
-except Exception as e:
-    print(f"⚠️ Warning: Could not fetch existing titles from ChromaDB: {e}. Duplicate checking might be affected.")
-    existing_titles: Set[str] = set()
+
+def init_vector_store(host: str = CHROMA_HOST, port: int = CHROMA_PORT, name: str = COLLECTION_NAME):
+    """
+    Connects to ChromaDB and gets (or creates) the story collection.
+    Done lazily rather than at import time so that extraction worker processes
+    can import this module without opening their own database connections.
+
+    @param host The hostname or IP address of the ChromaDB server.
+    @param port The port number of the ChromaDB server.
+    @param name The name of the collection to use.
+    @return The ChromaDB collection object. Exits the process if the connection fails.
+    """
+    global vector_store
+    print(f"🔗 Connecting to ChromaDB at {host}:{port} ...")
+    try:
+        chroma_client = chromadb.HttpClient(host=host, port=port)
+        vector_store = chroma_client.get_or_create_collection(name)
+        print(f"✅ Successfully connected and using collection '{name}'.")
+    except Exception as e:
+        print(f"❌ CRITICAL: Could not connect to ChromaDB or get/create collection: {e}")
+        print("   Please ensure ChromaDB is running and accessible, and configuration is correct.")
+        exit(1) # Exit if DB connection fails at startup
+    return vector_store
+
+def init_embedding_cache(path: str = EMBEDDING_CACHE_PATH, model_id: str = EMBEDDING_MODEL_ID) -> Optional[EmbeddingCache]:
+    """
+    Opens the embedding cache and loads ChromaDB's default embedding function
+    (all-MiniLM-L6-v2), which the collection also uses for query_texts.
+
+    @param path Path of the cache file; an empty string disables the cache.
+    @param model_id Cache namespace identifying the embedding model.
+    @return The EmbeddingCache, or None if disabled or unavailable.
+    """
+    global embedding_cache, embedding_function
+    if not path:
+        return None
+    try:
+        from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+        embedding_function = DefaultEmbeddingFunction()
+        embedding_cache = EmbeddingCache(path, model_id)
+        print(f"🧠 Embedding cache at '{path}' holds {embedding_cache.stats()['entries']} vectors.")
+    except Exception as e:
+        print(f"⚠️ Warning: Could not open embedding cache at '{path}': {e}. ChromaDB will embed all chunks.")
+        embedding_cache = None
+    return embedding_cache
+
+def init_keyword_index(path: str = KEYWORD_INDEX_PATH) -> Optional[KeywordIndex]:
+    """
+    Opens the keyword index. If it is empty while the collection is not (the
+    collection predates the index), it is first filled from the collection.
+
+    @param path Path of the SQLite index; an empty string disables it.
+    @return The KeywordIndex, or None if disabled or unavailable.
+    """
+    global keyword_index
+    if not path:
+        return None
+    try:
+        keyword_index = KeywordIndex(path)
+        if len(keyword_index) == 0 and vector_store.count() > 0:
+            print("ℹ️ Keyword index is empty; indexing the chunks already in ChromaDB...")
+            print(f"🔎 Keyword index synced: {keyword_index.sync(vector_store)}")
+        print(f"🔎 Keyword index at '{path}' holds {len(keyword_index)} chunks.")
+    except Exception as e:
+        print(f"⚠️ Warning: Could not open keyword index at '{path}': {e}. Hybrid search will not see this run's chunks.")
+        keyword_index = None
+    return keyword_index
+
+def load_existing_titles() -> Dict[str, int]:
+    """
+    Loads existing story titles (and their chunk counts) from ChromaDB to prevent duplicates.
+    This fetches every metadata in the collection, so it is only used to seed an
+    empty manifest for a collection that was populated before the manifest existed.
+
+    @return Lower-cased titles mapped to chunk counts (also stored in the module-level existing_titles).
+    """
+    global existing_titles
+    print("ℹ️ Loading existing story titles from ChromaDB to prevent duplicates...")
+    try:
+        existing_docs_data = vector_store.get(include=["metadatas"]) # Fetch all metadatas
+        existing_titles = {}
+        for metadata in existing_docs_data.get("metadatas") or []:
+            if metadata and metadata.get("title"): # Ensure metadata and title exist
+                title_key = metadata["title"].strip().lower()
+                existing_titles[title_key] = existing_titles.get(title_key, 0) + 1
+        print(f"Loaded {len(existing_titles)} existing titles.")
+    except Exception as e:
+        print(f"⚠️ Warning: Could not fetch existing titles from ChromaDB: {e}. Duplicate checking might be affected.")
+        existing_titles = {}
+    return existing_titles
+
+
+def bump_ingest_generation() -> None:
+    """
+    Writes a new ingest generation stamp into the collection metadata so that
+    readers caching query results (the REST wrapper) know to invalidate them.
+    Other metadata keys are preserved; "hnsw:" keys are left out because
+    ChromaDB rejects attempts to re-set them.
+    """
+    metadata = {k: v for k, v in (vector_store.metadata or {}).items() if not k.startswith("hnsw:")}
+    metadata[GENERATION_METADATA_KEY] = str(time.time_ns())
+    try:
+        vector_store.modify(metadata=metadata)
+        print(f"♻️ Bumped ingest generation to {metadata[GENERATION_METADATA_KEY]}.")
+    except Exception as e:
+        print(f"⚠️ Warning: Could not update the ingest generation stamp: {e}. Query caches may serve stale results until they expire.")
 
 
 # --- Utility Functions ---
 
-def extract_text_from_pdf(filepath: str) -> str:
+def iter_pdf_pages(filepath: str) -> Iterator[str]:
     """
-    Extracts raw text content from all pages of a PDF file.
+    Yields the text of a PDF one page at a time. Each page's parsed objects are
+    released after extraction so memory does not grow with the page count.
+    Extraction stops (after printing the error) if the PDF cannot be read.
 
     @param filepath The path to the PDF file.
-    @return A string containing the concatenated text from the PDF, or an empty string if extraction fails.
+    @return A generator of non-empty page texts.
     """
     print(f"📄 Extracting text from PDF: {os.path.basename(filepath)}")
-    text_pages: List[str] = []
     try:
         with pdfplumber.open(filepath) as pdf:
             for page in pdf.pages:
                 page_text = page.extract_text()
-                if page_text: # Only append if text was actually extracted
-                    text_pages.append(page_text)
-        return "\n".join(text_pages).strip()
+                page.close() # Drop pdfplumber's cached layout objects for this page
+                if page_text: # Only yield if text was actually extracted
+                    yield page_text
     except Exception as e:
         print(f"❌ Error extracting text from PDF '{filepath}': {e}")
-        return ""
 
-def extract_text_from_epub(filepath: str) -> str:
+def iter_epub_documents(filepath: str, reader: Optional[EpubReader] = None) -> Iterator[str]:
     """
-    Extracts concatenated plaintext content from all XHTML items in an EPUB file.
+    Yields the plaintext of each XHTML document in an EPUB file, one at a time, in reading order.
+    Extraction stops (after printing the error) if the EPUB cannot be read.
 
     @param filepath The path to the EPUB file.
-    @return A string containing the concatenated text from the EPUB, or an empty string if extraction fails.
+    @param reader An already-open EpubReader for this file, to avoid reopening it.
+                  It is left open; a reader opened here is closed when iteration ends.
+    @return A generator of document texts.
     """
     print(f"📚 Extracting text from EPUB: {os.path.basename(filepath)}")
-    texts: List[str] = []
     try:
-        book = epub.read_epub(filepath)
-        for item in book.get_items():
-            if item.get_type() == ebooklib.ITEM_DOCUMENT:
-                soup = BeautifulSoup(item.content, "html.parser")
-                texts.append(soup.get_text())
-        return "\n".join(texts).strip()
+        if reader is not None:
+            yield from reader.iter_documents()
+        else:
+            with EpubReader(filepath) as own_reader:
+                yield from own_reader.iter_documents()
     except Exception as e:
         print(f"❌ Error extracting text from EPUB '{filepath}': {e}")
-        return ""
 
-def extract_metadata_from_epub(filepath: str) -> Dict[str, str]:
+def extract_text_from_pdf(filepath: str) -> str:
+    """
+    Extracts raw text content from all pages of a PDF file.
+
+    @param filepath The path to the PDF file.
+    @return A string containing the concatenated text from the PDF, or an empty string if extraction fails.
     """
-    Extracts metadata (title, author, year, genre, subgenre) from an EPUB file.
+    return "\n".join(iter_pdf_pages(filepath)).strip()
+
+def extract_text_from_epub(filepath: str) -> str:
+    """
+    Extracts concatenated plaintext content from all XHTML items in an EPUB file.
+
+    @param filepath The path to the EPUB file.
+    @return A string containing the concatenated text from the EPUB, or an empty string if extraction fails.
+    """
+    return "\n".join(iter_epub_documents(filepath)).strip()
+
+def extract_metadata_from_epub(filepath: str, reader: Optional[EpubReader] = None) -> Dict[str, str]:
+    """
+    Extracts metadata (title, author, year, genre, subgenre) from an EPUB file's OPF package.
     Defaults to "Unknown" if a field is not found.
 
     @param filepath The path to the EPUB file.
+    @param reader An already-open EpubReader for this file, to avoid reopening it.
     @return A dictionary containing the extracted metadata.
     """
     print(f"📚 Extracting metadata from EPUB: {os.path.basename(filepath)}")
     metadata = {k: "Unknown" for k in ("title", "author", "year", "genre", "subgenre")}
+    own_reader = None
     try:
-        book = epub.read_epub(filepath)
-        if title_meta := book.get_metadata("DC", "title"):
-            metadata["title"] = title_meta[0][0].strip()
-        if creator_meta := book.get_metadata("DC", "creator"):
-            metadata["author"] = creator_meta[0][0].strip()
-        if date_meta := book.get_metadata("DC", "date"):
+        if reader is None:
+            reader = own_reader = EpubReader(filepath)
+        if title_meta := reader.dc("title"):
+            metadata["title"] = title_meta[0]
+        if creator_meta := reader.dc("creator"):
+            metadata["author"] = creator_meta[0]
+        if date_meta := reader.dc("date"):
             # EPUB date can be YYYY-MM-DD or just YYYY. Extract year part.
-            year_match = re.search(r'\d{4}', date_meta[0][0])
+            year_match = re.search(r'\d{4}', date_meta[0])
             if year_match:
                 metadata["year"] = year_match.group(0)
-        if subject_meta := book.get_metadata("DC", "subject"):
-            subjects = [s[0].strip() for s in subject_meta if s and s[0].strip()]
-            if subjects:
-                metadata["genre"] = subjects[0]
+        if subjects := reader.dc("subject"):
+            metadata["genre"] = subjects[0]
             if len(subjects) > 1:
                 metadata["subgenre"] = subjects[1]
     except Exception as e:
         print(f"⚠️ Warning: Could not extract full metadata from EPUB '{filepath}': {e}. Some fields might be 'Unknown'.")
+    finally:
+        if own_reader is not None:
+            own_reader.close()
     return metadata
 
 def extract_metadata_from_filename(filepath: str) -> Dict[str, str]:
@@ -182,7 +438,7 @@ def extract_metadata_from_filename(filepath: str) -> Dict[str, str]:
             "subgenre": "Unknown"
         }
 
-def get_story_metadata(filepath: str, file_format: Optional[str]) -> Dict[str, str]:
+def get_story_metadata(filepath: str, file_format: Optional[str], reader: Optional[EpubReader] = None) -> Dict[str, str]:
     """
     Extracts metadata for a story, preferring EPUB internal metadata.
     If EPUB metadata provides an "Unknown" or empty title, it attempts to use
@@ -191,10 +447,11 @@ def get_story_metadata(filepath: str, file_format: Optional[str]) -> Dict[str, s
 
     @param filepath The full path to the story file.
     @param file_format The format of the file (e.g., "EPUB3", "PDF").
+    @param reader An already-open EpubReader for EPUB files, shared with text extraction.
     @return A dictionary containing the story's metadata.
     """
     if file_format == "EPUB3":
-        epub_metadata = extract_metadata_from_epub(filepath)
+        epub_metadata = extract_metadata_from_epub(filepath, reader)
         epub_title = epub_metadata.get("title", "Unknown").strip()
 
         if not epub_title or epub_title.lower() == "unknown":
@@ -232,72 +489,539 @@ def choose_preferred_format(root_dir: str, file_group: List[str]) -> Tuple[Optio
     return None, None
 
 
-def split_story_into_chunks(story_text: str, metadata: Dict[str, str], chunk_size: int = 1000, chunk_overlap: int = 200):
+def split_story_into_chunks(story_text: str, metadata: Dict[str, str]) -> List[ChunkRecord]:
     """
-    Splits a long story text into smaller chunks using RecursiveCharacterTextSplitter.
+    Splits a whole story text into upload records with the shared story_chunker.
 
     @param story_text The full text of the story.
-    @param metadata The metadata dictionary to associate with each chunk.
-    @param chunk_size The maximum size of each chunk.
-    @param chunk_overlap The overlap between consecutive chunks.
-    @return A list of Langchain Document objects (chunks).
+    @param metadata The story metadata; each chunk gets a copy with its story_id and prev_chunk link.
+    @return A list of (id, text, metadata) tuples.
+    """
+    return list(story_chunker.iter_records([story_text], story_id(metadata["title"], metadata["author"]), metadata))
+
+
+def chunk_fingerprint(metadata: Dict[str, Any]) -> str:
+    """
+    Fingerprints a chunk's metadata. The chunk ID already covers its text, so an
+    unchanged ID and fingerprint mean the stored chunk can be kept as it is.
+
+    @param metadata The chunk's metadata.
+    @return A 16-character hex digest.
+    """
+    encoded = json.dumps(metadata, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.blake2b(encoded, digest_size=8).hexdigest()
+
+
+def iter_story_chunks(segments: Iterable[str]) -> Iterator[str]:
+    """
+    Incrementally splits a stream of text segments (pages, chapters) into chunks
+    with the shared story_chunker; only the unchunked tail of the text is buffered.
+
+    @param segments An iterable of text segments, in reading order.
+    @return A generator of chunk texts.
+    """
+    return story_chunker.iter_chunks(segments)
+
+
+# --- Pipeline Stages ---
+
+class StageStats:
+    """
+    Thread-safe accumulator of busy time and item counts for one pipeline stage,
+    used to report per-stage throughput at the end of a run.
+    """
+
+    def __init__(self, name: str, unit: str):
+        """
+        @param name Human-readable stage name (e.g., "extract").
+        @param unit Unit of work counted by this stage (e.g., "files", "chunks").
+        """
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float, items: int = 1) -> None:
+        """
+        Records work done by one worker.
+
+        @param seconds Time the worker spent on the work.
+        @param items Number of units of work completed.
+        """
+        with self._lock:
+            self.seconds += seconds
+            self.items += items
+
+    def stats(self) -> Dict[str, Any]:
+        """@return The stage's item count and busy time."""
+        with self._lock:
+            return {"items": self.items, "busy_seconds": round(self.seconds, 3)}
+
+    def summary(self, wall_seconds: float) -> str:
+        """
+        Formats the stage's totals and throughput.
+
+        @param wall_seconds Wall-clock duration of the whole run, for the overall rate.
+        @return A one-line summary string.
+        """
+        busy_rate = self.items / self.seconds if self.seconds > 0 else 0.0
+        wall_rate = self.items / wall_seconds if wall_seconds > 0 else 0.0
+        return (f"{self.name:<8} {self.items:>8} {self.unit:<7} busy {self.seconds:8.2f}s "
+                f"({busy_rate:8.1f} {self.unit}/s per worker, {wall_rate:8.1f} {self.unit}/s overall)")
+
+
+class BatchSizer:
+    """
+    Chooses the payload size of upsert requests from the latency ChromaDB shows:
+    a request answered within the target latency lets the next ones grow, a slower
+    one shrinks them in proportion, and a failed one halves them. Shared by all
+    uploader threads; also counts requests, bytes and retries for the run summary.
     """
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-    # Langchain's create_documents expects a list of texts and a list of metadatas (or one metadata for all)
-    return text_splitter.create_documents([story_text], metadatas=[metadata])
 
+    def __init__(self, initial_bytes: int = UPLOAD_BATCH_BYTES, min_bytes: int = UPLOAD_MIN_BATCH_BYTES,
+                 max_bytes: int = UPLOAD_MAX_BATCH_BYTES, target_seconds: float = UPLOAD_TARGET_SECONDS):
+        """
+        @param initial_bytes The payload size of the first requests.
+        @param min_bytes The smallest payload size (a request always holds at least one chunk).
+        @param max_bytes The largest payload size.
+        @param target_seconds The request latency to aim for.
+        """
+        self.min_bytes = max(1, min_bytes)
+        self.max_bytes = max(self.min_bytes, max_bytes)
+        self.target_seconds = target_seconds
+        self.requests = 0
+        self.bytes = 0
+        self.retries = 0
+        self.failed = 0
+        self._target = min(self.max_bytes, max(self.min_bytes, initial_bytes))
+        self._lock = threading.Lock()
+
+    def target(self) -> int:
+        """@return The payload size, in bytes, for the next request."""
+        with self._lock:
+            return self._target
+
+    def success(self, payload_bytes: int, seconds: float) -> None:
+        """
+        Records an acknowledged request. Only requests that used most of the current
+        size say something about it (a batch's short last request is fast anyway).
+
+        @param payload_bytes The request's payload size.
+        @param seconds How long the request took.
+        """
+        with self._lock:
+            self.requests += 1
+            self.bytes += payload_bytes
+            if payload_bytes < self._target // 2:
+                return
+            factor = min(2.0, max(0.5, self.target_seconds / max(seconds, 1e-3))) ** 0.5 # Damped
+            self._target = min(self.max_bytes, max(self.min_bytes, int(self._target * factor)))
+
+    def failure(self, final: bool = False) -> None:
+        """
+        Records a failed request and halves the payload size.
+
+        @param final True if the request will not be retried.
+        """
+        with self._lock:
+            if final:
+                self.failed += 1
+            else:
+                self.retries += 1
+            self._target = max(self.min_bytes, self._target // 2)
+
+    def stats(self) -> Dict[str, Any]:
+        """@return Request, byte, retry and failure counts and the current request size."""
+        with self._lock:
+            return {"requests": self.requests, "bytes": self.bytes, "retries": self.retries,
+                    "failed": self.failed, "target_bytes": self._target}
+
+    def summary(self, wall_seconds: float) -> str:
+        """
+        Formats the request totals.
+
+        @param wall_seconds Wall-clock duration of the whole run.
+        @return A one-line summary string.
+        """
+        megabytes = self.bytes / 2**20
+        rate = megabytes / wall_seconds if wall_seconds > 0 else 0.0
+        return (f"{self.requests} requests, {megabytes:.1f} MB ({rate:.2f} MB/s overall), {self.retries} retries, "
+                f"{self.failed} failed, request size now {self.target() >> 10} KB")
 
-def upload_story_chunks_to_chromadb(story_title: str, story_chunks_docs: List, batch_size: int = BATCH_SIZE):
+
+def payload_bytes(document: str, metadata: Dict[str, Any], embedding: Optional[Any] = None) -> int:
     """
-    Uploads story chunks (Langchain Document objects) to ChromaDB in batches.
+    Estimates the bytes one chunk adds to an upsert request.
 
-    @param story_title The title of the story, used for generating chunk IDs.
-    @param story_chunks_docs A list of Langchain Document objects.
-    @param batch_size The number of chunks to upload per batch.
-    @return True if all batches were uploaded successfully, False otherwise.
+    @param document The chunk text.
+    @param metadata The chunk metadata.
+    @param embedding The chunk's embedding, if sent.
+    @return The estimated size in bytes.
     """
-    chunk_ids = [f"{story_title}_{i}" for i in range(len(story_chunks_docs))]
-    chunk_texts = [chunk.page_content for chunk in story_chunks_docs]
-    chunk_metadatas = [chunk.metadata for chunk in story_chunks_docs]
+    size = len(document.encode("utf-8")) + sum(len(key) + len(str(value)) + 6 for key, value in metadata.items())
+    return size + (len(embedding) * EMBEDDING_JSON_BYTES if embedding is not None else 0)
+
+
+class _TimedIterator:
+    """Wraps an iterator and accumulates the time spent producing its items."""
+
+    def __init__(self, iterable: Iterable[Any]):
+        self._it = iter(iterable)
+        self.seconds = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> Any:
+        start = time.perf_counter()
+        try:
+            return next(self._it)
+        finally:
+            self.seconds += time.perf_counter() - start
 
-    total_chunks = len(chunk_ids)
-    num_batches = ((total_chunks - 1) // batch_size) + 1 if total_chunks > 0 else 0
 
-    print(f"📦 Uploading {total_chunks} chunks for '{story_title}' in {num_batches} batches (size: {batch_size})...")
+def stream_story(filepath: str, file_format: str, metadata: Dict[str, str], story: str,
+                 batch_queue, batch_size: int = BATCH_SIZE,
+                 previous_chunks: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """
+    Extraction stage, run inside a worker process: streams a story's text,
+    chunks it incrementally and puts each batch on the upload queue as soon as
+    it fills. Only one batch (plus the chunker's buffer) is held at a time.
+    Chunks whose ID and metadata fingerprint match *previous_chunks* are already
+    stored and are not queued.
+
+    @param filepath The full path to the story file.
+    @param file_format The format of the file ("EPUB3" or "PDF").
+    @param metadata The story metadata to attach to every chunk.
+    @param story The story_id() of the story.
+    @param batch_queue Queue receiving (story, batch_num, ids, documents, metadatas) tuples.
+    @param batch_size The number of chunks per batch.
+    @param previous_chunks The chunk IDs and fingerprints stored for this file by its last upload,
+           or acknowledged by an interrupted one (see IngestManifest.checkpoint()).
+    @return A summary dictionary with the title, filepath, word/chunk/batch counts, the
+            number of unchanged chunks, every chunk's fingerprint ("chunk_fingerprints")
+            and the time spent extracting and chunking.
+    """
+    start = time.perf_counter()
+    if file_format == "EPUB3":
+        segments = _TimedIterator(iter_epub_documents(filepath))
+    elif file_format == "PDF":
+        segments = _TimedIterator(iter_pdf_pages(filepath))
+    else: # Should not happen due to choose_preferred_format logic
+        print(f"❓ Unknown format '{file_format}' for {filepath}, skipping.")
+        segments = _TimedIterator([])
+
+    previous_chunks = previous_chunks or {}
+    words = 0
+    unchanged = 0
+    batches = 0
+    queue_seconds = 0.0
+    fingerprints: Dict[str, str] = {}
+    batch_ids: List[str] = []
+    batch_docs: List[str] = []
+    batch_metas: List[Dict[str, str]] = []
 
-    for i in range(0, total_chunks, batch_size):
-        batch_num = (i // batch_size) + 1
-        batch_ids = chunk_ids[i:i + batch_size]
-        batch_docs = chunk_texts[i:i + batch_size]
-        batch_metas = chunk_metadatas[i:i + batch_size]
+    def flush() -> float:
+        """Queues the current batch; returns the time spent blocked on the queue."""
+        nonlocal batches, batch_ids, batch_docs, batch_metas
+        batches += 1
+        put_start = time.perf_counter()
+        batch_queue.put((story, batches, batch_ids, batch_docs, batch_metas))
+        batch_ids, batch_docs, batch_metas = [], [], []
+        return time.perf_counter() - put_start
 
+    def counted(pieces: Iterable[str]) -> Iterator[str]:
+        nonlocal words
+        for piece in pieces:
+            words += len(piece.split())
+            yield piece
+
+    for chunk_id, chunk_text, chunk_metadata in story_chunker.iter_records(counted(segments), story, metadata):
+        fingerprint = fingerprints[chunk_id] = chunk_fingerprint(chunk_metadata)
+        if previous_chunks.get(chunk_id) == fingerprint:
+            unchanged += 1
+            continue
+        batch_ids.append(chunk_id)
+        batch_docs.append(chunk_text)
+        batch_metas.append(chunk_metadata)
+        if len(batch_ids) >= batch_size:
+            queue_seconds += flush()
+    if batch_ids:
+        queue_seconds += flush()
+
+    busy = time.perf_counter() - start - queue_seconds
+    return {
+        "title": metadata["title"],
+        "filepath": filepath,
+        "words": words,
+        "chunks": len(fingerprints),
+        "unchanged": unchanged,
+        "chunk_fingerprints": fingerprints,
+        "batches": batches,
+        "extract_seconds": segments.seconds,
+        "chunk_seconds": max(0.0, busy - segments.seconds),
+    }
+
+
+class UploadTracker:
+    """
+    Tracks outstanding batches per story so a story is only reported as uploaded
+    once every one of its batches has been acknowledged by ChromaDB. Because
+    batches are streamed, a story's batch count is only known once its worker
+    finishes; batches may be acknowledged before that. A story with a failed
+    batch is reported as incomplete, but its other batches are still uploaded
+    (and checkpointed), so the next run has less to resend. Stories are keyed by
+    their story_id, since different books can share a title.
+    """
+
+    def __init__(self):
+        self.successful_stories = 0
+        self._acked: Dict[str, int] = {}
+        self._expected: Dict[str, int] = {}
+        self._failed: Set[str] = set()
+        self._titles: Dict[str, str] = {}
+        self._on_success: Dict[str, Callable[[], None]] = {}
+        self._on_checkpoint: Dict[str, Callable[[List[str], List[Dict[str, Any]]], None]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, story: str, title: str, on_success: Optional[Callable[[], None]] = None,
+                 on_checkpoint: Optional[Callable[[List[str], List[Dict[str, Any]]], None]] = None) -> None:
+        """
+        Starts tracking a story before any of its batches can be queued.
+
+        @param story The story_id.
+        @param title The story title, for messages.
+        @param on_success Optional callback run (in an uploader thread) once every batch has succeeded.
+        @param on_checkpoint Optional callback run with the IDs and metadatas of every acknowledged request.
+        """
+        with self._lock:
+            self._acked[story] = 0
+            self._titles[story] = title
+            if on_success:
+                self._on_success[story] = on_success
+            if on_checkpoint:
+                self._on_checkpoint[story] = on_checkpoint
+
+    def checkpoint(self, story: str, ids: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        """
+        Records chunks of a story that ChromaDB has acknowledged.
+
+        @param story The story_id.
+        @param ids The acknowledged chunk IDs.
+        @param metadatas Their metadatas.
+        """
+        with self._lock:
+            on_checkpoint = self._on_checkpoint.get(story)
+        if on_checkpoint:
+            try:
+                on_checkpoint(ids, metadatas)
+            except Exception as e: # Only costs a resend if the run is interrupted
+                print(f"    ⚠️ Could not checkpoint {len(ids)} chunks of '{self._titles.get(story, story)}': {e}")
+
+    def finish(self, story: str, num_batches: int) -> None:
+        """
+        Records how many batches the story's worker produced.
+
+        @param story The story_id.
+        @param num_batches The total number of batches queued for the story.
+        """
+        with self._lock:
+            self._expected[story] = num_batches
+        self._maybe_complete(story)
+
+    def abandon(self, story: str) -> None:
+        """
+        Stops tracking a story that produced no usable output (or whose worker crashed).
+        Any of its batches acknowledged later are ignored.
+
+        @param story The story_id.
+        """
+        with self._lock:
+            self._acked.pop(story, None)
+            self._expected.pop(story, None)
+            self._titles.pop(story, None)
+            self._on_success.pop(story, None)
+            self._on_checkpoint.pop(story, None)
+
+    def batch_done(self, story: str, ok: bool) -> None:
+        """
+        Records the outcome of one batch.
+
+        @param story The story_id.
+        @param ok Whether the batch was uploaded successfully.
+        """
+        with self._lock:
+            if story not in self._acked:
+                return
+            if not ok:
+                self._failed.add(story)
+            self._acked[story] += 1
+        self._maybe_complete(story)
+
+    def _maybe_complete(self, story: str) -> None:
+        """Prints the story result (and runs its callback) once its last batch is acknowledged."""
+        with self._lock:
+            expected = self._expected.get(story)
+            if expected is None or self._acked.get(story) != expected:
+                return
+            del self._acked[story]
+            del self._expected[story]
+            title = self._titles.pop(story, story)
+            on_success = self._on_success.pop(story, None)
+            self._on_checkpoint.pop(story, None)
+            failed = story in self._failed
+            if not failed:
+                self.successful_stories += 1
+        if failed:
+            print(f"⚠️ Incomplete upload for '{title}'. Review logs above.")
+            return
+        if on_success:
+            try:
+                on_success()
+            except Exception as e:
+                print(f"⚠️ Post-upload bookkeeping failed for '{title}': {e}")
+        print(f"✅ Successfully processed and added '{title}' to ChromaDB.")
+
+
+def upsert_batch(batch_ids: List[str], batch_docs: List[str], batch_metas: List[Dict[str, Any]],
+                 embeddings: Optional[List[List[float]]], sizer: BatchSizer, upload_stats: StageStats,
+                 acknowledge: Callable[[int, int], None]) -> bool:
+    """
+    Upserts one batch as requests of about sizer.target() payload bytes. A failed
+    request is retried after an exponential backoff with jitter, re-split at the
+    sizer's reduced size, up to UPLOAD_RETRIES times.
+
+    @param batch_ids The chunk IDs.
+    @param batch_docs The chunk texts.
+    @param batch_metas The chunk metadatas.
+    @param embeddings The chunk embeddings, or None to let ChromaDB embed them.
+    @param sizer The shared BatchSizer.
+    @param upload_stats StageStats receiving the number of chunks uploaded.
+    @param acknowledge Called with the (start, end) slice of the batch after each acknowledged request.
+    @return True if every chunk was acknowledged; False once a request has exhausted its retries.
+    """
+    sizes = [payload_bytes(doc, meta, embeddings[i] if embeddings is not None else None)
+             for i, (doc, meta) in enumerate(zip(batch_docs, batch_metas))]
+    start = 0
+    attempt = 0
+    while start < len(batch_ids):
+        budget = sizer.target()
+        end, payload = start + 1, sizes[start]
+        while end < len(batch_ids) and payload + sizes[end] <= budget:
+            payload += sizes[end]
+            end += 1
+        request_start = time.perf_counter()
         try:
-            vector_store.add(
-                ids=batch_ids,
-                documents=batch_docs,
-                metadatas=batch_metas
+            vector_store.upsert(
+                ids=batch_ids[start:end],
+                documents=batch_docs[start:end],
+                metadatas=batch_metas[start:end],
+                embeddings=embeddings[start:end] if embeddings is not None else None
             )
-            print(f"    ✅ Uploaded batch {batch_num} of {num_batches}")
         except Exception as e:
-            print(f"    ❌ Failed to upload batch {batch_num} for '{story_title}': {e}")
-            return False # Stop on failure for this story
+            attempt += 1
+            if attempt > UPLOAD_RETRIES:
+                sizer.failure(final=True)
+                print(f"    ❌ Giving up on {end - start} chunks after {UPLOAD_RETRIES} retries: {e}")
+                return False
+            sizer.failure()
+            delay = UPLOAD_RETRY_BACKOFF * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+            print(f"    ⚠️ Upsert of {end - start} chunks failed ({e}); retry {attempt}/{UPLOAD_RETRIES} in {delay:.1f}s.")
+            time.sleep(delay)
+            continue
+        seconds = time.perf_counter() - request_start
+        sizer.success(payload, seconds)
+        upload_stats.add(seconds, end - start)
+        acknowledge(start, end)
+        attempt = 0
+        start = end
     return True
 
-# --- Main Ingestion Loop ---
-def main_ingestion_loop():
+
+def upload_worker(batch_queue, tracker: UploadTracker, upload_stats: StageStats, sizer: BatchSizer) -> None:
     """
-    Walks through the STORIES_DIR, processes each story (EPUB or PDF),
-    extracts content and metadata, and uploads it to ChromaDB.
+    Upload stage: drains chunk batches from the queue and upserts them into ChromaDB
+    (see upsert_batch()) until a None sentinel is received. Upserting (rather than
+    adding) lets modified stories overwrite their previous chunks in place. Every
+    acknowledged request is added to the keyword index and checkpointed through the tracker.
+
+    @param batch_queue Queue of (story, batch_num, ids, documents, metadatas) tuples.
+    @param tracker The shared UploadTracker.
+    @param upload_stats StageStats receiving the number of chunks uploaded.
+    @param sizer The shared BatchSizer.
     """
-    print(f"\n🚀 Starting story ingestion from directory: {STORIES_DIR}")
-    if not os.path.isdir(STORIES_DIR):
-        print(f"❌ Error: Stories directory not found: {STORIES_DIR}")
-        return
+    while True:
+        item = batch_queue.get()
+        if item is None:
+            return
+        story, batch_num, batch_ids, batch_docs, batch_metas = item
+        title = batch_metas[0]["title"]
 
-    processed_files_count = 0
-    successfully_uploaded_stories = 0
+        def acknowledge(start: int, end: int) -> None:
+            """Indexes and checkpoints one acknowledged request."""
+            if keyword_index is not None:
+                try:
+                    keyword_index.upsert(batch_ids[start:end], batch_docs[start:end], batch_metas[start:end])
+                except Exception as e: # The wrapper re-syncs its index from the collection
+                    print(f"    ⚠️ Could not add chunks of batch {batch_num} of '{title}' to the keyword index: {e}")
+            tracker.checkpoint(story, batch_ids[start:end], batch_metas[start:end])
+
+        try:
+            embeddings = embedding_cache.embed(batch_docs, embedding_function) if embedding_cache else None
+            ok = upsert_batch(batch_ids, batch_docs, batch_metas, embeddings, sizer, upload_stats, acknowledge)
+        except Exception as e:
+            print(f"    ❌ Failed to upload batch {batch_num} for '{title}': {e}")
+            ok = False
+        if ok:
+            print(f"    ✅ Uploaded batch {batch_num} ({len(batch_ids)} chunks) for '{title}'")
+        else:
+            print(f"    ❌ Batch {batch_num} for '{title}' is incomplete; its acknowledged chunks are checkpointed.")
+        tracker.batch_done(story, ok)
+
+
+def delete_stale_chunks(previous: Optional[Dict[str, Any]], previous_chunks: Dict[str, str],
+                        chunk_ids: Collection[str], checkpointed: Collection[str] = ()) -> int:
+    """
+    Deletes chunks a modified story owned before re-upload but no longer produces.
+    Entries recorded before chunk IDs became content-derived have no chunk list;
+    all of their positional `{title}_{i}` chunks are stale.
+
+    @param previous The file's previous manifest entry, or None for a new file.
+    @param previous_chunks The chunk IDs recorded for the file by its previous upload.
+    @param chunk_ids The chunk IDs the story has now.
+    @param checkpointed Chunk IDs acknowledged by an interrupted upload of the file
+           (the file may have changed again since).
+    @return The number of chunk IDs deleted.
+    """
+    stale_ids = [chunk_id for chunk_id in dict.fromkeys([*previous_chunks, *checkpointed]) if chunk_id not in chunk_ids]
+    if previous and not previous_chunks:
+        stale_ids += [f"{previous['title']}_{i}" for i in range(previous["chunk_count"])]
+    if stale_ids:
+        source = f"previously uploaded for '{previous['title']}'" if previous else "left by an interrupted upload"
+        print(f"🧹 Deleting {len(stale_ids)} stale chunks {source}.")
+        vector_store.delete(ids=stale_ids)
+        if keyword_index is not None:
+            keyword_index.delete(stale_ids)
+    return len(stale_ids)
 
-    for root, _, files in os.walk(STORIES_DIR):
+
+def discover_stories(stories_dir: str, manifest: IngestManifest):
+    """
+    Walks the stories directory and yields the stories that need uploading.
+    Files whose size/mtime (or, failing that, content hash) match the manifest are
+    skipped before any parsing. Stories whose title is missing or 'Unknown', or
+    whose title and author are owned by another file or already yielded earlier
+    in this run, are skipped too.
+
+    @param stories_dir The directory to scan.
+    @param manifest The ingestion manifest.
+    @return A generator of job dictionaries with the filepath, file_format, metadata,
+            story_id, fingerprint, content_hash, previous manifest entry and the
+            chunks recorded for it ("previous_chunks") or checkpointed by an interrupted upload ("checkpointed").
+    """
+    scheduled_stories: Set[str] = set()
+    for root, _, files in os.walk(stories_dir):
         if not files:
             continue
 
@@ -309,14 +1033,19 @@ def main_ingestion_loop():
                 file_groups.setdefault(base_name, []).append(filename)
 
         for base_name, file_list in file_groups.items():
-            processed_files_count +=1
-            print(f"\n--- Processing group: {base_name} ---")
             filepath_to_process, file_format = choose_preferred_format(root, file_list)
 
             if not filepath_to_process or not file_format:
                 print(f"⚠️ No processable EPUB or PDF found for base name '{base_name}' in '{root}', skipping.")
                 continue
 
+            previous = manifest.get(filepath_to_process)
+            unchanged, fingerprint, content_hash = manifest.is_unchanged(filepath_to_process, previous)
+            if unchanged:
+                print(f"⏩ Skipping unchanged file: {os.path.basename(filepath_to_process)}")
+                continue
+
+            print(f"\n--- Processing group: {base_name} ---")
             print(f"✨ Selected file: {os.path.basename(filepath_to_process)} (Format: {file_format})")
             metadata = get_story_metadata(filepath_to_process, file_format)
             story_title_key = metadata.get("title", "").strip().lower()
@@ -325,42 +1054,229 @@ def main_ingestion_loop():
                 print(f"⚠️ Skipping '{os.path.basename(filepath_to_process)}' due to missing or 'Unknown' title in metadata.")
                 continue
 
-            if story_title_key in existing_titles:
-                print(f"⏩ Skipping already-uploaded story (title: '{metadata['title']}')")
+            story = story_id(metadata["title"], metadata["author"])
+            owner = manifest.story_owner(story, metadata["title"])
+            if story in scheduled_stories or (owner and owner != os.path.abspath(filepath_to_process)):
+                print(f"⏩ Skipping already-uploaded story (title: '{metadata['title']}', author: '{metadata['author']}')")
                 continue
 
-            if file_format == "EPUB3":
-                story_content = extract_text_from_epub(filepath_to_process)
-            elif file_format == "PDF":
-                story_content = extract_text_from_pdf(filepath_to_process)
-            else: # Should not happen due to choose_preferred_format logic
-                print(f"❓ Unknown format '{file_format}' for {filepath_to_process}, skipping.")
+            if previous is None and story_title_key in existing_titles:
+                # Uploaded before the manifest existed: adopt it instead of re-uploading.
+                print(f"⏩ Skipping already-uploaded story (title: '{metadata['title']}'), recording it in the manifest.")
+                manifest.record(filepath_to_process, fingerprint, content_hash, metadata["title"],
+                                existing_titles[story_title_key], story)
                 continue
 
-            if not story_content.strip():
-                print(f"⚠️ No readable text content found in '{os.path.basename(filepath_to_process)}', skipping.")
-                continue
+            scheduled_stories.add(story)
+            checkpointed = manifest.checkpointed(filepath_to_process)
+            if checkpointed:
+                print(f"⏯️ Resuming '{metadata['title']}': {len(checkpointed)} chunks were acknowledged by an interrupted upload.")
+            yield {
+                "filepath": filepath_to_process,
+                "file_format": file_format,
+                "metadata": metadata,
+                "story_id": story,
+                "fingerprint": fingerprint,
+                "content_hash": content_hash,
+                "previous": previous,
+                "previous_chunks": manifest.chunks(filepath_to_process) if previous else {},
+                "checkpointed": checkpointed,
+            }
 
-            print(f"📝 Extracted ~{len(story_content.split())} words from '{metadata['title']}'. Splitting into chunks...")
-            story_chunks = split_story_into_chunks(story_content, metadata)
 
-            if not story_chunks:
-                print(f"⚠️ Could not split '{metadata['title']}' into chunks, skipping.")
-                continue
+# --- Main Ingestion Loop ---
+def main_ingestion_loop(manifest: IngestManifest, workers: int = INGEST_WORKERS, uploaders: int = UPLOAD_WORKERS,
+                        queue_size: int = UPLOAD_QUEUE_SIZE, stories_dir: str = STORIES_DIR) -> Optional[Dict[str, Any]]:
+    """
+    Walks the stories directory and runs the staged ingestion pipeline:
+    a process pool extracts and chunks stories, and uploader threads drain the
+    resulting batches from a bounded queue into ChromaDB.
 
-            upload_successful = upload_story_chunks_to_chromadb(metadata["title"], story_chunks)
+    @param manifest The ingestion manifest used to skip unchanged files.
+    @param workers Number of extraction/chunking worker processes.
+    @param uploaders Number of concurrent uploader threads.
+    @param queue_size Maximum number of batches buffered between the two stages.
+    @param stories_dir The directory containing the stories.
+    @return A report of the run (file, word and chunk counts, wall time, per-stage
+            stats() and upsert request stats), or None if the directory does not exist.
+    """
+    print(f"\n🚀 Starting story ingestion from directory: {stories_dir}")
+    if not os.path.isdir(stories_dir):
+        print(f"❌ Error: Stories directory not found: {stories_dir}")
+        return None
+
+    workers = max(1, workers)
+    uploaders = max(1, uploaders)
+    print(f"⚙️ Pipeline: {workers} extraction worker(s), {uploaders} uploader(s), queue size {queue_size}.")
+
+    discover_stats = StageStats("discover", "files")
+    extract_stats = StageStats("extract", "files")
+    chunk_stats = StageStats("chunk", "chunks")
+    upload_stats = StageStats("upload", "chunks")
+    delete_stats = StageStats("delete", "chunks")
+    sizer = BatchSizer()
+    tracker = UploadTracker()
+
+    # A manager queue can be handed to pool workers, which put batches on it
+    # directly; its bound is what keeps memory flat on very large books.
+    manager = multiprocessing.Manager()
+    batch_queue = manager.Queue(maxsize=max(1, queue_size))
+
+    upload_threads = [
+        threading.Thread(target=upload_worker, args=(batch_queue, tracker, upload_stats, sizer), daemon=True)
+        for _ in range(uploaders)
+    ]
+    for thread in upload_threads:
+        thread.start()
+
+    processed_files_count = 0
+    input_bytes = 0
+    words = 0
+    unchanged_chunks = 0
+    started = time.perf_counter()
+
+    def handle_finished(future: Future, job: Dict[str, Any]) -> None:
+        """Records the outcome of one finished extraction worker."""
+        nonlocal unchanged_chunks, words
+        title, story = job["metadata"]["title"], job["story_id"]
+        try:
+            summary = future.result()
+        except Exception as e:
+            print(f"❌ Extraction worker failed for '{title}': {e}")
+            tracker.abandon(story)
+            return
+        extract_stats.add(summary["extract_seconds"])
+        chunk_stats.add(summary["chunk_seconds"], summary["chunks"])
+        if not summary["words"]:
+            print(f"⚠️ No readable text content found in '{os.path.basename(summary['filepath'])}', skipping.")
+            tracker.abandon(story)
+            return
+        print(f"📝 Extracted ~{summary['words']} words from '{title}' into {summary['chunks']} chunks "
+              f"({summary['unchanged']} unchanged).")
+        unchanged_chunks += summary["unchanged"]
+        words += summary["words"]
+        job["summary"] = summary
+        tracker.finish(story, summary["batches"])
+
+    def make_on_success(job: Dict[str, Any]) -> Callable[[], None]:
+        """Builds the callback that updates the manifest once a story is fully uploaded."""
+        def on_success() -> None:
+            fingerprints = job["summary"]["chunk_fingerprints"]
+            start = time.perf_counter()
+            deleted = delete_stale_chunks(job["previous"], job["previous_chunks"], fingerprints, job["checkpointed"])
+            delete_stats.add(time.perf_counter() - start, deleted)
+            manifest.record(job["filepath"], job["fingerprint"], job["content_hash"],
+                            job["metadata"]["title"], len(fingerprints), job["story_id"], fingerprints)
+        return on_success
+
+    def make_on_checkpoint(job: Dict[str, Any]) -> Callable[[List[str], List[Dict[str, Any]]], None]:
+        """Builds the callback that checkpoints a story's acknowledged chunks in the manifest."""
+        def on_checkpoint(ids: List[str], metadatas: List[Dict[str, Any]]) -> None:
+            manifest.checkpoint(job["filepath"], {chunk_id: chunk_fingerprint(metadata) for chunk_id, metadata in zip(ids, metadatas)})
+        return on_checkpoint
+
+    # Cap in-flight extraction jobs so workers don't run far ahead of the uploaders.
+    max_pending = workers * 2
+    pending: Dict[Future, Dict[str, Any]] = {}
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            jobs = _TimedIterator(discover_stories(stories_dir, manifest))
+            for job in jobs:
+                processed_files_count += 1
+                input_bytes += job["fingerprint"][1]
+                tracker.register(job["story_id"], job["metadata"]["title"], make_on_success(job), make_on_checkpoint(job))
+                future = pool.submit(stream_story, job["filepath"], job["file_format"], job["metadata"],
+                                     job["story_id"], batch_queue, BATCH_SIZE,
+                                     {**job["previous_chunks"], **job["checkpointed"]})
+                pending[future] = job
+                if len(pending) >= max_pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        handle_finished(future, pending.pop(future))
+            for future, job in pending.items():
+                handle_finished(future, job)
+            discover_stats.add(jobs.seconds, processed_files_count)
+
+        for _ in upload_threads:
+            batch_queue.put(None)
+        for thread in upload_threads:
+            thread.join()
+    finally:
+        manager.shutdown()
+    wall_seconds = time.perf_counter() - started
+
+    if upload_stats.items > 0 or delete_stats.items > 0:
+        bump_ingest_generation()
 
-            if upload_successful:
-                print(f"✅ Successfully processed and added '{metadata['title']}' to ChromaDB.")
-                existing_titles.add(story_title_key) # Add to set to prevent re-processing in this run
-                successfully_uploaded_stories +=1
-            else:
-                print(f"⚠️ Incomplete upload for '{metadata['title']}'. Review logs above.")
-    
     print(f"\n--- Ingestion Summary ---")
-    print(f"Processed {processed_files_count} file groups.")
-    print(f"Successfully uploaded {successfully_uploaded_stories} new stories to ChromaDB.")
+    print(f"Processed {processed_files_count} new stories in {wall_seconds:.2f}s.")
+    print(f"Successfully uploaded {tracker.successful_stories} new stories to ChromaDB.")
+    print(f"Chunks: {upload_stats.items} upserted, {unchanged_chunks} unchanged, {delete_stats.items} deleted.")
+    print("Stage throughput:")
+    stages = (discover_stats, extract_stats, chunk_stats, upload_stats, delete_stats)
+    for stats in stages:
+        print(f"  {stats.summary(wall_seconds)}")
+    print(f"Upsert requests: {sizer.summary(wall_seconds)}.")
+    if embedding_cache is not None:
+        cache_stats = embedding_cache.stats()
+        print(f"Embedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, {cache_stats['entries']} vectors stored.")
+    if keyword_index is not None:
+        print(f"Keyword index: {len(keyword_index)} chunks indexed.")
     print("✅ Story ingestion process complete.")
+    return {
+        "files": processed_files_count,
+        "stories_uploaded": tracker.successful_stories,
+        "input_bytes": input_bytes,
+        "words": words,
+        "chunks": chunk_stats.items,
+        "chunks_upserted": upload_stats.items,
+        "chunks_unchanged": unchanged_chunks,
+        "chunks_deleted": delete_stats.items,
+        "wall_seconds": round(wall_seconds, 3),
+        "stages": {stats.name: stats.stats() for stats in stages},
+        "requests": sizer.stats(),
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """
+    Parses command-line options. Defaults come from the environment-driven configuration above.
+
+    @param argv Argument list (defaults to sys.argv[1:]).
+    @return The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description="Bulk-upload EPUB/PDF stories into ChromaDB.")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS,
+                        help="number of extraction/chunking worker processes (default: %(default)s)")
+    parser.add_argument("--uploaders", type=int, default=UPLOAD_WORKERS,
+                        help="number of concurrent upload threads (default: %(default)s)")
+    parser.add_argument("--queue-size", type=int, default=UPLOAD_QUEUE_SIZE,
+                        help="maximum batches buffered between extraction and upload (default: %(default)s)")
+    parser.add_argument("--stories-dir", default=STORIES_DIR,
+                        help="directory containing story files (default: %(default)s)")
+    parser.add_argument("--manifest", default=MANIFEST_PATH,
+                        help="SQLite manifest of already-ingested files (default: %(default)s)")
+    parser.add_argument("--embedding-cache", default=EMBEDDING_CACHE_PATH,
+                        help="memory-mapped embedding cache file; empty to disable (default: %(default)s)")
+    parser.add_argument("--keyword-index", default=KEYWORD_INDEX_PATH,
+                        help="SQLite BM25 keyword index of the chunk text; empty to disable (default: %(default)s)")
+    return parser.parse_args(argv)
+
 
 if __name__ == "__main__":
-    main_ingestion_loop()
+    args = parse_args()
+    manifest = IngestManifest(args.manifest, f"{CHROMA_HOST}:{CHROMA_PORT}/{COLLECTION_NAME}")
+    init_vector_store()
+    init_embedding_cache(args.embedding_cache)
+    init_keyword_index(args.keyword_index)
+    if len(manifest) == 0 and vector_store.count() > 0:
+        # First run against a populated collection: seed duplicate detection once.
+        load_existing_titles()
+    try:
+        main_ingestion_loop(manifest, workers=args.workers, uploaders=args.uploaders,
+                            queue_size=args.queue_size, stories_dir=args.stories_dir)
+    finally:
+        manifest.close()
+        if keyword_index is not None:
+            keyword_index.close()
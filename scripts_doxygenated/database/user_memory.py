@@ -0,0 +1,320 @@
+##! @file user_memory.py
+##! @brief SQLite (WAL) store of per-user conversation history with a token budget and rolling summaries.
+##! @details
+##! search_stories.py used to keep every user's history in one JSON file. Each
+##! save re-read and rewrote the whole file, two CLI sessions saving at the same
+##! time lost each other's turns, and every request resent the user's entire history.
+##! UserMemoryStore replaces that:
+##! - every turn is a row, indexed by (username, id), so saving an exchange is
+##!   one small INSERT transaction whatever the size of the history;
+##! - the database runs in WAL mode with a busy timeout, and writes take the
+##!   write lock up front (BEGIN IMMEDIATE). Several processes can read and
+##!   append at once, and no turn is lost;
+##! - context() returns the user's summary plus the newest turns that fit a token
+##!   budget, so the prompt stays bounded however long the history grows;
+##! - compact() folds turns older than the recent window into a per-user summary.
+##!   The summary comes from a caller-supplied function, normally an LLM call,
+##!   and is stored once the old turns are deleted. The slow summarize call runs
+##!   outside any transaction. If another process compacted the same user in
+##!   the meantime, the result is discarded, not applied twice.
+##!
+##! Tokens are counted with prompt_builder.count_tokens().
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from prompt_builder import SUMMARY_PREFIX, Summarizer, message_tokens
+
+__all__ = ["USER_MEMORY_TOKEN_BUDGET", "UserMemoryStore"]
+
+## @var USER_MEMORY_TOKEN_BUDGET
+# Tokens of remembered conversation (summary plus recent turns) sent with each request.
+USER_MEMORY_TOKEN_BUDGET: int = int(os.getenv("USER_MEMORY_TOKEN_BUDGET", "1500"))
+
+
+class UserMemoryStore:
+    """
+    Per-user conversation history in SQLite (WAL), bounded by a token budget.
+    Safe to share between threads, and between processes using the same file.
+    """
+
+    def __init__(self, path: str, budget_tokens: int = USER_MEMORY_TOKEN_BUDGET,
+                 keep_recent_tokens: Optional[int] = None, busy_timeout_s: float = 30.0):
+        """
+        Opens (or creates) the store.
+
+        @param path Filesystem path of the SQLite database.
+        @param budget_tokens Maximum tokens of summary plus turns returned by context().
+        @param keep_recent_tokens Tokens of newest turns compact() leaves verbatim (default: half the budget).
+        @param busy_timeout_s How long a write waits for another process holding the lock.
+        """
+        self.path = path
+        self.budget_tokens = budget_tokens
+        self.keep_recent_tokens = budget_tokens // 2 if keep_recent_tokens is None else keep_recent_tokens
+        self._lock = threading.Lock()
+        # Autocommit mode: transactions are opened explicitly (BEGIN IMMEDIATE for writes)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=busy_timeout_s, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL") # Durable at checkpoints; a crash loses at most the last turns
+            with self._write():
+                self._conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS turns (
+                        id         INTEGER PRIMARY KEY AUTOINCREMENT,
+                        username   TEXT NOT NULL,
+                        role       TEXT NOT NULL,
+                        content    TEXT NOT NULL,
+                        tokens     INTEGER NOT NULL,
+                        created_at REAL NOT NULL
+                    )
+                    """
+                )
+                self._conn.execute("CREATE INDEX IF NOT EXISTS turns_user ON turns (username, id)")
+                self._conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS summaries (
+                        username        TEXT PRIMARY KEY,
+                        content         TEXT NOT NULL,
+                        tokens          INTEGER NOT NULL,
+                        covered_through INTEGER NOT NULL,
+                        updated_at      REAL NOT NULL
+                    )
+                    """
+                )
+
+    @contextmanager
+    def _write(self) -> Iterator[None]:
+        """Runs the block in a write transaction that holds the database lock from the start. Caller holds self._lock."""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    @contextmanager
+    def _read(self) -> Iterator[None]:
+        """Runs the block in one read transaction (a consistent snapshot). Caller holds self._lock."""
+        self._conn.execute("BEGIN")
+        try:
+            yield
+        finally:
+            self._conn.execute("COMMIT")
+
+    # --- Writing ---
+
+    def append(self, username: str, role: str, content: str) -> None:
+        """
+        Appends one turn to the user's history.
+
+        @param username The user.
+        @param role "user" or "assistant".
+        @param content The message text.
+        """
+        self.extend(username, [{"role": role, "content": content}])
+
+    def extend(self, username: str, messages: List[Dict[str, str]]) -> None:
+        """
+        Appends several turns in one transaction (e.g., a prompt and its reply).
+
+        @param username The user.
+        @param messages Chat messages with "role" and "content", oldest first.
+        """
+        now = time.time()
+        rows = [(username, m["role"], m["content"], message_tokens(m), now) for m in messages]
+        with self._lock, self._write():
+            self._conn.executemany(
+                "INSERT INTO turns (username, role, content, tokens, created_at) VALUES (?, ?, ?, ?, ?)", rows
+            )
+
+    # --- Reading ---
+
+    def context(self, username: str, budget_tokens: Optional[int] = None) -> List[Dict[str, str]]:
+        """
+        Builds the remembered conversation to send with a request: the user's summary
+        (as a system message) followed by as many of the newest turns as fit.
+
+        @param username The user.
+        @param budget_tokens Token budget (default: the store's budget).
+        @return Chat messages, oldest first; never more than the budget (a summary larger
+                than the budget on its own is left out).
+        """
+        budget = self.budget_tokens if budget_tokens is None else budget_tokens
+        messages: List[Dict[str, str]] = []
+        with self._lock, self._read():
+            summary = self._conn.execute(
+                "SELECT content, tokens FROM summaries WHERE username = ?", (username,)
+            ).fetchone()
+            if summary and summary["tokens"] <= budget:
+                budget -= summary["tokens"]
+            else:
+                summary = None
+            # Newest first; stop at the first turn that does not fit so the kept turns stay contiguous
+            for row in self._conn.execute(
+                "SELECT role, content, tokens FROM turns WHERE username = ? ORDER BY id DESC", (username,)
+            ):
+                if row["tokens"] > budget:
+                    break
+                budget -= row["tokens"]
+                messages.append({"role": row["role"], "content": row["content"]})
+        messages.reverse()
+        if summary:
+            messages.insert(0, {"role": "system", "content": SUMMARY_PREFIX + summary["content"]})
+        return messages
+
+    def history(self, username: str) -> List[Dict[str, str]]:
+        """
+        @param username The user.
+        @return All turns not yet folded into the summary, oldest first.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT role, content FROM turns WHERE username = ? ORDER BY id", (username,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def recall(self, username: str) -> Tuple[Optional[str], List[Dict[str, str]]]:
+        """
+        Reads the summary and the unsummarised turns together (one snapshot, so a
+        concurrent compaction cannot make them overlap or leave a gap).
+
+        @param username The user.
+        @return (summary or None, turns oldest first), e.g. for PromptBuilder.build().
+        """
+        with self._lock, self._read():
+            row = self._conn.execute("SELECT content FROM summaries WHERE username = ?", (username,)).fetchone()
+            turns = self._conn.execute(
+                "SELECT role, content FROM turns WHERE username = ? ORDER BY id", (username,)
+            ).fetchall()
+        return (row["content"] if row else None), [dict(turn) for turn in turns]
+
+    def summary(self, username: str) -> Optional[str]:
+        """
+        @param username The user.
+        @return The user's rolling summary, or None before the first compaction.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT content FROM summaries WHERE username = ?", (username,)).fetchone()
+        return row["content"] if row else None
+
+    def history_tokens(self, username: str) -> int:
+        """
+        @param username The user.
+        @return Tokens of the summary plus all unsummarised turns.
+        """
+        with self._lock, self._read():
+            turns = self._conn.execute("SELECT COALESCE(SUM(tokens), 0) FROM turns WHERE username = ?",
+                                       (username,)).fetchone()[0]
+            summary = self._conn.execute("SELECT tokens FROM summaries WHERE username = ?", (username,)).fetchone()
+        return turns + (summary["tokens"] if summary else 0)
+
+    def needs_compaction(self, username: str) -> bool:
+        """
+        @param username The user.
+        @return True when the user's history no longer fits the budget.
+        """
+        return self.history_tokens(username) > self.budget_tokens
+
+    def users(self) -> List[str]:
+        """@return Every user with a history or a summary."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT username FROM turns UNION SELECT username FROM summaries ORDER BY username"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    # --- Compaction ---
+
+    def compact(self, username: str, summarize: Summarizer) -> bool:
+        """
+        Folds the turns older than the recent window (keep_recent_tokens) into the
+        user's summary and deletes them. The window is shrunk as needed so the kept
+        history starts on a user turn, never on a reply whose prompt was folded in.
+
+        @param username The user.
+        @param summarize Produces the new summary from the old one and the turns being folded in.
+        @raises Exception Whatever *summarize* raises; the history is left unchanged then.
+        @return True if turns were folded in; False if there was nothing to fold or
+                another process compacted the user concurrently.
+        """
+        with self._lock, self._read():
+            row = self._conn.execute(
+                "SELECT content, covered_through FROM summaries WHERE username = ?", (username,)
+            ).fetchone()
+            previous, covered_through = (row["content"], row["covered_through"]) if row else (None, 0)
+            kept = 0
+            cut: Optional[int] = None
+            newer: List[sqlite3.Row] = [] # Turns after the one being examined, newest first
+            for turn in self._conn.execute(
+                "SELECT id, role, tokens FROM turns WHERE username = ? ORDER BY id DESC", (username,)
+            ):
+                kept += turn["tokens"]
+                if kept > self.keep_recent_tokens:
+                    cut = turn["id"]
+                    # Kept history starts on a user turn: replies whose prompt is folded in go with it
+                    for later in reversed(newer):
+                        if later["role"] == "user":
+                            break
+                        cut = later["id"]
+                    break
+                newer.append(turn)
+            old = [] if cut is None else [dict(r) for r in self._conn.execute(
+                "SELECT role, content FROM turns WHERE username = ? AND id <= ? ORDER BY id", (username, cut)
+            )]
+        if not old:
+            return False
+
+        new_summary = summarize(previous, old).strip() # Slow (LLM); no lock or transaction held
+
+        with self._lock, self._write():
+            row = self._conn.execute(
+                "SELECT covered_through FROM summaries WHERE username = ?", (username,)
+            ).fetchone()
+            if (row["covered_through"] if row else 0) != covered_through:
+                return False # Someone else compacted this user meanwhile; their summary stands
+            self._conn.execute(
+                "INSERT OR REPLACE INTO summaries VALUES (?, ?, ?, ?, ?)",
+                (username, new_summary, message_tokens({"content": new_summary}), cut, time.time()),
+            )
+            self._conn.execute("DELETE FROM turns WHERE username = ? AND id <= ?", (username, cut))
+        return True
+
+    # --- Migration and housekeeping ---
+
+    def import_json(self, path: str) -> int:
+        """
+        Imports a legacy user_memory.json ({username: [messages]}). Users already
+        in the store are skipped, so importing twice is harmless.
+
+        @param path Path of the JSON file.
+        @return Number of turns imported.
+        """
+        with open(path, "r", encoding="utf-8") as fh:
+            legacy: Dict[str, List[Dict[str, str]]] = json.load(fh)
+        existing = set(self.users())
+        imported = 0
+        for username, messages in legacy.items():
+            if username in existing or not messages:
+                continue
+            self.extend(username, [{"role": m["role"], "content": m["content"]} for m in messages])
+            imported += len(messages)
+        return imported
+
+    def close(self) -> None:
+        """Closes the underlying database connection."""
+        with self._lock:
+            self._conn.close()
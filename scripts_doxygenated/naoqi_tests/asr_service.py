@@ -0,0 +1,187 @@
+##! @file asr_service.py
+##! @brief Event-driven keyword recogniser built on ALMemory event callbacks.
+##! @details
+##! Polling `memory.getData("WordRecognized")` every 0.5 s costs one RPC to the
+##! robot per poll, adds up to half a second of latency and can fire again on a
+##! stale value that ALSpeechRecognition left in memory. KeywordRecognizer
+##! subscribes to the **WordRecognized** event instead
+##! (`memory.subscribeToEvent(event, module, callback)`), so NAOqi calls it once
+##! per recognition. Each recognition is:
+##! 1. parsed (`[word, confidence, word, confidence, ...]`, `<...>` tags stripped);
+##! 2. dropped if its confidence is below the threshold;
+##! 3. dropped if the same word was accepted within the debounce window;
+##! 4. handed to a small worker pool, so a slow handler (fetching a story)
+##!    never blocks NAOqi's callback thread.
+##!
+##! On a robot, create_naoqi_module() wraps the recogniser in the ALModule that
+##! NAOqi needs to deliver the callbacks. mock_naoqi.MockMemory simulates the
+##! event side for runs without a robot.
+##!
+##! @author Calvin Vandor
+##! @date   2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+__all__ = ["KeywordRecognizer", "create_naoqi_module", "parse_recognition"]
+
+## @var WORD_RECOGNIZED_EVENT
+# ALMemory event raised by ALSpeechRecognition for every recognition.
+WORD_RECOGNIZED_EVENT: str = "WordRecognized"
+
+
+def parse_recognition(value: Any) -> Optional[Tuple[str, float]]:
+    """
+    Extracts the best hypothesis from a WordRecognized value.
+
+    @param value Event value: `[word, confidence, word, confidence, ...]`, best first.
+    @return (word, confidence), or None for empty or malformed values (e.g., ASR resets).
+    """
+    if not value or len(value) < 2:
+        return None
+    try:
+        # NAOqi might add <...> around spotted words; strip them for the raw word.
+        word = str(value[0]).strip("<...>").strip()
+        confidence = float(value[1])
+    except (TypeError, ValueError):
+        return None
+    return (word, confidence) if word else None
+
+
+class KeywordRecognizer:
+    """
+    Filters WordRecognized events and dispatches accepted keywords to a handler
+    on a worker pool. Thread-safe: NAOqi may invoke the callback from any thread.
+    """
+
+    def __init__(self, memory: Any, on_keyword: Callable[[str, float], None], confidence_threshold: float = 0.6,
+                 debounce_s: float = 2.0, workers: int = 2):
+        """
+        @param memory ALMemory proxy (or mock_naoqi.MockMemory).
+        @param on_keyword Handler called as on_keyword(word, confidence) on a worker thread.
+        @param confidence_threshold Recognitions below this confidence are ignored.
+        @param debounce_s Repeats of an accepted word within this many seconds are ignored.
+        @param workers Worker threads running the handler.
+        """
+        self.memory = memory
+        self.on_keyword = on_keyword
+        self.confidence_threshold = confidence_threshold
+        self.debounce_s = debounce_s
+        self.workers = max(1, workers)
+        self.module_name: Optional[str] = None
+        self.counters: Dict[str, int] = {"events": 0, "accepted": 0, "low_confidence": 0, "debounced": 0,
+                                         "ignored": 0, "handler_errors": 0}
+        self.dispatch_latencies_ms: List[float] = []
+        self._last_accepted: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def start(self, module_name: str, callback_name: str = "onWordRecognized") -> None:
+        """
+        Subscribes to WordRecognized. NAOqi will call `<module_name>.<callback_name>`,
+        which must forward to on_word_recognized().
+
+        @param module_name Name of the ALModule receiving the callbacks.
+        @param callback_name Callback method name on that module.
+        """
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="asr-worker")
+        self.module_name = module_name
+        self.memory.subscribeToEvent(WORD_RECOGNIZED_EVENT, module_name, callback_name)
+        print(f"👂 Subscribed to {WORD_RECOGNIZED_EVENT} as '{module_name}'.")
+
+    def stop(self) -> None:
+        """Unsubscribes from the event and waits for running handlers to finish."""
+        if self.module_name:
+            try:
+                self.memory.unsubscribeToEvent(WORD_RECOGNIZED_EVENT, self.module_name)
+            except Exception as exc:
+                print(f"⚠️ Could not unsubscribe from {WORD_RECOGNIZED_EVENT}: {exc}")
+            self.module_name = None
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def on_word_recognized(self, key: str, value: Any, message: Any = None) -> bool:
+        """
+        ALMemory event callback. Returns quickly; the handler runs on the worker pool.
+
+        @param key Event name ("WordRecognized").
+        @param value Event value (see parse_recognition()).
+        @param message Subscriber identifier passed by NAOqi (unused).
+        @return True if the recognition was dispatched to the handler.
+        """
+        received = time.perf_counter()
+        parsed = parse_recognition(value)
+        with self._lock:
+            self.counters["events"] += 1
+            if parsed is None or self._executor is None:
+                self.counters["ignored"] += 1
+                return False
+            word, confidence = parsed
+            if confidence < self.confidence_threshold:
+                self.counters["low_confidence"] += 1
+                return False
+            last = self._last_accepted.get(word)
+            if last is not None and received - last < self.debounce_s:
+                self.counters["debounced"] += 1
+                return False
+            self._last_accepted[word] = received
+            self.counters["accepted"] += 1
+            executor = self._executor
+        executor.submit(self._run_handler, word, confidence, received)
+        return True
+
+    def _run_handler(self, word: str, confidence: float, received: float) -> None:
+        """Worker-side wrapper recording dispatch latency and handler errors. (Internal)"""
+        with self._lock:
+            self.dispatch_latencies_ms.append((time.perf_counter() - received) * 1000.0)
+        try:
+            self.on_keyword(word, confidence)
+        except Exception as exc:
+            print(f"❌ [ASR] Keyword handler failed for '{word}': {exc}")
+            with self._lock:
+                self.counters["handler_errors"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        @return Event counters and the median/max callback-to-handler latency in milliseconds.
+        """
+        with self._lock:
+            latencies = sorted(self.dispatch_latencies_ms)
+            result: Dict[str, Any] = dict(self.counters)
+        result["dispatch_p50_ms"] = round(latencies[len(latencies) // 2], 3) if latencies else None
+        result["dispatch_max_ms"] = round(latencies[-1], 3) if latencies else None
+        return result
+
+
+def create_naoqi_module(recognizer: KeywordRecognizer, ip: str, port: int = 9559,
+                        module_name: str = "StorytellerASR") -> Tuple[Any, Any]:
+    """
+    Starts a local NAOqi broker and registers an ALModule that forwards
+    WordRecognized callbacks to *recognizer* (NAOqi can only deliver events
+    to modules registered with a broker).
+
+    @param recognizer The recogniser to forward callbacks to.
+    @param ip NAO's IPv4 address.
+    @param port NAOqi port.
+    @param module_name Module name; NAOqi requires a module-level global with the same name.
+    @return (broker, module); call broker.shutdown() on exit.
+    """
+    from naoqi import ALBroker, ALModule
+
+    class _ASRModule(ALModule):
+        """Forwards WordRecognized events to the keyword recogniser."""
+
+        def onWordRecognized(self, key, value, message):
+            """Callback for the WordRecognized event."""
+            recognizer.on_word_recognized(key, value, message)
+
+    broker = ALBroker(f"{module_name}Broker", "0.0.0.0", 0, ip, port)
+    module = _ASRModule(module_name)
+    globals()[module_name] = module # NAOqi looks the module up by this global name
+    return broker, module
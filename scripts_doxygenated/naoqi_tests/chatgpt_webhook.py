@@ -15,6 +15,16 @@
 ##!
 ##! ### Environment variables
 ##! * **AI_STORYTELLER_TEST_KEY_CV** – Your OpenAI API key (secret).
+##! * **OPENAI_API_BASE** – Optional OpenAI-compatible base URL (e.g., a local fake server).
+##! * **HTTP_*** – Pooling, timeout, retry and circuit-breaker settings (see http_client.py).
+##! * **STORY_POOL_KEYWORDS** – Comma-separated words whose stories are pre-generated (default: hello,story,robot).
+##! * **STORY_POOL_*** – Pool size, story lifetime, workers and file location (see story_pool.py).
+##!
+##! ### Routes
+##! * **POST /generate_story** – `{"word": "..."}` → `{"story": "..."}`. Served from the
+##!   pre-generated story pool when it holds a story for the word; generated live otherwise.
+##! * **GET /http_stats** – connection reuse, setup time, retries and breaker state of the OpenAI client.
+##! * **GET /pool_stats** – story pool hits, misses and ready stories per word.
 ##!
 ##! ### Example (curl)
 ##! ```bash
@@ -27,24 +37,45 @@
 
 from __future__ import annotations # For postponed evaluation of type hints
 
+import atexit
 import os
+import sys
 import requests
 from flask import Flask, jsonify, request
-from typing import Dict, Any, Optional # Changed str | None to Optional[str]
+from typing import Dict, Any, List, Optional # Changed str | None to Optional[str]
+
+from http_client import HTTP_CONNECT_TIMEOUT, get_shared_client
+from story_pool import STORY_POOL_DIR, StoryFactory, StoryPool, keyword_key
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database"))
+from prompt_builder import PromptBuilder # noqa: E402  (import after sys.path setup)
 
-__all__ = ["create_app", "generate_story"]
+__all__ = ["build_story_request", "create_app", "create_story_pool", "generate_story"]
 
 
 # --- Configuration & Global Setup ---
 
 ## @var _OPENAI_API_URL
-# @brief OpenAI ChatCompletion API endpoint. (Internal constant)
-_OPENAI_API_URL: str = "https://api.openai.com/v1/chat/completions"
+# @brief OpenAI ChatCompletion API endpoint; OPENAI_API_BASE points it at a compatible server. (Internal constant)
+_OPENAI_API_URL: str = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1").rstrip("/") + "/chat/completions"
 
 ## @var _REQUEST_TIMEOUT
-# @brief Default timeout in seconds for requests to the OpenAI API. (Internal constant)
+# @brief Default read timeout in seconds for requests to the OpenAI API. (Internal constant)
 _REQUEST_TIMEOUT: int = 30 # seconds
 
+## @var _OPENAI_CLIENT
+# @brief Pooled keep-alive client for OpenAI (timeouts, jittered retries on 429/5xx, circuit breaker). (Internal)
+_OPENAI_CLIENT = get_shared_client("openai", read_timeout=_REQUEST_TIMEOUT)
+
+## @var STORY_POOL_KEYWORDS
+# @brief Words whose stories are pre-generated; defaults to the robot vocabulary of test_asr.py.
+STORY_POOL_KEYWORDS: List[str] = [word.strip() for word in os.getenv("STORY_POOL_KEYWORDS", "hello,story,robot").split(",")
+                                  if word.strip()]
+
+## @var STORY_PROMPT_BUILDER
+# @brief Assembles keyword-story messages (system prompt plus request) within the prompt token budget.
+STORY_PROMPT_BUILDER = PromptBuilder(system_prompt="You are a creative storyteller for children.")
+
 # Early warning if the primary API key environment variable is not set
 if not os.getenv("AI_STORYTELLER_TEST_KEY_CV"):
     print("⚠️ WARNING: Environment variable AI_STORYTELLER_TEST_KEY_CV is not set. "
@@ -65,6 +96,23 @@ def _openai_headers(api_key: str) -> Dict[str, str]:
     }
 
 
+def build_story_request(keyword: str, model: str = "gpt-4o-mini") -> Dict[str, Any]:
+    """
+    Builds the ChatCompletion request body for a keyword story (shared with the ASGI variant).
+
+    @param keyword The topic or noun for the story.
+    @param model The OpenAI ChatCompletion model to use.
+    @return The JSON request body.
+    """
+    prompt = f"Tell a short, imaginative children's story about {keyword}. Keep it under 5 paragraphs."
+    return {
+        "model": model,
+        "messages": STORY_PROMPT_BUILDER.build(prompt).messages, # System role for broader instruction, then the request
+        # "max_tokens": 250, # Optional: to control length further
+        # "temperature": 0.7 # Optional: to control creativity
+    }
+
+
 def generate_story(keyword: str, *, api_key: Optional[str] = None, model: str = "gpt-4o-mini") -> str:
     """
     Calls the OpenAI ChatCompletion API to generate a short children’s story based on a keyword.
@@ -84,30 +132,16 @@ def generate_story(keyword: str, *, api_key: Optional[str] = None, model: str =
         print("❌ Error in generate_story: OpenAI API key is not configured or provided.")
         return "Error: API key not set. Please configure the AI_STORYTELLER_TEST_KEY_CV environment variable."
 
-    request_body: Dict[str, Any] = {
-        "model": model,
-        "messages": [
-            {
-                "role": "system", # Using system role for broader instruction
-                "content": "You are a creative storyteller for children."
-            },
-            {
-                "role": "user",
-                "content": f"Tell a short, imaginative children's story about {keyword}. Keep it under 5 paragraphs."
-            }
-        ],
-        # "max_tokens": 250, # Optional: to control length further
-        # "temperature": 0.7 # Optional: to control creativity
-    }
+    request_body = build_story_request(keyword, model)
 
     print(f"ℹ️ Sending prompt to OpenAI (model: {model}): '... about {keyword}'")
 
     try:
-        resp = requests.post(
+        resp = _OPENAI_CLIENT.post(
             _OPENAI_API_URL,
             headers=_openai_headers(effective_api_key),
             json=request_body,
-            timeout=_REQUEST_TIMEOUT
+            timeout=(HTTP_CONNECT_TIMEOUT, _REQUEST_TIMEOUT)
         )
 
         if resp.status_code == 200:
@@ -132,4 +166,76 @@ def generate_story(keyword: str, *, api_key: Optional[str] = None, model: str =
         return "Error: The story generation service took too long to respond. Please try again later."
     except requests.exceptions.ConnectionError as e:
         print(f"❌ OpenAI connection error: {e}")
-        return "Error: Could not connect to
+        return "Error: Could not connect to the story generation service. Please check the network connection."
+    except requests.RequestException as e:
+        # Any other requests failure, including CircuitOpenError while OpenAI keeps failing
+        print(f"❌ OpenAI request failed: {e}")
+        return "Error: The story generation service is unavailable right now. Please try again later."
+
+
+# --- Story Pool ---
+
+def _pool_factory(keyword: str) -> StoryFactory:
+    """
+    @param keyword The topic or noun for the story.
+    @return A story factory for the pool; error messages from generate_story() count as failures.
+    """
+    def factory() -> Optional[str]:
+        story = generate_story(keyword)
+        return None if story.startswith("Error") else story
+    return factory
+
+
+def create_story_pool(keywords: Optional[List[str]] = None, path: Optional[str] = None, **options: Any) -> StoryPool:
+    """
+    Creates the pre-generated story pool, loads it from disk and starts filling it.
+
+    @param keywords Words to pre-generate stories for (default: STORY_POOL_KEYWORDS).
+    @param path Pool file (default: story_pool_keywords.json in STORY_POOL_DIR).
+    @param options StoryPool settings overriding the STORY_POOL_* defaults (size, ttl_seconds, workers, max_keys, learn_misses).
+    @return The running pool; it is saved again when the process exits.
+    """
+    pool = StoryPool(path=path or os.path.join(STORY_POOL_DIR, "story_pool_keywords.json"), **options)
+    for word in STORY_POOL_KEYWORDS if keywords is None else keywords:
+        pool.add_key(keyword_key(word), _pool_factory(word))
+    atexit.register(pool.close)
+    return pool.start()
+
+
+# --- Flask Application ---
+
+def create_app(story_pool: Optional[StoryPool] = None) -> Flask:
+    """
+    Builds the Flask application exposing the story endpoint.
+
+    @param story_pool Pre-generated story pool (default: a new one from create_story_pool()).
+    @return The configured Flask app.
+    """
+    app = Flask(__name__)
+    pool = story_pool if story_pool is not None else create_story_pool()
+
+    @app.route("/generate_story", methods=["POST"])
+    def generate_story_endpoint() -> Any:
+        """Turns `{"word": "..."}` into `{"story": "..."}`, from the story pool when possible."""
+        body: Dict[str, Any] = request.get_json(force=True, silent=True) or {}
+        keyword = body.get("word") or "an adventure"
+        story = pool.take(keyword_key(keyword), _pool_factory(keyword))
+        if story is None:
+            story = generate_story(keyword)
+        return jsonify({"story": story})
+
+    @app.route("/http_stats", methods=["GET"])
+    def http_stats_endpoint() -> Any:
+        """Connection reuse, setup time, retries and breaker state of the OpenAI client."""
+        return jsonify(_OPENAI_CLIENT.stats())
+
+    @app.route("/pool_stats", methods=["GET"])
+    def pool_stats_endpoint() -> Any:
+        """Story pool hits, misses and ready stories per word."""
+        return jsonify(pool.stats())
+
+    return app
+
+
+if __name__ == "__main__":
+    create_app().run(host="0.0.0.0", port=int(os.getenv("PORT", "5000")))
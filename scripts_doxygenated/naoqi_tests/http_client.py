@@ -0,0 +1,329 @@
+##! @file http_client.py
+##! @brief Shared HTTP client layer: pooled keep-alive sessions, timeouts, retries and a circuit breaker.
+##! @details
+##! A bare `requests.post()` opens a new connection for every call, so the robot
+##! pays TCP (and TLS) setup to reach the story webhook, and the webhook pays it
+##! again to reach OpenAI. PooledHttpClient wraps one `requests.Session` per
+##! service:
+##! - **Keep-alive pool**: connections are reused across calls and threads
+##!   (`HTTP_POOL_SIZE` per host).
+##! - **Timeouts**: separate connect and read timeouts on every call
+##!   (`HTTP_CONNECT_TIMEOUT`, `HTTP_READ_TIMEOUT`).
+##! - **Retries**: 429 and 5xx responses and failed connection attempts are
+##!   retried up to `HTTP_MAX_RETRIES` times with full-jitter exponential backoff.
+##!   A `Retry-After` header is honoured. Read timeouts are not retried, because
+##!   the server may already be generating a (billed) story.
+##! - **Circuit breaker**: after `HTTP_BREAKER_FAILURES` consecutive failures,
+##!   calls fail fast with CircuitOpenError for `HTTP_BREAKER_RESET_SECONDS`.
+##!   One trial call is then let through.
+##! - **Metrics**: requests, retries, new connections and the time spent setting
+##!   them up, and breaker rejections, via stats().
+##!
+##! CircuitOpenError derives from `requests.RequestException`, so existing
+##! `except requests.RequestException` handlers keep working.
+##!
+##! @author Calvin Vandor
+##! @date   2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+__all__ = ["CircuitBreaker", "CircuitOpenError", "PooledHttpClient", "get_shared_client"]
+
+# --- Configuration (environment variables) ---
+
+## @var HTTP_CONNECT_TIMEOUT
+# @brief Seconds to wait for a TCP/TLS connection to be established.
+HTTP_CONNECT_TIMEOUT: float = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05"))
+
+## @var HTTP_READ_TIMEOUT
+# @brief Seconds to wait for the server between bytes of the response.
+HTTP_READ_TIMEOUT: float = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+
+## @var HTTP_MAX_RETRIES
+# @brief Retries after the first attempt for 429/5xx responses and connection failures.
+HTTP_MAX_RETRIES: int = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+
+## @var HTTP_BACKOFF_BASE
+# @brief Base delay in seconds of the exponential backoff (the delay cap doubles per retry).
+HTTP_BACKOFF_BASE: float = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))
+
+## @var HTTP_BACKOFF_MAX
+# @brief Upper bound in seconds for a single backoff delay (also caps Retry-After).
+HTTP_BACKOFF_MAX: float = float(os.getenv("HTTP_BACKOFF_MAX", "8"))
+
+## @var HTTP_POOL_SIZE
+# @brief Keep-alive connections kept per host.
+HTTP_POOL_SIZE: int = int(os.getenv("HTTP_POOL_SIZE", "10"))
+
+## @var HTTP_BREAKER_FAILURES
+# @brief Consecutive failures that open the circuit breaker.
+HTTP_BREAKER_FAILURES: int = int(os.getenv("HTTP_BREAKER_FAILURES", "5"))
+
+## @var HTTP_BREAKER_RESET_SECONDS
+# @brief Seconds the breaker stays open before letting a trial request through.
+HTTP_BREAKER_RESET_SECONDS: float = float(os.getenv("HTTP_BREAKER_RESET_SECONDS", "30"))
+
+## @var RETRY_STATUSES
+# @brief Response codes that are retried (rate limiting and transient server errors).
+RETRY_STATUSES: Tuple[int, ...] = (429, 500, 502, 503, 504)
+
+
+class CircuitOpenError(requests.RequestException):
+    """Raised instead of sending a request while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker (closed → open → half-open → closed). Thread-safe.
+    """
+
+    def __init__(self, failure_threshold: int = HTTP_BREAKER_FAILURES, reset_timeout_s: float = HTTP_BREAKER_RESET_SECONDS):
+        """
+        @param failure_threshold Consecutive failures that open the circuit (0 disables the breaker).
+        @param reset_timeout_s Seconds to stay open before a single trial request is allowed.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.state = "closed"
+        self.failures = 0
+        self.opened_count = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        @return True if a request may be sent now. In the half-open state only one trial request is allowed.
+        """
+        if self.failure_threshold <= 0:
+            return True
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout_s:
+                self.state, self._trial_in_flight = "half_open", False
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        """Closes the circuit and resets the failure count."""
+        with self._lock:
+            self.state, self.failures, self._trial_in_flight = "closed", 0, False
+
+    def record_failure(self) -> None:
+        """Counts a failure; opens the circuit at the threshold or when a half-open trial fails."""
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.opened_count += 1
+                    print(f"⚡ Circuit breaker opened after {self.failures} consecutive failures.")
+                self.state, self._opened_at, self._trial_in_flight = "open", time.monotonic(), False
+
+
+class _ConnectionMetrics:
+    """Counts new connections and their setup time; shared with the pooled connection classes. (Internal)"""
+
+    def __init__(self) -> None:
+        self.opened = 0
+        self.setup_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self.opened += 1
+            self.setup_seconds += seconds
+
+
+class _TimedAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections report how long their TCP/TLS setup took. (Internal)"""
+
+    def __init__(self, metrics: _ConnectionMetrics, **kwargs: Any):
+        def timed(connection_cls: type) -> type:
+            class TimedConnection(connection_cls): # type: ignore[misc, valid-type]
+                def connect(self) -> None:
+                    started = time.perf_counter()
+                    super().connect()
+                    metrics.record(time.perf_counter() - started)
+            return TimedConnection
+
+        self._pool_classes = {
+            "http": type("TimedHTTPConnectionPool", (HTTPConnectionPool,), {"ConnectionCls": timed(HTTPConnection)}),
+            "https": type("TimedHTTPSConnectionPool", (HTTPSConnectionPool,), {"ConnectionCls": timed(HTTPSConnection)}),
+        }
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = self._pool_classes
+
+
+class PooledHttpClient:
+    """
+    Keep-alive HTTP client with timeouts, jittered retries and a circuit breaker.
+    One instance per remote service; safe to share between threads.
+    """
+
+    def __init__(self, name: str = "default", pool_size: int = HTTP_POOL_SIZE,
+                 connect_timeout: float = HTTP_CONNECT_TIMEOUT, read_timeout: float = HTTP_READ_TIMEOUT,
+                 max_retries: int = HTTP_MAX_RETRIES, backoff_base_s: float = HTTP_BACKOFF_BASE,
+                 backoff_max_s: float = HTTP_BACKOFF_MAX, retry_statuses: Iterable[int] = RETRY_STATUSES,
+                 breaker: Optional[CircuitBreaker] = None):
+        """
+        @param name Label used in log lines and stats.
+        @param pool_size Keep-alive connections kept per host.
+        @param connect_timeout Default connect timeout in seconds.
+        @param read_timeout Default read timeout in seconds.
+        @param max_retries Retries after the first attempt.
+        @param backoff_base_s Base delay of the exponential backoff.
+        @param backoff_max_s Maximum single backoff delay.
+        @param retry_statuses Response codes that are retried.
+        @param breaker Circuit breaker (default: a new one with the HTTP_BREAKER_* settings).
+        """
+        self.name = name
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max(0, max_retries)
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self.retry_statuses = frozenset(retry_statuses)
+        self.breaker = breaker or CircuitBreaker()
+        self._connections = _ConnectionMetrics()
+        self._session = requests.Session()
+        adapter = _TimedAdapter(self._connections, pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._counters: Dict[str, int] = {"requests": 0, "attempts": 0, "retries": 0, "failures": 0,
+                                          "circuit_rejections": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._counters[key] += 1
+
+    def _backoff(self, attempt: int, response: Optional[requests.Response]) -> float:
+        """Full-jitter delay before retry number *attempt* (1-based); honours a numeric Retry-After. (Internal)"""
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                return min(self.backoff_max_s, max(0.0, float(retry_after)))
+            except ValueError:
+                pass # HTTP-date form: fall back to the computed backoff
+        return random.uniform(0.0, min(self.backoff_max_s, self.backoff_base_s * (2 ** (attempt - 1))))
+
+    def request(self, method: str, url: str, **kwargs: Any) -> requests.Response:
+        """
+        Sends a request through the pool, retrying 429/5xx responses and failed connections.
+
+        @param method HTTP method.
+        @param url Absolute URL.
+        @param kwargs Passed to requests (json, headers, stream, ...). `timeout` defaults to
+               (connect_timeout, read_timeout).
+        @return The final response (possibly a 429/5xx once the retries are exhausted).
+        @raises CircuitOpenError If the circuit breaker is open.
+        @raises requests.RequestException On connection errors after the retries, and on read timeouts.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        self._count("requests")
+        if not self.breaker.allow():
+            self._count("circuit_rejections")
+            raise CircuitOpenError(f"Circuit breaker for '{self.name}' is open; not calling {url}.")
+
+        attempt = 0
+        while True:
+            self._count("attempts")
+            response: Optional[requests.Response] = None
+            try:
+                response = self._session.request(method, url, **kwargs)
+            except requests.exceptions.ConnectionError: # Includes ConnectTimeout, but not ReadTimeout
+                if attempt >= self.max_retries:
+                    self._count("failures")
+                    self.breaker.record_failure()
+                    raise
+            except requests.RequestException:
+                self._count("failures")
+                self.breaker.record_failure()
+                raise
+            else:
+                if response.status_code not in self.retry_statuses:
+                    self.breaker.record_success()
+                    return response
+                if attempt >= self.max_retries:
+                    self._count("failures")
+                    self.breaker.record_failure()
+                    return response
+                response.close() # Return the connection to the pool before sleeping
+
+            attempt += 1
+            self._count("retries")
+            delay = self._backoff(attempt, response)
+            print(f"🔁 [{self.name}] Retry {attempt}/{self.max_retries} in {delay:.2f}s "
+                  f"({response.status_code if response is not None else 'connection error'}).")
+            time.sleep(delay)
+
+    def post(self, url: str, **kwargs: Any) -> requests.Response:
+        """Shorthand for request("POST", url, ...)."""
+        return self.request("POST", url, **kwargs)
+
+    def get(self, url: str, **kwargs: Any) -> requests.Response:
+        """Shorthand for request("GET", url, ...)."""
+        return self.request("GET", url, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        @return Request, retry and connection counters, suitable for a JSON response. `connections_reused`
+                is the number of attempts served by an already-open keep-alive connection.
+        """
+        with self._lock:
+            result: Dict[str, Any] = dict(self._counters)
+        opened = self._connections.opened
+        result.update({
+            "name": self.name,
+            "connections_opened": opened,
+            "connections_reused": max(0, result["attempts"] - opened),
+            "connection_setup_ms_total": round(self._connections.setup_seconds * 1000.0, 2),
+            "connection_setup_ms_mean": round(self._connections.setup_seconds * 1000.0 / opened, 3) if opened else 0.0,
+            "circuit_state": self.breaker.state,
+            "circuit_opened": self.breaker.opened_count,
+        })
+        return result
+
+    def close(self) -> None:
+        """Closes all pooled connections."""
+        self._session.close()
+
+
+## @var _SHARED_CLIENTS
+# Process-wide clients by name, created on first use. (Internal)
+_SHARED_CLIENTS: Dict[str, PooledHttpClient] = {}
+_SHARED_LOCK = threading.Lock()
+
+
+def get_shared_client(name: str = "default", **options: Any) -> PooledHttpClient:
+    """
+    Returns the process-wide client for a service, creating it on first use.
+
+    @param name Service name (e.g., "openai", "storyteller").
+    @param options PooledHttpClient settings; only used when the client is created.
+    @return The shared client.
+    """
+    with _SHARED_LOCK:
+        client = _SHARED_CLIENTS.get(name)
+        if client is None:
+            client = _SHARED_CLIENTS[name] = PooledHttpClient(name, **options)
+        return client
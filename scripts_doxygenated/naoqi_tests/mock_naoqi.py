@@ -0,0 +1,204 @@
+##! @file mock_naoqi.py
+##! @brief In-process stand-ins for the NAOqi proxies used by the NAO scripts.
+##! @details
+##! The NAOqi SDK and a robot are not always at hand (CI machines, laptops,
+##! benchmarks). MockALProxy mirrors the small part of `naoqi.ALProxy` these
+##! scripts use, with speech that takes real time, so pipelines can be timed:
+##! - **ALTextToSpeech**: `say()` blocks for the simulated speaking time;
+##!   `post.say()` starts it in the background and returns a task ID that
+##!   `wait(task_id, timeout_ms)`, `isRunning(task_id)` and `stop(task_id)` accept.
+##!   Like the real module, sentences are spoken one at a time.
+##! - **ALMemory**: `getData`/`insertData`, `raiseEvent` and
+##!   `subscribeToEvent(event, module, callback)`. Modules are looked up with
+##!   register_module() instead of a NAOqi broker. publish_recognitions()
+##!   raises synthetic WordRecognized events at a given rate.
+##! - Any other module name returns a recorder that accepts every call.
+##!
+##! @author Calvin Vandor
+##! @date   2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import itertools
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+__all__ = ["MockALProxy", "MockMemory", "MockTextToSpeech"]
+
+
+class _PostCalls:
+    """`proxy.post` namespace: every method runs in the background and returns a task ID. (Internal)"""
+
+    def __init__(self, owner: "MockTextToSpeech"):
+        self._owner = owner
+
+    def say(self, text: str) -> int:
+        return self._owner._start(text)
+
+
+class MockTextToSpeech:
+    """Simulated ALTextToSpeech whose speaking time grows with the number of words."""
+
+    def __init__(self, words_per_second: float = 2.5, call_latency_ms: float = 2.0):
+        """
+        @param words_per_second Simulated speaking rate (NAO speaks roughly 2–3 words per second).
+        @param call_latency_ms Simulated round-trip time of every proxy call.
+        """
+        self.words_per_second = words_per_second
+        self.call_latency_s = call_latency_ms / 1000.0
+        self.post = _PostCalls(self)
+        ## (task ID, text, start, end) of every spoken sentence, in speaking order.
+        self.spoken: List[Tuple[int, str, float, float]] = []
+        self._ids = itertools.count(1)
+        self._tasks: Dict[int, threading.Event] = {}
+        self._stopped: Dict[int, threading.Event] = {}
+        self._speaker = threading.Lock() # One sentence at a time, like the real module
+
+    def _duration(self, text: str) -> float:
+        return len(text.split()) / self.words_per_second
+
+    def _speak(self, task_id: int, text: str) -> None:
+        with self._speaker:
+            start = time.perf_counter()
+            self._stopped[task_id].wait(self._duration(text))
+            self.spoken.append((task_id, text, start, time.perf_counter()))
+        self._tasks[task_id].set()
+
+    def _start(self, text: str) -> int:
+        time.sleep(self.call_latency_s)
+        task_id = next(self._ids)
+        self._tasks[task_id] = threading.Event()
+        self._stopped[task_id] = threading.Event()
+        threading.Thread(target=self._speak, args=(task_id, text), daemon=True).start()
+        return task_id
+
+    def say(self, text: str) -> None:
+        """Speaks *text* and returns when done."""
+        self.wait(self._start(text), 0)
+
+    def wait(self, task_id: int, timeout_ms: int) -> bool:
+        """
+        @param task_id ID returned by post.say().
+        @param timeout_ms Maximum wait in milliseconds; 0 waits indefinitely.
+        @return True if the task finished.
+        """
+        time.sleep(self.call_latency_s)
+        done = self._tasks.get(task_id)
+        return True if done is None else done.wait(None if timeout_ms == 0 else timeout_ms / 1000.0)
+
+    def isRunning(self, task_id: int) -> bool:
+        done = self._tasks.get(task_id)
+        return done is not None and not done.is_set()
+
+    def stop(self, task_id: int) -> None:
+        time.sleep(self.call_latency_s)
+        if task_id in self._stopped:
+            self._stopped[task_id].set()
+
+    def stopAll(self) -> None:
+        for stopped in list(self._stopped.values()):
+            stopped.set()
+
+
+class MockMemory:
+    """Simulated ALMemory that delivers events to subscribed callbacks on the publishing thread."""
+
+    def __init__(self) -> None:
+        self.data: Dict[str, Any] = {}
+        self.rpc_calls = 0
+        self._modules: Dict[str, Any] = {}
+        self._subscribers: Dict[str, Dict[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def register_module(self, name: str, module: Any) -> None:
+        """
+        Makes *module* reachable by name, as a broker-registered ALModule would be.
+
+        @param name Module name used in subscribeToEvent().
+        @param module Object with the callback methods.
+        """
+        self._modules[name] = module
+
+    def subscribeToEvent(self, event: str, module_name: str, callback_name: str) -> None:
+        if module_name not in self._modules:
+            raise RuntimeError(f"Module '{module_name}' is not registered.")
+        with self._lock:
+            self._subscribers.setdefault(event, {})[module_name] = callback_name
+
+    def unsubscribeToEvent(self, event: str, module_name: str) -> None:
+        with self._lock:
+            self._subscribers.get(event, {}).pop(module_name, None)
+
+    def getData(self, key: str) -> Any:
+        self.rpc_calls += 1
+        return self.data.get(key)
+
+    def insertData(self, key: str, value: Any) -> None:
+        self.data[key] = value
+
+    def raiseEvent(self, event: str, value: Any) -> None:
+        """Stores *value* under *event* and calls every subscriber's callback(event, value, module_name)."""
+        self.data[event] = value
+        with self._lock:
+            subscribers = list(self._subscribers.get(event, {}).items())
+        for module_name, callback_name in subscribers:
+            getattr(self._modules[module_name], callback_name)(event, value, module_name)
+
+    def publish_recognitions(self, recognitions: List[Tuple[str, float]], rate_hz: float,
+                             event: str = "WordRecognized") -> threading.Thread:
+        """
+        Raises one WordRecognized event per (word, confidence) pair at a steady rate on a background thread.
+
+        @param recognitions Synthetic recognitions, in order.
+        @param rate_hz Events per second.
+        @param event Event name.
+        @return The publishing thread (join() it to wait for the end).
+        """
+        def publish() -> None:
+            interval = 1.0 / rate_hz
+            next_at = time.perf_counter()
+            for word, confidence in recognitions:
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                self.raiseEvent(event, [word, confidence])
+                next_at += interval
+
+        thread = threading.Thread(target=publish, name="mock-almemory", daemon=True)
+        thread.start()
+        return thread
+
+
+class _Recorder:
+    """Accepts any method call and records it. (Internal)"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls: List[Tuple[str, tuple]] = []
+
+    def __getattr__(self, method: str) -> Any:
+        if method.startswith("__"):
+            raise AttributeError(method)
+
+        def record(*args: Any) -> None:
+            self.calls.append((method, args))
+        return record
+
+
+def MockALProxy(name: str, ip: Optional[str] = None, port: int = 9559, **options: Any) -> Any:
+    """
+    Drop-in replacement for `naoqi.ALProxy(name, ip, port)`.
+
+    @param name NAOqi module name (e.g., "ALTextToSpeech").
+    @param ip Ignored.
+    @param port Ignored.
+    @param options Passed to the mock's constructor (e.g., words_per_second for ALTextToSpeech).
+    @return A simulated proxy.
+    """
+    if name == "ALTextToSpeech":
+        return MockTextToSpeech(**options)
+    if name == "ALMemory":
+        return MockMemory()
+    return _Recorder(name)
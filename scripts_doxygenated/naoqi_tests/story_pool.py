@@ -0,0 +1,402 @@
+##! @file story_pool.py
+##! @brief Pool of pre-generated stories per keyword (or theme/moral pair), refilled in the background.
+##! @details
+##! The robot only knows a handful of words, yet every recognition used to wait
+##! several seconds for a fresh LLM story. StoryPool keeps up to N ready-made
+##! stories per key. take() hands one out at once, and worker threads generate
+##! replacements while the robot is talking.
+##!
+##! - Every key has a *factory*, a zero-argument callable that generates one story
+##!   (for example `lambda: generate_story("dragon")`). Only the keys configured up
+##!   front are pooled by default. Learning runtime keys is opt-in: with learn_misses
+##!   set, take() registers an unpooled key (up to max_keys) once it has missed that
+##!   many times, and a learned key that is not asked for within ttl_seconds is dropped again.
+##! - A failed generation backs its key off exponentially (from _RETRY_BACKOFF_S up to
+##!   _MAX_RETRY_BACKOFF_S) before it is refilled again; a learned key is dropped
+##!   after _MAX_FAILURES failures in a row.
+##! - Each story is served at most once. Stories older than ttl_seconds are
+##!   dropped, so the pool never tells yesterday's story again.
+##! - The pool is written to a JSON file (atomically, via a temporary file and
+##!   os.replace) after changes and on close(). On start it is loaded back
+##!   without the expired stories, so a restarted webhook answers from the pool at once.
+##!
+##! ### Environment variables
+##! * **STORY_POOL_SIZE** — stories kept per key (default 3; 0 disables the pool).
+##! * **STORY_POOL_TTL_SECONDS** — maximum age of a pooled story (default 86400).
+##! * **STORY_POOL_WORKERS** — background generation threads (default 2).
+##! * **STORY_POOL_MAX_KEYS** — maximum number of pooled keys (default 64).
+##! * **STORY_POOL_LEARN_MISSES** — misses after which take() starts pooling an
+##!   unconfigured key (default 0: only configured keys are pooled).
+##! * **STORY_POOL_DIR** — directory of the pool files (default: this directory).
+##!
+##! @author Calvin Vandor
+##! @date 2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+__all__ = ["STORY_POOL_DIR", "STORY_POOL_SIZE", "StoryPool", "keyword_key", "theme_key"]
+
+## @var STORY_POOL_SIZE
+# Ready-made stories kept per key (0 disables the pool).
+STORY_POOL_SIZE: int = int(os.getenv("STORY_POOL_SIZE", "3"))
+
+## @var STORY_POOL_TTL_SECONDS
+# Maximum age of a pooled story, in seconds.
+STORY_POOL_TTL_SECONDS: float = float(os.getenv("STORY_POOL_TTL_SECONDS", "86400"))
+
+## @var STORY_POOL_WORKERS
+# Background threads generating replacement stories.
+STORY_POOL_WORKERS: int = int(os.getenv("STORY_POOL_WORKERS", "2"))
+
+## @var STORY_POOL_MAX_KEYS
+# Maximum number of keys kept in the pool (configured plus learned ones).
+STORY_POOL_MAX_KEYS: int = int(os.getenv("STORY_POOL_MAX_KEYS", "64"))
+
+## @var STORY_POOL_LEARN_MISSES
+# Misses of an unpooled key before take() registers it (0 disables learning runtime keys).
+STORY_POOL_LEARN_MISSES: int = int(os.getenv("STORY_POOL_LEARN_MISSES", "0"))
+
+## @var STORY_POOL_DIR
+# Directory holding the pool files.
+STORY_POOL_DIR: str = os.getenv("STORY_POOL_DIR", os.path.dirname(os.path.abspath(__file__)))
+
+#: Pool file format version
+_FILE_VERSION = 1
+
+#: Seconds between maintenance passes (expiry, top-up, save)
+_MAINTENANCE_INTERVAL_S = 30.0
+
+#: Wait before refilling a key after its first failed generation; doubles with each further failure
+_RETRY_BACKOFF_S = 30.0
+
+#: Upper bound of the refill backoff
+_MAX_RETRY_BACKOFF_S = 3600.0
+
+#: Failures in a row after which a learned key is dropped
+_MAX_FAILURES = 5
+
+StoryFactory = Callable[[], Optional[str]]
+
+
+def keyword_key(word: str) -> str:
+    """
+    @param word A recognised keyword (e.g., from test_asr.py).
+    @return The pool key of keyword stories about *word*.
+    """
+    return "word:" + " ".join(word.lower().split())
+
+
+def theme_key(theme: str, moral: str) -> str:
+    """
+    @param theme Story setting from the Dialogflow webhook.
+    @param moral Lesson from the Dialogflow webhook.
+    @return The pool key of stories for the theme/moral pair.
+    """
+    return f"theme:{' '.join(theme.lower().split())}|moral:{' '.join(moral.lower().split())}"
+
+
+class StoryPool:
+    """
+    Thread-safe pool of ready-made stories, refilled by background threads and
+    persisted to a JSON file.
+    """
+
+    def __init__(self, path: Optional[str] = None, size: int = STORY_POOL_SIZE,
+                 ttl_seconds: float = STORY_POOL_TTL_SECONDS, workers: int = STORY_POOL_WORKERS,
+                 max_keys: int = STORY_POOL_MAX_KEYS, learn_misses: int = STORY_POOL_LEARN_MISSES):
+        """
+        @param path JSON file the pool is saved to and loaded from, or None to keep it in memory.
+        @param size Stories kept per key. 0 disables the pool (take() always misses).
+        @param ttl_seconds Maximum age of a pooled story.
+        @param workers Background generation threads.
+        @param max_keys Maximum number of pooled keys.
+        @param learn_misses Misses of an unpooled key before take() registers it; 0 pools configured keys only.
+        """
+        self.path = path
+        self.size = size
+        self.ttl_seconds = ttl_seconds
+        self.max_keys = max_keys
+        self.learn_misses = learn_misses
+        self._stories: Dict[str, Deque[Tuple[float, str]]] = {}
+        self._factories: Dict[str, StoryFactory] = {}
+        self._pending: Dict[str, int] = {}
+        self._learned: Dict[str, float] = {} # Learned key -> time of its last take()
+        self._key_misses: Dict[str, int] = {} # Unpooled key -> misses so far
+        self._failures: Dict[str, int] = {} # Key -> failed generations in a row
+        self._retry_at: Dict[str, float] = {} # Key -> time before which it is not refilled
+        self._counters: Dict[str, int] = {key: 0 for key in (
+            "hits", "misses", "generated", "generation_failures", "expired", "loaded", "saves",
+            "learned_keys", "dropped_keys")}
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="story-pool")
+        self._maintainer: Optional[threading.Thread] = None
+        if path and self.enabled:
+            self._load()
+
+    @property
+    def enabled(self) -> bool:
+        """True unless the pool was configured with size = 0."""
+        return self.size > 0
+
+    # --- Keys and factories ---
+
+    def add_key(self, key: str, factory: StoryFactory) -> bool:
+        """
+        Registers *key* so it is kept topped up, and schedules its refill.
+
+        @param key A key from keyword_key() or theme_key().
+        @param factory Generates one story; returns None (or raises) on failure.
+        @return False if the pool is disabled or already holds max_keys keys.
+        """
+        if not self.enabled:
+            return False
+        with self._lock:
+            if key not in self._factories and len(self._factories) >= self.max_keys:
+                return False
+            self._factories[key] = factory
+            self._stories.setdefault(key, deque())
+            self._learned.pop(key, None) # Configured explicitly: never dropped as idle
+        self._schedule_refill(key)
+        return True
+
+    def _learn_locked(self, key: str, factory: StoryFactory) -> bool:
+        """
+        Counts a miss of the unpooled *key* and registers it once it reaches learn_misses. Caller holds the lock.
+
+        @return True if the key was registered.
+        """
+        misses = self._key_misses.pop(key, 0) + 1
+        if misses < self.learn_misses:
+            if len(self._key_misses) >= self.max_keys * 8: # Bound the tally: forget the oldest candidate
+                del self._key_misses[next(iter(self._key_misses))]
+            self._key_misses[key] = misses
+            return False
+        if len(self._factories) >= self.max_keys:
+            return False
+        self._factories[key] = factory
+        self._stories.setdefault(key, deque())
+        self._learned[key] = time.time()
+        self._counters["learned_keys"] += 1
+        return True
+
+    def _drop_key_locked(self, key: str) -> None:
+        """Unregisters a learned key and discards its stories. Caller holds the lock."""
+        self._factories.pop(key, None)
+        self._learned.pop(key, None)
+        self._failures.pop(key, None)
+        self._retry_at.pop(key, None)
+        if self._stories.pop(key, None):
+            self._dirty = True
+        self._counters["dropped_keys"] += 1
+
+    def start(self, interval_s: float = _MAINTENANCE_INTERVAL_S) -> "StoryPool":
+        """
+        Starts the maintenance thread, which expires stale stories, tops up every key and
+        saves the pool every *interval_s* seconds.
+
+        @return self, for chaining.
+        """
+        if self.enabled and self._maintainer is None:
+            self._maintainer = threading.Thread(target=self._maintain, args=(interval_s,), name="story-pool-maintenance",
+                                                daemon=True)
+            self._maintainer.start()
+        return self
+
+    # --- Serving ---
+
+    def take(self, key: str, factory: Optional[StoryFactory] = None) -> Optional[str]:
+        """
+        Hands out the oldest unexpired story for *key* and schedules a replacement.
+
+        @param key A key from keyword_key() or theme_key().
+        @param factory Generates stories for *key* if it is learned: when learn_misses is set and
+               the unpooled key has missed that many times (and there is room).
+        @return A story, or None if the pool has none for *key* (generate one live then).
+        """
+        if not self.enabled:
+            return None
+        story: Optional[str] = None
+        with self._lock:
+            self._expire_locked(key)
+            queue = self._stories.get(key)
+            if queue:
+                story = queue.popleft()[1]
+                self._dirty = True
+                self._counters["hits"] += 1
+            else:
+                self._counters["misses"] += 1
+            if key in self._learned:
+                self._learned[key] = time.time()
+            elif key not in self._factories and factory is not None and self.learn_misses > 0:
+                self._learn_locked(key, factory)
+        self._schedule_refill(key)
+        return story
+
+    def available(self, key: str) -> int:
+        """@return Number of unexpired stories ready for *key*."""
+        with self._lock:
+            self._expire_locked(key)
+            return len(self._stories.get(key, ()))
+
+    # --- Refilling ---
+
+    def _schedule_refill(self, key: str) -> None:
+        """Submits generation jobs until ready plus pending stories for *key* reach the pool size."""
+        with self._lock:
+            if self._closed.is_set() or key not in self._factories or time.time() < self._retry_at.get(key, 0.0):
+                return
+            missing = self.size - len(self._stories.get(key, ())) - self._pending.get(key, 0)
+            if missing <= 0:
+                return
+            self._pending[key] = self._pending.get(key, 0) + missing
+        for _ in range(missing):
+            self._executor.submit(self._generate, key)
+
+    def _generate(self, key: str) -> None:
+        """Worker job: generates one story for *key* and adds it to the pool."""
+        story: Optional[str] = None
+        try:
+            factory = self._factories.get(key)
+            if factory is not None and not self._closed.is_set():
+                story = factory()
+        except Exception as exc: # Factories call the network; a failure only means one story fewer
+            print(f"⚠️ Story pool: generation for '{key}' failed: {exc}")
+        with self._lock:
+            self._pending[key] -= 1
+            if key not in self._factories: # Dropped while generating
+                return
+            if story:
+                self._stories.setdefault(key, deque()).append((time.time(), story))
+                self._counters["generated"] += 1
+                self._dirty = True
+                self._failures.pop(key, None)
+                self._retry_at.pop(key, None)
+            elif not self._closed.is_set():
+                self._counters["generation_failures"] += 1
+                failures = self._failures[key] = self._failures.get(key, 0) + 1
+                if key in self._learned and failures >= _MAX_FAILURES:
+                    print(f"⚠️ Story pool: dropping '{key}' after {failures} failed generations in a row")
+                    self._drop_key_locked(key)
+                else:
+                    self._retry_at[key] = time.time() + min(_MAX_RETRY_BACKOFF_S, _RETRY_BACKOFF_S * 2 ** (failures - 1))
+
+    def _expire_locked(self, key: str) -> None:
+        """Drops stories of *key* older than the TTL. Caller holds the lock."""
+        queue = self._stories.get(key)
+        cutoff = time.time() - self.ttl_seconds
+        while queue and queue[0][0] < cutoff:
+            queue.popleft()
+            self._counters["expired"] += 1
+            self._dirty = True
+
+    def _maintain(self, interval_s: float) -> None:
+        """Maintenance loop: expire, drop idle learned keys, top up (retrying failed generations once backed off) and save."""
+        while not self._closed.wait(interval_s):
+            with self._lock:
+                idle_before = time.time() - self.ttl_seconds
+                for key in [key for key, last_taken in self._learned.items() if last_taken < idle_before]:
+                    self._drop_key_locked(key)
+                keys = list(self._stories)
+                for key in keys:
+                    self._expire_locked(key)
+            for key in keys:
+                self._schedule_refill(key)
+            self.save()
+
+    # --- Persistence ---
+
+    def _load(self) -> None:
+        """Loads unexpired stories from self.path; a missing or unreadable file means a cold start."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f: # type: ignore[arg-type]
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as exc:
+            print(f"⚠️ Story pool: ignoring unreadable pool file {self.path}: {exc}")
+            return
+        if data.get("version") != _FILE_VERSION:
+            return
+        cutoff = time.time() - self.ttl_seconds
+        for key, entries in data.get("stories", {}).items():
+            fresh = [(float(created), text) for created, text in entries if float(created) >= cutoff and text]
+            self._stories[key] = deque(sorted(fresh)[-self.size:])
+            self._counters["loaded"] += len(self._stories[key])
+        print(f"♻️ Story pool: loaded {self._counters['loaded']} stories from {self.path}")
+
+    def save(self) -> bool:
+        """
+        Writes the pool to self.path if it changed since the last save.
+
+        @return True if the file was written.
+        """
+        if not self.path or not self.enabled:
+            return False
+        with self._lock:
+            if not self._dirty:
+                return False
+            data = {"version": _FILE_VERSION, "saved_at": time.time(),
+                    "stories": {key: [list(entry) for entry in queue] for key, queue in self._stories.items() if queue}}
+            self._dirty = False
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as exc:
+            print(f"⚠️ Story pool: could not save {self.path}: {exc}")
+            with self._lock:
+                self._dirty = True
+            return False
+        with self._lock:
+            self._counters["saves"] += 1
+        return True
+
+    def close(self, wait: bool = False) -> None:
+        """
+        Stops refilling and saves the pool.
+
+        @param wait Wait for in-flight generations (their stories are saved too).
+        """
+        self._closed.set()
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+        if self._maintainer is not None:
+            self._maintainer.join()
+            self._maintainer = None
+        self.save()
+
+    # --- Reporting ---
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        @return Hit/miss counters and per-key sizes, suitable for a JSON response.
+        """
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                "enabled": self.enabled,
+                **self._counters,
+                "hit_rate": round(self._counters["hits"] / lookups, 4) if lookups else 0.0,
+                "size_per_key": self.size,
+                "ttl_seconds": self.ttl_seconds,
+                "keys": {key: {"ready": len(queue), "pending": self._pending.get(key, 0),
+                               "learned": key in self._learned, "failures": self._failures.get(key, 0)}
+                         for key, queue in sorted(self._stories.items())},
+                "path": self.path,
+            }
+
+    def keys(self) -> List[str]:
+        """@return The registered (topped-up) keys."""
+        with self._lock:
+            return sorted(self._factories)
@@ -10,10 +10,18 @@
 ##! graph TD
 ##!     A[main()] --> B[init_proxies()]
 ##!     B --> C[configure_asr()]
-##!     C --> D[listen loop]
-##!     D --> E[fetch_story()] --> F[speak_story()]
+##!     C --> D[KeywordRecognizer (WordRecognized events)]
+##!     D --> E[fetch_story_chunks()] --> F[SentencePipeline.play()]
 ##! ```
 ##!
+##! Stories are spoken sentence by sentence through tts_pipeline.SentencePipeline
+##! (non-blocking `post.say`), so NAO starts talking as soon as the first sentence
+##! is available and NAO keeps listening while it speaks. Keywords arrive as
+##! ALMemory `WordRecognized` events through asr_service.KeywordRecognizer
+##! (confidence threshold, debounce, worker pool) instead of polling. With
+##! `STORY_STREAM_URL` set, the story is streamed from webhook.py's
+##! `/webhook/stream?format=text` route and speech starts before generation ends.
+##!
 ##! @author  Calvin Vandor
 ##! @date    2025-05-08
 ##! @copyright MIT
@@ -22,8 +30,14 @@
 from __future__ import print_function  # Py2/3 print compatibility
 
 from naoqi import ALProxy
+import os
 import requests
+import threading
 import time
+
+from asr_service import KeywordRecognizer, create_naoqi_module
+from http_client import HTTP_CONNECT_TIMEOUT, get_shared_client
+from tts_pipeline import SentencePipeline
 # Consider adding 'from typing import Tuple, List, Dict, Any, Optional' if adding Python type hints
 
 # ---------------------------------------------------------------------------
@@ -39,10 +53,33 @@ NAO_IP = "192.168.1.120"
 ##! @note Expected to receive JSON `{"word": "recognized_word"}` and return JSON `{"story": "story_text"}`.
 WEBHOOK_URL = "http://localhost:5000/generate_story"
 
+##! @var STORY_STREAM_URL
+##! @brief Optional streaming story endpoint (webhook.py `/webhook/stream?format=text`).
+##! @note When set, the recognised word is sent as the story theme and sentences are spoken
+##!       as they stream in; when empty, the complete story is fetched from WEBHOOK_URL.
+STORY_STREAM_URL = os.getenv("STORY_STREAM_URL", "")
+
 ##! @var VOCABULARY
 ##! @brief Words NAO should detect via ALSpeechRecognition.
 VOCABULARY = ["hello", "story", "robot"]
 
+##! @var CONFIDENCE_THRESHOLD
+##! @brief Recognitions below this confidence are ignored (reduces false positives).
+CONFIDENCE_THRESHOLD = 0.6
+
+##! @var DEBOUNCE_SECONDS
+##! @brief Repeats of the same keyword within this window are treated as one.
+DEBOUNCE_SECONDS = 2.0
+
+##! @var ASR_MODULE_NAME
+##! @brief Name of the local ALModule that receives WordRecognized callbacks.
+ASR_MODULE_NAME = "StorytellerASR"
+
+##! @var STORY_CLIENT
+##! @brief Pooled keep-alive HTTP client for the story webhook, so each keyword reuses
+##!        the open connection (with timeouts, retries and a circuit breaker).
+STORY_CLIENT = get_shared_client("storyteller")
+
 # ---------------------------------------------------------------------------
 # Helper functions (documented for Doxygen)
 # ---------------------------------------------------------------------------
@@ -89,7 +126,7 @@ def fetch_story(word):
     print(f"📞 Calling webhook at {WEBHOOK_URL} with word: '{word}'")
     try:
         # Webhook expects JSON: {"word": "recognized_word"}
-        resp = requests.post(WEBHOOK_URL, json={"word": word}, timeout=10) # Added timeout
+        resp = STORY_CLIENT.post(WEBHOOK_URL, json={"word": word}, timeout=(HTTP_CONNECT_TIMEOUT, 10))
         resp.raise_for_status() # Raise an HTTPError for bad responses (4XX or 5XX)
         
         # Webhook response expected JSON: {"story": "generated_story_text"}
@@ -108,24 +145,62 @@ def fetch_story(word):
         return "The storyteller service gave a response I couldn't understand."
 
 
-def speak_story(tts, text):
-    """Play *text* aloud via NAO’s Text-to-Speech.
+def fetch_story_chunks(word):
+    """Yield the story for *word* as text chunks, for SentencePipeline.play().
 
-    @param tts   ALTextToSpeech proxy.
-    @param text  Unicode or UTF-8 story string.
+    Streams sentences from STORY_STREAM_URL while they are generated if it is
+    configured; otherwise yields the complete story from fetch_story().
+
+    @param word  The keyword recognised by NAO (e.g. ``"hello"``).
+    @return      Generator of story text chunks (runs on the pipeline's producer thread).
     """
-    # Encode to UTF-8 and replace newlines with spaces for smoother speech flow.
-    # NAO's TTS might handle raw newlines as pauses, but spaces ensure continuity.
-    story_clean = text.encode('utf-8').replace(b"\n", b" ")
-    print("🗣️ NAO speaking story…")
-    tts.say(story_clean)
-    print("✅ Story spoken.")
+    if not STORY_STREAM_URL:
+        story = fetch_story(word)
+        print(f"📖 [Story Received] '{story[:100]}...'") # Print a preview
+        yield story
+        return
+
+    print(f"📞 Streaming story from {STORY_STREAM_URL} with theme: '{word}'")
+    payload = {"sessionInfo": {"parameters": {"theme": word}}}
+    try:
+        with STORY_CLIENT.post(STORY_STREAM_URL, json=payload, stream=True, timeout=(HTTP_CONNECT_TIMEOUT, 10)) as resp:
+            resp.raise_for_status()
+            resp.encoding = resp.encoding or "utf-8"
+            for chunk in resp.iter_content(chunk_size=None, decode_unicode=True):
+                yield chunk
+    except requests.RequestException as exc:
+        print(f"❌ [webhook error] Story stream failed: {exc}")
+        yield " Sorry, I couldn't reach the storyteller service right now."
 
 
 # ---------------------------------------------------------------------------
 # Main control loop
 # ---------------------------------------------------------------------------
 
+def make_keyword_handler(pipeline):
+    """Build the handler KeywordRecognizer calls for each accepted keyword.
+
+    @param pipeline  SentencePipeline that plays the stories.
+    @return          Callable ``handler(word, confidence)``; thread-safe.
+    """
+    lock = threading.Lock()
+
+    def handle_keyword(word, confidence):
+        with lock: # Workers may race on the same keyword burst
+            if pipeline.busy:
+                # Still telling the previous story; keep listening without interrupting it.
+                print(f"⏭️ [ASR] Ignoring '{word}' while a story is playing.")
+                return
+            print(f"🔍 [ASR] Recognized: '{word}' (Confidence: {confidence:.2f})")
+            # Returns immediately: the story is fetched and spoken sentence by
+            # sentence on the pipeline's threads.
+            print("🗣️ NAO speaking story…")
+            pipeline.play(fetch_story_chunks(word))
+        print("--- Waiting for next keyword ---")
+
+    return handle_keyword
+
+
 def main():
     """Entry point — initialises proxies, listens for a keyword and narrates
     the resulting story until **Ctrl-C** is pressed.
@@ -135,53 +210,26 @@ def main():
     # Relax motors to reduce motor noise during listening and allow NAO to focus.
     motion.setStiffnesses("Body", 0.0)
 
+    pipeline = SentencePipeline(tts)
+    # ALSpeechRecognition raises "WordRecognized" ([word, confidence, ...]) for each
+    # recognition; NAOqi calls the recogniser back, so there is no polling loop.
+    recognizer = KeywordRecognizer(memory, make_keyword_handler(pipeline),
+                                   confidence_threshold=CONFIDENCE_THRESHOLD, debounce_s=DEBOUNCE_SECONDS)
+    broker, _ = create_naoqi_module(recognizer, NAO_IP, module_name=ASR_MODULE_NAME)
+    recognizer.start(ASR_MODULE_NAME)
     configure_asr(asr, VOCABULARY)
     print(f"👂 Listening… Say one of: {VOCABULARY}")
 
     try:
         while True:
-            # Retrieve data from ALMemory where ASR posts recognition results.
-            # "WordRecognized" event data: [recognized_word_string, confidence_value]
-            word_data = memory.getData("WordRecognized")
-
-            if word_data and len(word_data) >= 2:
-                # NAOqi might add <...> around spotted words; strip them for the raw word.
-                recognised_word = word_data[0].strip("<...>").strip()
-                confidence      = word_data[1]
-
-                # Filter out low-confidence recognitions to reduce false positives.
-                # 0.6 is a common threshold; adjust based on performance.
-                if confidence < 0.6:
-                    # Clear the event so it's not re-processed immediately if no new word is spoken.
-                    # This is important as getData("WordRecognized") might return the same old data.
-                    # However, directly clearing "WordRecognized" is not standard.
-                    # ASR usually clears it or it's an event you subscribe to.
-                    # For a polling loop like this, ensuring ASR is set to not repeat old data
-                    # or handling it by timestamp/flag might be needed if issues arise.
-                    # For now, a simple sleep and continue.
-                    time.sleep(0.1) # Shorter sleep if just filtering confidence
-                    continue
-
-                print(f"🔍 [ASR] Recognized: '{recognised_word}' (Confidence: {confidence:.2f})")
-
-                story = fetch_story(recognised_word)
-                print(f"📖 [Story Received] '{story[:100]}...'") # Print a preview
-                
-                speak_story(tts, story)
-                
-                # After processing a word, it's good practice to ensure ALMemory doesn't keep serving the same event.
-                # Depending on NAOqi version and ASR settings, you might need to manually clear it
-                # or rely on ASR to only update it on new recognitions.
-                # For simplicity, we assume ASR updates it. A small delay helps.
-                print("--- Waiting for next keyword ---")
-
-
-            # Brief sleep to prevent a tight loop consuming too much CPU if no word is recognized.
-            time.sleep(0.5) 
-
+            time.sleep(1.0) # Everything happens in NAOqi callbacks and worker threads
     except KeyboardInterrupt:
         print("\n🚫 Ctrl-C detected. Stopping ASR and exiting...")
     finally:
+        recognizer.stop()
+        if pipeline.busy:
+            print("🤫 Stopping the story in progress...")
+            pipeline.stop()
         # Ensure ASR is unsubscribed and motors are re-stiffened (optional) on exit.
         if 'asr' in locals() and asr: # Check if asr was initialized
             print("🛑 Unsubscribing from ASR...")
@@ -189,6 +237,9 @@ def main():
         if 'motion' in locals() and motion: # Check if motion was initialized
             print("💪 Re-stiffening NAO's motors (optional)...")
             # motion.setStiffnesses("Body", 1.0) # Or a preferred resting stiffness
+        print(f"📊 ASR events: {recognizer.stats()}")
+        print(f"📊 Story webhook client: {STORY_CLIENT.stats()}")
+        broker.shutdown()
         print("👋 Exiting script.")
 
 
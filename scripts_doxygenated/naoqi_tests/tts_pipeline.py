@@ -0,0 +1,232 @@
+##! @file tts_pipeline.py
+##! @brief Sentence-pipelined story playback through NAO's ALTextToSpeech.
+##! @details
+##! Speaking a whole story with one blocking `tts.say(story)` means NAO stays
+##! silent until the entire story has been generated, and the caller is stuck
+##! until the last word has been spoken. SentencePipeline splits the story into
+##! sentences instead and plays them one after another:
+##! - a **producer** thread reads the story text (a complete string, or chunks
+##!   streamed from the webhook as they arrive), cuts it into sentences and puts
+##!   them on a queue;
+##! - a **consumer** thread starts each sentence with the non-blocking
+##!   `tts.post.say()`, which returns a task ID, and takes (prefetches) the next
+##!   sentence from the queue while the current one is playing. When the task
+##!   finishes (`tts.wait(task_id, 0)`), the next sentence is started right away.
+##!
+##! play() returns immediately, so the caller can keep listening while NAO
+##! speaks. Timings (time to first spoken word, gaps between sentences) are
+##! recorded so the pipeline can be measured against mock_naoqi.MockTextToSpeech.
+##!
+##! ```mermaid
+##! graph LR
+##!     A[story chunks] --> B[producer: split sentences] --> C[(queue)]
+##!     C --> D[consumer: tts.post.say / tts.wait] --> E[NAO speakers]
+##! ```
+##!
+##! @author Calvin Vandor
+##! @date   2025-05-10
+##! @copyright MIT License
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import queue
+import re
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+__all__ = ["SentencePipeline", "split_sentences"]
+
+## @var _SENTENCE_END
+# End of a sentence: terminal punctuation, optional closing quotes/brackets, then whitespace.
+_SENTENCE_END = re.compile(r"[.!?…]+[\"'”’)\]]*\s+")
+
+## @var _END_OF_STORY
+# Queue sentinel marking the end of the sentence stream. (Internal constant)
+_END_OF_STORY = object()
+
+
+def split_sentences(chunks: Iterable[str]) -> Iterator[str]:
+    """
+    Regroups streamed text into complete sentences as soon as each one ends.
+    A sentence is complete once its terminal punctuation *and* the following
+    whitespace have arrived, so "3.5" or "Hi!!" are not cut early.
+
+    @param chunks Story text, as one string in a list or as streamed pieces of any size.
+    @return A generator of stripped sentences with newlines replaced by spaces;
+            the last one may lack terminal punctuation.
+    """
+    buffer = ""
+    for chunk in chunks:
+        buffer += chunk
+        while True:
+            match = _SENTENCE_END.search(buffer)
+            if not match:
+                break
+            sentence, buffer = buffer[:match.end()], buffer[match.end():]
+            sentence = " ".join(sentence.split()) # Newlines would make NAO pause mid-story
+            if sentence:
+                yield sentence
+    rest = " ".join(buffer.split())
+    if rest:
+        yield rest
+
+
+class SentencePipeline:
+    """
+    Plays a story sentence by sentence on an ALTextToSpeech proxy, with a producer
+    thread splitting the text and a consumer thread driving `post.say`.
+    One story plays at a time; the object can be reused for the next story.
+    """
+
+    def __init__(self, tts: Any, max_prefetch: int = 8):
+        """
+        @param tts ALTextToSpeech proxy (or a mock exposing `post.say`, `wait` and `stop`).
+        @param max_prefetch Maximum sentences buffered between the producer and the consumer.
+        """
+        self.tts = tts
+        self.max_prefetch = max(1, max_prefetch)
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=self.max_prefetch)
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._current_task: Optional[int] = None
+        self._lock = threading.Lock()
+        self.started_at: Optional[float] = None
+        self.first_word_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.sentence_starts: List[float] = []
+        self.sentence_ends: List[float] = []
+        self.error: Optional[BaseException] = None
+
+    @property
+    def busy(self) -> bool:
+        """True while a story is being produced or spoken."""
+        return any(thread.is_alive() for thread in self._threads)
+
+    def play(self, chunks: Iterable[str]) -> None:
+        """
+        Starts playing a story and returns immediately.
+
+        @param chunks The story text: a string, or an iterable of text chunks (e.g., a
+               streamed HTTP response body) consumed on the producer thread.
+        @raises RuntimeError If a story is already playing.
+        """
+        if self.busy:
+            raise RuntimeError("A story is already playing; call stop() or wait() first.")
+        if isinstance(chunks, str):
+            chunks = [chunks]
+        self._queue = queue.Queue(maxsize=self.max_prefetch)
+        self._stop.clear()
+        self.started_at = time.perf_counter()
+        self.first_word_at = self.finished_at = None
+        self.sentence_starts, self.sentence_ends = [], []
+        self.error = None
+        self._threads = [
+            threading.Thread(target=self._produce, args=(chunks,), name="tts-producer", daemon=True),
+            threading.Thread(target=self._consume, name="tts-consumer", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Blocks until the current story has been spoken completely (or stopped).
+
+        @param timeout Maximum seconds to wait (None waits indefinitely).
+        @return True if playback finished, False on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        return not self.busy
+
+    def stop(self) -> None:
+        """Interrupts the current story: drops queued sentences and stops the sentence being spoken."""
+        self._stop.set()
+        with self._lock:
+            task = self._current_task
+        if task is not None:
+            try:
+                self.tts.stop(task)
+            except Exception as exc:
+                print(f"⚠️ Could not stop TTS task {task}: {exc}")
+        while True: # Unblock a producer waiting on a full queue
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        self.wait(timeout=5.0)
+
+    def _put(self, item: Any) -> bool:
+        """Queues an item unless playback is stopped. (Internal)"""
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self, chunks: Iterable[str]) -> None:
+        """Producer thread: splits the incoming story into sentences. (Internal)"""
+        try:
+            for sentence in split_sentences(chunks):
+                if not self._put(sentence):
+                    return
+        except Exception as exc: # e.g., the streamed response broke off
+            print(f"❌ [TTS pipeline] Story source failed: {exc}")
+            self.error = exc
+        finally:
+            self._put(_END_OF_STORY)
+
+    def _next_sentence(self) -> Any:
+        """Takes the next sentence from the queue, giving up when playback is stopped. (Internal)"""
+        while not self._stop.is_set():
+            try:
+                return self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END_OF_STORY
+
+    def _consume(self) -> None:
+        """Consumer thread: plays each sentence and prefetches the next while it speaks. (Internal)"""
+        try:
+            sentence = self._next_sentence()
+            while sentence is not _END_OF_STORY and not self._stop.is_set():
+                task = self.tts.post.say(sentence)
+                now = time.perf_counter()
+                with self._lock:
+                    self._current_task = task
+                if self.first_word_at is None:
+                    self.first_word_at = now
+                self.sentence_starts.append(now)
+
+                sentence = self._next_sentence() # Prefetch while the current sentence plays
+                self.tts.wait(task, 0) # 0 = no timeout
+                self.sentence_ends.append(time.perf_counter())
+                with self._lock:
+                    self._current_task = None
+        except Exception as exc:
+            print(f"❌ [TTS pipeline] Text-to-speech failed: {exc}")
+            self.error = exc
+            self._stop.set()
+        finally:
+            self.finished_at = time.perf_counter()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        @return Timings of the last story in milliseconds: time to first spoken word,
+                total time, sentence count and the gaps between consecutive sentences.
+        """
+        def ms(value: Optional[float]) -> Optional[float]:
+            return None if value is None or self.started_at is None else round((value - self.started_at) * 1000.0, 1)
+
+        gaps = [(start - end) * 1000.0 for end, start in zip(self.sentence_ends, self.sentence_starts[1:])]
+        return {
+            "sentences": len(self.sentence_starts),
+            "first_word_ms": ms(self.first_word_at),
+            "total_ms": ms(self.finished_at),
+            "max_gap_ms": round(max(gaps), 1) if gaps else 0.0,
+            "mean_gap_ms": round(sum(gaps) / len(gaps), 1) if gaps else 0.0,
+            "error": str(self.error) if self.error else None,
+        }
@@ -0,0 +1,240 @@
+##! @file rag.py
+##! @brief  Retrieval-augmented story generation: archive chunks joined with the story prompt.
+##!
+##! The ChromaDB REST wrapper returns raw snippets, and the story webhooks
+##! generate from scratch without looking at the archive. This module holds the
+##! framework-free steps of the pipeline that joins them (served as `POST /rag`
+##! by webhook_asgi.py):
+##! 1. **retrieve** — `RAG_CANDIDATES` chunks for the theme/moral from the
+##!    wrapper's `POST /query/chunks`;
+##! 2. **rerank** — candidates rescored by vector rank plus query-term overlap,
+##!    duplicates dropped, best `RAG_TOP_K` kept;
+##! 3. **pack** — the best chunks injected into the system prompt while they fit
+##!    `RAG_CONTEXT_TOKENS` (counted with database/prompt_builder.py);
+##! 4. **generate** — the story streamed from OpenAI.
+##!
+##! StageTimings measures each stage of one request (reported in the response);
+##! StageStats keeps rolling per-stage percentiles for `GET /rag/stats`.
+##!
+##! @author Calvin Vandor
+##! @date   2025-05-10
+##! @copyright MIT License
+##!
+##! ### Environment variables
+##! * **RAG_RETRIEVER_URL** — chunk search endpoint (default `http://localhost:8080/query/chunks`).
+##! * **RAG_RETRIEVE_TIMEOUT** — seconds before generating without excerpts (default 3).
+##! * **RAG_CANDIDATES** — chunks retrieved before reranking (default 12).
+##! * **RAG_TOP_K** — chunks kept after reranking (default 4).
+##! * **RAG_CONTEXT_TOKENS** — token budget of the injected chunks (default 1200).
+##! * **RAG_LEXICAL_WEIGHT** — share of the rerank score from query-term overlap (default 0.3).
+##!
+##! ---
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Iterator, List, Tuple
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "database"))
+from prompt_builder import count_tokens # noqa: E402  (import after sys.path setup)
+
+__all__ = ["Chunk", "StageStats", "StageTimings", "build_rag_messages", "pack_context", "rerank", "retrieval_query"]
+
+#: Chunk search endpoint of the ChromaDB REST wrapper
+RAG_RETRIEVER_URL: str = os.getenv("RAG_RETRIEVER_URL", "http://localhost:8080/query/chunks")
+
+#: Timeout of the chunk search, in seconds (the story is generated without excerpts after it)
+RAG_RETRIEVE_TIMEOUT: float = float(os.getenv("RAG_RETRIEVE_TIMEOUT", "3"))
+
+#: Chunks retrieved before reranking
+RAG_CANDIDATES: int = int(os.getenv("RAG_CANDIDATES", "12"))
+
+#: Chunks kept after reranking
+RAG_TOP_K: int = int(os.getenv("RAG_TOP_K", "4"))
+
+#: Token budget of the retrieved chunks injected into the prompt
+RAG_CONTEXT_TOKENS: int = int(os.getenv("RAG_CONTEXT_TOKENS", "1200"))
+
+#: Share of the rerank score that comes from query-term overlap (the rest from vector rank)
+RAG_LEXICAL_WEIGHT: float = float(os.getenv("RAG_LEXICAL_WEIGHT", "0.3"))
+
+#: Instructions placed before the retrieved excerpts
+RAG_SYSTEM_PROMPT: str = (
+    "You are a creative storyteller for children. Below are excerpts from stories in our archive. "
+    "Use them for inspiration (characters, settings, style), but tell a new, complete story."
+)
+
+#: Words counted for query-term overlap
+_WORD = re.compile(r"\w+")
+
+#: Words ignored for query-term overlap
+_STOPWORDS = frozenset("a an and the of to in on for with about is are was be story stories".split())
+
+
+@dataclass
+class Chunk:
+    """One retrieved story chunk."""
+
+    id: str
+    text: str
+    metadata: Dict[str, Any] = field(default_factory=dict)
+    distance: float = 0.0
+    score: float = 0.0  # Rerank score (higher is better)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Chunk":
+        """Build a chunk from one entry of a `/query/chunks` response."""
+        return cls(str(data["id"]), data["text"], data.get("metadata") or {}, float(data.get("distance") or 0.0))
+
+    @property
+    def title(self) -> str:
+        """Title of the story the chunk comes from."""
+        return str(self.metadata.get("title", "Unknown Title"))
+
+
+def retrieval_query(theme: str, moral: str) -> str:
+    """Search text for a story request (the listener's name does not help the search).
+
+    @param theme: Story genre / setting.
+    @param moral: Core lesson.
+    @return The query sent to the chunk search.
+    """
+    return " ".join(part.strip() for part in (theme, moral) if part and part.strip())
+
+
+def _terms(text: str) -> set:
+    """Lower-cased content words of *text*."""
+    return {word for word in _WORD.findall(text.lower()) if word not in _STOPWORDS}
+
+
+def rerank(query: str, chunks: List[Chunk], top_k: int = RAG_TOP_K,
+           lexical_weight: float = RAG_LEXICAL_WEIGHT) -> List[Chunk]:
+    """Rescore retrieved chunks and keep the best *top_k*.
+
+    The score blends the vector search rank (nearest = 1) with the share of query
+    terms the chunk contains. Chunks whose text repeats a better one are dropped.
+
+    @param query:          The retrieval query.
+    @param chunks:         Chunks, nearest first.
+    @param top_k:          Chunks to keep.
+    @param lexical_weight: Share of the score from query-term overlap (0–1).
+    @return Up to *top_k* chunks, best first, with `score` set.
+    """
+    query_terms = _terms(query)
+    for rank, chunk in enumerate(chunks):
+        vector_score = 1.0 - rank / len(chunks)
+        overlap = len(query_terms & _terms(chunk.text)) / len(query_terms) if query_terms else 0.0
+        chunk.score = (1.0 - lexical_weight) * vector_score + lexical_weight * overlap
+    seen = set()
+    ranked: List[Chunk] = []
+    for chunk in sorted(chunks, key=lambda c: c.score, reverse=True):
+        key = " ".join(chunk.text.split()).lower()
+        if key not in seen:
+            seen.add(key)
+            ranked.append(chunk)
+    return ranked[:top_k]
+
+
+def pack_context(chunks: List[Chunk], budget_tokens: int = RAG_CONTEXT_TOKENS) -> Tuple[List[Chunk], int]:
+    """Select chunks, best first, while their tokens fit the budget.
+
+    A chunk too large for the remaining budget is skipped, so a smaller one after it can still fit.
+
+    @param chunks:        Chunks, best first.
+    @param budget_tokens: Token budget of the excerpts.
+    @return (the chunks injected, best first; their tokens).
+    """
+    used: List[Chunk] = []
+    tokens = 0
+    for chunk in chunks:
+        cost = count_tokens(chunk.text)
+        if tokens + cost <= budget_tokens:
+            used.append(chunk)
+            tokens += cost
+    return used, tokens
+
+
+def build_rag_messages(prompt: str, chunks: List[Chunk]) -> List[Dict[str, str]]:
+    """Assemble the ChatCompletion messages: instructions with the excerpts, then the request.
+
+    @param prompt: Fully-formed story prompt (see webhook.build_prompt).
+    @param chunks: Excerpts to inject, best first.
+    @return The messages.
+    """
+    if not chunks:
+        return [{"role": "user", "content": prompt}]
+    excerpts = "\n\n".join(f"[{i}] {chunk.title}:\n{chunk.text.strip()}" for i, chunk in enumerate(chunks, 1))
+    return [{"role": "system", "content": f"{RAG_SYSTEM_PROMPT}\n\n{excerpts}"},
+            {"role": "user", "content": prompt}]
+
+
+class StageTimings:
+    """Wall-clock duration of each stage of one request, in milliseconds."""
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time the enclosed block (which may await) as stage *name*."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = (time.perf_counter() - start) * 1000.0
+
+    def mark(self, name: str) -> None:
+        """Record the time since the request started as *name* (e.g., ``first_token``)."""
+        self.stages[name] = (time.perf_counter() - self.started) * 1000.0
+
+    def as_dict(self) -> Dict[str, float]:
+        """Stage durations as ``<stage>_ms``, rounded to 0.1 ms."""
+        return {f"{name}_ms": round(ms, 1) for name, ms in self.stages.items()}
+
+    def server_timing(self) -> str:
+        """Stages finished so far as a ``Server-Timing`` header value."""
+        return ", ".join(f"{name};dur={ms:.1f}" for name, ms in self.stages.items())
+
+
+class StageStats:
+    """Rolling per-stage latency percentiles over the last requests. Thread-safe."""
+
+    def __init__(self, window: int = 1024) -> None:
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+
+    def record(self, timings: StageTimings) -> None:
+        """Add one request's stage durations."""
+        with self._lock:
+            self.requests += 1
+            for name, ms in timings.stages.items():
+                self._samples.setdefault(name, deque(maxlen=self.window)).append(ms)
+
+    def summary(self) -> Dict[str, Any]:
+        """@return Requests seen and, per stage, the sample count, p50, p95 and max in ms."""
+        with self._lock:
+            stages = {name: sorted(samples) for name, samples in self._samples.items()}
+            requests = self.requests
+        return {
+            "requests": requests,
+            "stages": {
+                name: {"count": len(values), "p50_ms": round(_percentile(values, 0.50), 1),
+                       "p95_ms": round(_percentile(values, 0.95), 1), "max_ms": round(values[-1], 1)}
+                for name, values in stages.items()
+            },
+        }
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of non-empty, sorted values."""
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
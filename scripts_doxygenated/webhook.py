@@ -12,21 +12,53 @@
 ##!
 ##! ### Environment variables
 ##! * **OPENAI_API_KEY** — secret API key for the ChatCompletion endpoint.
+##! * **OPENAI_API_BASE** — optional base URL of an OpenAI-compatible API
+##!   (e.g., a local fake server for testing; see benchmarks/fake_openai_server.py).
+##! * **USER_MEMORY_DB** — optional SQLite user-memory database (see
+##!   database/user_memory.py). When set, `/webhook` remembers the stories told to
+##!   each named user and sends them back within the prompt token budget; older
+##!   turns are summarised in the background once over budget.
+##! * **PROMPT_TOKEN_BUDGET** — token budget of an assembled prompt (see database/prompt_builder.py).
+##! * **STORY_POOL_THEMES** — comma-separated `theme:moral` pairs whose stories are
+##!   pre-generated (default `fantasy:courage`, the webhook defaults).
+##! * **STORY_POOL_*** — pool size, story lifetime, workers and file location
+##!   (see naoqi_tests/story_pool.py).
 ##!
 ##! ### Flask routes
-##! * **POST /webhook** — primary Dialogflow CX fulfilment entry-point.
+##! * **POST /webhook** — primary Dialogflow CX fulfilment entry-point. Served from
+##!   the pre-generated story pool when it holds a story for the theme/moral pair
+##!   (pooled stories are written for *Adventurer*; the name is swapped for the
+##!   username) for users without remembered history, generated live otherwise.
+##! * **GET /pool_stats** — story pool hits, misses and ready stories per pair.
+##! * **POST /webhook/stream** — same request body, but the story is streamed
+##!   while it is generated: as server-sent events (default) with `token`,
+##!   `sentence`, `done` and `error` events, or with `?format=text` as chunked
+##!   plain text, one complete sentence per line. The first sentence goes out as
+##!   soon as the model has produced it, so a robot can start speaking right away.
 ##!
 ##! ---
 
 from __future__ import annotations
 
+import atexit
+import json
 import os
-from typing import Dict, Any
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Set, Tuple
 
 from dotenv import load_dotenv
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 import openai
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "naoqi_tests"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "database"))
+from prompt_builder import PromptBuilder, build_summary_messages # noqa: E402  (import after sys.path setup)
+from story_pool import STORY_POOL_DIR, StoryPool, theme_key # noqa: E402
+from user_memory import UserMemoryStore # noqa: E402
+
 load_dotenv()
 
 #: OpenAI API secret (read once at import time)
@@ -36,6 +68,42 @@ if OPENAI_API_KEY:
 else:
     print("⚠️ WARNING: OPENAI_API_KEY environment variable not set. OpenAI calls will fail.")
 
+#: Optional OpenAI-compatible base URL (e.g., ``http://127.0.0.1:8001/v1`` for a local fake server)
+OPENAI_API_BASE: str | None = os.getenv("OPENAI_API_BASE")
+if OPENAI_API_BASE:
+    openai.api_base = OPENAI_API_BASE
+
+#: ChatCompletion model used for story generation
+OPENAI_MODEL: str = "gpt-4o-mini" # User confirmed this model is fine for now
+
+#: Optional SQLite user-memory database; unset keeps the webhook stateless
+USER_MEMORY_DB: str | None = os.getenv("USER_MEMORY_DB")
+
+#: Shared prompt assembly: token budget, remembered summary, recent turns, repeated requests collapsed
+PROMPT_BUILDER = PromptBuilder()
+
+#: Listener name used when none is given, and in pre-generated stories
+DEFAULT_USERNAME: str = "Adventurer"
+
+#: (theme, moral) pairs whose stories are pre-generated
+STORY_POOL_THEMES: List[Tuple[str, str]] = [
+    (pair.split(":", 1)[0].strip(), pair.split(":", 1)[1].strip())
+    for pair in os.getenv("STORY_POOL_THEMES", "fantasy:courage").split(",") if ":" in pair
+]
+
+#: Apology returned (or streamed) when story generation fails
+FALLBACK_MESSAGE: str = "I'm sorry, I had a little trouble dreaming up a story just now. Could you try asking again?"
+
+#: Runs memory compactions (an OpenAI summary call each) after the webhook has responded
+_COMPACTION_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-compaction")
+
+#: Users with a compaction queued or running (guarded by :pydata:`_COMPACTING_LOCK`)
+_COMPACTING: Set[str] = set()
+_COMPACTING_LOCK = threading.Lock()
+
+#: End of a sentence: terminal punctuation, optional closing quotes/brackets, then whitespace
+_SENTENCE_END = re.compile(r"[.!?…]+[\"'”’)\]]*\s+")
+
 # ---------------------------------------------------------------------------
 # Helper functions
 # ---------------------------------------------------------------------------
@@ -54,10 +122,37 @@ def build_prompt(username: str, theme: str, moral: str) -> str:
     )
 
 
-def call_chatgpt(prompt: str) -> str:
+def extract_story_params(body: Dict[str, Any]) -> Tuple[str, str, str]:
+    """Pull *username*, *theme* and *moral* out of a Dialogflow CX webhook body.
+
+    @param body: Parsed JSON request body.
+    @return (username, theme, moral), with the defaults used since the first version.
+    """
+    params = body.get("sessionInfo", {}).get("parameters", {})
+    return (
+        params.get("username", DEFAULT_USERNAME),
+        params.get("theme", "fantasy"),
+        params.get("moral", "courage"),
+    )
+
+
+def build_messages(prompt: str, history: Iterable[Dict[str, str]] = (), summary: str | None = None) -> List[Dict[str, str]]:
+    """Assemble the ChatCompletion messages for *prompt* with :pydata:`PROMPT_BUILDER`.
+
+    @param prompt:  Fully-formed prompt as returned by :pyfunc:`build_prompt`.
+    @param history: Remembered turns of this user, oldest first.
+    @param summary: Remembered summary of older turns.
+    @return Messages within the prompt token budget.
+    """
+    return PROMPT_BUILDER.build(prompt, list(history), summary).messages
+
+
+def call_chatgpt(prompt: str, history: Iterable[Dict[str, str]] = (), summary: str | None = None) -> str:
     """Send the prompt to OpenAI and return the model's reply.
 
-    @param prompt: Fully-formed prompt as returned by :pyfunc:`build_prompt`.
+    @param prompt:  Fully-formed prompt as returned by :pyfunc:`build_prompt`.
+    @param history: Remembered turns of this user, oldest first (see :pyfunc:`build_messages`).
+    @param summary: Remembered summary of older turns.
     @raises openai.APIError: If the HTTP request to OpenAI fails or returns an error.
     @return The assistant's textual response.
     """
@@ -65,22 +160,228 @@ def call_chatgpt(prompt: str) -> str:
         raise ValueError("OpenAI API key is not configured. Cannot make API calls.")
     
     response = openai.ChatCompletion.create(
-        model="gpt-4o-mini", # User confirmed this model is fine for now
-        messages=[{"role": "user", "content": prompt}],
+        model=OPENAI_MODEL,
+        messages=build_messages(prompt, history, summary),
     )
     # Type checker might complain about indexing if response structure isn't fully known/typed by stubs
     # Assuming standard response structure from OpenAI
     return response["choices"][0]["message"]["content"] # type: ignore[index]
 
 
+def summarize_history(previous: str | None, turns: List[Dict[str, str]]) -> str:
+    """Fold remembered *turns* into a user's summary (the summarizer for :pyclass:`UserMemoryStore`).
+
+    @param previous: Current summary, or None.
+    @param turns:    Turns to fold in, oldest first.
+    @return The new summary.
+    """
+    response = openai.ChatCompletion.create(
+        model=OPENAI_MODEL,
+        messages=build_summary_messages(previous, turns),
+        max_tokens=200,
+    )
+    return response["choices"][0]["message"]["content"] # type: ignore[index]
+
+
+def compact_memory(memory: UserMemoryStore, username: str) -> None:
+    """Summarise *username*'s older turns (runs on :pydata:`_COMPACTION_EXECUTOR`).
+
+    @param memory:   The user-memory store.
+    @param username: The user whose history is over budget.
+    """
+    try:
+        memory.compact(username, summarize_history)
+    except Exception as exc:  # Memory stays complete; the prompt builder still caps what is sent
+        print(f"⚠️ Could not summarise memory of {username}: {exc}")
+    finally:
+        with _COMPACTING_LOCK:
+            _COMPACTING.discard(username)
+
+
+def remember_story(memory: UserMemoryStore, username: str, prompt: str, story: str) -> None:
+    """Append a story exchange to *username*'s memory; summarise older turns in the background once over budget.
+
+    The summary is a second OpenAI call, so it is left to :pydata:`_COMPACTION_EXECUTOR`
+    instead of delaying the webhook response (Dialogflow's timeout is tight).
+
+    @param memory:   The user-memory store.
+    @param username: Recipient of the story.
+    @param prompt:   Prompt the story answers.
+    @param story:    The story told.
+    """
+    memory.extend(username, [{"role": "user", "content": prompt}, {"role": "assistant", "content": story}])
+    if memory.needs_compaction(username):
+        with _COMPACTING_LOCK:
+            if username in _COMPACTING:  # Already queued; it will see these turns too
+                return
+            _COMPACTING.add(username)
+        _COMPACTION_EXECUTOR.submit(compact_memory, memory, username)
+
+
+def stream_chatgpt(prompt: str) -> Iterator[str]:
+    """Send the prompt to OpenAI with ``stream=True`` and yield text as it arrives.
+
+    @param prompt: Fully-formed prompt as returned by :pyfunc:`build_prompt`.
+    @raises openai.APIError: If the HTTP request to OpenAI fails or returns an error.
+    @return A generator of content deltas (usually one token each).
+    """
+    if not openai.api_key:
+        raise ValueError("OpenAI API key is not configured. Cannot make API calls.")
+
+    for chunk in openai.ChatCompletion.create(
+        model=OPENAI_MODEL,
+        messages=build_messages(prompt),
+        stream=True,
+    ):
+        delta = chunk["choices"][0].get("delta", {}) # type: ignore[index]
+        content = delta.get("content")
+        if content:
+            yield content
+
+
+class SentenceSplitter:
+    """Incrementally regroups streamed text into complete sentences.
+
+    A sentence is complete once its terminating punctuation *and* the
+    following whitespace have arrived (so "3.5" or "Hi!!" are not cut early).
+    """
+
+    def __init__(self) -> None:
+        self.buffer = ""
+
+    def feed(self, text: str) -> list[str]:
+        """Add streamed text and return the sentences it completed.
+
+        @param text: The next text delta.
+        @return Stripped, non-empty sentences completed by *text* (often none).
+        """
+        self.buffer += text
+        sentences = []
+        while (match := _SENTENCE_END.search(self.buffer)):
+            sentence, self.buffer = self.buffer[:match.end()].strip(), self.buffer[match.end():]
+            if sentence:
+                sentences.append(sentence)
+        return sentences
+
+    def flush(self) -> str | None:
+        """Return the unterminated remainder at the end of the stream, if any."""
+        rest, self.buffer = self.buffer.strip(), ""
+        return rest or None
+
+
+def split_sentences(tokens: Iterable[str]) -> Iterator[str]:
+    """Regroup a token stream into complete sentences as soon as each one ends.
+
+    @param tokens: Text deltas, e.g. from :pyfunc:`stream_chatgpt`.
+    @return A generator of sentences; the last one may lack terminal punctuation.
+    """
+    splitter = SentenceSplitter()
+    for token in tokens:
+        yield from splitter.feed(token)
+    rest = splitter.flush()
+    if rest:
+        yield rest
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format one server-sent event.
+
+    @param event: Event name (``token``, ``sentence``, ``done`` or ``error``).
+    @param data:  JSON-serialisable payload.
+    @return The event, terminated by a blank line.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream_story_events(prompt: str) -> Iterator[str]:
+    """Generate the story for *prompt* as a sequence of server-sent events.
+
+    Every token is forwarded as a ``token`` event; each complete sentence is
+    also sent as a ``sentence`` event the moment it is finished. A final
+    ``done`` event carries the whole story, or an ``error`` event carries the
+    fallback apology if generation fails part-way.
+
+    @param prompt: Fully-formed prompt as returned by :pyfunc:`build_prompt`.
+    @return A generator of SSE-formatted strings.
+    """
+    splitter = SentenceSplitter()
+    story_parts = []
+    try:
+        for token in stream_chatgpt(prompt):
+            story_parts.append(token)
+            yield sse_event("token", {"text": token})
+            for sentence in splitter.feed(token):
+                yield sse_event("sentence", {"text": sentence})
+        rest = splitter.flush()
+        if rest:
+            yield sse_event("sentence", {"text": rest})
+        yield sse_event("done", {"story": "".join(story_parts)})
+    except Exception as exc:  # The response has already started, so report in-band
+        print(f"❌ Streaming webhook error: {exc}")
+        yield sse_event("error", {"message": FALLBACK_MESSAGE})
+
+
+def stream_story_lines(prompt: str) -> Iterator[str]:
+    """Generate the story for *prompt* as plain text, one sentence per line.
+
+    @param prompt: Fully-formed prompt as returned by :pyfunc:`build_prompt`.
+    @return A generator of newline-terminated sentences.
+    """
+    try:
+        for sentence in split_sentences(stream_chatgpt(prompt)):
+            yield sentence + "\n"
+    except Exception as exc:  # The response has already started, so report in-band
+        print(f"❌ Streaming webhook error: {exc}")
+        yield FALLBACK_MESSAGE + "\n"
+
+
+# ---------------------------------------------------------------------------
+# Story pool
+# ---------------------------------------------------------------------------
+
+def personalise_story(story: str, username: str) -> str:
+    """Address a pre-generated story (written for :pydata:`DEFAULT_USERNAME`) to *username*.
+
+    @param story:    Story from the pool.
+    @param username: Recipient of the story.
+    @return The story with every whole-word occurrence of the default name replaced.
+    """
+    if username == DEFAULT_USERNAME:
+        return story
+    return re.sub(rf"\b{re.escape(DEFAULT_USERNAME)}\b", lambda _: username, story)
+
+
+def create_story_pool(pairs: Optional[List[Tuple[str, str]]] = None, path: Optional[str] = None,
+                      **options: Any) -> StoryPool:
+    """Create the pre-generated story pool, load it from disk and start filling it.
+
+    @param pairs: (theme, moral) pairs to pre-generate (default :pydata:`STORY_POOL_THEMES`).
+    @param path:  Pool file (default ``story_pool_themes.json`` in ``STORY_POOL_DIR``).
+    @param options: :pyclass:`StoryPool` settings overriding the ``STORY_POOL_*`` defaults.
+    @return The running pool; it is saved again when the process exits.
+    """
+    pool = StoryPool(path=path or os.path.join(STORY_POOL_DIR, "story_pool_themes.json"), **options)
+    for theme, moral in STORY_POOL_THEMES if pairs is None else pairs:
+        pool.add_key(theme_key(theme, moral),
+                     lambda theme=theme, moral=moral: call_chatgpt(build_prompt(DEFAULT_USERNAME, theme, moral)))
+    atexit.register(pool.close)
+    return pool.start()
+
+
 # ---------------------------------------------------------------------------
 # Flask setup
 # ---------------------------------------------------------------------------
 
-def create_app() -> Flask:
-    """Factory that builds and returns the Flask application object."""
+def create_app(story_pool: Optional[StoryPool] = None, user_memory: Optional[UserMemoryStore] = None) -> Flask:
+    """Factory that builds and returns the Flask application object.
+
+    @param story_pool:  Pre-generated story pool (default: a new one from :pyfunc:`create_story_pool`).
+    @param user_memory: Per-user memory (default: opened from :pydata:`USER_MEMORY_DB` if set, else none).
+    """
 
     app = Flask(__name__)
+    pool = story_pool if story_pool is not None else create_story_pool()
+    memory = user_memory if user_memory is not None else (UserMemoryStore(USER_MEMORY_DB) if USER_MEMORY_DB else None)
 
     @app.route("/webhook", methods=["POST"])
     def webhook_endpoint() -> Any:  # noqa: ANN401 (Flask view functions can return various types)
@@ -90,13 +391,24 @@ def create_app() -> Flask:
             # For Dialogflow, the mimetype should usually be application/json.
             body: Dict[str, Any] = request.get_json(force=True) # Consider silent=True if you want to handle non-JSON body more gracefully
             
-            params = body.get("sessionInfo", {}).get("parameters", {})
-            username = params.get("username", "Adventurer")
-            theme = params.get("theme", "fantasy")
-            moral = params.get("moral", "courage")
+            username, theme, moral = extract_story_params(body)
 
             prompt = build_prompt(username, theme, moral)
-            story_text = call_chatgpt(prompt)
+            remembered = memory is not None and username != DEFAULT_USERNAME
+            summary, history = memory.recall(username) if remembered else (None, [])  # type: ignore[union-attr]
+
+            story_text = None
+            if summary is None and not history:  # Pooled stories know nothing about the user
+                story_text = pool.take(
+                    theme_key(theme, moral),
+                    lambda: call_chatgpt(build_prompt(DEFAULT_USERNAME, theme, moral)),
+                )
+            if story_text is not None:
+                story_text = personalise_story(story_text, username)
+            else:
+                story_text = call_chatgpt(prompt, history, summary)
+            if remembered:
+                remember_story(memory, username, prompt, story_text)  # type: ignore[arg-type]
 
             return jsonify(
                 {
@@ -116,12 +428,32 @@ def create_app() -> Flask:
                 {
                     "fulfillment_response": {
                         "messages": [
-                            {"text": {"text": ["I'm sorry, I had a little trouble dreaming up a story just now. Could you try asking again?"]}}
+                            {"text": {"text": [FALLBACK_MESSAGE]}}
                         ]
                     }
                 }
             ) # Flask jsonify defaults to HTTP 200 OK
 
+    @app.route("/webhook/stream", methods=["POST"])
+    def webhook_stream_endpoint() -> Response:
+        """Streaming variant of ``/webhook``: SSE by default, ``?format=text`` for plain lines."""
+        body: Dict[str, Any] = request.get_json(force=True, silent=True) or {}
+        prompt = build_prompt(*extract_story_params(body))
+        if request.args.get("format") == "text":
+            generator, mimetype = stream_story_lines(prompt), "text/plain; charset=utf-8"
+        else:
+            generator, mimetype = stream_story_events(prompt), "text/event-stream"
+        return Response(
+            stream_with_context(generator),
+            mimetype=mimetype,
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},  # Defeat proxy buffering
+        )
+
+    @app.route("/pool_stats", methods=["GET"])
+    def pool_stats_endpoint() -> Any:  # noqa: ANN401
+        """Story pool hits, misses and ready stories per theme/moral pair."""
+        return jsonify(pool.stats())
+
     return app
 
 
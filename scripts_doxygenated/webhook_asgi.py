@@ -0,0 +1,496 @@
+##! @file webhook_asgi.py
+##! @brief  ASGI (FastAPI) variant of the story webhooks, built on an async HTTP client.
+##!
+##! The Flask apps in webhook.py and naoqi_tests/chatgpt_webhook.py call OpenAI
+##! synchronously, so every story being generated pins a worker thread for
+##! several seconds and a handful of concurrent children saturates the server.
+##! This module serves the same two endpoints from one event loop. The OpenAI
+##! calls go through a shared `aiohttp.ClientSession`, so hundreds of outstanding
+##! generations cost one coroutine each instead of one thread each. (aiohttp's
+##! connection pool kept its latency flat at a few hundred concurrent calls,
+##! where httpx's did not; see benchmarks/bench_asgi_webhook.py.)
+##!
+##! Request bodies, prompts and response shapes are identical to the Flask versions
+##! (prompt helpers are imported from them), but `/webhook` here always generates
+##! a fresh story: it skips webhook.py's pre-generated story pool and per-user
+##! memory (STORY_POOL_*, USER_MEMORY_DB). OpenAI calls reuse the settings
+##! of naoqi_tests/http_client.py: connect/read timeouts, jittered retries on
+##! 429/5xx and failed connects, and a circuit breaker.
+##!
+##! @author Calvin Vandor
+##! @date   2025-05-10
+##! @copyright MIT License
+##!
+##! ### Environment variables
+##! * **OPENAI_API_KEY** — API key for `/webhook` (as in webhook.py).
+##! * **AI_STORYTELLER_TEST_KEY_CV** — API key for `/generate_story` (as in chatgpt_webhook.py).
+##! * **OPENAI_API_BASE** — optional OpenAI-compatible base URL (e.g., a local fake server).
+##! * **ASGI_MAX_CONNECTIONS** — maximum concurrent connections to OpenAI (default 512).
+##! * **HTTP_*** — timeouts, retries and circuit breaker (see naoqi_tests/http_client.py).
+##! * **RAG_*** — retriever URL, candidates, top-k and context budget (see rag.py).
+##! * **RAG_WARMUP_IDLE_SECONDS** — idle time after which `/rag` re-opens the OpenAI connection
+##!   while retrieving (default 10).
+##!
+##! ### Routes
+##! * **POST /webhook** — Dialogflow CX fulfilment (same body and response as webhook.py,
+##!   without the story pool and user memory).
+##! * **POST /generate_story** — `{"word": "..."}` → `{"story": "..."}` (as chatgpt_webhook.py).
+##! * **POST /rag** — same body as `/webhook`; a story grounded in archive chunks from the
+##!   ChromaDB REST wrapper, streamed as server-sent events (`context`, `token`,
+##!   `sentence`, then `done` or `error`) with per-stage timings.
+##! * **GET /rag/stats** — p50/p95 latency per `/rag` stage.
+##! * **GET /http_stats** — in-flight and peak concurrent generations, retries, breaker state.
+##!
+##! ### Usage
+##! ```bash
+##! pip install fastapi uvicorn aiohttp
+##! uvicorn webhook_asgi:app --host 0.0.0.0 --port 3000
+##! ```
+##!
+##! ---
+
+from __future__ import annotations # For postponed evaluation of type hints
+
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import aiohttp
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from rag import (RAG_CANDIDATES, RAG_CONTEXT_TOKENS, RAG_RETRIEVE_TIMEOUT, RAG_RETRIEVER_URL, RAG_TOP_K, Chunk,
+                 StageStats, StageTimings, build_rag_messages, pack_context, rerank, retrieval_query)
+from webhook import (FALLBACK_MESSAGE, OPENAI_MODEL, SentenceSplitter, build_messages, build_prompt,
+                     extract_story_params, sse_event)
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "naoqi_tests"))
+from chatgpt_webhook import build_story_request # noqa: E402  (import after sys.path setup)
+from http_client import (HTTP_BACKOFF_BASE, HTTP_BACKOFF_MAX, HTTP_CONNECT_TIMEOUT, HTTP_MAX_RETRIES, # noqa: E402
+                         HTTP_READ_TIMEOUT, RETRY_STATUSES, CircuitBreaker, CircuitOpenError)
+
+__all__ = ["ChatResponse", "app", "chat_completion", "generate_story_async", "retrieve_chunks",
+           "stream_chat_completion", "warm_openai_connection"]
+
+#: OpenAI-compatible API base URL
+OPENAI_API_BASE: str = (os.getenv("OPENAI_API_BASE") or "https://api.openai.com/v1").rstrip("/")
+
+#: OpenAI-compatible ChatCompletion URL
+OPENAI_CHAT_URL: str = OPENAI_API_BASE + "/chat/completions"
+
+#: Cheap endpoint used to open a connection ahead of a generation
+OPENAI_MODELS_URL: str = OPENAI_API_BASE + "/models"
+
+#: Idle time after which a pooled OpenAI connection is assumed closed (aiohttp keeps idle ones 15 s)
+RAG_WARMUP_IDLE_SECONDS: float = float(os.getenv("RAG_WARMUP_IDLE_SECONDS", "10"))
+
+#: Maximum concurrent (and keep-alive) connections to OpenAI
+ASGI_MAX_CONNECTIONS: int = int(os.getenv("ASGI_MAX_CONNECTIONS", "512"))
+
+#: Shared async client session, created at startup
+HTTP_SESSION: Optional[aiohttp.ClientSession] = None
+
+#: Circuit breaker shared by all OpenAI calls of this process
+BREAKER = CircuitBreaker()
+
+#: Counters served at GET /http_stats (updated on the event loop only)
+STATS: Dict[str, int] = {"requests": 0, "retries": 0, "failures": 0, "circuit_rejections": 0,
+                         "in_flight": 0, "peak_in_flight": 0}
+
+#: Per-stage latency of /rag requests, served at GET /rag/stats
+RAG_STATS = StageStats()
+
+#: When an OpenAI call last finished (time.monotonic()); drives the connection warm-up
+_LAST_OPENAI_USE: float = float("-inf")
+
+app = FastAPI(title="Virtual Storyteller webhooks (ASGI)")
+
+
+# ---------------------------------------------------------------------------
+# Async OpenAI client
+# ---------------------------------------------------------------------------
+
+class ChatResponse(NamedTuple):
+    """Status and body of a finished ChatCompletion call."""
+
+    status: int
+    text: str
+
+
+def _touch_openai() -> None:
+    """Note that a connection to OpenAI was just used (it stays in the keep-alive pool)."""
+    global _LAST_OPENAI_USE
+    _LAST_OPENAI_USE = time.monotonic()
+
+
+@contextmanager
+def _in_flight() -> Iterator[None]:
+    """Count the enclosed OpenAI call in the in-flight statistics."""
+    STATS["in_flight"] += 1
+    STATS["peak_in_flight"] = max(STATS["peak_in_flight"], STATS["in_flight"])
+    try:
+        yield
+    finally:
+        STATS["in_flight"] -= 1
+
+
+async def _post_chat(api_key: str, body: Dict[str, Any]) -> aiohttp.ClientResponse:
+    """POST a ChatCompletion request, retrying 429/5xx responses and failed connections.
+
+    @param api_key: OpenAI API key.
+    @param body:    JSON request body.
+    @raises CircuitOpenError: If the circuit breaker is open.
+    @raises aiohttp.ClientError, asyncio.TimeoutError: On connection errors after the retries, and on timeouts.
+    @return The final response, body unread; the caller must read or release it.
+    """
+    assert HTTP_SESSION is not None, "HTTP session is created in the startup handler"
+    STATS["requests"] += 1
+    if not BREAKER.allow():
+        STATS["circuit_rejections"] += 1
+        raise CircuitOpenError("Circuit breaker for OpenAI is open.")
+
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+    attempt = 0
+    while True:
+        retry_after = ""
+        try:
+            resp = await HTTP_SESSION.post(OPENAI_CHAT_URL, headers=headers, json=body)
+        except aiohttp.ClientConnectorError: # Includes connect timeouts
+            if attempt >= HTTP_MAX_RETRIES:
+                STATS["failures"] += 1
+                BREAKER.record_failure()
+                raise
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            STATS["failures"] += 1
+            BREAKER.record_failure()
+            raise
+        else:
+            if resp.status not in RETRY_STATUSES:
+                BREAKER.record_success()
+                return resp
+            if attempt >= HTTP_MAX_RETRIES:
+                STATS["failures"] += 1
+                BREAKER.record_failure()
+                return resp
+            retry_after = resp.headers.get("Retry-After", "")
+            resp.release()
+
+        attempt += 1
+        STATS["retries"] += 1
+        delay = float(retry_after) if retry_after.replace(".", "", 1).isdigit() else \
+            random.uniform(0.0, HTTP_BACKOFF_BASE * (2 ** (attempt - 1)))
+        await asyncio.sleep(min(HTTP_BACKOFF_MAX, delay))
+
+
+async def chat_completion(api_key: str, body: Dict[str, Any]) -> ChatResponse:
+    """Send a ChatCompletion request without blocking the event loop.
+
+    Retries 429/5xx responses and failed connections with full-jitter
+    backoff; read timeouts are not retried (the story may already be billed).
+
+    @param api_key: OpenAI API key.
+    @param body:    JSON request body.
+    @raises CircuitOpenError: If the circuit breaker is open.
+    @raises aiohttp.ClientError, asyncio.TimeoutError: On connection errors after the retries, and on timeouts.
+    @return The final response (possibly a 429/5xx once the retries are exhausted).
+    """
+    with _in_flight():
+        resp = await _post_chat(api_key, body)
+        try:
+            return ChatResponse(resp.status, await resp.text())
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            STATS["failures"] += 1
+            BREAKER.record_failure()
+            raise
+        finally:
+            resp.release()
+            _touch_openai()
+
+
+async def stream_chat_completion(api_key: str, body: Dict[str, Any]) -> AsyncIterator[str]:
+    """Streaming counterpart of :pyfunc:`chat_completion`: yield content deltas as they arrive.
+
+    Retries happen only before the stream starts.
+
+    @param api_key: OpenAI API key.
+    @param body:    JSON request body (``stream`` is set here).
+    @raises RuntimeError: If OpenAI answers with an error status.
+    @raises CircuitOpenError, aiohttp.ClientError, asyncio.TimeoutError: As :pyfunc:`chat_completion`.
+    @return An async generator of text deltas (usually one token each).
+    """
+    with _in_flight():
+        resp = await _post_chat(api_key, {**body, "stream": True})
+        try:
+            if resp.status != 200:
+                raise RuntimeError(f"OpenAI returned HTTP {resp.status}: {(await resp.text())[:200]}")
+            async for raw in resp.content: # One server-sent event line at a time
+                line = raw.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                content = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                if content:
+                    yield content
+        finally:
+            resp.release()
+            _touch_openai()
+
+
+async def warm_openai_connection(api_key: Optional[str]) -> bool:
+    """Open a keep-alive connection to OpenAI ahead of a generation, if none is likely pooled.
+
+    Connects (TCP and TLS) with a cheap ``GET /models`` when no OpenAI call finished within
+    ``RAG_WARMUP_IDLE_SECONDS``; the ChatCompletion request that follows reuses the connection.
+
+    @param api_key: OpenAI API key (no warm-up without one).
+    @return True if a warm-up request was sent.
+    """
+    if HTTP_SESSION is None or not api_key or time.monotonic() - _LAST_OPENAI_USE < RAG_WARMUP_IDLE_SECONDS:
+        return False
+    try:
+        async with HTTP_SESSION.get(OPENAI_MODELS_URL, headers={"Authorization": f"Bearer {api_key}"}) as resp:
+            await resp.read()
+        _touch_openai()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as exc: # The generation will connect by itself
+        print(f"⚠️ OpenAI warm-up failed: {exc}")
+    return True
+
+
+def story_text(response: ChatResponse) -> str:
+    """Extract the assistant's reply from a successful ChatCompletion response.
+
+    @param response: A 200 response.
+    @raises ValueError, KeyError, IndexError: If the body is not a ChatCompletion.
+    @return The story text, stripped.
+    """
+    return json.loads(response.text)["choices"][0]["message"]["content"].strip()
+
+
+async def generate_story_async(keyword: str, *, api_key: Optional[str] = None, model: str = "gpt-4o-mini") -> str:
+    """Async counterpart of chatgpt_webhook.generate_story(), with the same error strings.
+
+    @param keyword: The topic or noun for the story.
+    @param api_key: Optional override for the OpenAI API key (default: AI_STORYTELLER_TEST_KEY_CV).
+    @param model:   The ChatCompletion model.
+    @return The story, or an error message string if generation fails.
+    """
+    effective_api_key = api_key or os.getenv("AI_STORYTELLER_TEST_KEY_CV")
+    if not effective_api_key:
+        return "Error: API key not set. Please configure the AI_STORYTELLER_TEST_KEY_CV environment variable."
+    try:
+        resp = await chat_completion(effective_api_key, build_story_request(keyword, model))
+        if resp.status != 200:
+            print(f"❌ OpenAI API Error. Status: {resp.status}, Response: {resp.text[:500]}")
+            return f"Error {resp.status}: The story generation service reported an issue. Please check server logs for details."
+        try:
+            return story_text(resp)
+        except (ValueError, KeyError, IndexError) as e:
+            print(f"❌ Error parsing successful OpenAI response: {e}\nResponse text: {resp.text[:500]}")
+            return "Error: Received an unexpected or malformed response from the story generation service."
+    except (asyncio.TimeoutError, aiohttp.ServerTimeoutError):
+        print(f"❌ OpenAI request timed out for URL: {OPENAI_CHAT_URL}")
+        return "Error: The story generation service took too long to respond. Please try again later."
+    except aiohttp.ClientConnectorError as e:
+        print(f"❌ OpenAI connection error: {e}")
+        return "Error: Could not connect to the story generation service. Please check the network connection."
+    except (aiohttp.ClientError, CircuitOpenError) as e:
+        print(f"❌ OpenAI request failed: {e}")
+        return "Error: The story generation service is unavailable right now. Please try again later."
+
+
+async def retrieve_chunks(query: str, n_results: int = RAG_CANDIDATES) -> Tuple[List[Chunk], Optional[str]]:
+    """Fetch story chunks for *query* from the REST wrapper's ``/query/chunks``.
+
+    @param query:     Search text (see rag.retrieval_query).
+    @param n_results: Chunks to retrieve.
+    @return (chunks, nearest first; None, or an error description if the search failed —
+            the story is then generated without excerpts).
+    """
+    assert HTTP_SESSION is not None, "HTTP session is created in the startup handler"
+    if not query:
+        return [], None
+    try:
+        async with HTTP_SESSION.post(RAG_RETRIEVER_URL, json={"query": query, "n_results": n_results},
+                                     timeout=aiohttp.ClientTimeout(total=RAG_RETRIEVE_TIMEOUT)) as resp:
+            if resp.status != 200:
+                return [], f"retriever returned HTTP {resp.status}"
+            body = await resp.json()
+        return [Chunk.from_dict(chunk) for chunk in body.get("chunks", [])], None
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError) as exc:
+        print(f"⚠️ Chunk retrieval failed for '{query}': {exc!r}")
+        return [], f"retrieval failed: {type(exc).__name__}"
+
+
+async def _timed(timings: StageTimings, stage: str, awaitable: Any) -> Any:
+    """Await *awaitable*, recording its duration as *stage*."""
+    with timings.stage(stage):
+        return await awaitable
+
+
+async def rag_story_events(api_key: Optional[str], messages: List[Dict[str, str]], context: List[Chunk],
+                           context_tokens: int, retrieval_error: Optional[str],
+                           timings: StageTimings) -> AsyncIterator[str]:
+    """Stream a retrieval-augmented story as server-sent events.
+
+    Events: ``context`` (the injected chunks), then ``token`` and ``sentence`` as in
+    webhook.py's ``/webhook/stream``, then ``done`` with the story and per-stage
+    timings, or ``error`` with the fallback apology and the timings so far.
+
+    @param api_key:         OpenAI API key.
+    @param messages:        ChatCompletion messages (see rag.build_rag_messages).
+    @param context:         Chunks injected into *messages*.
+    @param context_tokens:  Tokens of the injected chunks.
+    @param retrieval_error: Why no chunks could be retrieved, if so.
+    @param timings:         Timings of the request so far; ``generate`` and ``total`` are added here.
+    @return An async generator of SSE-formatted strings.
+    """
+    yield sse_event("context", {
+        "chunks": [{"id": c.id, "title": c.title, "score": round(c.score, 3)} for c in context],
+        "tokens": context_tokens,
+        "error": retrieval_error,
+    })
+    splitter = SentenceSplitter()
+    story_parts: List[str] = []
+    try:
+        if not api_key:
+            raise ValueError("OpenAI API key is not configured. Cannot make API calls.")
+        with timings.stage("generate"):
+            async for token in stream_chat_completion(api_key, {"model": OPENAI_MODEL, "messages": messages}):
+                if not story_parts:
+                    timings.mark("first_token")
+                story_parts.append(token)
+                yield sse_event("token", {"text": token})
+                for sentence in splitter.feed(token):
+                    yield sse_event("sentence", {"text": sentence})
+        rest = splitter.flush()
+        if rest:
+            yield sse_event("sentence", {"text": rest})
+        timings.mark("total")
+        RAG_STATS.record(timings)
+        yield sse_event("done", {"story": "".join(story_parts), "timings": timings.as_dict()})
+    except Exception as exc: # The response has already started, so report in-band
+        print(f"❌ RAG streaming error: {exc}")
+        timings.mark("total")
+        yield sse_event("error", {"message": FALLBACK_MESSAGE, "timings": timings.as_dict()})
+
+
+def dialogflow_text(text: str) -> Dict[str, Any]:
+    """Wrap *text* in a Dialogflow CX fulfilment response."""
+    return {"fulfillment_response": {"messages": [{"text": {"text": [text]}}]}}
+
+
+# ---------------------------------------------------------------------------
+# Lifecycle
+# ---------------------------------------------------------------------------
+
+@app.on_event("startup")
+async def startup_event() -> None:
+    """Create the shared async HTTP session (one connection pool for all requests)."""
+    global HTTP_SESSION
+    HTTP_SESSION = aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=None, sock_connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT),
+        connector=aiohttp.TCPConnector(limit=ASGI_MAX_CONNECTIONS, limit_per_host=ASGI_MAX_CONNECTIONS),
+    )
+    pack_context([Chunk("warm-up", "warm-up")]) # Counts tokens once, loading the tokenizer now rather than in the first /rag request
+    print(f"🚀 ASGI webhooks ready (OpenAI at {OPENAI_CHAT_URL}, up to {ASGI_MAX_CONNECTIONS} connections).")
+
+
+@app.on_event("shutdown")
+async def shutdown_event() -> None:
+    """Close the shared HTTP session."""
+    global HTTP_SESSION
+    if HTTP_SESSION is not None:
+        await HTTP_SESSION.close()
+        HTTP_SESSION = None
+
+
+# ---------------------------------------------------------------------------
+# Routes
+# ---------------------------------------------------------------------------
+
+@app.post("/webhook")
+async def webhook_endpoint(request: Request) -> JSONResponse:
+    """Dialogflow CX fulfilment route (no story pool or user memory); always answers 200 with a story or the fallback apology."""
+    try:
+        body: Dict[str, Any] = await request.json()
+        prompt = build_prompt(*extract_story_params(body))
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("OpenAI API key is not configured. Cannot make API calls.")
+        resp = await chat_completion(api_key, {"model": OPENAI_MODEL, "messages": build_messages(prompt)})
+        if resp.status != 200:
+            raise RuntimeError(f"OpenAI returned HTTP {resp.status}: {resp.text[:200]}")
+        return JSONResponse(dialogflow_text(story_text(resp)))
+    except Exception as exc: # Broad catch to ensure some response is always sent
+        print(f"❌ Webhook error: {exc}")
+        return JSONResponse(dialogflow_text(FALLBACK_MESSAGE))
+
+
+@app.post("/generate_story")
+async def generate_story_endpoint(request: Request) -> JSONResponse:
+    """Turns `{"word": "..."}` into `{"story": "..."}`."""
+    try:
+        body = await request.json()
+    except ValueError:
+        body = {}
+    keyword = (body.get("word") if isinstance(body, dict) else None) or "an adventure"
+    return JSONResponse({"story": await generate_story_async(keyword)})
+
+
+@app.post("/rag")
+async def rag_endpoint(request: Request) -> StreamingResponse:
+    """Retrieval-augmented story, streamed as server-sent events.
+
+    Chunk retrieval and the OpenAI connection warm-up run concurrently; the
+    candidates are then reranked and packed into the prompt, and the story is
+    streamed. ``retrieve``/``warmup``/``rerank`` timings are sent in the
+    ``Server-Timing`` header, all timings in the final event.
+    """
+    timings = StageTimings()
+    try:
+        body = await request.json()
+    except ValueError:
+        body = {}
+    username, theme, moral = extract_story_params(body if isinstance(body, dict) else {})
+    query = retrieval_query(theme, moral)
+    api_key = os.getenv("OPENAI_API_KEY")
+
+    (retrieved, retrieval_error), _ = await asyncio.gather(
+        _timed(timings, "retrieve", retrieve_chunks(query)),
+        _timed(timings, "warmup", warm_openai_connection(api_key)),
+    )
+    with timings.stage("rerank"):
+        context, context_tokens = pack_context(rerank(query, retrieved, RAG_TOP_K), RAG_CONTEXT_TOKENS)
+        messages = build_rag_messages(build_prompt(username, theme, moral), context)
+
+    return StreamingResponse(
+        rag_story_events(api_key, messages, context, context_tokens, retrieval_error, timings),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Server-Timing": timings.server_timing()},
+    )
+
+
+@app.get("/rag/stats")
+async def rag_stats_endpoint() -> JSONResponse:
+    """p50/p95/max per /rag stage (retrieve, warmup, rerank, first_token, generate, total)."""
+    return JSONResponse(RAG_STATS.summary())
+
+
+@app.get("/http_stats")
+async def http_stats_endpoint() -> JSONResponse:
+    """In-flight and peak concurrent OpenAI calls, retries and circuit breaker state."""
+    return JSONResponse({**STATS, "circuit_state": BREAKER.state, "circuit_opened": BREAKER.opened_count,
+                         "max_connections": ASGI_MAX_CONNECTIONS})
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", "3000")))